@@ -1,6 +1,12 @@
-import pandas as pd
 import numpy as np
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.loaders import load_klines
+
+@traced('factors.compute_cci')
 def compute_cci(df, n=20):
     """
     計算 CCI (Commodity Channel Index)
@@ -16,7 +22,7 @@ def compute_cci(df, n=20):
 
 def main():
     # 讀取第一步產生的原始資料
-    df = pd.read_csv('raw_MINAUSDT_futures.csv', parse_dates=['Open time'])
+    df = load_klines('raw_MINAUSDT_futures.csv', time_as='datetime')
     
     # 計算 CCI，預設週期 n=20 (可自行調整)
     df['CCI'] = compute_cci(df, n=30)
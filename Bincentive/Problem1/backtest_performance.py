@@ -1,7 +1,18 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.funding import accrue, events_from_bars, load_funding, unit_carry
+from backtest_sim.instrument import traced
+from backtest_sim.rules import RuleSet
+
+# CCI 由上往下穿越 lower 買進、由下往上穿越 upper 賣出 (兩者同時成立時賣出，與原本依序指定的結果相同)
+CCI_RULES = RuleSet([('prev(CCI) <= upper and CCI > upper', -1),
+                     ('prev(CCI) >= lower and CCI < lower', 1)])
+
+@traced('backtest.generate_cci_signals')
 def generate_cci_signals(df, upper=100, lower=-100):
     """
     根據 CCI 產生買賣訊號。
@@ -14,28 +25,39 @@ def generate_cci_signals(df, upper=100, lower=-100):
       0 => 無訊號
     """
     df = df.copy()
-    df['Signal'] = 0
-    
+
     # 當 CCI 從上往下穿越 lower => 產生買進訊號
     # 當 CCI 從下往上穿越 upper => 產生賣出訊號
-    for i in range(1, len(df)):
-        prev_cci = df.loc[i-1, 'CCI']
-        curr_cci = df.loc[i, 'CCI']
-        
-        # 買進訊號: 由上而下穿越 lower
-        if prev_cci >= lower and curr_cci < lower:
-            df.loc[i, 'Signal'] = 1
-        
-        # 賣出訊號: 由下而上穿越 upper
-        if prev_cci <= upper and curr_cci > upper:
-            df.loc[i, 'Signal'] = -1
-    
+    df['Signal'] = CCI_RULES.evaluate(df, upper=upper, lower=lower)
     return df
 
+def cci_positions(df):
+    """訊號之後持續持有：Buy 之後為 1 (多單)、Sell 之後為 -1 (空單)，第一個訊號之前為 0"""
+    return df['Signal'].replace(0, np.nan).ffill().fillna(0).to_numpy()
+
+
+@traced('backtest.cci_funding')
+def cci_funding(df, events, venues=('binance', 'okx')):
+    """
+    CCI 部位在各交易所的資金費用 (每根 K 線，正值為收入)
+    各交易所的結算事件一次對齊到 K 線，再對 (K 線數, 交易所數) 的部位一次計提
+    :param events: backtest_sim.funding.funding_events 的結果 (含 'venue' 欄位)
+    :return: DataFrame，每個交易所一欄
+    """
+    carry = np.column_stack([unit_carry(df['Open time'], events[events['venue'] == venue],
+                                        prices=df['Close'].to_numpy(), bar_ms='1h')
+                             for venue in venues])
+    position = np.repeat(cci_positions(df)[:, None], len(venues), axis=1)
+    return pd.DataFrame(accrue(position, carry), columns=list(venues), index=df.index)
+
+
+@traced('plot.plot_cci_signals')
 def plot_cci_signals(df, filename='cci_signals.png'):
     """
     視覺化價格與 CCI 指標，並在圖上標示買賣點。
     """
+    import matplotlib.pyplot as plt  # 只有畫圖時才載入 (產生訊號不需要)
+
     # 將時間設為 index
     df['Open time'] = pd.to_datetime(df['Open time'])
     df.set_index('Open time', inplace=True)
@@ -77,6 +99,22 @@ def main():
     
     # 產生買賣訊號
     df_signals = generate_cci_signals(df, upper=100, lower=-100)
+
+    # 持有訊號部位 (1 單位) 的資金費用；沒有另存的結算事件時從併入 K 線的資金費率還原
+    if os.path.exists('funding_MINAUSDT.csv'):
+        events = load_funding('funding_MINAUSDT.csv')
+    else:
+        events = events_from_bars(df)
+    # 每個交易所一欄 ('Funding_binance' / 'Funding_okx')，不加總 (同一部位只會在其中一個交易所持有)
+    funding = cci_funding(df_signals, events)
+    for venue in funding.columns:
+        df_signals[f'Funding_{venue}'] = funding[venue]
+        print(f"資金費用 ({venue}): {funding[venue].sum():+.6f} USDT / 單位")
+
+    # 儲存訊號與各交易所的資金費用
+    output_path = 'mina_cci_signals.csv'
+    df_signals.to_csv(output_path, index=False)
+    print(f"訊號與資金費用已儲存至 {output_path}")
     
     # 繪製圖表 (價格 + CCI + 買賣點)
     plot_cci_signals(df_signals, filename='cci_signals.png')
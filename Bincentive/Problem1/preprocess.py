@@ -1,7 +1,13 @@
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.instrument import traced
+
+@traced('preprocess.fetch_binance_futures_klines')
 def fetch_binance_futures_klines(symbol='MINAUSDT', interval='1h',
                                  start_date='2025-01-01', end_date='2025-03-26', limit=1500):
     """
@@ -54,6 +60,7 @@ def fetch_binance_futures_klines(symbol='MINAUSDT', interval='1h',
     df = df[['Open time','Open','High','Low','Close','Volume']]
     return df
 
+@traced('preprocess.fetch_binance_funding_rates')
 def fetch_binance_funding_rates(symbol='MINAUSDT', start_date='2025-01-01', end_date='2025-03-26', limit=1000):
     """
     從 Binance 永續期貨 API 撈取 funding rates 的歷史資料，
@@ -95,6 +102,7 @@ def fetch_binance_funding_rates(symbol='MINAUSDT', start_date='2025-01-01', end_
         df.rename(columns={'fundingTime': 'Open time'}, inplace=True)
     return df
 
+@traced('preprocess.fetch_okx_funding_rates')
 def fetch_okx_funding_rates(instId='MINA-USDT-SWAP', start_date='2025-01-01', end_date='2025-03-26', limit=100):
     """
     從 OKX API 撈取 funding rates 的歷史資料，
@@ -156,6 +164,9 @@ def main():
     # 合併 funding rates 資料
     df_funding = pd.concat([df_binance_funding, df_okx_funding], ignore_index=True, sort=True)
     df_funding = df_funding.sort_values(by='Open time')
+
+    # 另存原始的結算事件 (merge_asof 的容許誤差會讓同一次結算出現在兩根 K 線上，計提資金費用時以事件為準)
+    df_funding.to_csv('funding_MINAUSDT.csv', index=False)
     
     # 使用 merge_asof 以 futures 資料為主體，根據 "Open time" 近似合併 funding rates 資料
     # 這裡設定容許誤差 tolerance 為 1 小時，可依實際需求調整
@@ -1,6 +1,12 @@
-import pandas as pd
 import numpy as np
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.loaders import load_klines
+
+@traced('factors.compute_OBV')
 def compute_OBV(df):
     """
     計算 OBV (On Balance Volume)
@@ -18,12 +24,13 @@ def compute_OBV(df):
             obv.append(obv[-1])
     return obv
 
+# OBV 均線的期數 (backtest_performance 記錄回測結果時一併記錄)
+OBV_WINDOW = 25
+
 def main():
     # 讀入原始 K 線資料
-    df = pd.read_csv('klines_BTC.csv')
-    
-    # 假設原始資料中 'Open time' 為時間欄位，已轉換成 pandas datetime 格式（若尚未轉換，可自行轉換）
-    df['Open time'] = pd.to_datetime(df['Open time'])
+    # 'Open time' 直接解析為 pandas datetime 格式
+    df = load_klines('klines_BTC.csv', time_as='datetime')
     
     # 依需求，若有其他資料處理步驟也可在此處加入
     
@@ -31,7 +38,7 @@ def main():
     df['OBV'] = compute_OBV(df)
     
     # 計算 5 期 OBV 均線
-    df['OBV_MA5'] = df['OBV'].rolling(window=25).mean()
+    df['OBV_MA5'] = df['OBV'].rolling(window=OBV_WINDOW).mean()
     
     # 儲存預處理結果
     df.to_csv('factors_BTC.csv', index=False)
@@ -1,7 +1,16 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim import report
+from backtest_sim.instrument import span, traced
+from backtest_sim.results import record_from_env, symbol_from_path
+from add_factors import OBV_WINDOW
+from strategy_signals import FEE_RATE, INITIAL_CAPITAL
+
+@traced('report.compute_performance')
 def compute_performance(trades_df, initial_capital=100000):
     """
     計算回測績效指標：
@@ -55,32 +64,55 @@ def compute_performance(trades_df, initial_capital=100000):
     }
     return performance, equity_curve
 
-def plot_trades(preprocessed_df, trades_df, filename='price_chart.png'):
+@traced('plot.trades_figure')
+def trades_figure(preprocessed_df, trades_df, filename='price_chart.png'):
     """
-    繪製價格走勢圖並標示出進場與出場點，並存成 PNG
+    建立價格走勢圖 (標示進場與出場點) 的圖表描述
     """
-    # 將時間欄位轉成 datetime 格式，並設定為 index
-    preprocessed_df['Open time'] = pd.to_datetime(preprocessed_df['Open time'])
-    preprocessed_df = preprocessed_df.set_index('Open time')
+    # 將時間欄位轉成 datetime 格式
+    times = pd.to_datetime(preprocessed_df['Open time'])
 
-    plt.figure(figsize=(14,7))
-    plt.plot(preprocessed_df.index, preprocessed_df['Close'], label='Close Price', color='blue')
-    
     # 從 trades_df 中取出進場和出場時間及價格
     trades_df['Entry_Time'] = pd.to_datetime(trades_df['Entry_Time'])
     trades_df['Exit_Time'] = pd.to_datetime(trades_df['Exit_Time'])
-    
-    plt.scatter(trades_df['Entry_Time'], trades_df['Entry_Price'], marker='^', color='green', s=100, label='Buy')
-    plt.scatter(trades_df['Exit_Time'], trades_df['Exit_Price'], marker='v', color='red', s=100, label='Sell')
-    
-    plt.title('Price Chart with Buy & Sell Points')
-    plt.xlabel('Time')
-    plt.ylabel('Price')
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+
+    return report.figure(
+        filename,
+        report.axes(
+            report.line(preprocessed_df['Close'], x=times, label='Close Price', color='blue'),
+            report.scatter(trades_df['Entry_Time'], trades_df['Entry_Price'], marker='^', color='green', s=100, label='Buy'),
+            report.scatter(trades_df['Exit_Time'], trades_df['Exit_Price'], marker='v', color='red', s=100, label='Sell'),
+            title='Price Chart with Buy & Sell Points', xlabel='Time', ylabel='Price',
+        ),
+        figsize=(14, 7), dpi=100, style=None, bbox_inches=None,
+    )
+
+@traced('plot.equity_figure')
+def equity_figure(equity_curve, filename='equity_drawdown.png'):
+    """
+    建立累積損益曲線與回撤曲線的圖表描述，
+    上圖為 Equity Curve，下圖為 Drawdown 曲線
+    """
+    return report.figure(
+        filename,
+        # 累積損益曲線
+        report.axes(
+            report.line(equity_curve['Cumulative'], x=equity_curve.index, label='Equity Curve', color='purple'),
+            title='Equity Curve / Cumulative PnL', ylabel='Equity',
+        ),
+        # 回撤曲線
+        report.axes(
+            report.line(equity_curve['Drawdown'], x=equity_curve.index, label='Drawdown', color='red'),
+            title='Drawdown Curve', xlabel='Date', ylabel='Drawdown',
+        ),
+        figsize=(14, 10), sharex=True, dpi=100, style=None, bbox_inches=None,
+    )
+
+def plot_trades(preprocessed_df, trades_df, filename='price_chart.png'):
+    """
+    繪製價格走勢圖並標示出進場與出場點，並存成 PNG
+    """
+    report.render_report([trades_figure(preprocessed_df, trades_df, filename)], '.', html_name=None)
     print(f"價格走勢圖已儲存為 {filename}")
 
 def plot_equity_and_drawdown(equity_curve, filename='equity_drawdown.png'):
@@ -88,34 +120,16 @@ def plot_equity_and_drawdown(equity_curve, filename='equity_drawdown.png'):
     繪製累積損益曲線與回撤曲線，
     上圖為 Equity Curve，下圖為 Drawdown 曲線，並存成 PNG
     """
-    fig, axs = plt.subplots(2, 1, figsize=(14,10), sharex=True)
-    
-    # 累積損益曲線
-    axs[0].plot(equity_curve.index, equity_curve['Cumulative'], label='Equity Curve', color='purple')
-    axs[0].set_title('Equity Curve / Cumulative PnL')
-    axs[0].set_ylabel('Equity')
-    axs[0].legend()
-    axs[0].grid(True)
-    
-    # 回撤曲線
-    axs[1].plot(equity_curve.index, equity_curve['Drawdown'], label='Drawdown', color='red')
-    axs[1].set_title('Drawdown Curve')
-    axs[1].set_xlabel('Date')
-    axs[1].set_ylabel('Drawdown')
-    axs[1].legend()
-    axs[1].grid(True)
-    
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    report.render_report([equity_figure(equity_curve, filename)], '.', html_name=None)
     print(f"累積損益及回撤圖已儲存為 {filename}")
 
 def main():
+    klines_file = 'klines_BTC.csv'
     # 讀取交易明細檔 (trade_details.csv)
     trades_df = pd.read_csv('trade_details.csv')
     
     # 計算績效指標及累積損益曲線
-    performance, equity_curve = compute_performance(trades_df, initial_capital=100000)
+    performance, equity_curve = compute_performance(trades_df, initial_capital=INITIAL_CAPITAL)
     
     # 打印績效指標
     print("回測績效指標：")
@@ -127,15 +141,31 @@ def main():
     # 儲存每日資產曲線
     equity_curve.to_csv('equity_curve.csv')
     print("每日資產曲線已存檔至 equity_curve.csv")
+
+    # 設定 BACKTEST_SIM_RESULTS 時記錄到結果資料庫
+    pnl = trades_df['PnL']
+    config = {'obv_window': OBV_WINDOW, 'fee_rate': FEE_RATE, 'initial_capital': INITIAL_CAPITAL}
+    record_from_env('bincentive2', symbol_from_path(klines_file), config, metrics={
+        'final_balance': float(equity_curve['Cumulative'].iloc[-1]) if len(equity_curve) else float(INITIAL_CAPITAL),
+        'sharpe_ratio': performance['Sharpe Ratio'],
+        'max_drawdown': performance['Max Drawdown'],
+        'win_ratio': float((pnl > 0).mean()) if len(pnl) else 0.0,
+        'total_trades': len(pnl),
+        **performance,
+    }, data_range=(trades_df['Entry_Time'].min(), trades_df['Exit_Time'].max()), bars=len(equity_curve),
+        equity=equity_curve['Cumulative'].to_numpy(), trades=trades_df)
     
     # 讀取預處理過的資料 (用來畫價格走勢圖)
-    preprocessed_df = pd.read_csv('klines_BTC.csv')
-    
-    # 視覺化：價格圖標示買賣點，存成 PNG
-    plot_trades(preprocessed_df, trades_df, filename='price_chart.png')
+    preprocessed_df = pd.read_csv(klines_file)
     
-    # 視覺化：累積損益曲線與回撤曲線，存成 PNG
-    plot_equity_and_drawdown(equity_curve, filename='equity_drawdown.png')
+    # 視覺化：價格圖標示買賣點、累積損益曲線與回撤曲線，平行存成 PNG 並輸出 report.html
+    figures = [
+        trades_figure(preprocessed_df, trades_df, filename='price_chart.png'),
+        equity_figure(equity_curve, filename='equity_drawdown.png'),
+    ]
+    with span('plot.render_report'):
+        report.render_report(figures, '.', metrics=performance, title='OBV Strategy Backtest')
+    print("價格走勢圖、累積損益及回撤圖已儲存為 price_chart.png、equity_drawdown.png")
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,11 @@
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.instrument import traced
 
 
 # 設定 pandas 顯示選項
@@ -8,6 +13,7 @@ pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', None)
 
+@traced('preprocess.fetch_kline_price_data')
 def fetch_kline_price_data(symbol, interval, start_date, end_date):
     """
     從 Binance 抓取指定交易對的 K 線數據，包含開高低收量以及 Taker Buy 數據。
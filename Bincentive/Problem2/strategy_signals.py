@@ -1,37 +1,61 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+import os
+import sys
 
-def generate_trade_signals(df, fee_rate=0.0005, initial_capital=100000):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.chunked import IncrementalCSV, iter_chunks, with_last
+from backtest_sim.instrument import traced
+from backtest_sim.ledger import ROUND_TRIP_FIELDS, Ledger
+from backtest_sim.rules import Rule, evaluate
+
+# OBV 從下向上穿越均線為進場條件、從上向下穿越為出場條件
+CROSS_RULES = {'entry': Rule('crosses_above(OBV, OBV_MA5)'), 'exit': Rule('crosses_below(OBV, OBV_MA5)')}
+
+# 主程式的單邊手續費率與初始資金 (backtest_performance 記錄回測結果時一併記錄)
+FEE_RATE = 0.0005
+INITIAL_CAPITAL = 100000
+
+# 交易明細 CSV 的欄位 (ledger 欄位 -> 輸出欄名)
+TRADE_COLUMNS = {'entry_time': 'Entry_Time', 'entry_price': 'Entry_Price', 'entry_fee': 'Entry_Fee',
+                 'exit_time': 'Exit_Time', 'exit_price': 'Exit_Price', 'exit_fee': 'Exit_Fee', 'pnl': 'PnL'}
+
+def new_state(initial_capital=100000):
+    """分塊產生訊號時在區塊之間延續的狀態 (部位、未平倉交易的進場資料、交易明細與前一根的 OBV / 均線)"""
+    return {'capital': initial_capital, 'rows': 0, 'position': 0, 'entry_price': 0, 'entry_time': None,
+            'entry_fee': None, 'trades': Ledger(ROUND_TRIP_FIELDS), 'prev_obv': None, 'prev_ma': None}
+
+
+def signals_chunk(df, state, last=True, fee_rate=0.0005):
     """
-    策略邏輯：
-      - 當 OBV 從下向上穿越 OBV_MA5 時產生買進訊號 (Signal = 1)
-      - 當 OBV 從上向下穿越 OBV_MA5 時產生出場訊號 (Signal = -1)
-    模擬進出場：
-      - 以當前收盤價進出場
-      - 每次進場與出場均扣除單邊 5bp 費用
-    回傳：
-      - df: 原始 DataFrame 加上 'Signal' 欄位
-      - trades: 交易明細清單，每筆包含：進場時間、出場時間、進場價、出場價、手續費、損益
+    對一個區塊產生交易訊號並模擬進出場，依序對每個區塊呼叫的結果與一次處理整段資料相同
+    :param df: DataFrame 區塊 (index 為 0..n-1)，必須包含 'Open time', 'Close', 'OBV', 'OBV_MA5'
+    :param state: new_state() 建立的 dict，就地更新；平倉的交易加入 state['trades']
+    :param last: 是否為最後一個區塊 (最後仍有持倉時以最後一筆資料平倉)
+    :return: (加入 'Signal' 的 df, 交易明細 (backtest_sim.ledger.Ledger))
     """
-    df = df.copy()
     df['Signal'] = 0
-    trades = []
-    position = 0   # 0 表示空倉，1 表示持有多單
-    entry_price = 0
-    entry_time = None
-    capital = initial_capital
-
-    # 產生訊號：觀察 OBV 與 OBV_MA5 的交叉
-    for i in range(1, len(df)):
-        # 當前與前一根的 OBV 與均線
-        prev_obv = df.at[i-1, 'OBV']
-        prev_ma = df.at[i-1, 'OBV_MA5']
-        curr_obv = df.at[i, 'OBV']
-        curr_ma = df.at[i, 'OBV_MA5']
-        
+    trades = state['trades']
+    position = state['position']
+    entry_price = state['entry_price']
+    entry_time = state['entry_time']
+    entry_fee = state['entry_fee']
+    capital = state['capital']
+
+    # 產生訊號：觀察 OBV 與 OBV_MA5 的交叉 (區塊的第一根以上一個區塊的最後一根作為前一根)
+    data = {'OBV': df['OBV'].to_numpy(), 'OBV_MA5': df['OBV_MA5'].to_numpy()}
+    carried = state['rows'] > 0 and state['prev_obv'] is not None
+    if carried:
+        data = {'OBV': np.r_[state['prev_obv'], data['OBV']], 'OBV_MA5': np.r_[state['prev_ma'], data['OBV_MA5']]}
+    crosses = evaluate(CROSS_RULES, data)
+    entries = crosses['entry'][1:] if carried else crosses['entry']
+    exits = crosses['exit'][1:] if carried else crosses['exit']
+
+    # 只需依序走過有交叉的 K 線
+    for i in np.flatnonzero(entries | exits):
         # 檢查是否產生買進訊號：從下向上交叉
-        if position == 0 and (prev_obv < prev_ma) and (curr_obv >= curr_ma):
+        if position == 0 and entries[i]:
             df.at[i, 'Signal'] = 1
             position = 1
             entry_price = df.at[i, 'Close']
@@ -39,19 +63,9 @@ def generate_trade_signals(df, fee_rate=0.0005, initial_capital=100000):
             # 扣除進場手續費
             entry_fee = entry_price * fee_rate
             capital -= entry_fee
-            trade = {
-                'Entry_Time': entry_time,
-                'Entry_Price': entry_price,
-                'Entry_Fee': entry_fee,
-                'Exit_Time': None,
-                'Exit_Price': None,
-                'Exit_Fee': None,
-                'PnL': None
-            }
-            trades.append(trade)
-            
+
         # 出場訊號：持有部位且 OBV 從上向下穿越均線
-        elif position == 1 and (prev_obv > prev_ma) and (curr_obv <= curr_ma):
+        elif position == 1 and exits[i]:
             df.at[i, 'Signal'] = -1
             exit_price = df.at[i, 'Close']
             exit_time = df.at[i, 'Open time']
@@ -60,45 +74,87 @@ def generate_trade_signals(df, fee_rate=0.0005, initial_capital=100000):
             gross_profit = exit_price - entry_price
             net_profit = gross_profit - exit_fee
             capital += (net_profit)
-            # 更新最後一筆交易明細
-            trades[-1].update({
-                'Exit_Time': exit_time,
-                'Exit_Price': exit_price,
-                'Exit_Fee': exit_fee,
-                'PnL': net_profit
-            })
+            # 記錄這筆交易明細
+            trades.append(entry_time=entry_time, exit_time=exit_time, position='LONG', reason='SIGNAL', quantity=1,
+                          entry_price=entry_price, exit_price=exit_price, entry_fee=entry_fee, exit_fee=exit_fee,
+                          pnl=net_profit)
             position = 0
 
     # 若最後仍有持倉，則以最後一筆資料平倉
-    if position == 1:
+    if last and position == 1:
         exit_price = df.at[len(df)-1, 'Close']
         exit_time = df.at[len(df)-1, 'Open time']
         exit_fee = exit_price * fee_rate
         gross_profit = exit_price - entry_price
         net_profit = gross_profit - exit_fee
         capital += (net_profit)
-        trades[-1].update({
-            'Exit_Time': exit_time,
-            'Exit_Price': exit_price,
-            'Exit_Fee': exit_fee,
-            'PnL': net_profit
-        })
+        trades.append(entry_time=entry_time, exit_time=exit_time, position='LONG', reason='END', quantity=1,
+                      entry_price=entry_price, exit_price=exit_price, entry_fee=entry_fee, exit_fee=exit_fee,
+                      pnl=net_profit)
         df.at[len(df)-1, 'Signal'] = -1
 
-    return df, trades, capital
+    if len(df):
+        state['prev_obv'] = df.at[len(df)-1, 'OBV']
+        state['prev_ma'] = df.at[len(df)-1, 'OBV_MA5']
+    state.update({'capital': capital, 'position': position, 'entry_price': entry_price,
+                  'entry_time': entry_time, 'entry_fee': entry_fee})
+    state['rows'] += len(df)
+    return df, trades
+
+@traced('backtest.generate_trade_signals')
+def generate_trade_signals(df, fee_rate=0.0005, initial_capital=100000):
+    """
+    策略邏輯：
+      - 當 OBV 從下向上穿越 OBV_MA5 時產生買進訊號 (Signal = 1)
+      - 當 OBV 從上向下穿越 OBV_MA5 時產生出場訊號 (Signal = -1)
+    模擬進出場：
+      - 以當前收盤價進出場
+      - 每次進場與出場均扣除單邊 5bp 費用
+    回傳：
+      - df: 原始 DataFrame 加上 'Signal' 欄位
+      - trades: 交易明細 (backtest_sim.ledger.Ledger)，每筆包含：進場時間、出場時間、進場價、出場價、手續費、損益；
+                trades.to_frame(TRADE_COLUMNS) 為交易明細表
+    """
+    state = new_state(initial_capital)
+    df, trades = signals_chunk(df.copy(), state, last=True, fee_rate=fee_rate)
+    return df, trades, state['capital']
+
+@traced('backtest.generate_trade_signals_chunks')
+def generate_trade_signals_chunks(chunks, signals_file, trades_file, fee_rate=0.0005, initial_capital=100000,
+                                  chunksize=100_000):
+    """
+    分塊產生訊號並逐塊寫出，輸出與 main() 一次處理整段資料的兩個 CSV 相同
+    :param chunks: DataFrame 區塊的 iterable，或 CSV 路徑 (以 chunksize 切塊讀取，'Open time' 解析為時間)
+    :param signals_file: 含 'Signal' 欄位的資料輸出路徑
+    :param trades_file: 交易明細輸出路徑
+    :return: 最後的 state (含 'capital')
+    """
+    if isinstance(chunks, str):
+        chunks = iter_chunks(chunks, chunksize, parse_dates=['Open time'])
+    state = new_state(initial_capital)
+    with IncrementalCSV(signals_file) as signals_out, IncrementalCSV(trades_file) as trades_out:
+        for chunk, last in with_last(iter_chunks(chunks, chunksize)):
+            chunk, trades = signals_chunk(chunk, state, last, fee_rate)
+            signals_out.write(chunk)
+            if len(trades):
+                trades_out.write(trades.to_frame(TRADE_COLUMNS))
+            trades.clear()  # 已寫出的交易不留在記憶體
+        if trades_out.rows == 0:
+            trades_out.write(state['trades'].to_frame(TRADE_COLUMNS))
+    return state
 
 def main():
     # 讀取預處理過的資料
     df = pd.read_csv('factors_BTC.csv', parse_dates=['Open time'])
     
     # 依據策略產生交易訊號與模擬交易
-    df_signals, trades, final_capital = generate_trade_signals(df, fee_rate=0.0005)
+    df_signals, trades, final_capital = generate_trade_signals(df, fee_rate=FEE_RATE, initial_capital=INITIAL_CAPITAL)
     
     # 儲存含策略訊號的資料 (若需要)
     df_signals.to_csv('preprocessed_with_signals.csv', index=False)
     
     # 儲存交易明細表
-    trades_df = pd.DataFrame(trades)
+    trades_df = trades.to_frame(TRADE_COLUMNS)
     trades_df.to_csv('trade_details.csv', index=False)
     
     print("策略訊號處理完成！")
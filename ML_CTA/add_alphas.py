@@ -1,8 +1,23 @@
 import pandas as pd
-import xgboost as xgb
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.models import default_registry, fit_xgboost
+from backtest_sim.rules import RuleSet
+
+# XGBoost 超參數 (模型登錄以此作為 key 的一部分)
+XGB_PARAMS = {'objective': 'reg:squarederror', 'n_estimators': 100}
+
+# 主程式使用的預測期數與交易閾值 (plot_result 記錄回測結果時一併記錄)
+N = 1
+THRESHOLD = 0.05
+
+# 預測報酬超過 threshold 做多、低於 -threshold 做空 (兩者同時成立時做空，與原本依序指定的結果相同)
+DIRECTION_RULES = RuleSet([('Predicted_Return < -threshold', -1), ('Predicted_Return > threshold', 1)])
+
+@traced('alphas.load_data')
 def load_data(file_path, N):
     """
     讀取 CSV 文件，計算未來 N 小時的報酬，並處理 NaN 值
@@ -33,38 +48,43 @@ def prepare_features(df):
 
     return X, y
 
-def train_xgboost(X, y, test_size=0.7):
+@traced('alphas.train_xgboost')
+def train_xgboost(X, y, test_size=0.7, N=1, registry=None):
     """
     訓練 XGBoost 模型，並計算 MAE
     :param X: 特徵矩陣
     :param y: 目標變數
     :param test_size: 測試集比例 (預設 20%)
+    :param N: 預測 N 小時後的報酬 (模型登錄的 key)
+    :param registry: backtest_sim.models.ModelRegistry；訓練資料與超參數相同時直接載入模型與預測值，None 時每次重新訓練
     :return: 訓練好的 XGBoost 模型, 測試集 y 值, 預測值, MAE
     """
+    # sklearn 只在訓練時載入 (只使用 prepare_features 的模組不需要)
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.model_selection import train_test_split
+
     # 分割訓練集與測試集
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, shuffle=False)
 
     # 訓練 XGBoost 模型
-    model = xgb.XGBRegressor(objective="reg:squarederror", n_estimators=100)
-    model.fit(X_train, y_train)
+    model, key = fit_xgboost(X_train, y_train, XGB_PARAMS, N, registry)
 
     # 預測未來 N 小時報酬
-    y_pred = model.predict(X)
+    y_pred = model.predict(X) if key is None else registry.predict(key, X, model)
 
     # 計算 Mean Absolute Error (MAE)
-    mae = mean_absolute_error(y_test, model.predict(X_test))
+    mae = mean_absolute_error(y_test, y_pred[len(X_train):])
 
     return model, y_pred, mae
 
-def get_direction(df, threshold=0.05):
+@traced('alphas.get_direction')
+def get_direction(df, threshold=THRESHOLD):
     """
     根據預測結果產生交易信號，並儲存結果
     :param df: pandas DataFrame，應包含 Predicted_Return 欄位
     :param threshold: 設定交易閾值
     """
-    df['direction'] = 0
-    df.loc[df['Predicted_Return'] > threshold, 'direction'] = 1   # Long
-    df.loc[df['Predicted_Return'] < -threshold, 'direction'] = -1  # Short
+    df['direction'] = DIRECTION_RULES.evaluate(df, threshold=threshold)
     
     # 儲存結果
     df.to_csv("klines_BTC_factors_with_direction.csv", index=False)
@@ -72,7 +92,6 @@ def get_direction(df, threshold=0.05):
 
 if __name__ == "__main__":
     file_path = "klines_BTC_factors.csv"
-    N = 1
 
     # 讀取數據
     df = load_data(file_path, N)
@@ -81,7 +100,7 @@ if __name__ == "__main__":
     X, y = prepare_features(df)
 
     # 訓練模型 & 預測
-    model, y_pred, mae = train_xgboost(X, y)
+    model, y_pred, mae = train_xgboost(X, y, N=N, registry=default_registry())
 
     # 將預測結果加入 df
     df['Predicted_Return'] = y_pred
@@ -89,4 +108,4 @@ if __name__ == "__main__":
     print(f"MAE: {mae:.4f}")
 
     # 產生交易信號
-    get_direction(df)
+    get_direction(df, threshold=THRESHOLD)
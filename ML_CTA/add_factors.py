@@ -1,50 +1,74 @@
-import pandas as pd
 import numpy as np
+import os
+import sys
 
-# 讀取 CSV 文件
-file_path = "klines_BTC.csv"  # 請替換成你的檔案路徑
-df = pd.read_csv(file_path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.loaders import load_klines
 
-        # # 設定 window_size
-        # window_size = 100
+# 主程式使用的視窗大小與 Gamma Decay 系數 (plot_result 記錄回測結果時一併記錄)
+WINDOW_SIZE = 150
+GAMMA = 0.8
 
-        # # 計算滾動標準差 (Rolling Std)
-        # df["Rolling_Std_Close"] = df["Close"].rolling(window=window_size).std()
+def gamma_decay_weights(window_size, gamma):
+    """
+    計算 Gamma Decay 權重 (已歸一化，總和為 1)
+    :param window_size: 視窗大小
+    :param gamma: 衰減系數
+    :return: numpy array，weights[i] = gamma**i / sum
+    """
+    weights = np.array([gamma**i for i in range(window_size)])
+    weights /= weights.sum()  # 進行歸一化，使權重總和為 1
+    return weights
 
-        # # 計算滾動平均 (Rolling Mean)
-        # df["Rolling_Mean_Close"] = df["Close"].rolling(window=window_size).mean()
-# 設定 window_size
-window_size = 150
-gamma = 0.8  # 設定 Gamma Decay 系數
+@traced('factors.compute_factors')
+def compute_factors(df, window_size=WINDOW_SIZE, gamma=GAMMA):
+    """
+    計算 Gamma Decay 滾動平均、滾動標準差與 ATR
+    :param df: DataFrame，必須包含 'High', 'Low', 'Close' 欄位
+    :param window_size: 視窗大小
+    :param gamma: Gamma Decay 系數
+    :return: 加入 'Rolling_Std_Close', 'Rolling_Mean_Close', 'ATR' 的 DataFrame
+    """
+    # 計算 Gamma Decay 權重
+    weights = gamma_decay_weights(window_size, gamma)
 
-# 計算 Gamma Decay 權重
-weights = np.array([gamma**i for i in range(window_size)])
-weights /= weights.sum()  # 進行歸一化，使權重總和為 1
+    # 計算滾動標準差 (Rolling Std) 加上 Gamma Decay
+    df["Rolling_Std_Close"] = df["Close"].rolling(window=window_size).apply(
+        lambda x: np.sqrt(np.dot(weights[::-1], (x - np.dot(x, weights[::-1]))**2)), raw=True
+    )
 
-# 計算滾動標準差 (Rolling Std) 加上 Gamma Decay
-df["Rolling_Std_Close"] = df["Close"].rolling(window=window_size).apply(
-    lambda x: np.sqrt(np.dot(weights[::-1], (x - np.dot(x, weights[::-1]))**2)), raw=True
-)
+    # 計算滾動平均 (Rolling Mean) 加上 Gamma Decay
+    df["Rolling_Mean_Close"] = df["Close"].rolling(window=window_size).apply(
+        lambda x: np.dot(x, weights[::-1]), raw=True
+    )
 
-# 計算滾動平均 (Rolling Mean) 加上 Gamma Decay
-df["Rolling_Mean_Close"] = df["Close"].rolling(window=window_size).apply(
-    lambda x: np.dot(x, weights[::-1]), raw=True
-)
 
+    # 計算 ATR (Average True Range)
+    df["High-Low"] = df["High"] - df["Low"]
+    df["High-PrevClose"] = abs(df["High"] - df["Close"].shift(1))
+    df["Low-PrevClose"] = abs(df["Low"] - df["Close"].shift(1))
 
-# 計算 ATR (Average True Range)
-df["High-Low"] = df["High"] - df["Low"]
-df["High-PrevClose"] = abs(df["High"] - df["Close"].shift(1))
-df["Low-PrevClose"] = abs(df["Low"] - df["Close"].shift(1))
+    df["TR"] = df[["High-Low", "High-PrevClose", "Low-PrevClose"]].max(axis=1)
+    df["ATR"] = df["TR"].rolling(window=window_size).mean()
 
-df["TR"] = df[["High-Low", "High-PrevClose", "Low-PrevClose"]].max(axis=1)
-df["ATR"] = df["TR"].rolling(window=window_size).mean()
+    # 移除不必要的中間列
+    df.drop(columns=["High-Low", "High-PrevClose", "Low-PrevClose", "TR"], inplace=True)
+    return df
 
-# 移除不必要的中間列
-df.drop(columns=["High-Low", "High-PrevClose", "Low-PrevClose", "TR"], inplace=True)
+def main():
+    # 讀取 CSV 文件
+    file_path = "klines_BTC.csv"  # 請替換成你的檔案路徑
+    df = load_klines(file_path, time_as='datetime')
 
-# 存回檔案
-output_path = "klines_BTC_factors.csv"
-df.to_csv(output_path, index=False)
+    # 設定 window_size 與 Gamma Decay 系數
+    df = compute_factors(df, window_size=WINDOW_SIZE, gamma=GAMMA)
 
-print(f"計算完成，結果已儲存至 {output_path}")
+    # 存回檔案
+    output_path = "klines_BTC_factors.csv"
+    df.to_csv(output_path, index=False)
+
+    print(f"計算完成，結果已儲存至 {output_path}")
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,47 @@
-def backtesting(df):
-    balance = 100000
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.chunked import IncrementalCSV, iter_chunks, with_last
+from backtest_sim.funding import apply_funding, bar_period
+from backtest_sim.instrument import traced
+
+# 整段回測結束時才確定的欄位 (整欄為最後的進場價)
+FINAL_COLUMNS = {'long entry price': 'long_entry_price', 'short entry price': 'short_entry_price'}
+
+# 預設的出場與進場規則：停利 9 倍 ATR、停損 3 倍 ATR，連續超過 4 根同方向訊號才進場
+TAKE_PROFIT_ATR = 9
+STOP_LOSS_ATR = 3
+CONFIRM_COUNT = 4
+
+
+def new_state(balance=100000):
+    """分塊回測在區塊之間延續的狀態"""
+    return {'balance': balance, 'rows': 0, 'buy_position': None, 'sell_position': None,
+            'long_entry_price': None, 'short_entry_price': None,
+            'buy_signal_cnt': 0, 'sell_signal_cnt': 0, 'last_close': None}
+
+
+def backtest_chunk(df, state, last=True, take_profit_atr=TAKE_PROFIT_ATR, stop_loss_atr=STOP_LOSS_ATR,
+                   confirm=CONFIRM_COUNT):
+    """
+    回測一個區塊的 K 線，依序對每個區塊呼叫的結果與一次回測整段資料相同
+    :param df: DataFrame 區塊 (index 為 0..n-1)，必須包含 'Close', 'direction', 'ATR' 欄位
+    :param state: new_state() 建立的 dict，就地更新部位、進場價、訊號計數與資金
+    :param last: 是否為最後一個區塊 (整段資料的第一根與最後一根 K 線不交易，最後一根強制平倉)
+    :param take_profit_atr: 停利距離 (ATR 倍數)
+    :param stop_loss_atr: 停損距離 (ATR 倍數)
+    :param confirm: 同方向訊號連續超過此數量才進場
+    :return: 加入回測欄位的 df；'long entry price' / 'short entry price' 為目前為止的進場價
+    """
+    balance = state['balance']
     signals = [0] * len(df)
     buy_signals = [0] * len(df)
     sell_signals = [0] * len(df)
     buy_position = [None] * len(df)
     sell_position = [None] * len(df)
-    long_entry_price = None
-    short_entry_price = None
+    long_entry_price = state['long_entry_price']
+    short_entry_price = state['short_entry_price']
     exit_price = None
     entry_prices = [None] * len(df)
     exit_prices = [None] * len(df)
@@ -16,15 +51,17 @@ def backtesting(df):
     pnl = [0] * len(df)
     fee_rate = 0.01 * 0.1 # 0.5%
 
-    buy_signal_cnt = 0
-    sell_signal_cnt = 0
+    buy_signal_cnt = state['buy_signal_cnt']
+    sell_signal_cnt = state['sell_signal_cnt']
 
-    for i in range(1, len(df)-1):
+    start = 1 if state['rows'] == 0 else 0
+    stop = len(df) - 1 if last else len(df)
+    for i in range(start, stop):
         signals[i] = 0
         buy_signals[i] = 0
         sell_signals[i] = 0
-        buy_position[i] = buy_position[i-1]
-        sell_position[i] = sell_position[i-1]
+        buy_position[i] = buy_position[i-1] if i > 0 else state['buy_position']
+        sell_position[i] = sell_position[i-1] if i > 0 else state['sell_position']
 
         if df.at[i, 'direction'] == 1:
             buy_signal_cnt = buy_signal_cnt + 1
@@ -36,7 +73,7 @@ def backtesting(df):
         # long, take profit and stop loss
         if df.at[i, 'direction'] == -1  and buy_position[i] == True:
             # take profit (trend, reversion)
-            if df.at[i, 'Close'] >= long_entry_price + 9 * df.at[i, 'ATR']:
+            if df.at[i, 'Close'] >= long_entry_price + take_profit_atr * df.at[i, 'ATR']:
                 fee = df.at[i, 'Close'] * lot * fee_rate
                 take_profit = (df.at[i, 'Close'] - long_entry_price) * lot - fee
                 balance += take_profit
@@ -45,7 +82,7 @@ def backtesting(df):
                 exit_prices[i] = exit_price
                 pnl[i] = take_profit
             # stop loss
-            elif df.at[i, 'Close'] <= long_entry_price - 3 * df.at[i, 'ATR']:
+            elif df.at[i, 'Close'] <= long_entry_price - stop_loss_atr * df.at[i, 'ATR']:
                 fee = df.at[i, 'Close'] * lot * fee_rate
                 stop_loss = (long_entry_price - df.at[i, 'Close']) * lot + fee
                 balance -= stop_loss
@@ -57,7 +94,7 @@ def backtesting(df):
         # short, take profit and stop loss
         if sell_position[i] == True:
             # take profit (trend, reversion)
-            if df.at[i, 'direction'] == 1  and df.at[i, 'Close'] <= short_entry_price - 9 * df.at[i, 'ATR']:
+            if df.at[i, 'direction'] == 1  and df.at[i, 'Close'] <= short_entry_price - take_profit_atr * df.at[i, 'ATR']:
                 fee = df.at[i, 'Close'] * lot * fee_rate
                 take_profit = (short_entry_price - df.at[i, 'Close']) * lot - fee
                 balance += take_profit
@@ -66,7 +103,7 @@ def backtesting(df):
                 exit_prices[i] = exit_price
                 pnl[i] = take_profit
             # stop loss
-            elif df.at[i, 'Close'] >= short_entry_price + 3 * df.at[i, 'ATR']:
+            elif df.at[i, 'Close'] >= short_entry_price + stop_loss_atr * df.at[i, 'ATR']:
                 fee = df.at[i, 'Close'] * lot * fee_rate
                 stop_loss = (df.at[i, 'Close'] - short_entry_price) * lot + fee
                 balance -= stop_loss
@@ -75,25 +112,31 @@ def backtesting(df):
                 exit_prices[i] = exit_price
                 pnl[i] = - stop_loss
 
-        if buy_signal_cnt > 4 and buy_position[i] == None:
+        if buy_signal_cnt > confirm and buy_position[i] == None:
             buy_signals[i] = 1
             buy_position[i] = True
             long_entry_price = df.at[i, 'Close']
-        if sell_signal_cnt > 4 and sell_position[i] == None:
+        if sell_signal_cnt > confirm and sell_position[i] == None:
             sell_signals[i] = 1
             sell_position[i] = True
             short_entry_price = df.at[i, 'Close']
 
-    if buy_position[len(df)-2] == True:
+    if stop > start:
+        state['buy_position'] = buy_position[stop-1]
+        state['sell_position'] = sell_position[stop-1]
+        state['last_close'] = df.at[stop-1, 'Close']
+
+    # 最後一根 K 線強制平倉 (停損價沿用最後一次迴圈的收盤價，與原本的計算相同)
+    if last and state['buy_position'] == True:
         fee = df.at[len(df)-1, 'Close'] * lot * fee_rate
-        stop_loss = (long_entry_price - df.at[i, 'Close']) * lot + fee
+        stop_loss = (long_entry_price - state['last_close']) * lot + fee
         balance -= stop_loss
         buy_position[len(df)-1] = None
         exit_price = df.at[len(df)-1, 'Close']
         exit_prices[len(df)-1] = exit_price
         pnl[len(df)-1] += - stop_loss
-        long_entry_price = df.at[i, 'Close']
-    if sell_position[len(df)-2] == True:
+        long_entry_price = state['last_close']
+    if last and state['sell_position'] == True:
         fee = df.at[len(df)-1, 'Close'] * lot * fee_rate
         stop_loss = (df.at[len(df)-1, 'Close'] - short_entry_price) * lot + fee
         balance -= stop_loss
@@ -102,6 +145,13 @@ def backtesting(df):
         exit_prices[len(df)-1] = exit_price
         pnl[len(df)-1] += - stop_loss
 
+    state['balance'] = balance
+    state['long_entry_price'] = long_entry_price
+    state['short_entry_price'] = short_entry_price
+    state['buy_signal_cnt'] = buy_signal_cnt
+    state['sell_signal_cnt'] = sell_signal_cnt
+    state['rows'] += len(df)
+
     df['buy signal'] = buy_signals
     df['buy position'] = buy_position
     df['sell signals'] = sell_signals
@@ -110,4 +160,47 @@ def backtesting(df):
     df['short entry price'] = short_entry_price
     df['exit price'] = exit_prices
     df['PnL'] = pnl
-    return df
\ No newline at end of file
+    return df
+
+
+@traced('backtest.backtesting')
+def backtesting(df, funding=None, **rules):
+    """
+    :param funding: 資金費率事件 (backtest_sim.funding.funding_events)，持倉的資金費用記在 'Funding' 欄位並併入 'PnL'；
+                    None 為不計資金費用
+    :param rules: take_profit_atr / stop_loss_atr / confirm (見 backtest_chunk)
+    """
+    df = backtest_chunk(df, new_state(), last=True, **rules)
+    if funding is not None:
+        df, _ = apply_funding(df, funding)
+    return df
+
+
+@traced('backtest.backtesting_chunks')
+def backtesting_chunks(chunks, output_file, chunksize=100_000, funding=None, **rules):
+    """
+    分塊回測並逐塊寫出結果，輸出與 backtesting(整段資料).to_csv(index=False) 相同
+    (整段沒有任何平倉時，一次回測的 'PnL' 為整數，分塊輸出為 0.0)
+    :param chunks: DataFrame 區塊的 iterable，或 CSV 路徑 / 欄式資料夾 (以 chunksize 切塊讀取)
+    :param output_file: 輸出 CSV 路徑
+    :param funding: 資金費率事件 (同 backtesting)，K 線週期由第一個區塊推算
+    :param rules: take_profit_atr / stop_loss_atr / confirm (見 backtest_chunk)
+    :return: 最後的 state (含 'balance'，計入資金費用時另有 'funding' 合計)
+    """
+    state = new_state()
+    bar_ms = None
+    with IncrementalCSV(output_file) as out:
+        for chunk, last in with_last(iter_chunks(chunks, chunksize)):
+            chunk = backtest_chunk(chunk, state, last, **rules)
+            chunk['PnL'] = chunk['PnL'].astype(float)  # 沒有平倉的區塊也與整段資料同為浮點數
+            if funding is not None:
+                bar_ms = bar_ms or bar_period(chunk['Open time'].iloc[:1000])
+                chunk, total = apply_funding(chunk, funding, bar_ms=bar_ms)
+                state['funding'] = state.get('funding', 0.0) + total
+                state['balance'] += total
+            for column in FINAL_COLUMNS:
+                chunk[column] = out.placeholder(column)
+            out.write(chunk)
+        for column, key in FINAL_COLUMNS.items():
+            out.fill(column, state[key])
+    return state
@@ -1,27 +1,34 @@
-import matplotlib.pyplot as plt
+import os
+import sys
 import numpy as np
 import pandas as pd
-from backtest import backtesting
+from add_alphas import N, THRESHOLD
+from add_factors import GAMMA, WINDOW_SIZE
+from backtest import CONFIRM_COUNT, STOP_LOSS_ATR, TAKE_PROFIT_ATR, backtesting
 
-def plot_result(df, initial_balance=10000, save_path="./backtest_results"):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim import report
+from backtest_sim.instrument import span, traced
+from backtest_sim.results import record_from_env, symbol_from_path
+
+@traced('plot.plot_result')
+def plot_result(df, initial_balance=10000, save_path="./backtest_results", workers=None, max_points=5000):
     """
     視覺化回測結果，分開計算 Training & Testing 的績效指標，包括累積報酬、最大回撤、Sharpe Ratio 和 Win Ratio。
+    圖表以非互動式 backend 平行輸出，並附 report.html 摘要；結果未變動時不重繪。
 
     :param df: 包含回測結果的 DataFrame，應包含 'PnL', 'Close', 'buy signal', 'sell signals' 等欄位
     :param initial_balance: 初始資金
+    :param workers: 繪圖 process 數量，None 為自動
+    :param max_points: 每條序列降採樣後的最大點數
     """
-    import os
-    os.makedirs(save_path, exist_ok=True)  # 確保儲存資料夾存在
-    
-    plt.style.use("dark_background")  # 設定背景為黑色
-
     # 計算測試集的分界點
     split_idx = int(len(df) * 0.8)
     df_train = df.iloc[:split_idx]  # 訓練集
     df_test = df.iloc[split_idx:]  # 測試集
 
     # **計算累積報酬 (Cumulative PnL)**
-    df['PnL'].fillna(0, inplace=True)  # 填補空值
+    df['PnL'] = df['PnL'].fillna(0)  # 填補空值
     df['Cumulative PnL'] = df['PnL'].cumsum() + initial_balance  # 計算累積報酬
 
     df_train['Cumulative PnL'] = df_train['PnL'].cumsum() + initial_balance
@@ -67,31 +74,46 @@ def plot_result(df, initial_balance=10000, save_path="./backtest_results"):
     print(f"🔹 Win Ratio (Test): {win_ratio_test:.2%} ({winning_trades_test}/{total_trades_test})")
 
     # **📊 繪製累積報酬變化圖**
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['Cumulative PnL'], label='Cumulative PnL', color='cyan')
-    plt.axvline(x=split_idx, color='yellow', linestyle='--', label="Train-Test Split")
-    plt.fill_between(df.index, df['Cumulative PnL'], df['Peak'], color='red', alpha=0.3, label="Drawdown")
-    plt.title("Cumulative PnL & Drawdown")
-    plt.xlabel("Time")
-    plt.ylabel("PnL")
-    plt.legend()
-    plt.grid()
-    plt.savefig(f"{save_path}/cumulative_pnl.png", dpi=300, bbox_inches='tight')
-    plt.show()
-
-    # **📊 繪製價格走勢與交易信號**
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['Close'], label="Close Price", color='white')
-    plt.scatter(df.index[df['buy signal'] == 1], df['Close'][df['buy signal'] == 1], color='green', label="Buy Signal", marker="^", alpha=1)
-    plt.scatter(df.index[df['sell signals'] == 1], df['Close'][df['sell signals'] == 1], color='red', label="Sell Signal", marker="v", alpha=1)
-    plt.axvline(x=split_idx, color='yellow', linestyle='--', label="Train-Test Split")
-    plt.title("Price Movement & Trading Signals")
-    plt.xlabel("Time")
-    plt.ylabel("Price")
-    plt.legend()
-    plt.grid()
-    plt.savefig(f"{save_path}/price_signals.png", dpi=300, bbox_inches='tight')
-    plt.show()
+    buy = df['buy signal'] == 1
+    sell = df['sell signals'] == 1
+    split_line = report.axvline(split_idx, color='yellow', linestyle='--', label="Train-Test Split")
+    figures = [
+        report.figure(
+            "cumulative_pnl.png",
+            report.axes(
+                report.line(df['Cumulative PnL'], x=df.index, label='Cumulative PnL', color='cyan'),
+                split_line,
+                report.fill_between(df['Cumulative PnL'], df['Peak'], x=df.index, color='red', alpha=0.3, label="Drawdown"),
+                title="Cumulative PnL & Drawdown", xlabel="Time", ylabel="PnL",
+            ),
+            figsize=(12, 6), tight=False,
+        ),
+        # **📊 繪製價格走勢與交易信號**
+        report.figure(
+            "price_signals.png",
+            report.axes(
+                report.line(df['Close'], x=df.index, label="Close Price", color='white'),
+                report.scatter(df.index[buy], df['Close'][buy], color='green', label="Buy Signal", marker="^", alpha=1),
+                report.scatter(df.index[sell], df['Close'][sell], color='red', label="Sell Signal", marker="v", alpha=1),
+                split_line,
+                title="Price Movement & Trading Signals", xlabel="Time", ylabel="Price",
+            ),
+            figsize=(12, 6), tight=False,
+        ),
+    ]
+    metrics = {
+        'Final Balance (Train)': float(df_train['Cumulative PnL'].iloc[-1]),
+        'Final Balance (Test)': float(df_test['Cumulative PnL'].iloc[-1]),
+        'Sharpe Ratio (Train)': float(sharpe_ratio_train),
+        'Sharpe Ratio (Test)': float(sharpe_ratio_test),
+        'Max Drawdown (Train)': float(max_drawdown_train),
+        'Max Drawdown (Test)': float(max_drawdown_test),
+        'Win Ratio (Train)': float(win_ratio_train),
+        'Win Ratio (Test)': float(win_ratio_test),
+    }
+    with span('plot.render_report'):
+        report.render_report(figures, save_path, metrics=metrics, title="ML_CTA Backtest",
+                             workers=workers, max_points=max_points)
 
     print(f"✅ 所有圖表已儲存至 {save_path}/")
 
@@ -101,3 +123,6 @@ if __name__ == '__main__':
     df = pd.read_csv(file_path)
     df_backtesting = backtesting(df)
     plot_result(df_backtesting)
+    config = {'window_size': WINDOW_SIZE, 'gamma': GAMMA, 'N': N, 'threshold': THRESHOLD,
+              'take_profit_atr': TAKE_PROFIT_ATR, 'stop_loss_atr': STOP_LOSS_ATR, 'confirm': CONFIRM_COUNT}
+    record_from_env('ml_cta', symbol_from_path(file_path), config, df_backtesting)
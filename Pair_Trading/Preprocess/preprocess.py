@@ -1,32 +1,190 @@
+import argparse
+import logging
+import os
+import re
+import shutil
+import sys
 import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
 
-# Define file names and headers
-kline_file_path = 'ETH_kline.csv'
-kline_columns = [
-    "Open time", "Open", "High", "Low", "Close", "Volume",
-    "Close time", "Quote asset volume", "Number of trades",
-    "Taker buy base asset volume", "Taker buy quote asset volume", "Ignore", "symbol"
-]
-
-trades_file_path = 'ETH_trades.csv'
-trades_columns = [
-    "trade Id", "price", "qty", "quoteQty", "time",
-    "isBuyerMaker", "isBestMatch", "symbol"
-]
-
-# Define symbol value
-symbol_value = 'SPOT_BTC_USDT'
-
-# Remove duplicate headers in kline.csv and add symbol column
-data_kline = pd.read_csv(kline_file_path, dtype=str, low_memory=False)
-if data_kline.iloc[0].tolist()[:12] == kline_columns[:-1]:
-    data_kline = data_kline[1:]
-data_kline['symbol'] = symbol_value
-data_kline.to_csv(kline_file_path, index=False, header=kline_columns)
-
-# Remove duplicate headers in trades.csv and add symbol column
-data_trades = pd.read_csv(trades_file_path, dtype=str, low_memory=False)
-if data_trades.iloc[0].tolist()[:7] == trades_columns[:-1]:
-    data_trades = data_trades[1:]
-data_trades['symbol'] = symbol_value
-data_trades.to_csv(trades_file_path, index=False, header=trades_columns)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from backtest_sim.columnar import ColumnarWriter, write_parquet
+from backtest_sim.instrument import traced
+
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Preprocess')
+
+# 原始檔案的欄位 (不含 symbol) 與正規化後的型別
+KLINE_COLUMNS = {
+    "Open time": 'int64', "Open": 'float64', "High": 'float64', "Low": 'float64', "Close": 'float64',
+    "Volume": 'float64', "Close time": 'int64', "Quote asset volume": 'float64', "Number of trades": 'int64',
+    "Taker buy base asset volume": 'float64', "Taker buy quote asset volume": 'float64', "Ignore": 'float64',
+}
+TRADES_COLUMNS = {
+    "trade Id": 'int64', "price": 'float64', "qty": 'float64', "quoteQty": 'float64', "time": 'int64',
+    "isBuyerMaker": 'bool', "isBestMatch": 'bool',
+}
+SCHEMAS = {'kline': KLINE_COLUMNS, 'trades': TRADES_COLUMNS}
+
+DEFAULT_FILES = ['BTC_kline.csv', 'ETH_kline.csv', 'BTC_trades.csv', 'ETH_trades.csv']
+
+
+def symbol_from_filename(path, market='SPOT', quote='USDT'):
+    """
+    由檔名推斷 symbol，例如 ETH_trades.csv -> SPOT_ETH_USDT
+    :param path: 檔案路徑，檔名需以 '<幣種>_' 開頭
+    """
+    match = re.match(r'([A-Za-z0-9]+)_', os.path.basename(path))
+    if not match:
+        raise ValueError(f"Cannot infer symbol from file name {path!r}; pass symbol explicitly")
+    return f"{market}_{match.group(1).upper()}_{quote}"
+
+
+def detect_kind(path):
+    """由檔名 (kline / trades) 或第一列的欄位數判斷檔案種類"""
+    name = os.path.basename(path).lower()
+    if 'kline' in name:
+        return 'kline'
+    if 'trade' in name:
+        return 'trades'
+    with open(path) as f:
+        fields = len(f.readline().rstrip('\r\n').split(','))
+    for kind, columns in SCHEMAS.items():
+        if fields in (len(columns), len(columns) + 1):
+            return kind
+    raise ValueError(f"Cannot detect file kind of {path!r} ({fields} fields)")
+
+
+def _to_bool(values):
+    if is_bool_dtype(values):
+        return values
+    return values.astype(str).str.lower() == 'true'
+
+
+def _normalize_chunk(chunk, schema):
+    """
+    移除夾在資料中的表頭列並轉成正規型別
+    :return: (正規化後的 DataFrame, 移除的表頭列數)
+    """
+    first = next(iter(schema))
+    dropped = 0
+    if not is_numeric_dtype(chunk[first]):
+        # 表頭 (或其他非數字) 列的第一欄無法轉成數字
+        is_data = pd.to_numeric(chunk[first], errors='coerce').notna()
+        dropped = int((~is_data).sum())
+        if dropped:
+            chunk = chunk[is_data]
+    out = {}
+    for name, dtype in schema.items():
+        values = chunk[name]
+        if dtype == 'bool':
+            out[name] = _to_bool(values).to_numpy()
+        elif not is_numeric_dtype(values):
+            out[name] = pd.to_numeric(values).to_numpy().astype(dtype)
+        else:
+            out[name] = values.to_numpy().astype(dtype, copy=False)
+    return pd.DataFrame(out), dropped
+
+
+def iter_normalized(path, kind=None, chunk_size=250_000):
+    """
+    以固定大小的區塊讀取原始檔，逐塊回傳正規化後的 DataFrame (不含 symbol)
+    記憶體用量只與 chunk_size 有關，與檔案大小無關。
+    :param path: 原始 CSV (有無表頭皆可，表頭列可出現在任何位置，多出的 symbol 欄位會被忽略)
+    :param kind: 'kline' / 'trades'，None 時自動判斷
+    :param chunk_size: 每個區塊的列數
+    """
+    schema = SCHEMAS[kind or detect_kind(path)]
+    # 檔案開頭的表頭直接跳過，讓第一個區塊也能以數值型別解析
+    with open(path) as f:
+        first_field = f.readline().split(',', 1)[0].strip()
+    skip = 0 if first_field.lstrip('-').replace('.', '', 1).isdigit() else 1
+    # round_trip 解析使浮點數與原始文字完全對應
+    reader = pd.read_csv(path, header=None, skiprows=skip, usecols=range(len(schema)), chunksize=chunk_size,
+                         low_memory=False, float_precision='round_trip')
+    for chunk in reader:
+        chunk.columns = list(schema)
+        normalized, dropped = _normalize_chunk(chunk, schema)
+        if dropped:
+            logger.info(f"{os.path.basename(path)}: skipped {dropped} header row(s)")
+        yield normalized
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@traced('preprocess.normalize')
+def normalize(path, output=None, symbol=None, kind=None, fmt='columnar', chunk_size=250_000):
+    """
+    串流正規化一個 K 線或成交紀錄檔
+    :param path: 原始 CSV 路徑
+    :param output: 輸出路徑，預設為同名的 .cols 資料夾 / .parquet 檔，fmt='csv' 時預設原地覆寫
+    :param symbol: symbol 名稱，預設由檔名推斷 (BTC_trades.csv -> SPOT_BTC_USDT)
+    :param kind: 'kline' / 'trades'，None 時自動判斷
+    :param fmt: 'columnar' (backtest_sim 欄式資料夾)、'parquet' 或 'csv'
+    :param chunk_size: 每個區塊的列數
+    :return: (輸出路徑, 筆數)
+    """
+    symbol = symbol or symbol_from_filename(path)
+    if fmt not in ('columnar', 'parquet', 'csv'):
+        raise ValueError(f"Unknown format: {fmt}")
+    stem = os.path.splitext(path)[0]
+    output = output or {'columnar': stem + '.cols', 'parquet': stem + '.parquet', 'csv': path}[fmt]
+
+    # 先寫到暫存路徑，完成後才取代輸出 (fmt='csv' 時可安全地原地覆寫輸入檔)
+    tmp = output + '.tmp'
+    chunks = iter_normalized(path, kind=kind, chunk_size=chunk_size)
+    try:
+        if fmt == 'columnar':
+            with ColumnarWriter(tmp) as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+                # symbol 存成常數，不佔用每列空間
+                writer.set_constant('symbol', symbol)
+            rows = writer.rows
+        elif fmt == 'parquet':
+            rows = write_parquet((chunk.assign(symbol=symbol) for chunk in chunks), tmp)
+        else:
+            rows = 0
+            with open(tmp, 'w', newline='') as f:
+                for chunk in chunks:
+                    chunk.assign(symbol=symbol).to_csv(f, index=False, header=rows == 0)
+                    rows += len(chunk)
+    except BaseException:
+        _remove(tmp)
+        raise
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    os.replace(tmp, output)
+    logger.info(f"{path} -> {output}: {rows:,} rows, symbol={symbol}")
+    return output, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize raw kline / trades dumps in fixed-size chunks")
+    parser.add_argument('files', nargs='*', help=f"raw CSV files (default: {' '.join(DEFAULT_FILES)} if present)")
+    parser.add_argument('--symbol', help="symbol for every file (default: inferred from each file name)")
+    parser.add_argument('--kind', choices=sorted(SCHEMAS), help="file kind (default: inferred)")
+    parser.add_argument('--format', dest='fmt', default='columnar', choices=['columnar', 'parquet', 'csv'])
+    parser.add_argument('--chunk-size', type=int, default=250_000)
+    args = parser.parse_args(argv)
+
+    files = args.files or [f for f in DEFAULT_FILES if os.path.exists(f)]
+    if not files:
+        parser.error("no input files")
+    for path in files:
+        normalize(path, symbol=args.symbol, kind=args.kind, fmt=args.fmt, chunk_size=args.chunk_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
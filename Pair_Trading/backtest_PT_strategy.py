@@ -1,7 +1,14 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.loaders import load_klines
+from backtest_sim.rules import RuleSet
+
 
 # Set up logging
 logging.basicConfig(
@@ -10,6 +17,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger('PairTradingStrategy')
 
+# 價差低於均值 threshold 倍標準差買進、高於時賣出 (兩者同時成立時賣出，與原本依序指定的結果相同)
+SIGNAL_RULES = RuleSet([('diff > mean_diff + threshold * std_diff', -1),
+                        ('diff < mean_diff - threshold * std_diff', 1)])
+
 
 class BacktestPTStrategy:
     def __init__(self):
@@ -18,13 +29,14 @@ class BacktestPTStrategy:
         self.T = 400  # 設定觀察窗口大小
         self.threshold = 2  # 使用標準差作為門檻
 
+    @traced('strategy.load_data')
     def load_data(self, file_path):
         """Load data from CSV file"""
         try:
-            df = pd.read_csv(file_path)
-            df['timestamp'] = pd.to_datetime(df['Open time'], unit='ms')
-            df = df[['timestamp', 'Open', 'High', 'Low', 'Close', 'Volume']]
-            df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].astype(float)
+            # 只讀取需要的欄位，價格以 float64 解析，'Open time' 直接轉為 datetime
+            df = load_klines(file_path, columns=['Open time', 'Open', 'High', 'Low', 'Close', 'Volume'],
+                             time_as='datetime')
+            df = df.rename(columns={'Open time': 'timestamp'})
             df.sort_values('timestamp', inplace=True)
             df.reset_index(drop=True, inplace=True)
             return df
@@ -43,6 +55,7 @@ class BacktestPTStrategy:
         df['diff'] = df1['Close'] - df2['Close']
         return df
 
+    @traced('strategy.calculate_statistics')
     def calculate_statistics(self, df):
         """計算期望值與變異數"""
         df['mean_diff'] = df['diff'].rolling(window=self.T).mean()
@@ -51,13 +64,13 @@ class BacktestPTStrategy:
         df['std_diff'] = np.sqrt(df['var_diff'])
         return df
 
+    @traced('strategy.generate_signals')
     def generate_signals(self, df):
         """根據價格差與變異數計算交易訊號"""
-        df['signal'] = 0
-        df.loc[df['diff'] < (df['mean_diff'] - self.threshold * df['std_diff']), 'signal'] = 1  # Buy
-        df.loc[df['diff'] > (df['mean_diff'] + self.threshold * df['std_diff']), 'signal'] = -1  # Sell
+        df['signal'] = SIGNAL_RULES.evaluate(df, threshold=self.threshold)
         return df
 
+    @traced('strategy.run_backtest')
     def run_backtest(self, file1, file2, output_file='backtest_results.csv'):
         """執行配對交易回測"""
         df1 = self.load_data(file1)
@@ -79,4 +92,4 @@ class BacktestPTStrategy:
 
 if __name__ == "__main__":
     strategy = BacktestPTStrategy()
-    strategy.run_backtest('Preprocess/BTC_kline.csv', 'Preprocess/ETH_kline.csv', 'backtest_results.csv')
+    strategy.run_backtest('Preprocess/BTC_kline.cols', 'Preprocess/ETH_kline.cols', 'backtest_results.csv')
@@ -1,13 +1,32 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 from backtest_PT_strategy import BacktestPTStrategy
 from order_executor import OrderExecutor
 from pnl import plot_pnl
+from backtest_sim.metrics import summary_metrics
+from backtest_sim.results import record_from_env
+
+# 配對的兩個標的 (第一個為下單標的)
+PAIR = ('BTC', 'ETH')
+
+
+def record_run(strategy, executor):
+    """設定 BACKTEST_SIM_RESULTS 時把這次配對交易回測 (參數、資料區間、交易紀錄) 記錄到結果資料庫"""
+    orders_df = executor.orders.to_frame()
+    closed = orders_df[orders_df['reason'] != 'ENTER']
+    pnl = closed['profit_or_loss'].to_numpy()
+    config = {'window': strategy.T, 'threshold': strategy.threshold, 'fee_rate': executor.fee_rate,
+              'pair': '/'.join(PAIR)}
+    bars = executor.df['timestamp']
+    data_range = tuple(pd.to_datetime([bars.min(), bars.max()], unit='ms')) if len(bars) else (None, None)
+    return record_from_env('pair_trading', '/'.join(PAIR), config,
+                           metrics={**summary_metrics(pnl), **executor.trade_stats()},
+                           data_range=data_range, bars=len(bars), equity=pnl.cumsum(), trades=orders_df)
 
 
 if __name__ == "__main__":
     strategy = BacktestPTStrategy()
-    strategy.run_backtest('Preprocess/BTC_kline.csv', 'Preprocess/ETH_kline.csv', 'backtest_results.csv')
-    executor = OrderExecutor('backtest_results.csv', 'orders.csv', 'Preprocess/BTC_trades.csv')
+    strategy.run_backtest('Preprocess/BTC_kline.cols', 'Preprocess/ETH_kline.cols', 'backtest_results.csv')
+    executor = OrderExecutor('backtest_results.csv', 'orders.csv', 'Preprocess/BTC_trades.cols')
     executor.run_backtest()
+    record_run(strategy, executor)
     plot_pnl('orders.csv')
@@ -1,9 +1,20 @@
 import json
+import os
+import sys
+import numpy as np
 import pandas as pd
 import logging
 import time
 from tqdm import tqdm  # 引入進度條模組
-from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import span, traced
+from backtest_sim.ledger import ORDER_FIELDS, Ledger
+from backtest_sim.loaders import load_csv, load_trades
+from backtest_sim.tickstore import TickStore, is_tickstore
+
+# 交易紀錄的時間為台北時間 (UTC+8)
+TAIPEI_OFFSET_MS = 8 * 3_600_000
 
 
 # Set up logging
@@ -15,46 +26,70 @@ logger = logging.getLogger('OrderExecutor')
 
 
 class OrderExecutor:
+    @traced('execute.OrderExecutor.__init__')
     def __init__(self, strategy_file, output_file, trades_file):
-        """Initialize order executor for backtesting"""
+        """
+        Initialize order executor for backtesting
+        strategy_file / trades_file 為 None 時不載入資料，只接收 process_signal (例如 paper trading)
+        strategy_file / trades_file 也可以是已載入的 DataFrame (時間為毫秒數)，例如 backtest_sim.shm 共享的唯讀資料，
+        多個 executor 共用同一份資料而不重新讀檔
+        trades_file 為 backtest_sim.tickstore 的資料夾時，只解壓縮策略期間涵蓋的區塊
+        """
         self.strategy_file = strategy_file
         self.output_file = output_file
 
-        # 讀取資料並提前過濾交易資料
-        self.df = pd.read_csv(strategy_file)
-        self.df['timestamp'] = pd.to_datetime(self.df['timestamp']).astype('int64') // 10**6  # 轉為毫秒數
-        trades_df = pd.read_csv(trades_file)
-        trades_df['time'] = pd.to_datetime(trades_df['time'], unit='ms').astype('int64') // 10**6
+        # 讀取資料並提前過濾交易資料 (只讀取需要的欄位，時間直接解析為毫秒數)
+        if isinstance(strategy_file, pd.DataFrame):
+            self.df = strategy_file[['timestamp', 'signal', 'Close']]
+        elif strategy_file is not None:
+            self.df = load_csv(strategy_file, columns=['timestamp', 'signal', 'Close'])
+        else:
+            self.df = pd.DataFrame({'timestamp': np.empty(0, dtype=np.int64), 'signal': np.empty(0, dtype=np.int8),
+                                    'Close': np.empty(0)})
+        self.trade_times = np.empty(0, dtype=np.int64)
+        self.trade_prices = np.empty(0)
+        self.trade_pos = 0
+        if is_tickstore(trades_file):
+            min_time = int(self.df['timestamp'].min()) if len(self.df) else None
+            with span('execute.tickstore'):
+                trades = TickStore(trades_file).trades('SPOT_BTC_USDT', min_time, columns=['price', 'isBestMatch'])
+            # tick store 的資料已依時間排序
+            self.trade_times = trades['time'][trades['isBestMatch']]
+            self.trade_prices = trades['price'][trades['isBestMatch']]
+        elif trades_file is not None:
+            if isinstance(trades_file, pd.DataFrame):
+                trades_df = trades_file
+            else:
+                trades_df = load_trades(trades_file, columns=['time', 'price', 'isBestMatch', 'symbol'])
 
-        # 過濾交易資料，僅保留可能需要處理的時間範圍
-        min_time = self.df['timestamp'].min()
-        filtered_trades = trades_df[(trades_df['time'] >= min_time) &
-                                    (trades_df['isBestMatch'] == True) &
-                                    (trades_df['symbol'] == 'SPOT_BTC_USDT')]
+            # 過濾交易資料，僅保留可能需要處理的時間範圍
+            min_time = self.df['timestamp'].min() if len(self.df) else trades_df['time'].min()
+            filtered_trades = trades_df[(trades_df['time'] >= min_time) &
+                                        trades_df['isBestMatch'] &
+                                        (trades_df['symbol'] == 'SPOT_BTC_USDT')]
 
-        # 排序並轉換為 deque 加速操作
-        filtered_trades.sort_values('time', inplace=True)
-        self.trades_deque = deque(filtered_trades.to_dict('records'))
+            # 排序後只保留時間與價格兩個連續陣列，以游標代替 deque 的 popleft
+            with span('execute.trade_arrays'):
+                filtered_trades = filtered_trades.sort_values('time', kind='stable')
+                self.trade_times = filtered_trades['time'].to_numpy()
+                self.trade_prices = filtered_trades['price'].to_numpy()
+            del trades_df, filtered_trades
 
         # 其他變數初始化
         self.current_position = None
         self.position_size = 0.0
         self.entry_price = None
-        self.orders = []
+        self.orders = Ledger(ORDER_FIELDS)  # 交易紀錄 (backtest_sim.ledger)
         self.fee_rate = 0.0002  # 0.02% fee
         logger.info("OrderExecutorBacktest initialized")
 
     def get_trade_price(self, timestamp):
-        """線性搜尋取得最接近的交易價格，並刪除無效資料"""
-        trade_price = None
-        while len(self.trades_deque) > 0:
-            trade = self.trades_deque[0]
-            if trade['time'] < timestamp:
-                self.trades_deque.popleft()  # 移除舊資料
-            else:
-                trade_price = trade['price']
-                break
-        return trade_price
+        """從游標位置二分搜尋第一筆時間不早於 timestamp 的交易價格，游標只會前進"""
+        pos = self.trade_pos + int(np.searchsorted(self.trade_times[self.trade_pos:], timestamp, side='left'))
+        self.trade_pos = pos
+        if pos < len(self.trade_times):
+            return float(self.trade_prices[pos])
+        return None
 
     def check_exit_conditions(self, current_signal):
         """檢查是否符合平倉條件"""
@@ -75,8 +110,8 @@ class OrderExecutor:
         fee = turnover * self.fee_rate
         gross_pnl = 0.0
 
-        # 將 timestamp 轉換成台北時間
-        taipei_time = pd.to_datetime(timestamp, unit='ms') + pd.Timedelta(hours=8)
+        # 將 timestamp (毫秒) 轉換成台北時間
+        taipei_time = int(timestamp) + TAIPEI_OFFSET_MS
 
         # 建立持倉
         if self.current_position is None:
@@ -84,12 +119,12 @@ class OrderExecutor:
                 self.current_position = 'LONG'
                 self.position_size = quantity
                 self.entry_price = price
-                self.orders.append([taipei_time, 'BUY', quantity, price, 'LONG', 'ENTER', profit_or_loss, gross_pnl, fee, turnover])
+                self.orders.append(taipei_time, 'BUY', quantity, price, 'LONG', 'ENTER', profit_or_loss, gross_pnl, fee, turnover)
             elif signal == -1:  # Sell signal
                 self.current_position = 'SHORT'
                 self.position_size = quantity
                 self.entry_price = price
-                self.orders.append([taipei_time, 'SELL', quantity, price, 'SHORT', 'ENTER', profit_or_loss, gross_pnl, fee, turnover])
+                self.orders.append(taipei_time, 'SELL', quantity, price, 'SHORT', 'ENTER', profit_or_loss, gross_pnl, fee, turnover)
         else:
             # 平倉條件
             exit_reason = self.check_exit_conditions(signal)
@@ -100,14 +135,15 @@ class OrderExecutor:
                     gross_pnl = (self.entry_price - price) * self.position_size
                 profit_or_loss = gross_pnl - fee
 
-                self.orders.append([taipei_time, 'SELL' if self.current_position == 'LONG' else 'BUY',
-                                    self.position_size, price, self.current_position, exit_reason,
-                                    profit_or_loss, gross_pnl, fee, turnover])
+                self.orders.append(taipei_time, 'SELL' if self.current_position == 'LONG' else 'BUY',
+                                   self.position_size, price, self.current_position, exit_reason,
+                                   profit_or_loss, gross_pnl, fee, turnover)
 
                 self.current_position = None
                 self.entry_price = None
                 self.position_size = 0.0
 
+    @traced('execute.OrderExecutor.run_backtest')
     def run_backtest(self):
         """執行回測"""
         logger.info("Starting backtest")
@@ -116,13 +152,17 @@ class OrderExecutor:
         logger.info("Backtest completed")
         self.save_orders()
 
+    def trade_stats(self):
+        """平倉紀錄的統計 (勝率、獲利因子、最長連續虧損...)"""
+        return self.orders.stats(pnl='profit_or_loss', where=self.orders.column('reason', decode=True) != 'ENTER')
+
     def save_orders(self):
         """儲存交易紀錄"""
-        orders_df = pd.DataFrame(self.orders, columns=['timestamp', 'side', 'quantity', 'price', 'position', 'reason', 'profit_or_loss', 'gross_pnl', 'fee', 'turnover'])
+        orders_df = self.orders.to_frame()
         orders_df.to_csv(self.output_file, index=False)
         logger.info(f"Orders saved to {self.output_file}")
 
 
 if __name__ == "__main__":
-    executor = OrderExecutor('backtest_results.csv', 'orders.csv', 'Preprocess/BTC_trades.csv')
+    executor = OrderExecutor('backtest_results.csv', 'orders.csv', 'Preprocess/BTC_trades.cols')
     executor.run_backtest()
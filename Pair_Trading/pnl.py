@@ -1,8 +1,21 @@
+import os
+import sys
 import pandas as pd
-import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim import report
+from backtest_sim.instrument import traced
 
-def plot_pnl(file):
+
+@traced('plot.plot_pnl')
+def plot_pnl(file, save_path='.', workers=None, max_points=5000):
+    """
+    繪製累計盈虧走勢圖與每筆盈虧長條圖 (非互動式 backend，平行輸出，結果未變動時不重繪)
+    :param file: orders.csv 路徑
+    :param save_path: 圖表輸出資料夾
+    :param workers: 繪圖 process 數量，None 為自動
+    :param max_points: 每條序列降採樣後的最大點數
+    """
     # 讀取 orders.csv
     orders_df = pd.read_csv(file)
     # 確保 profit_or_loss 欄位為 float 類型
@@ -14,53 +27,42 @@ def plot_pnl(file):
     # 確保 timestamp 欄位為時間格式
     orders_df['timestamp'] = pd.to_datetime(orders_df['timestamp'])
 
-    # 設定樣式
-    plt.style.use('dark_background')
-
-    # 繪製累計盈虧走勢圖
-    plt.figure(figsize=(12, 8))
-    plt.plot(orders_df['timestamp'], orders_df['cumulative_profit'], color='cyan', label='Cumulative Profit')
-
-    # 設置軸標籤與標題
-    plt.xlabel('Timestamp', fontsize=12)
-    plt.ylabel('Cumulative Profit or Loss', fontsize=12)
-    plt.title('Cumulative Profit or Loss Trend', fontsize=14)
-
-    # 只顯示 timestamp 頭尾標籤
-    plt.xticks([orders_df['timestamp'].iloc[0], orders_df['timestamp'].iloc[-1]],
-            labels=[orders_df['timestamp'].iloc[0].strftime('%Y-%m-%d %H:%M:%S'),
-                    orders_df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S')])
-
-    # 顯示圖例與網格
-    plt.legend(fontsize=10)
-    plt.grid(color='gray', linestyle='--', linewidth=0.5, alpha=0.6)
-    plt.tight_layout()
-    plt.savefig('cumulative_pnl.png', dpi=300)
-    plt.show()
-
-    # 繪製每筆盈虧變動圖 (柱狀圖)
-    plt.figure(figsize=(12, 8))
-    colors = ['green' if val > 0 else 'red' for val in orders_df['profit_or_loss']]
-    plt.bar(orders_df['timestamp'], orders_df['profit_or_loss'], color=colors, alpha=0.7, label='Profit or Loss')
-
-    # 設置軸標籤與標題
-    plt.xlabel('Timestamp', fontsize=12)
-    plt.ylabel('Profit or Loss', fontsize=12)
-    plt.title('Profit or Loss Over Time', fontsize=14)
-    plt.xlim([orders_df['timestamp'].min(), orders_df['timestamp'].max()])
-
     # 只顯示 timestamp 頭尾標籤
-    plt.xticks([orders_df['timestamp'].iloc[0], orders_df['timestamp'].iloc[-1]],
-            labels=[orders_df['timestamp'].iloc[0].strftime('%Y-%m-%d %H:%M:%S'),
-                    orders_df['timestamp'].iloc[-1].strftime('%Y-%m-%d %H:%M:%S')])
+    first, last = orders_df['timestamp'].iloc[0], orders_df['timestamp'].iloc[-1]
+    xticks = ([first, last], [first.strftime('%Y-%m-%d %H:%M:%S'), last.strftime('%Y-%m-%d %H:%M:%S')])
+    grid = {'color': 'gray', 'linestyle': '--', 'linewidth': 0.5, 'alpha': 0.6}
 
-    # 顯示圖例與網格
-    plt.legend(fontsize=10)
-    plt.grid(color='gray', linestyle='--', linewidth=0.5, alpha=0.6)
-    plt.tight_layout()
-    plt.savefig('pnl.png', dpi=300)
-    plt.show()
+    figures = [
+        # 繪製累計盈虧走勢圖
+        report.figure(
+            'cumulative_pnl.png',
+            report.axes(
+                report.line(orders_df['cumulative_profit'], x=orders_df['timestamp'], color='cyan', label='Cumulative Profit'),
+                title='Cumulative Profit or Loss Trend', xlabel='Timestamp', ylabel='Cumulative Profit or Loss',
+                xticks=xticks, legend={'fontsize': 10}, grid=grid, fontsize=12,
+            ),
+            figsize=(12, 8), bbox_inches=None,
+        ),
+        # 繪製每筆盈虧變動圖 (柱狀圖)
+        report.figure(
+            'pnl.png',
+            report.axes(
+                report.bar(orders_df['profit_or_loss'], x=orders_df['timestamp'], sign_colors=('green', 'red'),
+                           alpha=0.7, label='Profit or Loss'),
+                title='Profit or Loss Over Time', xlabel='Timestamp', ylabel='Profit or Loss',
+                xticks=xticks, xlim=[orders_df['timestamp'].min(), orders_df['timestamp'].max()],
+                legend={'fontsize': 10}, grid=grid, fontsize=12,
+            ),
+            figsize=(12, 8), bbox_inches=None,
+        ),
+    ]
+    metrics = {
+        'Total Profit or Loss': float(orders_df['cumulative_profit'].iloc[-1]),
+        'Orders': len(orders_df),
+    }
+    report.render_report(figures, save_path, metrics=metrics, title='Pair Trading PnL',
+                         workers=workers, max_points=max_points)
 
 
 if __name__ == "__main__":
-    plot_pnl('orders.csv')
\ No newline at end of file
+    plot_pnl('orders.csv')
@@ -1,39 +1,99 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.quantile import rolling_quantiles
+from backtest_sim.rules import RuleSet
 
 # 設定 Pandas 選項
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', None)
 
-plt.style.use('dark_background')
+# 收盤價突破 threshold1 倍標準差為 -2 (停損)，介於 threshold2 與 threshold1 倍之間時逆勢 (-1 / 1)，
+# 都不成立時沿用前一根的趨勢
+# 主程式使用的標準差倍數 (plot_result 記錄回測結果時一併記錄)
+THRESHOLD1 = 4.5
+THRESHOLD2 = 2
+
+DIRECTION_RULES = RuleSet([
+    ('Close > Rolling_Mean_Close + threshold1 * Rolling_Std_Close', -2),
+    ('Close < Rolling_Mean_Close - threshold1 * Rolling_Std_Close', -2),
+    ('Close > Rolling_Mean_Close + threshold2 * Rolling_Std_Close and '
+     'Close < Rolling_Mean_Close + threshold1 * Rolling_Std_Close', -1),
+    ('Close < Rolling_Mean_Close - threshold2 * Rolling_Std_Close and '
+     'Close > Rolling_Mean_Close - threshold1 * Rolling_Std_Close', 1),
+], hold=True)
+
+# 經驗百分位帶的版本：不假設常態分佈，以過去 window 根收盤價的分位數作為上下軌
+# (外軌取代 threshold1 倍標準差、內軌取代 threshold2 倍標準差)
+PERCENTILE_RULES = RuleSet([
+    ('Close > Band_Outer_High', -2),
+    ('Close < Band_Outer_Low', -2),
+    ('Close > Band_Inner_High and Close < Band_Outer_High', -1),
+    ('Close < Band_Inner_Low and Close > Band_Outer_Low', 1),
+], hold=True)
+BAND_COLUMNS = ['Band_Outer_Low', 'Band_Inner_Low', 'Band_Inner_High', 'Band_Outer_High']
 
-def get_direction(df, threshold1=4.5, threshold2=2):
+
+@traced('alphas.get_direction')
+def get_direction(df, threshold1=THRESHOLD1, threshold2=THRESHOLD2, state=None):
     """
     根據價格突破均線標準差範圍來判定趨勢方向
     :param df: DataFrame, 必須包含 'Close', 'Rolling_Mean_Close', 'Rolling_Std_Close' 欄位
     :param threshold: 標準差倍數閥值, 預設為 3
+    :param state: 分塊處理時傳入同一個 dict，延續上一個區塊最後的趨勢 ('trend')
     :return: 更新後的 DataFrame
     """
-    trend = 0
-    directions = [0] * len(df)  # 預先建立長度相同的陣列，避免錯誤
-
-    for i in range(len(df)):
-        if df.at[i, 'Close'] > df.at[i, 'Rolling_Mean_Close'] + threshold1 * df.at[i, 'Rolling_Std_Close']:
-                trend = -2
-        elif df.at[i, 'Close'] < df.at[i, 'Rolling_Mean_Close'] - threshold1 * df.at[i, 'Rolling_Std_Close']:
-                trend = -2
-        elif df.at[i, 'Close'] > df.at[i, 'Rolling_Mean_Close'] + threshold2 * df.at[i, 'Rolling_Std_Close'] and \
-             df.at[i, 'Close'] < df.at[i, 'Rolling_Mean_Close'] + threshold1 * df.at[i, 'Rolling_Std_Close']:
-                trend = -1
-        elif df.at[i, 'Close'] < df.at[i, 'Rolling_Mean_Close'] - threshold2 * df.at[i, 'Rolling_Std_Close'] and \
-             df.at[i, 'Close'] > df.at[i, 'Rolling_Mean_Close'] - threshold1 * df.at[i, 'Rolling_Std_Close']:
-                trend = 1
-        directions[i] = trend  # 直接賦值，確保索引正確
+    trend = state.get('trend', 0) if state is not None else 0
+    directions = DIRECTION_RULES.evaluate(df, initial=trend, threshold1=threshold1, threshold2=threshold2)
 
+    if state is not None and len(directions):
+        state['trend'] = int(directions[-1])
     df.loc[:, 'direction'] = directions  # 確保 direction 正確加入 df
     return df
 
+
+@traced('alphas.get_percentile_direction')
+def get_percentile_direction(df, window=240, outer=0.005, inner=0.05, state=None):
+    """
+    與 get_direction 相同的逆勢 / 停損規則，但上下軌為過去 window 根收盤價 (不含當根) 的經驗分位數
+    四個分位數 (outer, inner, 1 - inner, 1 - outer) 以 backtest_sim.quantile 一次走過資料算出
+    :param df: DataFrame, 必須包含 'Close' 欄位
+    :param window: 計算分位數的 K 線根數，需讓 outer * (window - 1) >= 1
+                   (否則外軌與過去 window 根的最高 / 最低價相差不到一個名次，任何新高 / 新低都會成為 -2)
+    :param outer: 外軌的單邊機率 (收盤價落在外軌之外為 -2)
+    :param inner: 內軌的單邊機率 (介於內軌與外軌之間時逆勢 -1 / 1)
+    :param state: 分塊處理時傳入同一個 dict，延續上一個區塊的趨勢 ('trend') 與最後 window 根收盤價 ('closes')
+    :return: 加入 BAND_COLUMNS 與 'direction' 的 DataFrame
+    """
+    if not 0 <= outer < inner < 0.5:
+        raise ValueError("Expected 0 <= outer < inner < 0.5")
+    if outer * (window - 1) < 1:
+        raise ValueError(f"outer={outer} with window={window} puts the outer band within one rank of the "
+                         f"window's max / min; use window >= {int(np.ceil(1 / outer)) + 1} or a larger outer")
+    close = df['Close'].to_numpy(dtype=np.float64)
+    history = state.get('closes', np.empty(0)) if state is not None else np.empty(0)
+    series = np.concatenate([history, close])
+
+    # 第 i 根的上下軌為第 i-window ~ i-1 根的分位數
+    quantiles = rolling_quantiles(series, window, [outer, inner, 1 - inner, 1 - outer])
+    bands = np.vstack([np.full((1, 4), np.nan), quantiles[:-1]])[len(history):]
+    for j, column in enumerate(BAND_COLUMNS):
+        df.loc[:, column] = bands[:, j]
+
+    trend = state.get('trend', 0) if state is not None else 0
+    directions = PERCENTILE_RULES.evaluate(df, initial=trend)
+    if state is not None:
+        if len(directions):
+            state['trend'] = int(directions[-1])
+        state['closes'] = series[-window:]
+    df.loc[:, 'direction'] = directions
+    return df
+
 if __name__ == '__main__':
     file_path = "klines_BTC_factors.csv"  # 替換為你的實際檔案路徑
     df = pd.read_csv(file_path)
@@ -42,7 +102,7 @@ if __name__ == '__main__':
     if 'Rolling_Mean_Close' not in df.columns or 'Rolling_Std_Close' not in df.columns:
         print("請先計算 'Rolling_Mean_Close' 和 'Rolling_Std_Close'!")
     else:
-        df = get_direction(df)
+        df = get_direction(df, threshold1=THRESHOLD1, threshold2=THRESHOLD2)
         print(df[['Close', 'Rolling_Mean_Close', 'Rolling_Std_Close', 'direction']].head(10))
 
         # 存回 CSV，確保 direction 寫入
@@ -1,31 +1,53 @@
-import pandas as pd
+import os
+import sys
 
-# 讀取 CSV 文件
-file_path = "klines_BTC.csv"  # 請替換成你的檔案路徑
-df = pd.read_csv(file_path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim.instrument import traced
+from backtest_sim.loaders import load_klines
 
-# 設定 window_size
-window_size = 24
+# 主程式使用的視窗大小 (plot_result 記錄回測結果時一併記錄)
+WINDOW_SIZE = 24
 
-# 計算滾動標準差 (Rolling Std)
-df["Rolling_Std_Close"] = df["Close"].rolling(window=window_size).std()
 
-# 計算滾動平均 (Rolling Mean)
-df["Rolling_Mean_Close"] = df["Close"].rolling(window=window_size).mean()
+@traced('factors.compute_factors')
+def compute_factors(df, window_size=WINDOW_SIZE):
+    """
+    計算滾動平均、滾動標準差與 ATR
+    :param df: DataFrame，必須包含 'High', 'Low', 'Close' 欄位
+    :param window_size: 視窗大小
+    :return: 加入 'Rolling_Std_Close', 'Rolling_Mean_Close', 'ATR' 的 DataFrame
+    """
+    # 計算滾動標準差 (Rolling Std)
+    df["Rolling_Std_Close"] = df["Close"].rolling(window=window_size).std()
 
-# 計算 ATR (Average True Range)
-df["High-Low"] = df["High"] - df["Low"]
-df["High-PrevClose"] = abs(df["High"] - df["Close"].shift(1))
-df["Low-PrevClose"] = abs(df["Low"] - df["Close"].shift(1))
+    # 計算滾動平均 (Rolling Mean)
+    df["Rolling_Mean_Close"] = df["Close"].rolling(window=window_size).mean()
 
-df["TR"] = df[["High-Low", "High-PrevClose", "Low-PrevClose"]].max(axis=1)
-df["ATR"] = df["TR"].rolling(window=window_size).mean()
+    # 計算 ATR (Average True Range)
+    df["High-Low"] = df["High"] - df["Low"]
+    df["High-PrevClose"] = abs(df["High"] - df["Close"].shift(1))
+    df["Low-PrevClose"] = abs(df["Low"] - df["Close"].shift(1))
 
-# 移除不必要的中間列
-df.drop(columns=["High-Low", "High-PrevClose", "Low-PrevClose", "TR"], inplace=True)
+    df["TR"] = df[["High-Low", "High-PrevClose", "Low-PrevClose"]].max(axis=1)
+    df["ATR"] = df["TR"].rolling(window=window_size).mean()
 
-# 存回檔案
-output_path = "klines_BTC_factors.csv"
-df.to_csv(output_path, index=False)
+    # 移除不必要的中間列
+    df.drop(columns=["High-Low", "High-PrevClose", "Low-PrevClose", "TR"], inplace=True)
+    return df
 
-print(f"計算完成，結果已儲存至 {output_path}")
+def main():
+    # 讀取 CSV 文件
+    file_path = "klines_BTC.csv"  # 請替換成你的檔案路徑
+    df = load_klines(file_path, time_as='datetime')
+
+    # 設定 window_size
+    df = compute_factors(df, window_size=WINDOW_SIZE)
+
+    # 存回檔案
+    output_path = "klines_BTC_factors.csv"
+    df.to_csv(output_path, index=False)
+
+    print(f"計算完成，結果已儲存至 {output_path}")
+
+if __name__ == '__main__':
+    main()
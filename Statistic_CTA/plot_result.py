@@ -1,23 +1,30 @@
-import matplotlib.pyplot as plt
+import os
+import sys
 import numpy as np
 import pandas as pd
+from add_alphas import THRESHOLD1, THRESHOLD2
+from add_factors import WINDOW_SIZE
 from backtest import backtesting
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backtest_sim import report
+from backtest_sim.instrument import span, traced
+from backtest_sim.results import record_from_env, symbol_from_path
 
-def plot_result(df, initial_balance=10000, save_path="./backtest_results"):
+
+@traced('plot.plot_result')
+def plot_result(df, initial_balance=10000, save_path="./backtest_results", workers=None, max_points=5000):
     """
     視覺化回測結果，包括累積報酬、最大回撤、Sharpe Ratio 和 Win Ratio。
+    圖表以非互動式 backend 平行輸出，並附 report.html 摘要；結果未變動時不重繪。
 
     :param df: 包含回測結果的 DataFrame，應包含 'PnL', 'Close', 'buy signal', 'sell signals' 等欄位
     :param initial_balance: 初始資金
+    :param workers: 繪圖 process 數量，None 為自動
+    :param max_points: 每條序列降採樣後的最大點數
     """
-    import os
-    os.makedirs(save_path, exist_ok=True)  # 確保存儲資料夾存在
-    
-    plt.style.use("dark_background")  # 設定背景為黑色
-
     # **計算累積報酬 (Cumulative PnL)**
-    df['PnL'].fillna(0, inplace=True)  # 填補空值
+    df['PnL'] = df['PnL'].fillna(0)  # 填補空值
     df['Cumulative PnL'] = df['PnL'].cumsum() + initial_balance  # 計算累積報酬
 
     # **計算最大回撤 (Max Drawdown)**
@@ -41,41 +48,50 @@ def plot_result(df, initial_balance=10000, save_path="./backtest_results"):
     print(f"🔹 Win Ratio: {win_ratio:.2%} ({winning_trades}/{total_trades})")
 
     # **📊 繪製累積報酬變化圖**
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['Cumulative PnL'], label='Cumulative PnL', color='cyan')
-    plt.fill_between(df.index, df['Cumulative PnL'], df['Peak'], color='red', alpha=0.3, label="Drawdown")
-    plt.title("Cumulative PnL & Drawdown")
-    plt.xlabel("Time")
-    plt.ylabel("PnL")
-    plt.legend()
-    plt.grid()
-    plt.savefig(f"{save_path}/cumulative_pnl.png", dpi=300, bbox_inches='tight')
-    plt.show()
-
-    # **📊 繪製價格走勢與交易信號**
-    plt.figure(figsize=(12, 6))
-    plt.plot(df['Close'], label="Close Price", color='white')
-    plt.scatter(df.index[df['buy signal'] == 1], df['Close'][df['buy signal'] == 1], color='green', label="Buy Signal", marker="^", alpha=1)
-    plt.scatter(df.index[df['sell signals'] == 1], df['Close'][df['sell signals'] == 1], color='red', label="Sell Signal", marker="v", alpha=1)
-    plt.title("Price Movement & Trading Signals")
-    plt.xlabel("Time")
-    plt.ylabel("Price")
-    plt.legend()
-    plt.grid()
-    plt.savefig(f"{save_path}/price_signals.png", dpi=300, bbox_inches='tight')
-    plt.show()
-
-    # **📊 繪製 PnL 變化圖**
-    plt.figure(figsize=(12, 4))
-    plt.plot(df['PnL'], label='Daily PnL', color='orange')
-    plt.axhline(y=0, color='white', linestyle='--', alpha=0.6)
-    plt.title("Daily PnL")
-    plt.xlabel("Time")
-    plt.ylabel("PnL")
-    plt.legend()
-    plt.grid()
-    plt.savefig(f"{save_path}/daily_pnl.png", dpi=300, bbox_inches='tight')
-    plt.show()
+    buy = df['buy signal'] == 1
+    sell = df['sell signals'] == 1
+    figures = [
+        report.figure(
+            "cumulative_pnl.png",
+            report.axes(
+                report.line(df['Cumulative PnL'], x=df.index, label='Cumulative PnL', color='cyan'),
+                report.fill_between(df['Cumulative PnL'], df['Peak'], x=df.index, color='red', alpha=0.3, label="Drawdown"),
+                title="Cumulative PnL & Drawdown", xlabel="Time", ylabel="PnL",
+            ),
+            figsize=(12, 6), tight=False,
+        ),
+        # **📊 繪製價格走勢與交易信號**
+        report.figure(
+            "price_signals.png",
+            report.axes(
+                report.line(df['Close'], x=df.index, label="Close Price", color='white'),
+                report.scatter(df.index[buy], df['Close'][buy], color='green', label="Buy Signal", marker="^", alpha=1),
+                report.scatter(df.index[sell], df['Close'][sell], color='red', label="Sell Signal", marker="v", alpha=1),
+                title="Price Movement & Trading Signals", xlabel="Time", ylabel="Price",
+            ),
+            figsize=(12, 6), tight=False,
+        ),
+        # **📊 繪製 PnL 變化圖**
+        report.figure(
+            "daily_pnl.png",
+            report.axes(
+                report.line(df['PnL'], x=df.index, label='Daily PnL', color='orange'),
+                report.axhline(0, color='white', linestyle='--', alpha=0.6),
+                title="Daily PnL", xlabel="Time", ylabel="PnL",
+            ),
+            figsize=(12, 4), tight=False,
+        ),
+    ]
+    metrics = {
+        'Final Balance': float(df['Cumulative PnL'].iloc[-1]),
+        'Sharpe Ratio': float(sharpe_ratio),
+        'Max Drawdown': float(max_drawdown),
+        'Win Ratio': float(win_ratio),
+        'Trades': f"{winning_trades}/{total_trades}",
+    }
+    with span('plot.render_report'):
+        report.render_report(figures, save_path, metrics=metrics, title="Statistic_CTA Backtest",
+                             workers=workers, max_points=max_points)
 
     print(f"✅ 所有圖表已儲存至 {save_path}/")
 
@@ -84,4 +100,6 @@ if __name__ == '__main__':
     file_path = "klines_BTC_factors_with_direction.csv"  # 替換為你的實際檔案路徑
     df = pd.read_csv(file_path)
     df_backtesting = backtesting(df)
-    plot_result(df_backtesting)
\ No newline at end of file
+    plot_result(df_backtesting)
+    config = {'window_size': WINDOW_SIZE, 'threshold1': THRESHOLD1, 'threshold2': THRESHOLD2}
+    record_from_env('statistic_cta', symbol_from_path(file_path), config, df_backtesting)
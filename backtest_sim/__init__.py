@@ -0,0 +1,10 @@
+"""
+Backtest_Simulator 共用模組。
+
+各專案 (Statistic_CTA、ML_CTA、Pair_Trading、Bincentive) 的腳本以
+sys.path 引用本套件，取得報表、指標計算等共用工具。
+"""
+import os
+
+# 專案根目錄 (即 Statistic_CTA、ML_CTA 等資料夾所在位置)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
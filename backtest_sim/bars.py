@@ -0,0 +1,255 @@
+"""
+由成交紀錄 (price, qty, quoteQty, time, isBuyerMaker) 建立 K 線：時間、筆數、成交量與成交額 K 線。
+
+- time    每 size 毫秒 (或 '1m'、'1h' 等) 一根，對齊 UTC epoch，與 Binance K 線的切分方式相同
+- tick    每 size 筆成交一根
+- volume  累積成交量 (qty) 每跨過 size 的整數倍收一根
+- dollar  累積成交額 (quoteQty) 每跨過 size 的整數倍收一根
+
+分組以向量化方式計算：時間 K 線為 time // size；其餘為成交前的累積量 (cumsum) 除以 size 取整數，
+跨過門檻的那一筆成交屬於當根 K 線，單筆跨過多個門檻時只收一根 (不產生空 K 線)。
+各根的 OHLCV 以 ohlcv.aggregate (np.*.reduceat) 一次算出。
+
+BarBuilder 以串流方式逐塊處理成交紀錄，區塊之間只延續最後一根尚未完成的 K 線與累積量，
+數千萬筆成交可分塊讀取 (CSV / 欄式資料夾)，記憶體用量只與區塊大小有關。
+volume / dollar 的累積量跨區塊延續時以浮點數相加，恰好落在門檻上的成交可能因最後一個位元的差異而分到相鄰的 K 線。
+
+輸出與 klines_BTC.csv 相同的欄位 (另含 'Close time'、'Quote asset volume'、'Number of trades')，
+各專案的 add_factors 可直接讀取。
+
+用法：
+    python -m backtest_sim.bars Pair_Trading/Preprocess/BTC_trades.cols bars_BTC.csv --kind dollar --size 5e6
+    python -m backtest_sim.bars BTC_trades.csv klines_BTC_5m.csv --kind time --size 5m --symbol BTCUSDT
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from .ohlcv import aggregate, boundaries
+
+BAR_KINDS = ('time', 'tick', 'volume', 'dollar')
+TRADE_COLUMNS = ['price', 'qty', 'quoteQty', 'time', 'isBuyerMaker']
+BAR_COLUMNS = ['Open time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close time', 'Quote asset volume',
+               'Number of trades', 'Taker buy base asset volume', 'Taker buy quote asset volume']
+
+
+def _trade_arrays(trades):
+    """成交紀錄 (DataFrame 或 dict) -> {欄位: numpy array}，缺少 quoteQty 時以 price * qty 計算"""
+    names = trades.columns if hasattr(trades, 'columns') else trades.keys()
+    price = np.asarray(trades['price'], dtype=np.float64)
+    qty = np.asarray(trades['qty'], dtype=np.float64)
+    quote = np.asarray(trades['quoteQty'], dtype=np.float64) if 'quoteQty' in names else price * qty
+    # isBuyerMaker 為 False 表示買方為 taker (主動買)
+    taker_buy = ~np.asarray(trades['isBuyerMaker'], dtype=bool) if 'isBuyerMaker' in names \
+        else np.zeros(len(price), dtype=bool)
+    return {'price': price, 'qty': qty, 'quote': quote,
+            'time': np.asarray(trades['time'], dtype=np.int64), 'taker_buy': taker_buy}
+
+
+class BarBuilder:
+    """
+    串流建立 K 線
+        builder = BarBuilder('dollar', 5e6)
+        for chunk in chunks:
+            bars = builder.update(chunk)   # 這一塊中已完成的 K 線
+        bars = builder.flush()             # 最後一根 (未完成) K 線
+    """
+
+    def __init__(self, kind, size, origin=0):
+        """
+        :param kind: 'time' / 'tick' / 'volume' / 'dollar'
+        :param size: time 為毫秒數或 '5m' 等間隔字串；tick 為筆數；volume 為成交量；dollar 為成交額
+        :param origin: time K 線對齊的起點 (毫秒)
+        """
+        if kind not in BAR_KINDS:
+            raise ValueError(f"Unknown bar kind: {kind} (choose from {', '.join(BAR_KINDS)})")
+        if kind == 'time' and isinstance(size, str):
+            from .timeutil import interval_ms
+            size = interval_ms(size)
+        if size <= 0:
+            raise ValueError(f"Bar size must be positive, got {size}")
+        self.kind = kind
+        self.size = int(size) if kind in ('time', 'tick') else float(size)
+        self.origin = origin
+        self.trades = 0
+        self.bars = 0
+        self._pending = None   # 最後一根尚未完成的 K 線的成交 ({欄位: array})
+        self._count = 0        # pending 第一筆之前的成交筆數
+        self._cum = 0.0        # pending 第一筆之前的累積量 (volume / dollar)
+
+    def _keys(self, arrays):
+        """每筆成交所屬的 K 線編號 (遞增，可不連續)"""
+        n = len(arrays['price'])
+        if self.kind == 'time':
+            return (arrays['time'] - self.origin) // self.size
+        if self.kind == 'tick':
+            return (self._count + np.arange(n, dtype=np.int64)) // self.size
+        measure = arrays['qty'] if self.kind == 'volume' else arrays['quote']
+        # 成交前的累積量：跨過門檻的那一筆仍屬於當根 K 線
+        before = np.empty(n, dtype=np.float64)
+        before[0] = self._cum
+        np.cumsum(measure[:-1], out=before[1:])
+        before[1:] += self._cum
+        return np.floor(before / self.size).astype(np.int64)
+
+    def _advance(self, arrays, n):
+        """前 n 筆已輸出，更新延續的累積量"""
+        self._count += n
+        if self.kind in ('volume', 'dollar'):
+            measure = arrays['qty'] if self.kind == 'volume' else arrays['quote']
+            self._cum += float(measure[:n].sum())
+            # 只保留門檻內的餘數，避免累積量過大而損失精度
+            whole = np.floor(self._cum / self.size) * self.size
+            self._cum -= whole
+
+    def _aggregate(self, arrays, keys, starts, n):
+        qty, quote, taker = arrays['qty'][:n], arrays['quote'][:n], arrays['taker_buy'][:n]
+        out = {'Open time': (keys[starts] * self.size + self.origin) if self.kind == 'time' else arrays['time'][starts]}
+        out.update(aggregate(starts, n, open=arrays['price'][:n], high=arrays['price'][:n],
+                             low=arrays['price'][:n], close=arrays['price'][:n]))
+        ends = np.append(starts[1:], n) - 1
+        out['Volume'] = np.add.reduceat(qty, starts)
+        out['Close time'] = arrays['time'][ends]
+        out['Quote asset volume'] = np.add.reduceat(quote, starts)
+        out['Number of trades'] = np.diff(np.append(starts, n))
+        out['Taker buy base asset volume'] = np.add.reduceat(np.where(taker, qty, 0.0), starts)
+        out['Taker buy quote asset volume'] = np.add.reduceat(np.where(taker, quote, 0.0), starts)
+        self.bars += len(starts)
+        return {name: out[name] for name in BAR_COLUMNS}
+
+    def _empty(self):
+        return {name: np.empty(0, dtype=np.int64 if name in ('Open time', 'Close time', 'Number of trades')
+                               else np.float64) for name in BAR_COLUMNS}
+
+    def update(self, trades):
+        """
+        加入一塊依時間排序的成交紀錄
+        :return: {欄位: array}，這一塊中已完成的 K 線 (最後一根留到下一塊或 flush)
+        """
+        new = _trade_arrays(trades)
+        self.trades += len(new['price'])
+        arrays = new if self._pending is None else \
+            {name: np.concatenate([self._pending[name], values]) for name, values in new.items()}
+        if len(arrays['price']) == 0:
+            return self._empty()
+        keys = self._keys(arrays)
+        starts = boundaries(keys)
+        last = int(starts[-1])
+        self._pending = {name: values[last:].copy() for name, values in arrays.items()}
+        if last == 0:
+            return self._empty()
+        out = self._aggregate(arrays, keys, starts[:-1], last)
+        self._advance(arrays, last)
+        return out
+
+    def flush(self):
+        """輸出最後一根 K 線 (可能未達門檻或時間區段未結束)"""
+        if self._pending is None or len(self._pending['price']) == 0:
+            return self._empty()
+        arrays, n = self._pending, len(self._pending['price'])
+        keys = self._keys(arrays)
+        out = self._aggregate(arrays, keys, np.zeros(1, dtype=np.int64), n)
+        self._advance(arrays, n)
+        self._pending = None
+        return out
+
+
+def to_frame(bars, symbol=None):
+    """{欄位: array} -> klines_BTC.csv 格式的 DataFrame ('Open time' / 'Close time' 轉為 datetime)"""
+    import pandas as pd
+
+    df = pd.DataFrame(bars)
+    for name in ('Open time', 'Close time'):
+        df[name] = pd.to_datetime(df[name], unit='ms')
+    if symbol is not None:
+        df['Symbol'] = symbol
+    return df
+
+
+def iter_bars(chunks, kind, size, origin=0, symbol=None, include_last=True):
+    """
+    逐塊讀取成交紀錄並產生 K 線 DataFrame
+    :param chunks: 成交紀錄 DataFrame 的 iterable
+    :param include_last: 是否輸出最後一根未完成的 K 線
+    """
+    builder = BarBuilder(kind, size, origin)
+    for chunk in chunks:
+        bars = builder.update(chunk)
+        if len(bars['Open']):
+            yield to_frame(bars, symbol)
+    if include_last:
+        bars = builder.flush()
+        if len(bars['Open']):
+            yield to_frame(bars, symbol)
+
+
+def build_bars(trades, kind, size, origin=0, symbol=None, chunksize=None, include_last=True):
+    """
+    建立 K 線並回傳單一 DataFrame
+    :param trades: 成交紀錄 DataFrame、CSV 路徑、欄式資料夾，或 DataFrame 的 iterable
+    :param chunksize: 讀取檔案時每塊的筆數
+    """
+    import pandas as pd
+
+    from .chunked import DEFAULT_CHUNKSIZE, iter_chunks
+
+    if isinstance(trades, pd.DataFrame) and chunksize is None:
+        chunks = [trades]
+    else:
+        chunks = iter_chunks(trades, chunksize or DEFAULT_CHUNKSIZE, columns=_columns(trades))
+    frames = list(iter_bars(chunks, kind, size, origin, symbol, include_last))
+    return pd.concat(frames, ignore_index=True) if frames else to_frame(BarBuilder(kind, size)._empty(), symbol)
+
+
+def _columns(source):
+    """只讀取需要的成交紀錄欄位 (檔案中存在的)"""
+    import os
+
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    from .columnar import is_columnar, read_schema
+    if is_columnar(source):
+        names = read_schema(source)['columns']
+    else:
+        with open(source) as f:
+            names = f.readline().rstrip('\r\n').split(',')
+    return [c for c in TRADE_COLUMNS if c in names]
+
+
+def main(argv=None):
+    from .chunked import DEFAULT_CHUNKSIZE, IncrementalCSV, iter_chunks
+    from .instrument import peak_rss_mb
+
+    parser = argparse.ArgumentParser(description="Build time / tick / volume / dollar bars from a trades tape")
+    parser.add_argument('input', help="trades CSV or columnar directory (price, qty, quoteQty, time, isBuyerMaker)")
+    parser.add_argument('output', help="bars CSV (klines_BTC.csv layout)")
+    parser.add_argument('--kind', choices=BAR_KINDS, default='time')
+    parser.add_argument('--size', required=True, help="interval (e.g. 5m) for time bars, trades / qty / quote otherwise")
+    parser.add_argument('--symbol', help="value of the 'Symbol' column")
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--drop-last', action='store_true', help="do not write the last, unfinished bar")
+    args = parser.parse_args(argv)
+
+    size = args.size if args.kind == 'time' and not args.size.isdigit() else float(args.size)
+    chunks = iter_chunks(args.input, args.chunksize or DEFAULT_CHUNKSIZE, columns=_columns(args.input))
+    builder = BarBuilder(args.kind, size)
+    start = time.perf_counter()
+    # 成交時間為毫秒，info K 線的開始 / 結束時間保留毫秒
+    with IncrementalCSV(args.output, date_format='%Y-%m-%d %H:%M:%S.%f') as out:
+        for chunk in chunks:
+            bars = builder.update(chunk)
+            if len(bars['Open']):
+                out.write(to_frame(bars, args.symbol))
+        bars = builder.flush()
+        if len(bars['Open']) and not args.drop_last:
+            out.write(to_frame(bars, args.symbol))
+    elapsed = time.perf_counter() - start
+    print(f"{builder.trades:,} trades -> {out.rows:,} {args.kind} bars in {elapsed:.2f}s "
+          f"({builder.trades / max(elapsed, 1e-9):,.0f} trades/s, peak RSS {peak_rss_mb():.0f} MB) -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+熱點函式的效能基準測試。
+
+以合成資料在 10k / 100k / 1M / 10M 筆的規模執行各專案的核心函式，
+每個 (case, size) 在獨立的 process 中執行，記錄 wall time、peak RSS 與每秒處理筆數，
+結果附加到 JSON 歷史檔，並與基準檔比較；超過容忍度的退步會讓程式以非 0 結束。
+
+用法：
+    python -m backtest_sim.bench --sizes 10k,100k
+    python -m backtest_sim.bench --save-baseline
+    python -m backtest_sim.bench --cases ml_cta.backtesting --tolerance 0.1
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from . import ROOT
+from .instrument import peak_rss_mb, rss_mb
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+HISTORY_FILE = os.path.join(BENCH_DIR, 'history.json')
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+
+CASES = {}
+
+
+def case(name, unit='bars', size=None):
+    """
+    註冊一個 benchmark case。被裝飾的函式接受 (n, seed)，
+    負責準備資料 (不計時)，並回傳一個不帶參數、執行熱點函式的 callable。
+    size 不為 None 時該 case 固定以此規模執行，忽略 --sizes (例如 n 不是資料筆數的 case)。
+    """
+    def decorator(setup):
+        CASES[name] = {'setup': setup, 'unit': unit, 'size': size}
+        return setup
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# 合成資料
+# ---------------------------------------------------------------------------
+def synthetic_klines(n, seed=0, interval='1h'):
+    """產生 n 根與 klines_BTC.csv 相同欄位的合成 K 線"""
+    from .synth import repo_klines
+    return repo_klines(n, interval=interval, seed=seed)
+
+
+def _with_directions(df, seed, values=(-2, -1, 0, 1)):
+    import numpy as np
+    rng = np.random.default_rng(seed + 1)
+    df['direction'] = rng.choice(values, len(df))
+    return df
+
+
+# ---------------------------------------------------------------------------
+# Cases
+# ---------------------------------------------------------------------------
+@case('statistic_cta.backtesting')
+def _bench_statistic_backtesting(n, seed):
+    from .projects import load
+    backtesting = load('statistic_cta', 'backtest').backtesting
+    df = _with_directions(synthetic_klines(n, seed), seed)
+    return lambda: backtesting(df)
+
+
+@case('ml_cta.backtesting')
+def _bench_ml_backtesting(n, seed):
+    from .projects import load
+    backtesting = load('ml_cta', 'backtest').backtesting
+    df = _with_directions(synthetic_klines(n, seed), seed, values=(-1, 0, 1))
+    df['ATR'] = (df['High'] - df['Low']).rolling(24, min_periods=1).mean()
+    return lambda: backtesting(df)
+
+
+@case('statistic_cta.get_direction')
+def _bench_get_direction(n, seed):
+    from .projects import load
+    add_alphas = load('statistic_cta', 'add_alphas')
+    factors = load('statistic_cta', 'add_factors')
+    df = factors.compute_factors(synthetic_klines(n, seed))
+    return lambda: add_alphas.get_direction(df)
+
+
+@case('statistic_cta.get_percentile_direction')
+def _bench_percentile_direction(n, seed):
+    from .projects import load
+    add_alphas = load('statistic_cta', 'add_alphas')
+    df = synthetic_klines(n, seed)
+    return lambda: add_alphas.get_percentile_direction(df)
+
+
+@case('ml_cta.gamma_decay_factors')
+def _bench_gamma_factors(n, seed):
+    from .projects import load
+    compute_factors = load('ml_cta', 'add_factors').compute_factors
+    df = synthetic_klines(n, seed)
+    return lambda: compute_factors(df.copy())
+
+
+@case('bincentive1.compute_cci')
+def _bench_cci(n, seed):
+    from .projects import load
+    compute_cci = load('bincentive1', 'add_factors').compute_cci
+    df = synthetic_klines(n, seed)
+    return lambda: compute_cci(df, n=30)
+
+
+@case('bincentive2.compute_OBV')
+def _bench_obv(n, seed):
+    from .projects import load
+    compute_OBV = load('bincentive2', 'add_factors').compute_OBV
+    df = synthetic_klines(n, seed)
+    return lambda: compute_OBV(df)
+
+
+@case('bincentive2.generate_trade_signals')
+def _bench_trade_signals(n, seed):
+    import numpy as np
+    from .projects import load
+    generate_trade_signals = load('bincentive2', 'strategy_signals').generate_trade_signals
+    df = synthetic_klines(n, seed)
+    sign = np.sign(df['Close'].diff().fillna(0).to_numpy())
+    df['OBV'] = np.cumsum(sign * df['Volume'].to_numpy())
+    df['OBV_MA5'] = df['OBV'].rolling(window=25).mean()
+    return lambda: generate_trade_signals(df)
+
+
+@case('pair_trading.OrderExecutor.run_backtest', unit='trades')
+def _bench_order_executor(n, seed):
+    """n 為成交紀錄筆數，K 線 (1m) 數量為 n // 10，平均每根 K 線 10 筆成交"""
+    import logging
+    import tempfile
+    import numpy as np
+    from .projects import load
+    from .synth import agg_trades
+
+    OrderExecutor = load('pair_trading', 'order_executor').OrderExecutor
+    logging.getLogger('OrderExecutor').setLevel(logging.WARNING)
+    rng = np.random.default_rng(seed)
+    tmp = tempfile.mkdtemp(prefix='bench_executor_')
+
+    bars = synthetic_klines(max(n // 10, 2), seed, interval='1m')
+    bars['timestamp'] = bars['Open time']
+    bars['signal'] = rng.choice([-1, 0, 1], len(bars))
+    strategy_file = os.path.join(tmp, 'backtest_results.csv')
+    bars[['timestamp', 'Close', 'signal']].to_csv(strategy_file, index=False)
+
+    tape = agg_trades(n, start=bars['Open time'].iloc[0], s0=float(bars['Close'].iloc[0]),
+                      trades_per_second=10 / 60, symbol='SPOT_BTC_USDT', seed=seed)
+    trades_file = os.path.join(tmp, 'trades.csv')
+    tape.to_csv(trades_file, index=False)
+
+    output_file = os.path.join(tmp, 'orders.csv')
+
+    def run():
+        # 建構子載入成交紀錄也是熱點之一，一併計時
+        executor = OrderExecutor(strategy_file, output_file, trades_file)
+        executor.run_backtest()
+    return run
+
+
+@case('bars.dollar_bars', unit='trades')
+def _bench_dollar_bars(n, seed):
+    """n 筆成交紀錄以 1M 筆為一塊串流建立成交額 K 線"""
+    from .bars import BarBuilder
+    from .synth import iter_agg_trades
+
+    chunks = list(iter_agg_trades(n, chunk_size=1_000_000, seed=seed))
+
+    def run():
+        builder = BarBuilder('dollar', 5e6)
+        for chunk in chunks:
+            builder.update(chunk)
+        builder.flush()
+    return run
+
+
+@case('cli.startup', unit='launches', size=14)
+def _bench_cli_startup(n, seed):
+    """n 為啟動次數 (固定 14 次，不隨 --sizes 改變)，每次以新的直譯器執行各步驟的 `backtest-sim <step> --help`"""
+    from .cli import STEPS
+
+    commands = [[sys.executable, '-m', 'backtest_sim']] + \
+               [[sys.executable, '-m', 'backtest_sim', step, '--help'] for step in STEPS]
+
+    def run():
+        for i in range(n):
+            subprocess.run(commands[i % len(commands)], cwd=ROOT, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
+    return run
+
+
+# ---------------------------------------------------------------------------
+# 執行
+# ---------------------------------------------------------------------------
+def _run_case(name, n, seed, conn):
+    try:
+        run = CASES[name]['setup'](n, seed)
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        run()
+        wall = time.perf_counter() - start
+        conn.send({
+            'status': 'ok',
+            'wall_s': wall,
+            'rss_before_mb': rss_before,
+            'peak_rss_mb': peak_rss_mb(),
+            'throughput': n / wall if wall > 0 else float('inf'),
+        })
+    except Exception as e:
+        conn.send({'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_case(name, n, seed=0, timeout=None):
+    """在獨立 process 中執行一個 case，回傳結果 dict"""
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(name, n, seed, child_conn))
+    proc.start()
+    child_conn.close()
+    try:
+        if parent_conn.poll(timeout):
+            result = parent_conn.recv()
+        else:
+            proc.terminate()
+            result = {'status': 'timeout', 'timeout_s': timeout}
+    except EOFError:
+        result = {'status': 'error', 'error': f"worker exited with code {proc.exitcode}"}
+    proc.join()
+    result.update({'case': name, 'size': n, 'unit': CASES[name]['unit']})
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return f"{result['case']}@{result['size']}"
+
+
+def compare(results, baseline, tolerance):
+    """
+    與基準比較 wall time
+    :return: 退步的 list，每筆為 (key, baseline 秒數, 目前秒數或狀態)
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(_key(result))
+        if not base or base.get('status') != 'ok':
+            continue
+        if result['status'] != 'ok':
+            regressions.append((_key(result), base['wall_s'], result['status']))
+        elif result['wall_s'] > base['wall_s'] * (1 + tolerance):
+            regressions.append((_key(result), base['wall_s'], result['wall_s']))
+    return regressions
+
+
+def _load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000"""
+    text = text.strip().lower().replace('_', '')
+    scale = {'k': 10**3, 'm': 10**6, 'g': 10**9}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale != 1 else text) * scale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark backtest hot paths on synthetic data")
+    parser.add_argument('--cases', help="comma separated case names (default: all)")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated sizes, e.g. 10k,100k,1M")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=None, help="seconds per case before it is killed")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed slowdown vs. baseline (0.15 = 15%%)")
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--list', action='store_true', help="list available cases")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, spec in CASES.items():
+            print(f"{name} ({spec['unit']})")
+        return 0
+
+    names = args.cases.split(',') if args.cases else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+
+    results = []
+    for name in names:
+        fixed = CASES[name]['size']
+        for n in ([fixed] if fixed is not None else sizes):
+            result = run_case(name, n, seed=args.seed, timeout=args.timeout)
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"{name:45s} {n:>11,d} {result['wall_s']:10.3f}s "
+                      f"{result['peak_rss_mb']:9.1f}MB {result['throughput']:14,.0f} {result['unit']}/s")
+            else:
+                print(f"{name:45s} {n:>11,d} {result['status']}: {result.get('error', '')}")
+
+    history = _load_json(args.history, [])
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'results': results,
+    })
+    _write_json(args.history, history)
+
+    if args.save_baseline:
+        baseline = _load_json(args.baseline, {})
+        baseline.update({_key(r): r for r in results if r['status'] == 'ok'})
+        _write_json(args.baseline, baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, _load_json(args.baseline, {}), args.tolerance)
+    for key, base, now in regressions:
+        now_text = f"{now:.3f}s" if isinstance(now, float) else now
+        print(f"REGRESSION {key}: {base:.3f}s -> {now_text} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+以 bootstrap 重抽樣評估回測結果的穩健度。
+
+單一條 PnL 路徑容易過度擬合；這裡把每根 K 線 (或每筆交易) 的損益重抽樣成
+(paths x length) 的矩陣，一次以向量化方式算出每條路徑的 Sharpe、最大回撤與期末資金，
+得到這些指標的分布。
+
+- 'stationary'：Politis-Romano stationary bootstrap，區塊長度為幾何分布 (平均 block_size)
+- 'block'：固定長度 block_size 的環狀移動區塊 bootstrap
+- 'iid'：逐筆獨立重抽 (block_size = 1)
+路徑數很大時依 max_memory_mb 切成多個區塊計算，並可分散到多個 process；
+每個區塊使用由 seed 衍生的獨立亂數流，結果與 workers 數量無關。
+
+用法：
+    python -m backtest_sim.bootstrap Statistic_CTA/klines_BTC_backtest.csv --paths 20000
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .metrics import summary_metrics
+
+METHODS = ('stationary', 'block', 'iid')
+METRICS = ('final_balance', 'sharpe_ratio', 'max_drawdown', 'win_ratio')
+
+
+def default_block_size(n):
+    """常用的經驗值 n^(1/3)"""
+    return max(1, int(round(n ** (1 / 3))))
+
+
+def stationary_indices(n, paths, length, mean_block, rng):
+    """
+    stationary bootstrap 的索引矩陣：每個位置以 1 / mean_block 的機率開始新區塊 (隨機起點)，
+    否則延續上一個位置 +1 (環狀)
+    :return: (paths, length) 的整數矩陣
+    """
+    dtype = np.int32 if n < 2**31 else np.int64
+    new_block = rng.random((paths, length)) < 1.0 / mean_block
+    new_block[:, 0] = True
+    starts = rng.integers(0, n, size=(paths, length), dtype=dtype)
+    # 每個位置所屬區塊的起始位置
+    pos = np.arange(length, dtype=dtype)
+    block_pos = np.maximum.accumulate(np.where(new_block, pos, 0), axis=1)
+    idx = np.take_along_axis(starts, block_pos, axis=1)
+    idx += pos - block_pos
+    idx %= n
+    return idx
+
+
+def block_indices(n, paths, length, block_size, rng):
+    """
+    環狀移動區塊 bootstrap 的索引矩陣：由隨機起點接上固定長度的連續區塊
+    :return: (paths, length) 的整數矩陣
+    """
+    dtype = np.int32 if n < 2**31 else np.int64
+    blocks = -(-length // block_size)
+    starts = rng.integers(0, n, size=(paths, blocks, 1), dtype=dtype)
+    idx = (starts + np.arange(block_size, dtype=dtype)).reshape(paths, blocks * block_size)[:, :length]
+    return idx % n
+
+
+def resample(pnl, paths, length=None, method='stationary', block_size=None, rng=None):
+    """
+    產生重抽樣後的損益矩陣
+    :param pnl: 損益序列
+    :param paths: 路徑數
+    :param length: 每條路徑長度，預設與原序列相同
+    :param method: 'stationary' / 'block' / 'iid'
+    :param block_size: (平均) 區塊長度，預設 n^(1/3)
+    :return: (paths, length) 的 float64 矩陣
+    """
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=np.float64))
+    n = len(pnl)
+    length = length or n
+    rng = rng if rng is not None else np.random.default_rng()
+    if method == 'iid':
+        idx = rng.integers(0, n, size=(paths, length))
+    elif method == 'block':
+        idx = block_indices(n, paths, length, block_size or default_block_size(n), rng)
+    elif method == 'stationary':
+        idx = stationary_indices(n, paths, length, block_size or default_block_size(n), rng)
+    else:
+        raise ValueError(f"Unknown method: {method} (expected one of {METHODS})")
+    return pnl[idx]
+
+
+def path_metrics(pnl_paths, initial_balance=10000, periods_per_year=252):
+    """
+    對 (paths, length) 的損益矩陣逐列計算績效指標，公式與 metrics.summary_metrics 相同
+    :return: {指標名稱: (paths,) array}
+    """
+    pnl_paths = np.asarray(pnl_paths, dtype=np.float64)
+    length = pnl_paths.shape[1]
+    equity = np.cumsum(pnl_paths, axis=1)
+    equity += initial_balance
+    peak = np.maximum.accumulate(equity, axis=1)
+    max_drawdown = ((equity - peak) / peak).min(axis=1)
+    final_balance = equity[:, -1].copy()
+    del equity, peak
+
+    returns = pnl_paths / initial_balance
+    std = returns.std(axis=1, ddof=1) if length > 1 else np.zeros(len(returns))
+    sharpe_ratio = returns.mean(axis=1) / (std + 1e-8) * np.sqrt(periods_per_year)
+
+    total = (pnl_paths != 0).sum(axis=1)
+    wins = (pnl_paths > 0).sum(axis=1)
+    win_ratio = np.divide(wins, total, out=np.zeros(len(total)), where=total > 0)
+    return {
+        'final_balance': final_balance,
+        'sharpe_ratio': sharpe_ratio,
+        'max_drawdown': max_drawdown,
+        'win_ratio': win_ratio,
+    }
+
+
+def chunk_paths(length, max_memory_mb=256):
+    """在記憶體上限內一次可計算的路徑數 (索引、損益矩陣與計算暫存約為 5 份 float64)"""
+    return max(1, int(max_memory_mb * 2**20 // (length * 8 * 5)))
+
+
+_shared = {}
+
+
+def _init_worker(pnl, options):
+    _shared['pnl'] = pnl
+    _shared['options'] = options
+
+
+def _simulate_chunk(task):
+    """計算一個區塊的路徑指標 (在 worker process 或主 process 中執行)"""
+    paths, seed = task
+    opts = _shared['options']
+    rng = np.random.default_rng(seed)
+    matrix = resample(_shared['pnl'], paths, opts['length'], opts['method'], opts['block_size'], rng)
+    return path_metrics(matrix, opts['initial_balance'], opts['periods_per_year'])
+
+
+def monte_carlo(pnl, paths=10000, length=None, method='stationary', block_size=None,
+                initial_balance=10000, periods_per_year=252, seed=None, max_memory_mb=256, workers=1):
+    """
+    bootstrap Monte Carlo：重抽樣 paths 條損益路徑並計算指標分布
+    :param pnl: 每根 K 線或每筆交易的損益 (array-like)
+    :param paths: 路徑數
+    :param length: 每條路徑長度，預設與原序列相同
+    :param method: 'stationary' / 'block' / 'iid'
+    :param block_size: (平均) 區塊長度，預設 n^(1/3)
+    :param initial_balance: 初始資金
+    :param periods_per_year: Sharpe 年化期數
+    :param seed: 亂數種子 (相同 seed 的結果與 workers 數量無關)
+    :param max_memory_mb: 每個區塊的記憶體上限
+    :param workers: process 數量，1 為在目前 process 計算，None 為 CPU 數量
+    :return: dict，包含各指標的 (paths,) 分布、原始路徑的指標 ('observed') 與參數
+    """
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=np.float64))
+    if len(pnl) < 2:
+        raise ValueError("Need at least 2 PnL observations to bootstrap")
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method} (expected one of {METHODS})")
+    length = length or len(pnl)
+    block_size = 1 if method == 'iid' else (block_size or default_block_size(len(pnl)))
+    options = {'length': length, 'method': method, 'block_size': block_size,
+               'initial_balance': initial_balance, 'periods_per_year': periods_per_year}
+
+    per_chunk = chunk_paths(length, max_memory_mb)
+    sizes = [min(per_chunk, paths - start) for start in range(0, paths, per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(sizes, seeds))
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(pnl, options)) as pool:
+            parts = list(pool.map(_simulate_chunk, tasks))
+    else:
+        _init_worker(pnl, options)
+        parts = [_simulate_chunk(task) for task in tasks]
+        _shared.clear()
+
+    result = {name: np.concatenate([p[name] for p in parts]) for name in METRICS}
+    observed = summary_metrics(pnl, initial_balance, periods_per_year)
+    result['observed'] = {name: observed[name] for name in METRICS}
+    result['params'] = dict(options, paths=paths, seed=seed)
+    return result
+
+
+def summarize(result, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    整理 monte_carlo 的結果：各指標的平均、分位數，以及原始路徑落在分布中的百分位
+    :return: {指標名稱: dict}
+    """
+    summary = {}
+    for name in METRICS:
+        dist = result[name]
+        observed = result['observed'][name]
+        summary[name] = {
+            'mean': float(dist.mean()),
+            'std': float(dist.std()),
+            **{f"q{int(q * 100):02d}": float(v) for q, v in zip(quantiles, np.quantile(dist, quantiles))},
+            'observed': observed,
+            'observed_percentile': float((dist < observed).mean() * 100),
+        }
+    initial = result['params']['initial_balance']
+    summary['prob_loss'] = float((result['final_balance'] < initial).mean())
+    return summary
+
+
+def pnl_series(df, column='PnL', per='bar'):
+    """
+    由回測結果取出損益序列
+    :param df: backtesting / generate_trade_signals 輸出的 DataFrame
+    :param column: 損益欄位
+    :param per: 'bar' 為每根 K 線 (含 0)，'trade' 只保留非 0 的損益 (每筆平倉)
+    """
+    pnl = np.nan_to_num(df[column].to_numpy(dtype=np.float64))
+    if per == 'trade':
+        pnl = pnl[pnl != 0]
+    elif per != 'bar':
+        raise ValueError(f"per must be 'bar' or 'trade', got {per!r}")
+    return pnl
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Bootstrap Monte Carlo of backtest PnL")
+    parser.add_argument('file', help="backtest results CSV")
+    parser.add_argument('--column', default='PnL')
+    parser.add_argument('--per', default='bar', choices=['bar', 'trade'])
+    parser.add_argument('--paths', type=int, default=10000)
+    parser.add_argument('--method', default='stationary', choices=METHODS)
+    parser.add_argument('--block-size', type=int)
+    parser.add_argument('--initial-balance', type=float, default=10000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-memory-mb', type=float, default=256)
+    args = parser.parse_args(argv)
+
+    pnl = pnl_series(pd.read_csv(args.file, usecols=[args.column]), args.column, args.per)
+    result = monte_carlo(pnl, paths=args.paths, method=args.method, block_size=args.block_size,
+                         initial_balance=args.initial_balance, seed=args.seed,
+                         max_memory_mb=args.max_memory_mb, workers=args.workers)
+    summary = summarize(result)
+    print(f"{len(pnl):,} observations, {args.paths:,} {args.method} paths "
+          f"(block {result['params']['block_size']})")
+    print(f"{'metric':15s} {'observed':>12s} {'pct':>6s} {'q05':>12s} {'q50':>12s} {'q95':>12s}")
+    for name in METRICS:
+        s = summary[name]
+        print(f"{name:15s} {s['observed']:12.4f} {s['observed_percentile']:6.1f} "
+              f"{s['q05']:12.4f} {s['q50']:12.4f} {s['q95']:12.4f}")
+    print(f"P(final balance < initial) = {summary['prob_loss']:.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
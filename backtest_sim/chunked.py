@@ -0,0 +1,215 @@
+"""
+分塊 (out-of-core) 回測的共用工具。
+
+回測引擎原本需要把整段歷史讀成一個 DataFrame。分塊模式下引擎逐塊處理 K 線，
+在區塊之間只延續一個小的 state dict (持有部位、進場價、訊號計數、前一根的指標值等)，
+每塊處理完立即寫出，記憶體用量只與區塊大小有關。
+
+- iter_chunks(source)      CSV / 欄式資料夾 / DataFrame 切成 DataFrame 區塊 (index 皆為 0..n-1)
+- with_last(chunks)        多讀一塊，標出最後一塊 (整段資料的最後一根 K 線不交易)
+- with_tail(chunks, ...)   滾動視窗指標：每塊前面接上前一塊的尾端再計算
+- IncrementalCSV           逐塊附加寫入 CSV；整欄為最終值的欄位 (例如 'long entry price')
+                           先寫入佔位字串，結束時以串流方式代換成最終值
+
+用法：
+    python -m backtest_sim.chunked statistic_cta Statistic_CTA/klines_BTC_factors_with_direction.csv out.csv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .columnar import is_columnar, open_columnar, read_schema
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def iter_chunks(source, chunksize=DEFAULT_CHUNKSIZE, columns=None, **read_kw):
+    """
+    把資料來源切成 DataFrame 區塊
+    :param source: CSV 路徑、欄式資料夾、DataFrame，或已經是 DataFrame 區塊的 iterable
+    :param chunksize: 每塊筆數
+    :param columns: 只讀取的欄位 (CSV / 欄式資料夾)
+    :param read_kw: 傳給 pd.read_csv 的其他參數 (例如 parse_dates)
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize].reset_index(drop=True)
+    elif isinstance(source, (str, os.PathLike)) and is_columnar(source):
+        yield from _columnar_chunks(source, chunksize, columns)
+    elif isinstance(source, (str, os.PathLike)):
+        with pd.read_csv(source, chunksize=chunksize, usecols=columns, **read_kw) as reader:
+            for chunk in reader:
+                yield chunk.reset_index(drop=True)
+    else:
+        for chunk in source:
+            yield chunk.reset_index(drop=True)
+
+
+def _columnar_chunks(path, chunksize, columns):
+    """欄式資料夾以 memmap 開啟，每次只複製一塊"""
+    schema = read_schema(path)
+    arrays = open_columnar(path, columns)
+    for start in range(0, schema['rows'], chunksize):
+        stop = min(start + chunksize, schema['rows'])
+        data = {}
+        for name, values in arrays.items():
+            spec = schema['columns'][name]
+            if spec['kind'] == 'category':
+                data[name] = pd.Categorical.from_codes(np.array(values[start:stop]), categories=spec['categories'])
+            elif spec['kind'] == 'constant':
+                data[name] = [values.item()] * (stop - start) if values.dtype == object else \
+                    np.full(stop - start, values, dtype=values.dtype)
+            else:
+                data[name] = np.array(values[start:stop])
+        yield pd.DataFrame(data)
+
+
+def with_last(chunks):
+    """
+    依序回傳 (chunk, is_last)，略過空的區塊
+    多讀一塊以判斷是否為最後一塊，因此同時最多保留兩塊
+    """
+    pending = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if pending is not None:
+            yield pending, False
+        pending = chunk
+    if pending is not None:
+        yield pending, True
+
+
+def with_tail(chunks, compute, tail):
+    """
+    分塊計算滾動視窗指標：每塊前面接上前一塊原始資料的最後 tail 筆，計算後再去掉
+    以 rolling().apply 逐視窗計算的指標 (例如 ML_CTA 的 gamma decay) 與一次計算完全相同；
+    pandas 的 rolling mean / std 以累加方式計算，分塊結果與一次計算可能差在最後一個位元
+    :param compute: 接收 DataFrame 並回傳加入指標欄位的 DataFrame，例如 compute_factors
+    :param tail: 需要延續的筆數 (通常為視窗大小)
+    """
+    prev = None
+    for chunk in chunks:
+        n_tail = 0 if prev is None else len(prev)
+        frame = chunk if prev is None else pd.concat([prev, chunk], ignore_index=True)
+        prev = frame.iloc[-tail:].copy() if tail else None
+        out = compute(frame.copy())
+        yield out.iloc[n_tail:].reset_index(drop=True)
+
+
+def format_value(value):
+    """單一值寫入 CSV 時的文字 (與 DataFrame.to_csv 對整欄相同值的輸出一致)"""
+    text = pd.DataFrame({'value': [value], 'end': [0]}).to_csv(index=False, header=False)
+    return text.rstrip('\r\n').rsplit(',', 1)[0]
+
+
+class IncrementalCSV:
+    """
+    逐塊附加寫入 CSV，先寫到 <path>.tmp，成功結束時才取代目標檔
+    時間欄位固定以 '%Y-%m-%d %H:%M:%S' 輸出 (pandas 對整欄都在午夜的區塊會省略時間，分塊時格式會不一致)
+        with IncrementalCSV('out.csv') as out:
+            for chunk in chunks:
+                chunk['final'] = out.placeholder('final')
+                out.write(chunk)
+            out.fill('final', value)
+    """
+
+    def __init__(self, path, date_format='%Y-%m-%d %H:%M:%S'):
+        self.path = path
+        self.date_format = date_format
+        self.tmp = path + '.tmp'
+        self.rows = 0
+        self._header = True
+        self._values = {}
+        self._file = open(self.tmp, 'w', newline='')
+
+    @staticmethod
+    def placeholder(name):
+        """尚未知道最終值的欄位先寫入的佔位字串"""
+        return f"__backtest_sim_{name.replace(' ', '_')}__"
+
+    def write(self, df):
+        df.to_csv(self._file, index=False, header=self._header, date_format=self.date_format)
+        self._header = False
+        self.rows += len(df)
+
+    def fill(self, name, value):
+        """設定 placeholder(name) 最後要代換成的值"""
+        self._values[self.placeholder(name)] = format_value(value)
+
+    def close(self):
+        """完成寫入：有佔位欄位時逐行代換 (串流處理，不載入整個檔案)，再取代目標檔"""
+        self._file.close()
+        if self._values:
+            done = self.tmp + '.fill'
+            with open(self.tmp, 'r', newline='') as src, open(done, 'w', newline='') as dst:
+                for line in src:
+                    for token, text in self._values.items():
+                        line = line.replace(token, text)
+                    dst.write(line)
+            os.replace(done, self.tmp)
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# 各專案的分塊引擎：(模組, 函式, read_csv 參數)
+ENGINES = {
+    'statistic_cta': ('backtest', 'backtesting_chunks', {}),
+    'ml_cta': ('backtest', 'backtesting_chunks', {}),
+    'bincentive2': ('strategy_signals', 'generate_trade_signals_chunks', {'parse_dates': ['Open time']}),
+}
+
+
+def main(argv=None):
+    from .instrument import peak_rss_mb
+    from .projects import load
+
+    parser = argparse.ArgumentParser(description="Run a backtest engine chunk by chunk")
+    parser.add_argument('project', choices=sorted(ENGINES))
+    parser.add_argument('input', help="factor / direction CSV or columnar directory")
+    parser.add_argument('output', help="backtest results CSV (signals CSV for bincentive2)")
+    parser.add_argument('--trades-output', default='trade_details.csv', help="trade list CSV (bincentive2)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--funding', help="funding-rate CSV; charge funding on open positions (statistic_cta / ml_cta)")
+    parser.add_argument('--venue', help="only use funding events from this venue (binance / okx)")
+    args = parser.parse_args(argv)
+
+    if args.project == 'bincentive2' and (args.funding or args.venue):
+        parser.error("--funding / --venue are only supported for statistic_cta and ml_cta")
+
+    module, function, read_kw = ENGINES[args.project]
+    engine = getattr(load(args.project, module), function)
+    chunks = iter_chunks(args.input, args.chunksize, **read_kw)
+    if args.project == 'bincentive2':
+        state = engine(chunks, args.output, args.trades_output)
+        print(f"Final capital: {state['capital']:.2f}")
+    elif args.funding:
+        from .funding import load_funding
+
+        state = engine(chunks, args.output, funding=load_funding(args.funding, venue=args.venue))
+        print(f"Final balance: {state['balance']:.2f} (funding {state.get('funding', 0.0):+.2f})")
+    else:
+        state = engine(chunks, args.output)
+        print(f"Final balance: {state['balance']:.2f}")
+    print(f"{state['rows']:,} rows -> {args.output} (peak RSS {peak_rss_mb():.0f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
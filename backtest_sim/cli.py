@@ -0,0 +1,143 @@
+"""
+統一的命令列入口：backtest-sim <步驟> <專案> [參數]
+
+各步驟對應專案中既有的腳本 (與 Makefile 相同)，在腳本所在的資料夾中以 __main__ 執行：
+    fetch     下載 / 整理原始資料     preprocess.py
+    factors   計算因子               add_factors.py
+    signals   產生方向 / 交易訊號     add_alphas.py、strategy_signals.py
+    backtest  回測                   分塊回測引擎 (backtest_sim.chunked)、backtest_PT_strategy.py
+    execute   以成交紀錄模擬下單      order_executor.py
+    report    績效指標與圖表          plot_result.py、pnl.py、backtest_performance.py
+本模組只 import 標準函式庫；pandas、matplotlib、xgboost、requests 等只在執行需要它們的步驟時才載入，
+`backtest-sim --help` 與參數錯誤不必等待這些套件載入。啟動時間以 `python -m backtest_sim.bench --cases cli.startup` 追蹤。
+
+用法：
+    ./backtest-sim signals statistic_cta
+    python -m backtest_sim report ml_cta
+    python -m backtest_sim backtest statistic_cta --chunksize 50000
+    python -m backtest_sim fetch pair_trading BTC_kline.csv     # 其餘參數傳給腳本
+    python -m backtest_sim --profile factors ml_cta            # 等同 BACKTEST_SIM_PROFILE=1
+"""
+import argparse
+import os
+import runpy
+import sys
+
+# 由分塊回測引擎執行的 backtest 步驟 (backtest_sim.chunked.ENGINES) 與其預設的輸入 / 輸出檔
+ENGINE = 'engine'
+ENGINE_FILES = {
+    'statistic_cta': ['klines_BTC_factors_with_direction.csv', 'klines_BTC_backtest.csv'],
+    'ml_cta': ['klines_BTC_factors_with_direction.csv', 'klines_BTC_backtest.csv'],
+    'bincentive2': ['factors_BTC.csv', 'preprocessed_with_signals.csv', '--trades-output', 'trade_details.csv'],
+}
+
+# 步驟 -> {專案: 腳本 (相對於專案資料夾)}
+STEPS = {
+    'fetch': {
+        'statistic_cta': 'preprocess.py',
+        'ml_cta': 'preprocess.py',
+        'pair_trading': os.path.join('Preprocess', 'preprocess.py'),
+        'bincentive1': 'preprocess.py',
+        'bincentive2': 'preprocess.py',
+    },
+    'factors': {
+        'statistic_cta': 'add_factors.py',
+        'ml_cta': 'add_factors.py',
+        'bincentive1': 'add_factors.py',
+        'bincentive2': 'add_factors.py',
+    },
+    'signals': {
+        'statistic_cta': 'add_alphas.py',
+        'ml_cta': 'add_alphas.py',
+        'bincentive2': 'strategy_signals.py',
+    },
+    'backtest': {
+        'statistic_cta': ENGINE,
+        'ml_cta': ENGINE,
+        'pair_trading': 'backtest_PT_strategy.py',
+        'bincentive2': ENGINE,
+    },
+    'execute': {
+        'pair_trading': 'order_executor.py',
+    },
+    'report': {
+        'statistic_cta': 'plot_result.py',
+        'ml_cta': 'plot_result.py',
+        'pair_trading': 'pnl.py',
+        'bincentive1': 'backtest_performance.py',
+        'bincentive2': 'backtest_performance.py',
+    },
+}
+
+HELP = {
+    'fetch': "download (or normalize) raw market data",
+    'factors': "compute factor columns",
+    'signals': "compute directions / trade signals",
+    'backtest': "run the backtest engine",
+    'execute': "simulate order execution against the trade tape",
+    'report': "print metrics and render charts",
+}
+
+
+def run_script(project, script, argv=()):
+    """
+    在腳本所在資料夾以 __main__ 執行專案腳本 (與在該資料夾執行 python <script> 相同)
+    :param argv: 傳給腳本的 sys.argv[1:]
+    """
+    from .projects import project_dir
+
+    path = os.path.join(project_dir(project), script)
+    directory = os.path.dirname(path)
+    cwd, saved_argv = os.getcwd(), sys.argv
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    sys.argv = [path, *argv]
+    try:
+        runpy.run_path(path, run_name='__main__')
+    finally:
+        sys.argv = saved_argv
+        sys.path.remove(directory)
+        os.chdir(cwd)
+
+
+def run_engine(project, argv=()):
+    """以分塊回測引擎執行 backtest 步驟；沒有指定輸入 / 輸出檔時使用專案的預設檔名"""
+    from . import chunked
+    from .projects import project_dir
+
+    argv = list(argv)
+    if not argv or argv[0].startswith('-'):
+        argv = ENGINE_FILES[project] + argv
+    cwd = os.getcwd()
+    os.chdir(project_dir(project))
+    try:
+        return chunked.main([project, *argv])
+    finally:
+        os.chdir(cwd)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='backtest-sim', description="Backtest_Simulator pipeline steps")
+    parser.add_argument('--profile', action='store_true', help="enable backtest_sim.instrument (BACKTEST_SIM_PROFILE=1)")
+    sub = parser.add_subparsers(dest='step', required=True, metavar='step')
+    for step, projects in STEPS.items():
+        p = sub.add_parser(step, help=HELP[step], description=HELP[step])
+        p.add_argument('project', choices=list(projects))
+        p.add_argument('args', nargs=argparse.REMAINDER, help="arguments passed to the project script")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        # instrument 在 import 時讀取環境變數，必須在載入任何專案模組之前設定
+        os.environ['BACKTEST_SIM_PROFILE'] = '1'
+    script = STEPS[args.step][args.project]
+    if script == ENGINE:
+        return run_engine(args.project, args.args)
+    run_script(args.project, script, args.args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+欄式 (columnar) 儲存格式。
+
+一個資料集是一個資料夾：
+    _schema.json      欄位名稱、dtype、種類 (array / category / constant) 與總筆數
+    <column>.bin      該欄位的原始 little-endian 位元組
+
+可以分塊附加寫入，讀取時以 np.memmap 直接映射，不需解析文字。
+字串欄位存成整數代碼 + 類別表 (pandas Categorical)，整欄相同的值 (例如 symbol) 存成常數。
+另外提供以 pyarrow 寫 Parquet 的選項 (需安裝 pyarrow)。
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+SCHEMA_FILE = '_schema.json'
+
+
+def _safe_name(column):
+    """欄位名稱轉成檔名 (欄位名稱可能含空白，例如 'Open time')"""
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in column)
+
+
+class ColumnarWriter:
+    """
+    分塊寫入欄式資料夾
+        with ColumnarWriter('trades.cols') as w:
+            for chunk in chunks:
+                w.write(chunk)
+    """
+
+    def __init__(self, path, overwrite=True, append=False):
+        """
+        :param overwrite: 資料夾已存在時是否清除重寫 (False 則丟出 FileExistsError)
+        :param append: 資料夾已存在時接在既有資料之後寫入 (欄位需相同)
+        """
+        self.path = path
+        self.columns = {}
+        self.rows = 0
+        self._files = {}
+        if append and is_columnar(path):
+            schema = read_schema(path)
+            self.columns = schema['columns']
+            self.rows = schema['rows']
+            for name, spec in self.columns.items():
+                if spec['kind'] != 'constant':
+                    self._files[name] = open(os.path.join(path, spec['file']), 'ab')
+            return
+        if os.path.exists(path):
+            if not overwrite:
+                raise FileExistsError(path)
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def _open(self, name, spec):
+        spec['file'] = _safe_name(name) + '.bin'
+        self.columns[name] = spec
+        self._files[name] = open(os.path.join(self.path, spec['file']), 'wb')
+
+    def write(self, chunk):
+        """
+        附加一個區塊
+        :param chunk: DataFrame 或 {欄位名稱: array} dict，每次寫入的欄位需相同
+        """
+        items = chunk.items() if isinstance(chunk, dict) else ((c, chunk[c]) for c in chunk.columns)
+        n = None
+        for name, values in items:
+            if hasattr(values, 'cat'):
+                codes = values.cat.codes.to_numpy()
+                n = len(codes) if n is None else n
+                self._write_codes(name, [str(c) for c in values.cat.categories], codes)
+                continue
+            # tz-aware 的時間 (例如 funding_rates 的 UTC 'Open time') 的 to_numpy 是 object array，先轉成 UTC 的 naive 時間
+            if getattr(getattr(values, 'dt', None), 'tz', None) is not None:
+                values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+            elif getattr(values, 'tz', None) is not None:
+                values = values.tz_convert('UTC').tz_localize(None)
+            values = values.to_numpy() if hasattr(values, 'to_numpy') else np.asarray(values)
+            if values.dtype.kind == 'M':
+                values = values.astype('datetime64[ns]')
+            n = len(values) if n is None else n
+            if len(values) != n:
+                raise ValueError(f"Column {name!r} has {len(values)} rows, expected {n}")
+
+            if values.dtype == object or values.dtype.kind == 'U':
+                uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+                self._write_codes(name, list(uniques), inverse)
+            else:
+                if name not in self.columns:
+                    self._open(name, {'kind': 'array', 'dtype': values.dtype.str})
+                elif self.columns[name]['dtype'] != values.dtype.str:
+                    values = values.astype(np.dtype(self.columns[name]['dtype']))
+                self._files[name].write(np.ascontiguousarray(values).tobytes())
+        if n is not None:
+            self.rows += n
+
+    def _write_codes(self, name, categories, codes):
+        """以資料集層級的類別表重新編碼後寫入 (-1 代表缺值)"""
+        if name not in self.columns:
+            self._open(name, {'kind': 'category', 'dtype': '<i4', 'categories': []})
+        spec = self.columns[name]
+        lookup = {c: i for i, c in enumerate(spec['categories'])}
+        mapping = np.empty(len(categories) + 1, dtype=np.int32)
+        mapping[-1] = -1
+        for i, c in enumerate(categories):
+            if c not in lookup:
+                lookup[c] = len(spec['categories'])
+                spec['categories'].append(c)
+            mapping[i] = lookup[c]
+        self._files[name].write(mapping[np.asarray(codes)].astype('<i4').tobytes())
+
+    def set_constant(self, name, value, dtype=None):
+        """記錄一個整欄相同值的欄位 (不佔用每列空間)"""
+        dtype = np.dtype(dtype) if dtype is not None else np.asarray(value).dtype
+        if dtype.kind == 'U':
+            dtype = np.dtype(object)
+        self.columns[name] = {'kind': 'constant', 'dtype': dtype.str,
+                              'value': value.item() if hasattr(value, 'item') else value}
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        schema = {'rows': self.rows, 'columns': self.columns}
+        tmp = os.path.join(self.path, SCHEMA_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(schema, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, SCHEMA_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_schema(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def is_columnar(path):
+    return os.path.isfile(os.path.join(path, SCHEMA_FILE))
+
+
+def truncate_columnar(path, rows):
+    """把欄式資料夾截斷成前 rows 筆 (用於重寫最後幾筆尚未完整的資料)"""
+    schema = read_schema(path)
+    if rows >= schema['rows']:
+        return
+    for spec in schema['columns'].values():
+        if spec['kind'] != 'constant':
+            with open(os.path.join(path, spec['file']), 'r+b') as f:
+                f.truncate(rows * np.dtype(spec['dtype']).itemsize)
+    schema['rows'] = rows
+    tmp = os.path.join(path, SCHEMA_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(schema, f, indent=2)
+    os.replace(tmp, os.path.join(path, SCHEMA_FILE))
+
+
+def open_columnar(path, columns=None, mmap=True):
+    """
+    開啟欄式資料夾，回傳 {欄位名稱: numpy array}
+    category 欄位回傳整數代碼 (類別表見 read_schema)，constant 欄位回傳 0 維 array。
+    :param columns: 只讀取指定欄位，None 為全部
+    :param mmap: True 以唯讀 memmap 映射 (零複製)，False 讀進記憶體
+    """
+    schema = read_schema(path)
+    out = {}
+    for name in columns or schema['columns']:
+        spec = schema['columns'][name]
+        dtype = np.dtype(spec['dtype'])
+        if spec['kind'] == 'constant':
+            out[name] = np.asarray(spec['value'], dtype=dtype)
+            continue
+        file = os.path.join(path, spec['file'])
+        if schema['rows'] == 0:
+            out[name] = np.empty(0, dtype=dtype)
+        elif mmap:
+            out[name] = np.memmap(file, dtype=dtype, mode='r', shape=(schema['rows'],))
+        else:
+            out[name] = np.fromfile(file, dtype=dtype)
+    return out
+
+
+def read_columnar(path, columns=None, mmap=False):
+    """讀取欄式資料夾為 DataFrame (category 欄位為 pandas Categorical，constant 欄位展開)"""
+    return frame_from_arrays(read_schema(path), open_columnar(path, columns, mmap=mmap))
+
+
+def frame_from_arrays(schema, arrays):
+    """
+    依 schema 把 {欄位名稱: array} 組成 DataFrame，數值欄位不複製 (memmap / 共享記憶體的 view 維持唯讀)
+    :param schema: read_schema 格式的 dict ('rows' 與 'columns')
+    """
+    import pandas as pd
+
+    data = {}
+    for name, values in arrays.items():
+        spec = schema['columns'][name]
+        if spec['kind'] == 'category':
+            # 代碼由 ColumnarWriter / MarketDataServer 寫入，不再逐筆檢查範圍 (attach 的成本與筆數無關)
+            data[name] = pd.Categorical.from_codes(np.asarray(values), categories=spec['categories'], validate=False)
+        elif spec['kind'] == 'constant':
+            if values.dtype == object:
+                data[name] = pd.Categorical.from_codes(np.zeros(schema['rows'], dtype=np.int8),
+                                                       categories=[spec['value']])
+            else:
+                data[name] = np.full(schema['rows'], values, dtype=values.dtype)
+        else:
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def write_parquet(chunks, path, compression='zstd'):
+    """以 pyarrow 將多個 DataFrame 區塊寫成單一 Parquet 檔 (不需一次載入全部資料)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Writing Parquet requires pyarrow (pip install pyarrow)") from e
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=compression)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_chunks(chunks, path, fmt='columnar'):
+    """
+    將 DataFrame 區塊串流寫入欄式格式
+    :param fmt: 'columnar' (本模組的資料夾格式) 或 'parquet'
+    :return: 寫入筆數
+    """
+    if fmt == 'parquet':
+        return write_parquet(chunks, path)
+    if fmt != 'columnar':
+        raise ValueError(f"Unknown format: {fmt}")
+    with ColumnarWriter(path) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.rows
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def minmax_indices(y, n_out):
+    """
+    Min-Max 降採樣：把序列切成 n_out // 2 個區間，每個區間保留最小值與最大值的位置。
+    每個區間的極值都會被保留，因此回撤、跳空等尖峰不會在圖上消失。
+    :param y: 數值序列
+    :param n_out: 目標點數 (約略)
+    :return: 排序後的索引 (numpy int64 array)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+
+    n_buckets = n_out // 2
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+
+    # NaN 不參與極值比較
+    lo = np.where(np.isnan(y), np.inf, y)
+    hi = np.where(np.isnan(y), -np.inf, y)
+    min_vals = np.minimum.reduceat(lo, starts)
+    max_vals = np.maximum.reduceat(hi, starts)
+
+    # 以 bucket id 找出每個區間內第一個等於極值的位置
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    is_min = lo == min_vals[bucket]
+    is_max = hi == max_vals[bucket]
+    first_min = np.full(n_buckets, -1, dtype=np.int64)
+    first_max = np.full(n_buckets, -1, dtype=np.int64)
+    idx = np.arange(n)
+    # 反向寫入，讓較前面的位置覆蓋較後面的
+    first_min[bucket[is_min][::-1]] = idx[is_min][::-1]
+    first_max[bucket[is_max][::-1]] = idx[is_max][::-1]
+
+    # 全為 NaN 的區間退回區間起點
+    first_min[first_min < 0] = starts[first_min < 0]
+    first_max[first_max < 0] = starts[first_max < 0]
+
+    keep = np.concatenate([first_min, first_max, [0, n - 1]])
+    return np.unique(keep)
+
+
+def lttb_indices(y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降採樣，x 軸以位置索引計算 (K 線為等距資料)。
+    另外強制保留全域最小值與最大值。
+    :param y: 數值序列
+    :param n_out: 目標點數
+    :return: 排序後的索引 (numpy int64 array)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    y_filled = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for k in range(n_out - 2):
+        start, stop = edges[k], edges[k + 1]
+        if stop <= start:
+            selected[k + 1] = start
+            a = start
+            continue
+        # 下一個區間的平均點
+        if k + 2 < len(edges):
+            nxt_start, nxt_stop = edges[k + 1], max(edges[k + 2], edges[k + 1] + 1)
+        else:
+            nxt_start, nxt_stop = n - 1, n
+        avg_x = (nxt_start + nxt_stop - 1) / 2.0
+        avg_y = y_filled[nxt_start:nxt_stop].mean()
+
+        xs = np.arange(start, stop)
+        area = np.abs((a - avg_x) * (y_filled[start:stop] - y_filled[a])
+                      - (a - xs) * (avg_y - y_filled[a]))
+        a = start + int(np.argmax(area))
+        selected[k + 1] = a
+
+    extremes = [int(np.nanargmin(y)), int(np.nanargmax(y))] if np.isfinite(y).any() else []
+    return np.unique(np.concatenate([selected, extremes]).astype(np.int64))
+
+
+def decimate_indices(ys, n_out, method='minmax'):
+    """
+    對一組共用 x 軸的序列取得降採樣索引 (取各序列索引的聯集，保證對齊)
+    :param ys: 序列的 list
+    :param n_out: 每條序列的目標點數
+    :param method: 'minmax' 或 'lttb'
+    :return: 排序後的索引
+    """
+    if method == 'lttb':
+        pick = lttb_indices
+    elif method == 'minmax':
+        pick = minmax_indices
+    else:
+        raise ValueError(f"Unknown decimation method: {method}")
+    return np.unique(np.concatenate([pick(y, n_out) for y in ys]))
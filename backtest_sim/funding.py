@@ -0,0 +1,148 @@
+"""
+永續合約資金費率 (funding) 的對齊與計提。
+
+CTA 回測以 K 線收盤價進出場，但從未計算持倉期間的資金費用，持有永續合約數天時 PnL 會被高估。
+這裡把各交易所的資金費率結算事件一次對齊到 K 線列 (np.searchsorted)，再以向量運算對持倉計提：
+    列 i 的部位 (第 i 根 K 線收盤後的部位) 持有到下一根收盤，期間 [收盤 i, 收盤 i + 週期) 內的結算都向它收取
+    每單位部位的費用 = 費率 × 標記價格 (事件沒有 markPrice 時用該列的收盤價)
+    carry = -部位 × lot × 每單位費用     (費率為正時多單付費、空單收費)
+部位與每單位費用可以是 (K 線數, 商品數) 的二維 array，一次計算所有部位與商品。
+
+資金費率事件的格式與 Bincentive/Problem1/preprocess.py (Binance / OKX) 及 synth.funding_rates 相同：
+'Open time' (或 'fundingTime')、'fundingRate'，可選 'markPrice'；交易所由 'venue' 欄位，
+或 'symbol' (Binance) / 'instId' (OKX) 欄位判斷。
+
+用法：
+    events = load_funding('funding_MINAUSDT.csv', venue='binance')
+    df = backtesting(df, funding=events)          # Statistic_CTA / ML_CTA，'Funding' 欄位併入 'PnL'
+    python -m backtest_sim.chunked statistic_cta in.csv out.csv --funding funding_BTCUSDT.csv
+"""
+import numpy as np
+
+from .timeutil import interval_ms, to_epoch_ms_array
+
+# 沒有 'venue' 欄位時，由哪個欄位有值判斷交易所
+VENUE_COLUMNS = {'symbol': 'binance', 'instId': 'okx'}
+
+
+def funding_events(df, venue=None):
+    """
+    資金費率 DataFrame 整理成依時間排序的事件
+    :param df: 含 'Open time' (或 'fundingTime') 與 'fundingRate' 的 DataFrame
+    :param venue: 只保留此交易所 ('binance' / 'okx' ...)，None 為全部
+    :return: DataFrame ('time' (毫秒), 'rate', 'venue'[, 'markPrice'])
+    """
+    import pandas as pd
+
+    time_column = 'Open time' if 'Open time' in df.columns else 'fundingTime'
+    events = pd.DataFrame({'time': to_epoch_ms_array(df[time_column]),
+                           'rate': pd.to_numeric(df['fundingRate'], errors='coerce').to_numpy()})
+    if 'venue' in df.columns:
+        events['venue'] = df['venue'].astype(str).to_numpy()
+    else:
+        events['venue'] = None
+        for column, name in VENUE_COLUMNS.items():
+            if column in df.columns:
+                events.loc[df[column].notna().to_numpy() & events['venue'].isna().to_numpy(), 'venue'] = name
+    if 'markPrice' in df.columns:
+        events['markPrice'] = pd.to_numeric(df['markPrice'], errors='coerce').to_numpy()
+    events = events[events['rate'].notna()]
+    if venue is not None:
+        events = events[events['venue'] == venue]
+    return events.sort_values('time', kind='stable').reset_index(drop=True)
+
+
+def events_from_bars(df, venue=None):
+    """
+    從已以 merge_asof 併入 K 線的資金費率欄位還原事件 (例如 raw_MINAUSDT_futures.csv)
+    merge_asof 的容許誤差會讓同一次結算出現在連續兩根 K 線上，相鄰且內容相同的列只保留第一列，
+    事件時間以該列的 K 線時間近似
+    """
+    columns = [c for c in ('fundingRate', 'markPrice', *VENUE_COLUMNS, 'venue') if c in df.columns]
+    rows = df[df['fundingRate'].notna()]
+    # 與前一列 (整段資料中的前一根 K 線) 內容不同才是新的結算
+    previous = df[columns].shift(1).loc[rows.index]
+    same = (rows[columns].eq(previous) | (rows[columns].isna() & previous.isna())).all(axis=1)
+    return funding_events(rows[~same.to_numpy()], venue=venue)
+
+
+def load_funding(path, venue=None):
+    """讀取資金費率 CSV (preprocess.py 儲存的事件或 synth.funding_rates 的輸出)"""
+    import pandas as pd
+
+    return funding_events(pd.read_csv(path), venue=venue)
+
+
+def bar_period(bar_times):
+    """K 線週期 (毫秒)，以相鄰時間差的中位數估計"""
+    bar_times = to_epoch_ms_array(bar_times)
+    if len(bar_times) < 2:
+        raise ValueError("Need at least two bars (or pass bar_ms) to infer the bar period")
+    return int(np.median(np.diff(bar_times)))
+
+
+def align_funding(bar_times, event_times, bar_ms):
+    """
+    結算事件對應到收取費用的 K 線列
+    列 i 的部位持有於 [bar_times[i] + bar_ms, bar_times[i] + 2 * bar_ms)；不在任何區間內的事件 (資料開始前、缺漏期間) 不計
+    :param bar_times: K 線開始時間 (毫秒，遞增)
+    :param event_times: 結算時間 (毫秒)
+    :return: (列號 array, 是否有對應的 bool array)
+    """
+    closes = np.asarray(bar_times, dtype=np.int64) + bar_ms
+    rows = np.searchsorted(closes, event_times, side='right') - 1
+    valid = rows >= 0
+    valid[valid] = event_times[valid] < closes[rows[valid]] + bar_ms
+    return rows, valid
+
+
+def unit_carry(bar_times, events, prices=None, bar_ms=None):
+    """
+    每根 K 線上每單位多單部位的資金費用 (費率 × 價格，同一列的多次結算加總)
+    :param bar_times: K 線開始時間 (毫秒 array，或 datetime / 字串 Series)
+    :param events: funding_events() 的結果
+    :param prices: 各列的收盤價，事件沒有 markPrice 時使用
+    :param bar_ms: K 線週期 (毫秒或 '1h' 等)，None 時由 bar_times 推算
+    :return: float array (長度與 bar_times 相同)
+    """
+    bar_times = to_epoch_ms_array(bar_times)
+    bar_ms = bar_period(bar_times) if bar_ms is None else interval_ms(bar_ms)
+    event_times = events['time'].to_numpy()
+    rows, valid = align_funding(bar_times, event_times, bar_ms)
+    rows = rows[valid]
+    rates = events['rate'].to_numpy()[valid]
+    marks = events['markPrice'].to_numpy()[valid] if 'markPrice' in events else np.full(len(rows), np.nan)
+    if prices is not None:
+        marks = np.where(np.isnan(marks), np.asarray(prices, dtype=np.float64)[rows], marks)
+    elif np.isnan(marks).any():
+        raise ValueError("Funding events without markPrice need bar prices")
+    return np.bincount(rows, weights=rates * marks, minlength=len(bar_times))
+
+
+def accrue(position, carry, lot=1):
+    """
+    持倉的資金費用 (正值為收入、負值為支出)，部位與費用可為 (K 線數, 商品數) 的 array
+    :param position: 各列收盤後的淨部位 (多單為正、空單為負)
+    :param carry: unit_carry() 的結果
+    """
+    return -np.asarray(position, dtype=np.float64) * lot * carry
+
+
+def net_position(df):
+    """CTA 回測結果的淨部位：'buy position' 與 'sell position' 為 True 的列分別為 +1 / -1 (可同時持有)"""
+    return ((df['buy position'] == True).to_numpy().astype(np.int8)
+            - (df['sell position'] == True).to_numpy().astype(np.int8))
+
+
+def apply_funding(df, events, lot=1, bar_ms=None, time_column='Open time', price_column='Close'):
+    """
+    在 CTA 回測結果加入 'Funding' 欄位並併入 'PnL'
+    分塊回測時對每個區塊呼叫 (bar_ms 需相同)，結果與一次處理整段資料相同
+    :param events: funding_events() 的結果
+    :return: (df, 資金費用合計)
+    """
+    carry = unit_carry(df[time_column], events, prices=df[price_column].to_numpy(), bar_ms=bar_ms)
+    funding = accrue(net_position(df), carry, lot)
+    df['Funding'] = funding
+    df['PnL'] = df['PnL'] + funding
+    return df, float(funding.sum())
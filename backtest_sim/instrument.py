@@ -0,0 +1,362 @@
+"""
+各階段 (preprocess / factors / alphas / backtest / plot) 的計時與記憶體量測。
+
+預設關閉，關閉時 span() 回傳共用的空 context manager、traced() 只多一次旗標判斷。
+開啟方式：
+    BACKTEST_SIM_PROFILE=1 python plot_result.py
+    BACKTEST_SIM_PROFILE=1 BACKTEST_SIM_PROFILE_SAMPLE=10 make all   # 每 10 次進入同名 span 以 cProfile 取樣一次
+或在程式中呼叫 instrument.enable()。
+
+開啟時每個 span 記錄：次數、總時間、自身時間、tracemalloc 的記憶體增量與峰值、RSS。
+程式結束時輸出 run_report.json (可用 BACKTEST_SIM_REPORT 指定路徑) 與同名的 .folded 檔，
+後者為 flamegraph.pl / speedscope 可讀的 collapsed stack 格式；若有 cProfile 取樣，另輸出 .<script>.prof 檔。
+Makefile 的每個步驟是獨立的 process：報告以 (工作目錄, argv) 為 key 合併進既有的 run_report.json，
+同一步驟重跑時取代舊的紀錄，.folded 由所有步驟重新產生 (最外層為腳本名稱)，因此 `make` 結束後保有跨步驟的完整資料。
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # 非 POSIX 系統 (Windows)
+    resource = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _State:
+    enabled = False
+    memory = False
+    profile_every = 0
+    report_path = 'run_report.json'
+    started = None
+
+
+_state = _State()
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}          # path tuple -> 累計資料
+_entries = {}        # span 名稱 -> 進入次數 (決定是否取樣)
+_profile_stats = None
+_profiling = False
+
+
+def rss_mb():
+    """目前 process 的 RSS (MB)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return float('nan')
+
+
+def peak_rss_mb():
+    """process 啟動至今的最大 RSS (MB)，沒有 resource 模組時為 NaN"""
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB，macOS 為 bytes
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _Span:
+    __slots__ = ('name', 'path', 'start', 'child_ns', 'mem_start', 'peak', 'rss_start', 'profiler')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _profiling
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.path = (parent.path if parent else ()) + (self.name,)
+        self.child_ns = 0
+        self.profiler = None
+
+        if _state.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.mem_start = current
+            self.peak = current
+        else:
+            self.mem_start = None
+        self.rss_start = rss_mb()
+
+        if _state.profile_every:
+            with _lock:
+                count = _entries[self.name] = _entries.get(self.name, 0) + 1
+                take = count % _state.profile_every == 1 % _state.profile_every and not _profiling
+                if take:
+                    _profiling = True
+            if take:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        global _profile_stats, _profiling
+        elapsed = time.perf_counter_ns() - self.start
+        stack = _stack()
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            parent.child_ns += elapsed
+
+        if self.profiler is not None:
+            self.profiler.disable()
+
+        mem_delta = peak = None
+        if self.mem_start is not None and tracemalloc.is_tracing():
+            current, traced_peak = tracemalloc.get_traced_memory()
+            peak = max(self.peak, traced_peak)
+            mem_delta = current - self.mem_start
+            if parent is not None:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+        rss = rss_mb()
+
+        with _lock:
+            s = _stats.get(self.path)
+            if s is None:
+                s = _stats[self.path] = {'count': 0, 'total_ns': 0, 'self_ns': 0, 'mem_delta': 0,
+                                         'peak': 0, 'rss_max': 0.0, 'rss_delta': 0.0}
+            s['count'] += 1
+            s['total_ns'] += elapsed
+            s['self_ns'] += elapsed - self.child_ns
+            if mem_delta is not None:
+                s['mem_delta'] += mem_delta
+                s['peak'] = max(s['peak'], peak - self.mem_start)
+            s['rss_max'] = max(s['rss_max'], rss)
+            s['rss_delta'] += rss - self.rss_start
+            if self.profiler is not None:
+                if _profile_stats is None:
+                    _profile_stats = pstats.Stats(self.profiler)
+                else:
+                    _profile_stats.add(self.profiler)
+                _profiling = False
+        return False
+
+
+def span(name):
+    """
+    計時區塊：with span('backtest'): ...
+    關閉量測時回傳空 context manager，幾乎沒有額外成本。
+    """
+    if not _state.enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def traced(name=None):
+    """
+    函式裝飾器，在量測開啟時以 span 包住每次呼叫
+    :param name: span 名稱，預設為函式的 __qualname__
+    """
+    def decorator(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _Span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enabled():
+    return _state.enabled
+
+
+def enable(memory=True, profile_every=0, report_path=None, write_at_exit=True):
+    """
+    開啟量測
+    :param memory: 是否以 tracemalloc 追蹤 Python 記憶體配置 (會讓程式變慢約 2-4 倍)
+    :param profile_every: 每 N 次進入同名 span 以 cProfile 取樣一次，0 為不取樣
+    :param report_path: 報告輸出路徑 (JSON)，同名 .folded / .prof 一併輸出
+    :param write_at_exit: 程式結束時自動輸出報告
+    """
+    if _state.enabled:
+        return
+    _state.enabled = True
+    _state.memory = memory
+    _state.profile_every = int(profile_every or 0)
+    _state.started = time.time()
+    if report_path:
+        _state.report_path = report_path
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if write_at_exit:
+        atexit.register(write_report)
+
+
+def disable():
+    _state.enabled = False
+    if _state.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """清除已收集的資料"""
+    global _profile_stats
+    with _lock:
+        _stats.clear()
+        _entries.clear()
+        _profile_stats = None
+
+
+def report():
+    """回傳目前收集到的資料 (dict，可直接轉成 JSON)"""
+    with _lock:
+        items = sorted(_stats.items(), key=lambda kv: kv[0])
+        spans = [{
+            'path': '/'.join(path),
+            'name': path[-1],
+            'depth': len(path) - 1,
+            'count': s['count'],
+            'total_s': s['total_ns'] / 1e9,
+            'self_s': s['self_ns'] / 1e9,
+            'mem_delta_mb': s['mem_delta'] / 2**20,
+            'mem_peak_mb': s['peak'] / 2**20,
+            'rss_max_mb': s['rss_max'],
+            'rss_delta_mb': s['rss_delta'],
+        } for path, s in items]
+
+        profile = []
+        if _profile_stats is not None:
+            for (file, line, func), (cc, nc, tt, ct, _) in _profile_stats.stats.items():
+                profile.append({'function': f"{func} ({os.path.basename(file)}:{line})",
+                                'calls': nc, 'tottime_s': tt, 'cumtime_s': ct})
+            profile.sort(key=lambda r: r['cumtime_s'], reverse=True)
+            profile = profile[:50]
+
+    return {
+        'started': datetime.fromtimestamp(_state.started or time.time(), timezone.utc).isoformat(timespec='seconds'),
+        'wall_s': time.time() - (_state.started or time.time()),
+        'argv': sys.argv,
+        'cwd': os.getcwd(),
+        'pid': os.getpid(),
+        'peak_rss_mb': peak_rss_mb(),
+        'spans': spans,
+        'profile_top': profile,
+    }
+
+
+def folded_stacks():
+    """collapsed stack 格式：每行 'a;b;c <自身時間 (微秒)>'"""
+    with _lock:
+        return [f"{';'.join(path)} {s['self_ns'] // 1000}" for path, s in sorted(_stats.items())
+                if s['self_ns'] >= 1000]
+
+
+def _script(run):
+    """run 的腳本名稱 (argv[0] 去掉路徑與 .py)，作為 .folded 的最外層與 .prof 的檔名"""
+    argv = run.get('argv') or ['python']
+    name = os.path.basename(argv[0]) or 'python'
+    return name[:-3] if name.endswith('.py') else name
+
+
+def _run_folded(run):
+    """由一筆 run 的 spans 重建 collapsed stack，最外層加上腳本名稱以區分各步驟"""
+    root = _script(run)
+    return [f"{root};{r['path'].replace('/', ';')} {int(r['self_s'] * 1e6)}" for r in run['spans']
+            if r['self_s'] >= 1e-6]
+
+
+def merge_report(existing, run):
+    """
+    把本 process 的 run 合併進既有的報告
+    :param existing: 既有報告 (dict)，舊格式 (單一 run) 或無法讀取時為 None
+    :param run: report() 的結果
+    :return: {'runs': [...], 'wall_s', 'peak_rss_mb'}，同 (cwd, argv) 的舊 run 會被取代
+    """
+    runs = existing.get('runs', []) if isinstance(existing, dict) else []
+    key = (run['cwd'], run['argv'])
+    runs = [r for r in runs if (r.get('cwd'), r.get('argv')) != key] + [run]
+    return {
+        'runs': runs,
+        'wall_s': sum(r['wall_s'] for r in runs),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+    }
+
+
+def write_report(path=None):
+    """
+    輸出 JSON 報告、.folded 堆疊檔與 (若有取樣) .<script>.prof 檔，回傳 JSON 路徑
+    既有的 JSON 報告會被合併 (見 merge_report)，並行的 process 以檔案鎖依序寫入
+    """
+    path = path or _state.report_path
+    base = path[:-5] if path.endswith('.json') else path
+    run = report()
+    with open(path + '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                existing = json.load(f)
+        except (OSError, ValueError):
+            existing = None
+        merged = merge_report(existing, run)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(merged, f, indent=2)
+        os.replace(tmp, path)
+        with open(base + '.folded', 'w') as f:
+            f.write('\n'.join(line for r in merged['runs'] for line in _run_folded(r)) + '\n')
+    if _profile_stats is not None:
+        _profile_stats.dump_stats(f"{base}.{_script(run)}.prof")
+    return path
+
+
+def print_summary(file=None):
+    """以表格列出各 span 的時間與記憶體"""
+    file = file or sys.stderr
+    rows = report()['spans']
+    print(f"{'span':50s} {'count':>7s} {'total s':>10s} {'self s':>10s} {'peak MB':>9s} {'RSS MB':>9s}", file=file)
+    for r in rows:
+        label = '  ' * r['depth'] + r['name']
+        print(f"{label[:50]:50s} {r['count']:7d} {r['total_s']:10.3f} {r['self_s']:10.3f} "
+              f"{r['mem_peak_mb']:9.1f} {r['rss_max_mb']:9.1f}", file=file)
+
+
+if os.environ.get('BACKTEST_SIM_PROFILE', '') not in ('', '0'):
+    enable(memory=os.environ.get('BACKTEST_SIM_PROFILE_MEMORY', '1') != '0',
+           profile_every=int(os.environ.get('BACKTEST_SIM_PROFILE_SAMPLE', '0') or 0),
+           report_path=os.environ.get('BACKTEST_SIM_REPORT') or None)
@@ -0,0 +1,426 @@
+"""
+可中斷、可續跑的工作層 (參數掃描與 walk-forward 重新訓練)。
+
+一個 job 拆成許多獨立的 unit：每個 unit 是 (task 名稱, 參數 dict)，以參數的雜湊作為 unit id。
+每完成一個 unit 就把結果原子性地寫入 checkpoint 資料夾 (先寫暫存檔再 os.replace)，
+重新執行同一個 job 時略過已完成的 unit，因此 job 可以隨時中斷、續跑，
+或加入新的格點後只計算新的部分。
+
+    <store>/units/<id[:2]>/<id>.json    每個完成的 unit：task、params、result、耗時
+
+內建的 task (見 TASKS)：
+    statistic   Statistic_CTA：compute_factors -> get_direction -> backtesting，參數 window_size / threshold1 / threshold2
+    ml_fold     ML_CTA walk-forward 的一個 fold：在訓練區間訓練 XGBoost，在測試區間產生方向並回測
+
+用法：
+    python -m backtest_sim.jobs sweep --store runs/stat --klines Statistic_CTA/klines_BTC.csv \\
+        --window 24:200:8 --threshold1 3,4.5 --threshold2 1.5,2 --workers 4
+    python -m backtest_sim.jobs walk-forward --store runs/ml --klines ML_CTA/klines_BTC.csv --train 4000 --test 1000
+    python -m backtest_sim.jobs status --store runs/stat
+    python -m backtest_sim.jobs export --store runs/stat --out sweep.csv
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .metrics import summary_metrics
+
+TASKS = {}
+
+
+def task(name):
+    """登記一個 task：函式接收參數 dict，回傳可轉為 JSON 的結果 dict"""
+    def decorator(fn):
+        TASKS[name] = fn
+        return fn
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# unit
+# ---------------------------------------------------------------------------
+def _canonical(params):
+    return json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def unit_id(task_name, params):
+    """同一個 task 與參數永遠得到相同的 id (參數順序不影響)"""
+    return hashlib.sha1(f"{task_name}|{_canonical(params)}".encode()).hexdigest()[:20]
+
+
+def grid(**axes):
+    """
+    參數格點：grid(window_size=[24, 48], threshold1=[3, 4.5]) -> 4 個參數 dict
+    值為單一數值 (非 list / tuple) 的參數在每個格點都相同
+    """
+    names = list(axes)
+    values = [v if isinstance(v, (list, tuple, np.ndarray)) else [v] for v in axes.values()]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def walk_forward(n, train, test, step=None, expanding=False):
+    """
+    walk-forward 的 fold 切分
+    :param n: 資料筆數
+    :param train: 訓練區間長度 (expanding 時為第一個 fold 的長度)
+    :param test: 測試區間長度
+    :param step: 每個 fold 前進的筆數，預設為 test
+    :param expanding: True 時訓練區間從 0 開始逐漸擴大
+    :return: list of dict，'fold', 'train_start', 'train_end', 'test_end' (左閉右開)
+    """
+    step = step or test
+    folds = []
+    end = train
+    while end + test <= n:
+        folds.append({'fold': len(folds), 'train_start': 0 if expanding else end - train,
+                      'train_end': end, 'test_end': end + test})
+        end += step
+    return folds
+
+
+def parse_values(text, kind=float):
+    """
+    命令列的參數值：'24,48,96' 或 'start:stop:step' (包含 stop)，可混用，例如 '10,24:48:12'
+    """
+    values = []
+    for part in str(text).split(','):
+        if ':' in part:
+            start, stop, step = (kind(x) for x in part.split(':'))
+            values.extend(kind(v) for v in np.arange(start, stop + step / 2, step))
+        elif part:
+            values.append(kind(part))
+    return values
+
+
+# ---------------------------------------------------------------------------
+# checkpoint
+# ---------------------------------------------------------------------------
+class CheckpointStore:
+    """以資料夾保存每個完成的 unit (每個 unit 一個 JSON，原子寫入)"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'units'), exist_ok=True)
+
+    def path(self, uid):
+        return os.path.join(self.root, 'units', uid[:2], uid + '.json')
+
+    def has(self, uid):
+        return os.path.exists(self.path(uid))
+
+    def get(self, uid):
+        with open(self.path(uid)) as f:
+            return json.load(f)
+
+    def put(self, uid, record):
+        """寫入暫存檔並 fsync 後再改名，中斷時不會留下寫到一半的結果"""
+        path = self.path(uid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(record, f, default=_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def ids(self):
+        units = os.path.join(self.root, 'units')
+        for shard in sorted(os.listdir(units)):
+            for name in sorted(os.listdir(os.path.join(units, shard))):
+                if name.endswith('.json'):
+                    yield name[:-5]
+
+    def records(self, task_name=None):
+        for uid in self.ids():
+            record = self.get(uid)
+            if task_name is None or record['task'] == task_name:
+                yield record
+
+    def __len__(self):
+        return sum(1 for _ in self.ids())
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+# ---------------------------------------------------------------------------
+# 執行
+# ---------------------------------------------------------------------------
+def run_unit(task_name, params):
+    """執行一個 unit (在 worker process 或目前的 process 中)"""
+    start = time.perf_counter()
+    result = TASKS[task_name](params)
+    return {'task': task_name, 'params': params, 'result': result,
+            'elapsed': time.perf_counter() - start, 'finished_at': time.time()}
+
+
+def run_job(task_name, param_list, store, workers=1, verbose=True):
+    """
+    執行 job 中尚未完成的 unit，每完成一個就寫入 checkpoint
+    失敗的 unit 不寫入 (下次執行時重試)，錯誤訊息列在回傳值中
+    :param task_name: TASKS 中的名稱
+    :param param_list: 參數 dict 的 list (例如 grid() / walk_forward() 的結果)
+    :param store: CheckpointStore 或資料夾路徑
+    :param workers: process 數量，1 為在目前 process 執行
+    :return: dict，'total' / 'skipped' / 'completed' / 'failed' 數量與 'errors'
+    """
+    if task_name not in TASKS:
+        raise ValueError(f"Unknown task: {task_name} (choose from {', '.join(sorted(TASKS))})")
+    store = store if isinstance(store, CheckpointStore) else CheckpointStore(store)
+    units = {unit_id(task_name, p): p for p in param_list}
+    pending = {uid: p for uid, p in units.items() if not store.has(uid)}
+    summary = {'total': len(units), 'skipped': len(units) - len(pending), 'completed': 0, 'failed': 0, 'errors': {}}
+    if verbose:
+        print(f"{task_name}: {len(units):,} units, {summary['skipped']:,} already done, {len(pending):,} to run")
+
+    start = time.perf_counter()
+
+    def finish(uid, record=None, error=None):
+        if error is None:
+            record['id'] = uid
+            store.put(uid, record)
+            summary['completed'] += 1
+        else:
+            summary['failed'] += 1
+            summary['errors'][uid] = error
+        done = summary['completed'] + summary['failed']
+        if verbose and (done == len(pending) or done % max(1, len(pending) // 20) == 0):
+            rate = done / (time.perf_counter() - start)
+            print(f"  {done:,}/{len(pending):,} units ({rate:.2f}/s, {summary['failed']} failed)")
+
+    if workers > 1 and len(pending) > 1:
+        # 必須在建立 worker 之前匯出共享記憶體的 handle (環境變數)
+        server = _share_klines(pending.values())
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_unit, task_name, p): uid for uid, p in pending.items()}
+                for future in as_completed(futures):
+                    try:
+                        finish(futures[future], future.result())
+                    except Exception:
+                        finish(futures[future], error=traceback.format_exc(limit=3))
+        finally:
+            if server is not None:
+                server.close()
+    else:
+        for uid, p in pending.items():
+            try:
+                finish(uid, run_unit(task_name, p))
+            except Exception:
+                finish(uid, error=traceback.format_exc(limit=3))
+    return summary
+
+
+def collect(store, task_name=None):
+    """已完成的 unit 整理成 DataFrame (參數欄位 + 結果欄位)"""
+    import pandas as pd
+
+    store = store if isinstance(store, CheckpointStore) else CheckpointStore(store)
+    rows = [{'id': r['id'], 'task': r['task'], **r['params'], **r['result'], 'elapsed': r['elapsed']}
+            for r in store.records(task_name)]
+    return pd.DataFrame(rows)
+
+
+# ---------------------------------------------------------------------------
+# 內建 task
+# ---------------------------------------------------------------------------
+_data = {}
+
+
+def _klines(path):
+    """
+    每個 process 只讀取一次同一個 K 線檔
+    run_job 以多個 process 執行時，K 線由主 process 放進共享記憶體 (backtest_sim.shm)，worker 直接取用唯讀 view
+    """
+    if path not in _data:
+        from .shm import attach
+
+        shared = attach()
+        if shared is not None and path in shared:
+            _data[path] = shared.frame(path)
+        else:
+            from .loaders import load_klines
+            _data[path] = load_klines(path, time_as='datetime', report=False)
+    return _data[path]
+
+
+def _share_klines(param_list):
+    """把各 unit 用到的 K 線檔讀取一次放進共享記憶體，回傳 MarketDataServer (沒有 K 線參數時回傳 None)"""
+    # 不存在的檔案留給各 unit 回報錯誤
+    paths = sorted({p['klines'] for p in param_list if isinstance(p.get('klines'), str) and os.path.exists(p['klines'])})
+    if not paths:
+        return None
+    from .loaders import load_klines
+    from .shm import MarketDataServer
+
+    server = MarketDataServer()
+    for path in paths:
+        server.add(path, load_klines(path, time_as='datetime', report=False))
+    server.export()
+    return server
+
+
+def _window(df, params):
+    """依 'start' / 'end' (時間字串) 截取資料"""
+    if params.get('start'):
+        df = df[df['Open time'] >= params['start']]
+    if params.get('end'):
+        df = df[df['Open time'] < params['end']]
+    return df.reset_index(drop=True)
+
+
+@task('statistic')
+def statistic_task(params):
+    """Statistic_CTA 的一組參數：window_size、threshold1、threshold2 (可選 start / end)"""
+    from .projects import load
+
+    factors = load('statistic_cta', 'add_factors')
+    alphas = load('statistic_cta', 'add_alphas')
+    backtest = load('statistic_cta', 'backtest')
+    df = _window(_klines(params['klines']), params).copy()
+    df = factors.compute_factors(df, window_size=int(params.get('window_size', 24)))
+    df = alphas.get_direction(df, threshold1=params.get('threshold1', 4.5), threshold2=params.get('threshold2', 2))
+    df = backtest.backtesting(df)
+    result = summary_metrics(df['PnL'], initial_balance=params.get('initial_balance', 10000))
+    result['bars'] = len(df)
+    return result
+
+
+def _ml_factors(path, window_size, gamma):
+    key = ('ml_factors', path, window_size, gamma)
+    if key not in _data:
+        from .projects import load
+        factors = load('ml_cta', 'add_factors')
+        _data[key] = factors.compute_factors(_klines(path).copy(), window_size=window_size, gamma=gamma)
+    return _data[key]
+
+
+@task('ml_fold')
+def ml_fold_task(params):
+    """
+    ML_CTA walk-forward 的一個 fold：在 [train_start, train_end) 訓練，在 [train_end, test_end) 回測
+    參數：klines、train_start、train_end、test_end，可選 N、threshold、window_size、gamma、n_estimators，
+    以及回測規則 take_profit_atr、stop_loss_atr、confirm (預設與 ML_CTA/backtest.py 相同)
+    """
+    from sklearn.metrics import mean_absolute_error
+
+    from .models import default_registry, fit_xgboost
+    from .projects import load
+
+    alphas = load('ml_cta', 'add_alphas')
+    backtest = load('ml_cta', 'backtest')
+    N = int(params.get('N', 1))
+    df = _ml_factors(params['klines'], int(params.get('window_size', 150)), params.get('gamma', 0.8)).copy()
+    df['Future_Return_N'] = (df['Close'].shift(-N) - df['Close']) / df['Close']
+    df['Future_Return_N'] *= 100
+    df = df.dropna().reset_index(drop=True)
+
+    train = df.iloc[params['train_start']:params['train_end']]
+    test = df.iloc[params['train_end']:params['test_end']].reset_index(drop=True)
+    X_train, y_train = alphas.prepare_features(train)
+    X_test, y_test = alphas.prepare_features(test)
+    # 相同 fold 與超參數的模型只訓練一次 (只改 threshold 時直接沿用登錄中的模型與預測值)
+    registry = default_registry()
+    xgb_params = dict(alphas.XGB_PARAMS, n_estimators=int(params.get('n_estimators', 100)))
+    model, key = fit_xgboost(X_train, y_train, xgb_params, N, registry)
+    test['Predicted_Return'] = model.predict(X_test) if key is None else registry.predict(key, X_test, model)
+
+    # 與 add_alphas.get_direction 相同的規則 (該函式會寫檔，這裡直接計算)
+    test['direction'] = alphas.DIRECTION_RULES.evaluate(test, threshold=params.get('threshold', 0.05))
+    rules = {name: params[name] for name in ('take_profit_atr', 'stop_loss_atr', 'confirm') if name in params}
+    test = backtest.backtesting(test, **rules)
+
+    result = summary_metrics(test['PnL'], initial_balance=params.get('initial_balance', 10000))
+    result['mae'] = float(mean_absolute_error(y_test, test['Predicted_Return']))
+    result['bars'] = len(test)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 命令列
+# ---------------------------------------------------------------------------
+def add_job_parsers(sub, parents=()):
+    """登記 'sweep' / 'walk-forward' 子命令 (jobs 與 taskqueue 共用)"""
+    p = sub.add_parser('sweep', help="Statistic_CTA parameter grid", parents=list(parents))
+    p.add_argument('--klines', required=True)
+    p.add_argument('--window', default='24', help="e.g. 24,48 or 24:200:8")
+    p.add_argument('--threshold1', default='4.5')
+    p.add_argument('--threshold2', default='2')
+    p.add_argument('--start')
+    p.add_argument('--end')
+    p = sub.add_parser('walk-forward', help="ML_CTA walk-forward retraining", parents=list(parents))
+    p.add_argument('--klines', required=True)
+    p.add_argument('--train', type=int, required=True, help="training bars per fold")
+    p.add_argument('--test', type=int, required=True, help="test bars per fold")
+    p.add_argument('--step', type=int)
+    p.add_argument('--expanding', action='store_true')
+    p.add_argument('--threshold', default='0.05')
+    p.add_argument('--N', default='1')
+    return sub.choices['sweep'], sub.choices['walk-forward']
+
+
+def job_units(args):
+    """由 'sweep' / 'walk-forward' 的命令列參數產生 (task 名稱, 參數 list)"""
+    klines = os.path.abspath(args.klines)
+    if args.command == 'sweep':
+        return 'statistic', grid(klines=klines, window_size=parse_values(args.window, int),
+                                 threshold1=parse_values(args.threshold1), threshold2=parse_values(args.threshold2),
+                                 start=args.start, end=args.end)
+    # fold 的位置以去除 NaN 後的因子資料計算 (與 ml_fold_task 相同)
+    n = len(_ml_factors(klines, 150, 0.8).dropna()) - max(parse_values(args.N, int))
+    folds = walk_forward(n, args.train, args.test, args.step, args.expanding)
+    return 'ml_fold', [dict(fold, **extra) for fold in folds
+                       for extra in grid(klines=klines, threshold=parse_values(args.threshold),
+                                         N=parse_values(args.N, int))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checkpointed parameter sweeps and walk-forward jobs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for p in add_job_parsers(sub):
+        p.add_argument('--workers', type=int, default=1)
+    p = sub.add_parser('status', help="count finished units")
+    p = sub.add_parser('export', help="write finished units as one CSV")
+    p.add_argument('--out', required=True)
+    p.add_argument('--task')
+    for p in sub.choices.values():
+        p.add_argument('--store', required=True, help="checkpoint directory")
+    args = parser.parse_args(argv)
+
+    store = CheckpointStore(args.store)
+    if args.command in ('sweep', 'walk-forward'):
+        task_name, params = job_units(args)
+        summary = run_job(task_name, params, store, workers=args.workers)
+    elif args.command == 'status':
+        counts = {}
+        for record in store.records():
+            counts[record['task']] = counts.get(record['task'], 0) + 1
+        for name, count in sorted(counts.items()):
+            print(f"{name:12s} {count:>10,d} units")
+        return 0
+    else:
+        df = collect(store, args.task)
+        df.to_csv(args.out, index=False)
+        print(f"{len(df):,} units -> {args.out}")
+        return 0
+
+    for uid, error in summary['errors'].items():
+        print(f"unit {uid} failed:\n{error}", file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
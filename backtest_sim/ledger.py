@@ -0,0 +1,256 @@
+"""
+交易紀錄 (ledger) 的共用結構。
+
+原本各引擎各自記錄交易：OrderExecutor.orders 是含 pd.Timestamp 的 Python list，
+Bincentive/Problem2 是以 trades[-1].update 修改的 dict list。每筆交易都是十幾個 Python 物件 (約 0.5 ~ 1 KB)，
+百萬筆交易的記憶體與轉成 DataFrame 的時間都很可觀。這裡改為一個可成長的 NumPy structured array：
+    - 時間為 int64 毫秒，side / position / reason 等列舉以 int8 代碼存放，每筆約 60 bytes
+    - append 為均攤 O(1) (容量不足時加倍)，extend 以向量一次加入多筆
+    - to_frame 不複製資料 (各欄位是 structured array 的 view，時間為 datetime64[ms]，列舉為 Categorical)
+    - stats / trade_stats 以向量運算計算每筆交易的統計
+
+用法：
+    ledger = Ledger(ROUND_TRIP_FIELDS)
+    ledger.append(entry_time=t0, exit_time=t1, position='LONG', reason='SIGNAL', entry_price=100.0, exit_price=101.0, pnl=1.0)
+    ledger.to_frame()                  # DataFrame
+    ledger.stats()                     # {'trades': 1, 'win_rate': 1.0, ...}
+"""
+import numpy as np
+
+from .timeutil import to_epoch_ms, to_epoch_ms_array
+
+SIDES = ('BUY', 'SELL')
+POSITIONS = ('LONG', 'SHORT')
+# OrderExecutor 的進出場原因 ('ENTER' / 'Exit Long' / 'Exit Short') 與其他引擎的平倉原因
+REASONS = ('ENTER', 'Exit Long', 'Exit Short', 'SIGNAL', 'TAKE_PROFIT', 'STOP_LOSS', 'END')
+
+# 欄位定義：(名稱, 型態)；型態為 'time' (int64 毫秒)、列舉值的 tuple (int8 代碼) 或 numpy dtype 字串
+ORDER_FIELDS = [('timestamp', 'time'), ('side', SIDES), ('quantity', 'f8'), ('price', 'f8'), ('position', POSITIONS),
+                ('reason', REASONS), ('profit_or_loss', 'f8'), ('gross_pnl', 'f8'), ('fee', 'f8'), ('turnover', 'f8')]
+ROUND_TRIP_FIELDS = [('entry_time', 'time'), ('exit_time', 'time'), ('position', POSITIONS), ('reason', REASONS),
+                     ('quantity', 'f8'), ('entry_price', 'f8'), ('exit_price', 'f8'), ('entry_fee', 'f8'),
+                     ('exit_fee', 'f8'), ('pnl', 'f8')]
+
+# 沒有值的時間 (以 datetime64 解讀時為 NaT)
+NAT = np.iinfo(np.int64).min
+
+
+def _time_ms(value):
+    """單一時間值轉為毫秒 (數字視為毫秒，None 為 NaT)"""
+    if value is None:
+        return NAT
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    return to_epoch_ms(value)
+
+
+class Ledger:
+    """
+    以 structured array 存放的交易紀錄，欄位由 fields 定義 (例如 ORDER_FIELDS / ROUND_TRIP_FIELDS)
+    len(ledger) 為筆數，ledger.records 為已寫入部分的 view
+    """
+
+    def __init__(self, fields, capacity=1024):
+        """
+        :param fields: [(名稱, 型態), ...]，型態為 'time'、列舉值的 tuple 或 numpy dtype 字串
+        :param capacity: 初始容量 (筆)
+        """
+        self.fields = list(fields)
+        self.names = [name for name, _ in self.fields]
+        self.labels = {name: kind for name, kind in self.fields if isinstance(kind, tuple)}
+        self._codes = {name: {label: code for code, label in enumerate(labels)} for name, labels in self.labels.items()}
+        self._times = [j for j, (_, kind) in enumerate(self.fields) if kind == 'time']
+        self._enums = [(j, self._codes[name]) for j, (name, kind) in enumerate(self.fields) if isinstance(kind, tuple)]
+        self.dtype = np.dtype([(name, 'i8' if kind == 'time' else 'i1' if isinstance(kind, tuple) else kind)
+                               for name, kind in self.fields])
+        # append 以關鍵字指定時，未給的欄位：時間為 NaT、列舉為 -1 (NaN)、浮點數為 NaN、整數為 0
+        self._defaults = [NAT if kind == 'time' else -1 if isinstance(kind, tuple) else
+                          np.nan if np.dtype(kind).kind == 'f' else 0 for _, kind in self.fields]
+        self._data = np.empty(max(int(capacity), 1), dtype=self.dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"Ledger({self._size:,} rows, {', '.join(self.names)})"
+
+    @property
+    def records(self):
+        """已寫入的紀錄 (structured array 的 view)"""
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        return self._size * self.dtype.itemsize
+
+    def _reserve(self, n):
+        if self._size + n > len(self._data):
+            data = np.empty(max(2 * len(self._data), self._size + n), dtype=self.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, *values, **named):
+        """
+        加入一筆紀錄：依欄位順序的位置參數，或以欄位名稱指定 (未給的欄位為空值)
+        時間可為毫秒數或 Timestamp / datetime64 / 字串，列舉欄位為列舉值 (例如 'BUY')
+        """
+        if named:
+            values = [named.pop(name, default) for name, default in zip(self.names, self._defaults)]
+            if named:
+                raise KeyError(f"Unknown ledger fields: {', '.join(named)}")
+        else:
+            values = list(values)
+        for j in self._times:
+            values[j] = _time_ms(values[j])
+        for j, codes in self._enums:
+            value = values[j]
+            values[j] = -1 if value is None else value if isinstance(value, (int, np.integer)) else codes[value]
+        if self._size == len(self._data):
+            self._reserve(1)
+        self._data[self._size] = tuple(values)
+        self._size += 1
+
+    def extend(self, **columns):
+        """
+        一次加入多筆 (各欄位為等長的 array / Series / list，未給的欄位為空值)
+        :return: 加入的筆數
+        """
+        unknown = set(columns) - set(self.names)
+        if unknown:
+            raise KeyError(f"Unknown ledger fields: {', '.join(sorted(unknown))}")
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns passed to extend() must have the same length")
+        n = lengths.pop() if lengths else 0
+        self._reserve(n)
+        block = self._data[self._size:self._size + n]
+        for (name, kind), default in zip(self.fields, self._defaults):
+            if name not in columns:
+                block[name] = default
+            elif kind == 'time':
+                block[name] = to_epoch_ms_array(columns[name])
+            elif isinstance(kind, tuple):
+                import pandas as pd
+                block[name] = pd.Categorical(columns[name], categories=list(kind)).codes
+            else:
+                block[name] = columns[name]
+        self._size += n
+        return n
+
+    def clear(self):
+        """清空紀錄 (保留已配置的容量)，例如分塊輸出時每個區塊寫出後呼叫"""
+        self._size = 0
+
+    def column(self, name, decode=False):
+        """
+        單一欄位 (view，不複製)
+        :param decode: 時間轉為 datetime64[ms]、列舉轉為 Categorical
+        """
+        values = self.records[name]
+        if not decode:
+            return values
+        kind = dict(self.fields)[name]
+        if kind == 'time':
+            return values.view('datetime64[ms]')
+        if isinstance(kind, tuple):
+            import pandas as pd
+            return pd.Categorical.from_codes(values, categories=list(kind), validate=False)
+        return values
+
+    def _select(self, columns):
+        if columns is None:
+            return {name: name for name in self.names}
+        if isinstance(columns, dict):
+            return dict(columns)
+        return {name: name for name in columns}
+
+    def to_frame(self, columns=None, start=0):
+        """
+        轉為 DataFrame，數值與時間欄位直接引用 ledger 的記憶體 (不複製)
+        :param columns: 欄位 list，或 {欄位: 輸出欄名} 的 dict (選取並改名)；None 為全部
+        :param start: 從第 start 筆開始 (例如只輸出新加入的紀錄)
+        """
+        import pandas as pd
+
+        data = {}
+        for name, output in self._select(columns).items():
+            values = self.column(name, decode=True)
+            data[output] = values[start:]
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self, columns=None):
+        """
+        轉為 pyarrow.Table：時間為 timestamp('ms')、列舉為 dictionary 型態
+        (Arrow 的欄位需要連續記憶體，structured array 的每個欄位各複製一次)
+        """
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("Exporting a ledger to Arrow requires pyarrow (pip install pyarrow)") from e
+
+        kinds = dict(self.fields)
+        arrays, names = [], []
+        for name, output in self._select(columns).items():
+            values = np.ascontiguousarray(self.records[name])
+            kind = kinds[name]
+            if kind == 'time':
+                array = pa.array(values, type=pa.int64(), mask=values == NAT).cast(pa.timestamp('ms'))
+            elif isinstance(kind, tuple):
+                array = pa.DictionaryArray.from_arrays(pa.array(values, mask=values < 0), pa.array(list(kind)))
+            else:
+                array = pa.array(values)
+            arrays.append(array)
+            names.append(output)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def stats(self, pnl='pnl', where=None, entry_time='entry_time', exit_time='exit_time'):
+        """
+        每筆交易的統計 (trade_stats)
+        :param pnl: 損益欄位
+        :param where: 只統計這些紀錄的 bool array (例如 OrderExecutor 只取平倉紀錄)
+        :param entry_time / exit_time: 進出場時間欄位 (兩者都存在時計算平均持有時間)
+        """
+        records = self.records if where is None else self.records[np.asarray(where, dtype=bool)]
+        holding = None
+        if entry_time in self.names and exit_time in self.names:
+            entry, exit = records[entry_time], records[exit_time]
+            holding = np.where((entry == NAT) | (exit == NAT), np.nan, (exit - entry).astype(np.float64))
+        return trade_stats(records[pnl], holding)
+
+
+def trade_stats(pnl, holding_ms=None):
+    """
+    每筆交易損益的統計
+    :param pnl: 每筆交易的損益 array
+    :param holding_ms: 每筆交易的持有時間 (毫秒，NaN 為未知)，None 為不計算
+    :return: dict
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    wins, losses = pnl > 0, pnl < 0
+    gross_win, gross_loss = float(pnl[wins].sum()), float(-pnl[losses].sum())
+
+    # 最長連續虧損筆數：虧損區段的起點與終點相減
+    edges = np.diff(np.concatenate(([0], losses.astype(np.int8), [0])))
+    streaks = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+    n = len(pnl)
+    stats = {
+        'trades': n,
+        'wins': int(wins.sum()),
+        'losses': int(losses.sum()),
+        'win_rate': float(wins.mean()) if n else 0.0,
+        'total_pnl': float(pnl.sum()),
+        'avg_pnl': float(pnl.mean()) if n else 0.0,
+        'avg_win': gross_win / int(wins.sum()) if wins.any() else 0.0,
+        'avg_loss': -gross_loss / int(losses.sum()) if losses.any() else 0.0,
+        'profit_factor': gross_win / gross_loss if gross_loss > 0 else float('inf') if gross_win > 0 else 0.0,
+        'max_win': float(pnl.max()) if n else 0.0,
+        'max_loss': float(pnl.min()) if n else 0.0,
+        'max_consecutive_losses': int(streaks.max()) if len(streaks) else 0,
+    }
+    if holding_ms is not None:
+        holding_ms = np.asarray(holding_ms, dtype=np.float64)
+        valid = ~np.isnan(holding_ms)
+        stats['avg_holding_hours'] = float(holding_ms[valid].mean() / 3_600_000) if valid.any() else 0.0
+    return stats
@@ -0,0 +1,239 @@
+"""
+統一的 CSV 載入器。
+
+- 只讀取需要的欄位 (usecols)
+- 依欄位名稱套用明確的 dtype：價格與會寫回檔案的數值維持 float64，
+  成交紀錄中不參與損益計算的數量欄位用 float32，旗標用 bool，symbol 用 category，
+  時間欄位轉為 int64 毫秒 (或 datetime64，供需要寫回原格式的腳本使用)
+- 預設以 C 引擎解析 (搭配 usecols 與明確 dtype，不產生 object 欄位)，可選用 pyarrow 引擎
+- 解析結果以欄式格式快取在 CSV 旁的 .backtest_sim_cache/，CSV 未變動時直接讀取快取，不再解析文字
+- 每次載入記錄相較於預設 pd.read_csv 的記憶體節省 (logger 'backtest_sim.loaders'，以及 df.attrs['load_report'])
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from .columnar import ColumnarWriter, is_columnar, read_columnar, read_schema
+from .timeutil import to_epoch_ms_array
+
+logger = logging.getLogger('backtest_sim.loaders')
+
+CACHE_DIR = '.backtest_sim_cache'
+
+# 'time' 表示時間欄位 (毫秒整數或日期字串)
+COLUMN_TYPES = {
+    # K 線 (Binance 12 欄與各專案輸出)
+    'Open time': 'time',
+    'Close time': 'time',
+    'timestamp': 'time',
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Volume': 'float64',
+    'Quote asset volume': 'float64',
+    'Number of trades': 'int64',
+    'Taker buy base asset volume': 'float64',
+    'Taker buy quote asset volume': 'float64',
+    'Symbol': 'category',
+    # 成交紀錄
+    'trade Id': 'int64',
+    'price': 'float64',
+    'qty': 'float32',
+    'quoteQty': 'float32',
+    'time': 'time',
+    'isBuyerMaker': 'bool',
+    'isBestMatch': 'bool',
+    'symbol': 'category',
+    # 因子與訊號
+    'direction': 'int8',
+    'signal': 'int8',
+    'Signal': 'int8',
+}
+
+LOAD_REPORTS = []
+
+
+def _header(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _source_key(path, columns, types, time_as, engine):
+    st = os.stat(path)
+    payload = json.dumps([os.path.abspath(path), st.st_size, st.st_mtime_ns, columns, types, time_as, engine])
+    return hashlib.blake2b(payload.encode(), digest_size=10).hexdigest()
+
+
+def _cache_path(path, key):
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    return os.path.join(directory, f"{os.path.basename(path)}.{key}")
+
+
+def _to_time(values, time_as):
+    """時間欄位轉為 int64 毫秒 ('epoch') 或 datetime64 ('datetime')"""
+    if values.dtype.kind in 'iuf':
+        if time_as == 'epoch':
+            return values.astype('int64')
+        return pd.to_datetime(values, unit='ms')
+    if time_as == 'epoch':
+        return pd.Series(to_epoch_ms_array(values), index=values.index, name=values.name)
+    if values.dtype.kind != 'M':
+        values = pd.to_datetime(values, format='ISO8601')
+    return values
+
+
+def _to_bool(values):
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind in 'iuf':
+        return values.astype(bool)
+    return values.astype(str).str.lower().isin(['true', '1'])
+
+
+def _parse(path, columns, types, time_as, engine):
+    # 'float64' 欄位交給引擎推斷：整數資料維持 int64，寫回 CSV 時格式不變
+    dtype = {c: t for c, t in types.items() if t not in ('time', 'bool', 'float64')}
+    if engine == 'c':
+        # C 引擎可直接把 True / False 字串解析成 bool
+        dtype.update({c: 'bool' for c, t in types.items() if t == 'bool'})
+    df = pd.read_csv(path, usecols=columns, dtype=dtype, engine=engine)
+    if columns is not None:
+        df = df[columns]
+    for name, kind in types.items():
+        if kind == 'time':
+            df[name] = _to_time(df[name], time_as)
+        elif kind == 'bool':
+            df[name] = _to_bool(df[name])
+    return df
+
+
+def _naive_bytes(path, rows, sample_rows=2000):
+    """以預設 pd.read_csv 讀取前幾列，推估全檔以預設方式載入的記憶體用量"""
+    sample = pd.read_csv(path, nrows=sample_rows)
+    if len(sample) == 0:
+        return 0
+    return int(sample.memory_usage(deep=True, index=False).sum() / len(sample) * rows)
+
+
+def load_csv(path, columns=None, dtypes=None, time_as='epoch', engine='c', cache=True, report=True):
+    """
+    以精簡 dtype 與欄位投影載入 CSV
+    :param path: CSV 路徑；也可以是欄式資料夾 (直接讀取，不經過快取)
+    :param columns: 只讀取這些欄位，None 為全部
+    :param dtypes: 覆寫 COLUMN_TYPES 的 {欄位: dtype}，dtype 可為 'time' / 'bool' / 'category' / numpy dtype 名稱
+    :param time_as: 'epoch' 轉成 int64 毫秒，'datetime' 轉成 datetime64 (寫回 CSV 時維持原格式)
+    :param engine: 'c' (預設，浮點數解析結果與 pd.read_csv 相同、峰值記憶體最低) 或 'pyarrow' (多執行緒，較快但暫存記憶體較大)
+    :param cache: 是否使用 / 建立欄式快取
+    :param report: 是否計算並記錄記憶體節省
+    :return: DataFrame，df.attrs['load_report'] 為載入報告
+    """
+    if time_as not in ('epoch', 'datetime'):
+        raise ValueError(f"time_as must be 'epoch' or 'datetime', got {time_as!r}")
+    start = time.perf_counter()
+    if is_columnar(path):
+        return _load_columnar(path, columns, dtypes, time_as, start)
+    header = _header(path)
+    if columns is not None:
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise KeyError(f"{path}: missing columns {missing}")
+    selected = list(columns) if columns is not None else header
+    overrides = dtypes or {}
+    types = {c: overrides.get(c, COLUMN_TYPES.get(c)) for c in selected}
+    types = {c: t for c, t in types.items() if t is not None}
+
+    cached = False
+    cache_path = None
+    if cache:
+        cache_path = _cache_path(path, _source_key(path, selected, types, time_as, engine))
+        if is_columnar(cache_path):
+            df = read_columnar(cache_path)
+            cached = True
+    if not cached:
+        df = _parse(path, columns and selected, types, time_as, engine)
+        if cache:
+            _write_cache(df, cache_path)
+
+    elapsed = time.perf_counter() - start
+    info = {'path': path, 'rows': len(df), 'columns': len(df.columns), 'seconds': elapsed, 'cached': cached}
+    if report:
+        info['bytes'] = int(df.memory_usage(deep=True, index=False).sum())
+        info['naive_bytes'] = _naive_bytes(path, len(df))
+        info['saving'] = info['naive_bytes'] / info['bytes'] if info['bytes'] else float('nan')
+        logger.info(
+            f"{os.path.basename(path)}: {info['rows']:,} rows x {info['columns']} cols, "
+            f"{info['bytes'] / 2**20:.1f} MB (default read_csv {info['naive_bytes'] / 2**20:.1f} MB, "
+            f"{info['saving']:.1f}x smaller), {elapsed * 1000:.0f} ms{' [cache]' if cached else ''}"
+        )
+    LOAD_REPORTS.append(info)
+    df.attrs['load_report'] = info
+    return df
+
+
+def _load_columnar(path, columns, dtypes, time_as, start):
+    """讀取已正規化的欄式資料夾 (例如 Pair_Trading/Preprocess 的輸出)，時間欄位已是毫秒數"""
+    names = list(read_schema(path)['columns'])
+    if columns is not None:
+        missing = [c for c in columns if c not in names]
+        if missing:
+            raise KeyError(f"{path}: missing columns {missing}")
+    df = read_columnar(path, columns=list(columns) if columns is not None else None)
+    overrides = dtypes or {}
+    for name in df.columns:
+        if overrides.get(name, COLUMN_TYPES.get(name)) == 'time':
+            df[name] = _to_time(df[name], time_as)
+    info = {'path': path, 'rows': len(df), 'columns': len(df.columns),
+            'seconds': time.perf_counter() - start, 'cached': True,
+            'bytes': int(df.memory_usage(deep=True, index=False).sum())}
+    logger.info(f"{os.path.basename(path)}: {info['rows']:,} rows x {info['columns']} cols, "
+                f"{info['bytes'] / 2**20:.1f} MB, {info['seconds'] * 1000:.0f} ms [columnar]")
+    LOAD_REPORTS.append(info)
+    df.attrs['load_report'] = info
+    return df
+
+
+def _cacheable(df):
+    """欄式格式無法完整保存 object 欄位的缺值與帶時區的時間，這類結果不快取"""
+    for dtype in df.dtypes:
+        if dtype == object or getattr(dtype, 'tz', None) is not None:
+            return False
+    return True
+
+
+def _write_cache(df, cache_path):
+    """寫入欄式快取；快取失敗 (例如唯讀目錄) 不影響載入"""
+    if not _cacheable(df):
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = cache_path + '.tmp'
+        with ColumnarWriter(tmp) as writer:
+            writer.write(df)
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write load cache {cache_path}: {e}")
+
+
+def load_klines(path, columns=None, time_as='epoch', **kwargs):
+    """載入 K 線 CSV (Binance 12 欄或 klines_BTC.csv 格式)"""
+    return load_csv(path, columns=columns, time_as=time_as, **kwargs)
+
+
+def load_trades(path, columns=('time', 'price', 'isBestMatch', 'symbol'), **kwargs):
+    """載入成交紀錄 CSV，預設只讀取回測需要的欄位"""
+    return load_csv(path, columns=list(columns) if columns is not None else None, **kwargs)
+
+
+def memory_saving(df_compact, df_default):
+    """兩個 DataFrame 的記憶體比值 (預設 / 精簡)"""
+    a = df_default.memory_usage(deep=True, index=False).sum()
+    b = df_compact.memory_usage(deep=True, index=False).sum()
+    return a / b if b else np.nan
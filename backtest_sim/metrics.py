@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def equity_curve(pnl, initial_balance=10000):
+    """
+    由每根 K 線 (或每筆交易) 的損益計算累積資產曲線
+    :param pnl: 損益序列 (array-like)，NaN 視為 0
+    :param initial_balance: 初始資金
+    :return: numpy array，累積資產
+    """
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=np.float64))
+    return np.cumsum(pnl) + initial_balance
+
+
+def drawdown(equity):
+    """
+    計算回撤序列 (相對於歷史高點的比例)
+    :param equity: 累積資產曲線
+    :return: (peak, drawdown) 兩個 numpy array
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    peak = np.maximum.accumulate(equity)
+    return peak, (equity - peak) / peak
+
+
+def summary_metrics(pnl, initial_balance=10000, periods_per_year=252):
+    """
+    計算回測績效指標，公式與各專案 plot_result 相同：
+      - Final Balance：累積損益加上初始資金
+      - Sharpe Ratio：pnl / initial_balance 的平均除以標準差，年化 sqrt(periods_per_year)
+      - Max Drawdown：相對歷史高點的最大跌幅
+      - Win Ratio：獲利筆數 / 非零損益筆數
+    :param pnl: 損益序列 (array-like)
+    :param initial_balance: 初始資金
+    :param periods_per_year: 年化使用的期數
+    :return: dict
+    """
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=np.float64))
+    equity = equity_curve(pnl, initial_balance)
+    _, dd = drawdown(equity)
+
+    returns = pnl / initial_balance
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    sharpe_ratio = returns.mean() / (std + 1e-8) * np.sqrt(periods_per_year) if len(returns) else 0.0
+
+    total_trades = int((pnl != 0).sum())
+    winning_trades = int((pnl > 0).sum())
+    win_ratio = winning_trades / total_trades if total_trades > 0 else 0
+
+    return {
+        'final_balance': float(equity[-1]) if len(equity) else float(initial_balance),
+        'sharpe_ratio': float(sharpe_ratio),
+        'max_drawdown': float(dd.min()) if len(dd) else 0.0,
+        'win_ratio': float(win_ratio),
+        'winning_trades': winning_trades,
+        'total_trades': total_trades,
+    }
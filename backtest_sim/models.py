@@ -0,0 +1,205 @@
+"""
+ML_CTA 的模型登錄與預測快取。
+
+add_alphas.py 每次執行都從頭訓練 XGBoost，即使特徵與超參數都沒有改變；只調整
+get_direction 的 threshold 或 backtest.py 的 ATR 倍數也要重新訓練。這裡以
+(特徵欄位, 訓練資料雜湊, 超參數, N) 作為模型的 key：
+    <root>/<key>/model.ubj              訓練好的 booster
+    <root>/<key>/meta.json              特徵、超參數、N、訓練筆數與訓練時間
+    <root>/<key>/predictions/<X 雜湊>.npy  對某份特徵矩陣的 Predicted_Return
+相同的訓練資料與設定直接載入模型；對相同的特徵矩陣直接讀取預測值，新的 K 線則以已存的模型推論。
+
+預設存放在目前目錄的 .backtest_sim_cache/models，可用環境變數 BACKTEST_SIM_MODELS 指定路徑，
+設為 0 則停用快取 (每次重新訓練)。
+
+用法：
+    python -m backtest_sim.models list --root ML_CTA/.backtest_sim_cache/models
+    python -m backtest_sim.models clear --root ML_CTA/.backtest_sim_cache/models
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROOT = os.path.join('.backtest_sim_cache', 'models')
+
+
+def frame_hash(*frames):
+    """DataFrame / Series / array 內容 (含欄位名稱與 dtype) 的雜湊"""
+    h = hashlib.sha1()
+    for frame in frames:
+        if isinstance(frame, pd.DataFrame):
+            h.update(json.dumps([str(c) for c in frame.columns]).encode())
+            arrays = [frame[c].to_numpy() for c in frame.columns]
+        elif isinstance(frame, pd.Series):
+            h.update(str(frame.name).encode())
+            arrays = [frame.to_numpy()]
+        else:
+            arrays = [np.asarray(frame)]
+        for values in arrays:
+            values = np.ascontiguousarray(values)
+            h.update(f"{values.dtype.str}{values.shape}".encode())
+            h.update(values.view(np.uint8) if values.dtype != object else repr(values.tolist()).encode())
+    return h.hexdigest()
+
+
+def model_key(features, data_hash, params, N):
+    """(特徵欄位, 訓練資料雜湊, 超參數, N) -> 模型 key"""
+    text = json.dumps({'features': list(features), 'data': data_hash, 'params': params, 'N': N},
+                      sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+def _atomic_save(path, values):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, values, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+class ModelRegistry:
+    """
+    以 key 保存 XGBoost 模型與預測值
+        registry = ModelRegistry()
+        model = registry.fit(key, lambda: train(...), meta)
+        y_pred = registry.predict(key, X, model)
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self._models = {}
+
+    def path(self, key, *parts):
+        return os.path.join(self.root, key, *parts)
+
+    def has(self, key):
+        return os.path.exists(self.path(key, 'meta.json'))
+
+    def meta(self, key):
+        with open(self.path(key, 'meta.json')) as f:
+            return json.load(f)
+
+    def keys(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(k for k in os.listdir(self.root) if self.has(k))
+
+    def load(self, key):
+        """載入已保存的模型 (同一個 process 內只讀一次)"""
+        if key not in self._models:
+            import xgboost as xgb
+
+            model = xgb.XGBRegressor()
+            model.load_model(self.path(key, 'model.ubj'))
+            self._models[key] = model
+        return self._models[key]
+
+    def save(self, key, model, meta):
+        """先寫到暫存資料夾，完整寫入後才改名，中斷時不會留下不完整的模型"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=f".{key}.")
+        model.save_model(os.path.join(tmp, 'model.ubj'))
+        os.makedirs(os.path.join(tmp, 'predictions'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, key=key, created=time.time()), f, indent=2, default=str)
+        try:
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # 其他 process 已經存好同一個 key
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._models[key] = model
+
+    def fit(self, key, train, meta=None):
+        """
+        取得 key 對應的模型，沒有時呼叫 train() 訓練並保存
+        :param train: 不帶參數、回傳已訓練模型的函式
+        :param meta: 一併保存的說明資料 (dict)
+        :return: (model, 是否為新訓練)
+        """
+        if self.has(key):
+            return self.load(key), False
+        start = time.perf_counter()
+        model = train()
+        self.save(key, model, dict(meta or {}, train_seconds=time.perf_counter() - start))
+        return model, True
+
+    def predict(self, key, X, model=None):
+        """
+        模型 key 對特徵矩陣 X 的預測值，相同的 X 直接讀取快取
+        :param model: 已載入的模型 (省略時從登錄載入)
+        :return: numpy array
+        """
+        path = self.path(key, 'predictions', frame_hash(X) + '.npy')
+        if os.path.exists(path):
+            return np.load(path)
+        y_pred = (model or self.load(key)).predict(X)
+        _atomic_save(path, y_pred)
+        return y_pred
+
+    def remove(self, key):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        self._models.pop(key, None)
+
+
+def default_registry():
+    """依 BACKTEST_SIM_MODELS 建立 ModelRegistry，設為 0 時回傳 None (不使用快取)"""
+    root = os.environ.get('BACKTEST_SIM_MODELS', DEFAULT_ROOT)
+    if root in ('', '0'):
+        return None
+    return ModelRegistry(root)
+
+
+def fit_xgboost(X_train, y_train, params, N, registry=None):
+    """
+    以 (特徵, 訓練資料, 超參數, N) 為 key 取得或訓練 XGBRegressor
+    :param params: XGBRegressor 的超參數 dict
+    :param registry: ModelRegistry，None 時每次重新訓練
+    :return: (model, key)，不使用登錄時 key 為 None
+    """
+    import xgboost as xgb
+
+    def train():
+        model = xgb.XGBRegressor(**params)
+        model.fit(X_train, y_train)
+        return model
+
+    if registry is None:
+        return train(), None
+    key = model_key(list(X_train.columns), frame_hash(X_train, y_train), params, N)
+    meta = {'features': list(X_train.columns), 'params': params, 'N': N, 'train_rows': len(X_train),
+            'xgboost': xgb.__version__}
+    model, _ = registry.fit(key, train, meta)
+    return model, key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ML_CTA model registry")
+    parser.add_argument('command', choices=['list', 'clear'])
+    parser.add_argument('--root', default=os.environ.get('BACKTEST_SIM_MODELS', DEFAULT_ROOT))
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.root)
+    keys = registry.keys()
+    if args.command == 'list':
+        for key in keys:
+            meta = registry.meta(key)
+            n_pred = len(os.listdir(registry.path(key, 'predictions')))
+            print(f"{key}  N={meta['N']} rows={meta['train_rows']:,} params={json.dumps(meta['params'])} "
+                  f"predictions={n_pred} trained={time.strftime('%Y-%m-%d %H:%M', time.localtime(meta['created']))}")
+        print(f"{len(keys)} models in {args.root}")
+    else:
+        for key in keys:
+            registry.remove(key)
+        print(f"Removed {len(keys)} models from {args.root}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+向量化的 OHLCV 彙總。
+
+把依時間排序的資料切成連續的區段 (bucket)，以 np.*.reduceat 一次算出每段的
+first / max / min / last / sum，不需要 groupby 或 Python 迴圈。
+K 線重取樣 (pyramid) 與成交紀錄轉 K 線 (bars) 共用這裡的函式。
+"""
+import numpy as np
+
+# 彙總時累加的欄位 (存在時才計算)
+SUM_COLUMNS = ['Volume', 'Quote asset volume', 'Number of trades',
+               'Taker buy base asset volume', 'Taker buy quote asset volume']
+
+
+def bucket_ids(times, interval_ms, origin=0):
+    """每筆資料所屬的時間區段編號 (對齊 origin，預設為 UTC epoch，與 Binance K 線的切分方式相同)"""
+    return (np.asarray(times, dtype=np.int64) - origin) // interval_ms
+
+
+def boundaries(keys):
+    """
+    已排序的 keys 中每個區段的起始位置
+    :return: int64 array，第一個元素為 0
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1)).astype(np.int64)
+
+
+def aggregate(starts, n, open=None, high=None, low=None, close=None, sums=None):
+    """
+    依區段起始位置彙總 OHLC 與累加欄位
+    :param starts: 各區段起始位置 (遞增，第一個為 0)
+    :param n: 資料總筆數
+    :param open / high / low / close: 對應的 array，None 的欄位不計算
+    :param sums: {欄位名稱: array}，每段加總
+    :return: dict
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    out = {}
+    if len(starts) == 0:
+        for name, values in (('Open', open), ('High', high), ('Low', low), ('Close', close)):
+            if values is not None:
+                out[name] = np.asarray(values)[:0]
+        for name, values in (sums or {}).items():
+            out[name] = np.asarray(values)[:0]
+        return out
+    ends = np.append(starts[1:], n) - 1
+    if open is not None:
+        out['Open'] = np.asarray(open)[starts]
+    if high is not None:
+        out['High'] = np.maximum.reduceat(np.asarray(high), starts)
+    if low is not None:
+        out['Low'] = np.minimum.reduceat(np.asarray(low), starts)
+    if close is not None:
+        out['Close'] = np.asarray(close)[ends]
+    for name, values in (sums or {}).items():
+        out[name] = np.add.reduceat(np.asarray(values), starts)
+    return out
+
+
+def resample(columns, interval_ms, time_column='Open time', origin=0):
+    """
+    把較細的 K 線彙總成較粗的時間間隔
+    :param columns: {欄位名稱: array} (或 DataFrame)，time_column 為毫秒數，需已排序
+    :param interval_ms: 目標間隔 (毫秒)
+    :return: {欄位名稱: array}，time_column 為每段的起始時間 (對齊 interval)
+    """
+    times = np.asarray(columns[time_column], dtype=np.int64)
+    ids = bucket_ids(times, interval_ms, origin)
+    starts = boundaries(ids)
+    names = columns.columns if hasattr(columns, 'columns') else columns.keys()
+    out = {time_column: ids[starts] * interval_ms + origin}
+    out.update(aggregate(starts, len(times),
+                         open=columns['Open'], high=columns['High'], low=columns['Low'], close=columns['Close'],
+                         sums={name: columns[name] for name in SUM_COLUMNS if name in names}))
+    return out
@@ -0,0 +1,254 @@
+"""
+策略參數的最佳化 (TPE，Tree-structured Parzen Estimator)。
+
+threshold1 / threshold2 / window_size、ML_CTA 的停利 / 停損 ATR 倍數與進場確認次數一起掃描時，
+格點數量是各參數候選值數量的乘積，全部回測不切實際。這裡改為逐批提出參數：
+    1. 前 n_startup 組在格點上隨機抽樣
+    2. 之後依目標值把已評估的參數分為前 gamma (好) 與其餘 (差)，各參數分別以離散的 Parzen 密度估計 l(x) / g(x)，
+       從 l(x) 抽樣候選，選 l(x) / g(x) 最大且尚未評估的一批
+每一批以 jobs.run_job 平行回測 (與 sweep / walk-forward 使用相同的 task 與 checkpoint)。
+每次評估以 (task, 參數) 的雜湊 (jobs.unit_id) 存在 checkpoint 資料夾：
+    - 參數只取格點上的值，相近的提議落在同一點，重複的提議不會再回測
+    - 重新執行或擴大 trials 時，之前已完成的格點直接讀取結果，並作為 TPE 的觀測值
+
+用法：
+    python -m backtest_sim.optimize statistic --klines Statistic_CTA/klines_BTC.csv \\
+        --param window_size=12:240:12 --param threshold1=1:8:0.25 --param threshold2=0.5:5:0.25 \\
+        --trials 80 --batch 8 --workers 4 --store .backtest_sim_cache/optimize
+    python -m backtest_sim.optimize ml_fold --klines ML_CTA/klines_BTC.csv \\
+        --set train_start=0 --set train_end=4000 --set test_end=7000 \\
+        --param take_profit_atr=3:15:1 --param stop_loss_atr=1:6:0.5 --param confirm=0:8:1 --param threshold=0.01:0.2:0.01
+"""
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from .jobs import TASKS, CheckpointStore, parse_values, run_job, unit_id
+
+
+class TPE:
+    """
+    離散格點上的 TPE：每個參數為一組有序的候選值，以候選值的位置 (index) 估計密度
+        tpe = TPE({'window_size': [12, 24, 48], 'threshold1': [3, 4, 5]})
+        for index in tpe.ask(8):
+            tpe.tell(index, score(tpe.params(index)))     # 目標值越大越好
+    """
+
+    def __init__(self, space, gamma=0.25, n_startup=None, n_candidates=128, seed=None):
+        """
+        :param space: {參數名稱: 候選值 list}
+        :param gamma: 視為「好」的觀測值比例
+        :param n_startup: 開始建模前的隨機抽樣數，預設為 max(8, 2 × 參數數)
+        :param n_candidates: 每一批從 l(x) 抽樣的候選數量
+        """
+        self.names = list(space)
+        self.values = [list(v) for v in space.values()]
+        self.sizes = np.array([len(v) for v in self.values])
+        if (self.sizes == 0).any():
+            raise ValueError("Every parameter needs at least one candidate value")
+        self.gamma = gamma
+        self.n_startup = n_startup or max(8, 2 * len(self.names))
+        self.n_candidates = n_candidates
+        self.rng = np.random.default_rng(seed)
+        self.observed = {}
+
+    @property
+    def grid_size(self):
+        return int(np.prod(self.sizes.astype(float)))
+
+    def params(self, index):
+        return {name: values[i] for name, values, i in zip(self.names, self.values, index)}
+
+    def index(self, params):
+        """參數 dict -> 格點位置，不在格點上時回傳 None"""
+        try:
+            return tuple(values.index(params[name]) for name, values in zip(self.names, self.values))
+        except (KeyError, ValueError):
+            return None
+
+    def tell(self, index, value):
+        """記錄一個評估結果 (失敗或 NaN 視為最差)"""
+        value = float(value) if value is not None else -math.inf
+        self.observed[tuple(index)] = value if not math.isnan(value) else -math.inf
+
+    def best(self):
+        index = max(self.observed, key=self.observed.get)
+        return self.params(index), self.observed[index]
+
+    def _random(self, n, taken):
+        out = []
+        for _ in range(n * 20):
+            if len(out) == n or len(taken) + len(out) >= self.grid_size:
+                break
+            index = tuple(int(i) for i in self.rng.integers(0, self.sizes))
+            if index not in taken and index not in out:
+                out.append(index)
+        return out
+
+    def _pmf(self, points, size, n_total):
+        """一個參數的離散 Parzen 密度：各觀測點的高斯核 + 均勻先驗 (權重與一個觀測點相同)"""
+        grid = np.arange(size)
+        if len(points) == 0:
+            return np.full(size, 1.0 / size)
+        bandwidth = max(0.5, size * n_total ** -0.2 / 4)
+        kernels = np.exp(-0.5 * ((grid[None, :] - np.asarray(points)[:, None]) / bandwidth) ** 2)
+        kernels /= kernels.sum(axis=1, keepdims=True)
+        pmf = kernels.sum(axis=0) + 1.0 / size
+        return pmf / pmf.sum()
+
+    def ask(self, n):
+        """
+        提出 n 組尚未評估的格點位置 (格點用完時較少)
+        :return: list of tuple
+        """
+        taken = set(self.observed)
+        if len(taken) < self.n_startup:
+            return self._random(n, taken)
+
+        ranked = sorted(self.observed, key=self.observed.get, reverse=True)
+        n_good = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good, bad = np.array(ranked[:n_good]), np.array(ranked[n_good:] or ranked[-1:])
+        candidates = np.empty((self.n_candidates, len(self.names)), dtype=np.int64)
+        score = np.zeros(self.n_candidates)
+        for d, size in enumerate(self.sizes):
+            l = self._pmf(good[:, d], size, len(ranked))
+            g = self._pmf(bad[:, d], size, len(ranked))
+            candidates[:, d] = self.rng.choice(size, size=self.n_candidates, p=l)
+            score += np.log(l[candidates[:, d]]) - np.log(g[candidates[:, d]])
+
+        out = []
+        for i in np.argsort(-score, kind='stable'):
+            index = tuple(int(x) for x in candidates[i])
+            if index not in taken and index not in out:
+                out.append(index)
+                if len(out) == n:
+                    break
+        # 候選都已評估過時以隨機抽樣補足
+        return out + self._random(n - len(out), taken | set(out))
+
+
+def _metric(record, metric, minimize):
+    value = record['result'].get(metric) if record else None
+    if value is None:
+        return None
+    return -value if minimize else value
+
+
+def optimize(task_name, space, fixed=None, store='.backtest_sim_cache/optimize', metric='sharpe_ratio',
+             minimize=False, trials=64, batch=8, workers=1, seed=0, verbose=True, **tpe_kw):
+    """
+    以 TPE 搜尋 task 的參數
+    :param task_name: jobs.TASKS 中的名稱 ('statistic' / 'ml_fold')
+    :param space: {參數名稱: 候選值 list}
+    :param fixed: 每次評估都相同的參數 (例如 klines、fold 區間)
+    :param store: CheckpointStore 或資料夾路徑 (評估結果的快取)
+    :param metric: task 結果中的目標欄位
+    :param minimize: 目標值越小越好
+    :param trials: 最多新回測的次數 (快取中已有的結果不計)
+    :param batch: 每一批平行評估的數量
+    :return: dict，'best_params'、'best'、'evaluations'、'cached'、'grid_size'、'history'
+    """
+    if task_name not in TASKS:
+        raise ValueError(f"Unknown task: {task_name} (choose from {', '.join(sorted(TASKS))})")
+    fixed = dict(fixed or {})
+    store = store if isinstance(store, CheckpointStore) else CheckpointStore(store)
+    tpe = TPE(space, seed=seed, **tpe_kw)
+
+    # 之前的執行已評估過的格點直接作為觀測值
+    cached = 0
+    for record in store.records(task_name):
+        params = record['params']
+        index = tpe.index(params)
+        if index is not None and all(params.get(k) == v for k, v in fixed.items()) \
+                and len(params) == len(fixed) + len(space):
+            tpe.tell(index, _metric(record, metric, minimize))
+            cached += 1
+
+    history = []
+    evaluations = 0
+    start = time.perf_counter()
+    while evaluations < trials:
+        indexes = tpe.ask(min(batch, trials - evaluations))
+        if not indexes:
+            break
+        param_list = [dict(fixed, **tpe.params(index)) for index in indexes]
+        summary = run_job(task_name, param_list, store, workers=workers, verbose=False)
+        evaluations += summary['completed'] + summary['failed']
+        for index, params in zip(indexes, param_list):
+            uid = unit_id(task_name, params)
+            value = _metric(store.get(uid), metric, minimize) if store.has(uid) else None
+            tpe.tell(index, value)
+            history.append({'params': tpe.params(index), metric: None if value is None else
+                            (-value if minimize else value)})
+        best_params, best = tpe.best()
+        if verbose:
+            print(f"  {evaluations:,}/{trials:,} evaluations ({len(tpe.observed):,} of {tpe.grid_size:,} grid points, "
+                  f"{time.perf_counter() - start:.0f}s): best {metric} {-best if minimize else best:.4f} "
+                  f"at {json.dumps(best_params)}")
+
+    if not tpe.observed:
+        raise ValueError("Nothing was evaluated")
+    best_params, best = tpe.best()
+    return {'best_params': best_params, 'best': -best if minimize else best, 'evaluations': evaluations,
+            'cached': cached, 'grid_size': tpe.grid_size, 'history': history}
+
+
+def parse_space(items):
+    """['window_size=12:240:12', 'threshold1=1,2,4'] -> {名稱: 候選值}，全部為整數時以 int 解析"""
+    space = {}
+    for item in items:
+        name, _, text = item.partition('=')
+        numbers = text.replace(':', ',').split(',')
+        if all(x.lstrip('-').isdigit() for x in numbers if x):
+            space[name] = parse_values(text, int)
+        else:
+            # np.arange 的浮點誤差 (例如 0.30000000000000004) 不帶進參數與快取的 key
+            space[name] = [round(v, 10) for v in parse_values(text)]
+    return space
+
+
+def parse_fixed(items):
+    """['train_end=4000', 'start=2024-03-01'] -> dict，可解析為 JSON 的值 (數字) 以 JSON 解析"""
+    fixed = {}
+    for item in items:
+        name, _, text = item.partition('=')
+        try:
+            fixed[name] = json.loads(text)
+        except ValueError:
+            fixed[name] = text
+    return fixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TPE search over strategy parameters (cached, parallel batches)")
+    parser.add_argument('task', choices=sorted(TASKS))
+    parser.add_argument('--klines', required=True)
+    parser.add_argument('--param', action='append', default=[], help="searched parameter, e.g. threshold1=1:8:0.25")
+    parser.add_argument('--set', action='append', default=[], help="fixed parameter, e.g. train_end=4000")
+    parser.add_argument('--metric', default='sharpe_ratio')
+    parser.add_argument('--minimize', action='store_true')
+    parser.add_argument('--trials', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', default='.backtest_sim_cache/optimize', help="evaluation cache (checkpoint directory)")
+    args = parser.parse_args(argv)
+
+    space = parse_space(args.param)
+    if not space:
+        parser.error("at least one --param is required")
+    fixed = dict(parse_fixed(args.set), klines=args.klines)
+    result = optimize(args.task, space, fixed, args.store, metric=args.metric, minimize=args.minimize,
+                      trials=args.trials, batch=args.batch, workers=args.workers, seed=args.seed)
+    print(f"Best {args.metric}: {result['best']:.4f} at {json.dumps(result['best_params'])}")
+    print(f"{result['evaluations']:,} new + {result['cached']:,} cached evaluations "
+          f"of {result['grid_size']:,} grid points")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""
+Paper trading：以 asyncio 接收 K 線串流，逐根更新因子、判斷方向並送單給模擬的 OrderExecutor。
+
+- 串流來源：replay() 直接重播 DataFrame，或 serve_replay() / tcp_bars() 經由本機 TCP
+  (每行一根 JSON K 線) 模擬真實的網路訂閱
+- 因子：StatisticFactors (滾動平均 / 標準差 / ATR) 與 GammaDecayFactors (ML_CTA 的 gamma decay 因子)
+  以固定長度的環狀緩衝區逐根更新，不重算整段歷史
+- 規則：DirectionRule 與 Statistic_CTA get_direction 相同；ThresholdRule 與 ML_CTA get_direction 相同
+- 延遲：每根 K 線從收到到送出委託的時間 (因子、規則、下單三段) 記錄成直方圖並回報 p50 / p99
+
+用法：
+    python -m backtest_sim.paper --klines Statistic_CTA/klines_BTC.csv --strategy statistic
+    python -m backtest_sim.paper --klines ML_CTA/klines_BTC.csv --strategy ml --train-bars 4000 --tcp
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+from .timeutil import to_epoch_ms
+
+logger = logging.getLogger('backtest_sim.paper')
+
+
+# ---------------------------------------------------------------------------
+# 串流
+# ---------------------------------------------------------------------------
+def _bar_records(df):
+    """DataFrame 轉為逐根的 dict，'Open time' 轉為毫秒數"""
+    columns = [c for c in ('Open time', 'Open', 'High', 'Low', 'Close', 'Volume') if c in df.columns]
+    times = df['Open time']
+    if times.dtype.kind not in 'iu':
+        from .timeutil import to_epoch_ms_array
+        times = to_epoch_ms_array(times)
+    values = {c: df[c].to_numpy(dtype=np.float64) for c in columns if c != 'Open time'}
+    for i in range(len(df)):
+        bar = {name: float(v[i]) for name, v in values.items()}
+        bar['Open time'] = int(times[i])
+        yield bar
+
+
+async def replay(df, speed=None, interval_ms=None):
+    """
+    重播 K 線 (收盤後才送出)
+    :param speed: None 為盡快送出；否則為相對真實時間的倍數 (例如 3600 表示 1 小時 K 線每秒一根)
+    :param interval_ms: speed 不為 None 時每根 K 線的時間長度
+    """
+    delay = (interval_ms / 1000 / speed) if speed and interval_ms else 0
+    for bar in _bar_records(df):
+        yield bar
+        await asyncio.sleep(delay)
+
+
+async def serve_replay(df, host='127.0.0.1', port=0, speed=None, interval_ms=None):
+    """
+    在本機啟動 TCP 伺服器，每個連線收到完整的 K 線重播 (每行一根 JSON)，結束後關閉連線
+    :return: asyncio.Server，實際的 port 見 server.sockets[0].getsockname()[1]
+    """
+    async def handle(reader, writer):
+        try:
+            async for bar in replay(df, speed, interval_ms):
+                writer.write(json.dumps(bar).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+
+async def tcp_bars(host, port):
+    """連線到 serve_replay 的伺服器，逐根回傳 K 線 dict"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+# ---------------------------------------------------------------------------
+# 逐根更新的因子
+# ---------------------------------------------------------------------------
+class RollingWindow:
+    """固定長度的環狀緩衝區，values() 回傳依時間排序的連續 view (不複製)"""
+
+    def __init__(self, size):
+        self.size = size
+        self._buf = np.zeros(2 * size)
+        self._pos = 0
+        self.count = 0
+
+    def push(self, value):
+        # 同時寫入兩個位置，讓最近 size 筆永遠是 _buf 中的連續區段
+        self._buf[self._pos] = value
+        self._buf[self._pos + self.size] = value
+        self._pos = (self._pos + 1) % self.size
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    def values(self):
+        return self._buf[self._pos:self._pos + self.size]
+
+
+class _ATR:
+    """True Range 的滾動平均 (與 add_factors 的 ATR 相同)"""
+
+    def __init__(self, window_size):
+        self.tr = RollingWindow(window_size)
+        self.prev_close = None
+
+    def update(self, bar):
+        high, low = bar['High'], bar['Low']
+        if self.prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = bar['Close']
+        self.tr.push(tr)
+        return self.tr.values().mean() if self.tr.full else np.nan
+
+
+class StatisticFactors:
+    """Statistic_CTA add_factors 的逐根版本：Rolling_Mean_Close、Rolling_Std_Close (ddof=1)、ATR"""
+
+    def __init__(self, window_size=24):
+        self.close = RollingWindow(window_size)
+        self.atr = _ATR(window_size)
+
+    def update(self, bar):
+        self.close.push(bar['Close'])
+        factors = dict(bar)
+        if self.close.full:
+            x = self.close.values()
+            factors['Rolling_Mean_Close'] = x.mean()
+            factors['Rolling_Std_Close'] = x.std(ddof=1)
+        else:
+            factors['Rolling_Mean_Close'] = factors['Rolling_Std_Close'] = np.nan
+        factors['ATR'] = self.atr.update(bar)
+        return factors
+
+
+class GammaDecayFactors:
+    """ML_CTA add_factors 的逐根版本 (gamma decay 加權平均 / 標準差與 ATR)，逐根結果與批次計算相同"""
+
+    def __init__(self, window_size=150, gamma=0.8):
+        weights = np.array([gamma**i for i in range(window_size)])
+        self.weights = (weights / weights.sum())[::-1].copy()
+        self.close = RollingWindow(window_size)
+        self.atr = _ATR(window_size)
+
+    def update(self, bar):
+        self.close.push(bar['Close'])
+        factors = dict(bar)
+        if self.close.full:
+            x = self.close.values()
+            mean = np.dot(x, self.weights)
+            factors['Rolling_Mean_Close'] = mean
+            factors['Rolling_Std_Close'] = np.sqrt(np.dot(self.weights, (x - mean)**2))
+        else:
+            factors['Rolling_Mean_Close'] = factors['Rolling_Std_Close'] = np.nan
+        factors['ATR'] = self.atr.update(bar)
+        return factors
+
+
+# ---------------------------------------------------------------------------
+# 規則與策略
+# ---------------------------------------------------------------------------
+class DirectionRule:
+    """Statistic_CTA get_direction 的逐根版本 (趨勢狀態在 K 線之間延續)"""
+
+    def __init__(self, threshold1=4.5, threshold2=2):
+        self.threshold1 = threshold1
+        self.threshold2 = threshold2
+        self.trend = 0
+
+    def update(self, close, mean, std):
+        t1, t2 = self.threshold1, self.threshold2
+        if close > mean + t1 * std:
+            self.trend = -2
+        elif close < mean - t1 * std:
+            self.trend = -2
+        elif mean + t2 * std < close < mean + t1 * std:
+            self.trend = -1
+        elif mean - t1 * std < close < mean - t2 * std:
+            self.trend = 1
+        return self.trend
+
+
+class ThresholdRule:
+    """ML_CTA get_direction：預測報酬超過 ±threshold 時做多 / 做空"""
+
+    def __init__(self, threshold=0.05):
+        self.threshold = threshold
+
+    def update(self, predicted):
+        if predicted > self.threshold:
+            return 1
+        if predicted < -self.threshold:
+            return -1
+        return 0
+
+
+class StatisticStrategy:
+    name = 'statistic'
+
+    def __init__(self, window_size=24, threshold1=4.5, threshold2=2):
+        self.factors = StatisticFactors(window_size)
+        self.rule = DirectionRule(threshold1, threshold2)
+
+    def on_bar(self, bar):
+        f = self.factors.update(bar)
+        return self.rule.update(f['Close'], f['Rolling_Mean_Close'], f['Rolling_Std_Close'])
+
+
+class MLStrategy:
+    """以 XGBoost 模型預測每根 K 線的未來報酬 (特徵與 ML_CTA prepare_features 相同)"""
+    name = 'ml'
+    FEATURES = ['Open', 'High', 'Low', 'Close', 'Volume', 'Rolling_Std_Close', 'Rolling_Mean_Close', 'ATR']
+
+    def __init__(self, model, window_size=150, gamma=0.8, threshold=0.05):
+        self.booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        self.factors = GammaDecayFactors(window_size, gamma)
+        self.rule = ThresholdRule(threshold)
+        self._x = np.empty((1, len(self.FEATURES)), dtype=np.float32)
+
+    def on_bar(self, bar):
+        f = self.factors.update(bar)
+        for j, name in enumerate(self.FEATURES):
+            self._x[0, j] = f[name]
+        if np.isnan(self._x).any():
+            return 0
+        predicted = float(self.booster.inplace_predict(self._x)[0])
+        return self.rule.update(predicted)
+
+
+def train_ml_model(history, N=1, window_size=150, gamma=0.8):
+    """以 ML_CTA 的因子與特徵在歷史 K 線上訓練模型 (供 paper trading 使用)，相同的歷史資料沿用登錄中的模型"""
+    from .models import default_registry
+    from .projects import load
+
+    factors = load('ml_cta', 'add_factors')
+    alphas = load('ml_cta', 'add_alphas')
+    df = factors.compute_factors(history.reset_index(drop=True).copy(), window_size=window_size, gamma=gamma)
+    df['Future_Return_N'] = (df['Close'].shift(-N) - df['Close']) / df['Close'] * 100
+    df = df.dropna()
+    X, y = alphas.prepare_features(df)
+    model, _, mae = alphas.train_xgboost(X, y, N=N, registry=default_registry())
+    logger.info(f"Trained model on {len(df):,} bars, MAE {mae:.4f}")
+    return model
+
+
+def direction_to_signal(direction, position):
+    """
+    方向轉為 OrderExecutor 的訊號：1 / -1 直接送出；-2 (停損) 時送出與目前部位相反的訊號以平倉
+    :param position: executor.current_position ('LONG' / 'SHORT' / None)
+    """
+    if direction in (1, -1):
+        return direction
+    if direction == -2 and position is not None:
+        return -1 if position == 'LONG' else 1
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# 主迴圈與延遲統計
+# ---------------------------------------------------------------------------
+class LatencyHistogram:
+    """以對數區間記錄延遲 (微秒)，同時保留原始值以計算精確分位數"""
+
+    BOUNDS_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, ns):
+        self.samples.append(ns)
+
+    def summary(self):
+        x = np.asarray(self.samples, dtype=np.float64) / 1000.0
+        if len(x) == 0:
+            return {'count': 0}
+        counts = np.histogram(x, bins=(0,) + self.BOUNDS_US + (np.inf,))[0]
+        labels = [f"<{b}us" for b in self.BOUNDS_US] + [f">={self.BOUNDS_US[-1]}us"]
+        return {
+            'count': int(len(x)),
+            'mean_us': float(x.mean()),
+            'p50_us': float(np.percentile(x, 50)),
+            'p90_us': float(np.percentile(x, 90)),
+            'p99_us': float(np.percentile(x, 99)),
+            'max_us': float(x.max()),
+            'histogram': dict(zip(labels, counts.tolist())),
+        }
+
+
+class PaperTrader:
+    """
+    逐根處理串流 K 線：策略產生方向 -> 轉為訊號 -> 送給模擬的 OrderExecutor
+        trader = PaperTrader(StatisticStrategy(), executor)
+        asyncio.run(trader.run(replay(df)))
+    """
+
+    def __init__(self, strategy, executor, p99_target_ms=5.0):
+        self.strategy = strategy
+        self.executor = executor
+        self.p99_target_ms = p99_target_ms
+        self.latency = {'signal': LatencyHistogram(), 'order': LatencyHistogram(), 'total': LatencyHistogram()}
+        self.bars = 0
+        self.orders = 0
+
+    def on_bar(self, bar):
+        received = time.perf_counter_ns()
+        direction = self.strategy.on_bar(bar)
+        decided = time.perf_counter_ns()
+        signal = direction_to_signal(direction, self.executor.current_position)
+        before = len(self.executor.orders)
+        self.executor.process_signal(bar['Open time'], signal, bar['Close'])
+        routed = time.perf_counter_ns()
+        self.orders += len(self.executor.orders) - before
+        self.bars += 1
+        self.latency['signal'].add(decided - received)
+        self.latency['order'].add(routed - decided)
+        self.latency['total'].add(routed - received)
+        return direction
+
+    async def run(self, bars, max_bars=None):
+        """:param bars: 非同步 K 線來源 (replay() / tcp_bars())"""
+        async for bar in bars:
+            self.on_bar(bar)
+            if max_bars is not None and self.bars >= max_bars:
+                break
+        return self.report()
+
+    def report(self):
+        total = self.latency['total'].summary()
+        return {
+            'strategy': getattr(self.strategy, 'name', type(self.strategy).__name__),
+            'bars': self.bars,
+            'orders': self.orders,
+            'latency': {name: h.summary() for name, h in self.latency.items()},
+            'p99_target_ms': self.p99_target_ms,
+            'p99_ok': bool(total.get('p99_us', 0) <= self.p99_target_ms * 1000),
+        }
+
+
+def print_report(report, file=None):
+    file = file or sys.stdout
+    print(f"{report['strategy']}: {report['bars']:,} bars, {report['orders']:,} orders", file=file)
+    for name, s in report['latency'].items():
+        if s['count']:
+            print(f"  {name:7s} p50 {s['p50_us']:8.1f}us  p90 {s['p90_us']:8.1f}us  "
+                  f"p99 {s['p99_us']:8.1f}us  max {s['max_us']:9.1f}us", file=file)
+    hist = report['latency']['total'].get('histogram', {})
+    print('  ' + '  '.join(f"{k}:{v}" for k, v in hist.items() if v), file=file)
+    status = 'OK' if report['p99_ok'] else 'MISSED'
+    print(f"  p99 target {report['p99_target_ms']}ms: {status}", file=file)
+
+
+async def _run(args, df, strategy, executor):
+    trader = PaperTrader(strategy, executor, p99_target_ms=args.p99_target_ms)
+    if args.tcp:
+        server = await serve_replay(df, speed=args.speed, interval_ms=args.interval_ms)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await trader.run(tcp_bars('127.0.0.1', port))
+    return await trader.run(replay(df, speed=args.speed, interval_ms=args.interval_ms))
+
+
+def main(argv=None):
+    from .loaders import load_klines
+    from .projects import load
+
+    parser = argparse.ArgumentParser(description="Paper-trade a strategy on a replayed kline stream")
+    parser.add_argument('--klines', required=True, help="klines_BTC.csv style file to replay")
+    parser.add_argument('--strategy', choices=['statistic', 'ml'], default='statistic')
+    parser.add_argument('--model', help="saved XGBoost model (JSON / UBJ) for --strategy ml")
+    parser.add_argument('--train-bars', type=int, default=0,
+                        help="train the ML model on the first N bars and replay the rest")
+    parser.add_argument('--start', help="replay bars from this time on")
+    parser.add_argument('--speed', type=float, default=None, help="replay speed vs. real time (default: max)")
+    parser.add_argument('--interval-ms', type=int, default=3_600_000)
+    parser.add_argument('--tcp', action='store_true', help="stream through a local TCP socket")
+    parser.add_argument('--orders', default='paper_orders.csv')
+    parser.add_argument('--p99-target-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    df = load_klines(args.klines, report=False)
+    if args.strategy == 'statistic':
+        strategy = StatisticStrategy()
+    else:
+        if args.model:
+            import xgboost as xgb
+            model = xgb.XGBRegressor()
+            model.load_model(args.model)
+        elif args.train_bars:
+            model = train_ml_model(df.iloc[:args.train_bars])
+        else:
+            parser.error("--strategy ml needs --model or --train-bars")
+        strategy = MLStrategy(model)
+        # 訓練用的 K 線仍需經過因子的暖機，但不送單
+        for bar in _bar_records(df.iloc[:args.train_bars]):
+            strategy.factors.update(bar)
+        df = df.iloc[args.train_bars:]
+    if args.start:
+        df = df[df['Open time'] >= to_epoch_ms(args.start)]
+
+    OrderExecutor = load('pair_trading', 'order_executor').OrderExecutor
+    executor = OrderExecutor(None, args.orders, None)
+    report = asyncio.run(_run(args, df.reset_index(drop=True), strategy, executor))
+    executor.save_orders()
+    print_report(report)
+    return 0 if report['p99_ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+多個標的的 下載 -> 因子 -> 回測 管線 (producer-consumer)。
+
+preprocess.py 依序下載所有標的後才開始計算因子，因子全部算完才開始回測：下載等待網路時 CPU 閒置，計算時網路閒置。
+這裡每個步驟 (stage) 由各自的執行緒處理，相鄰步驟之間以有容量上限的 queue 連接：
+    標的 N+1 下載的同時，標的 N 在計算因子、標的 N-1 在回測
+    queue 滿時上游暫停 (backpressure)，已下載但還沒處理的資料不會無限累積
+總時間接近最慢的一個步驟，而不是各步驟的加總。cpu=True 的步驟可交給 process pool 執行 (--processes)，
+pandas / NumPy 中不釋放 GIL 的計算也能與其他標的平行。
+
+結束時回報每個步驟的使用率：忙碌時間 / (總時間 × 執行緒數)，以及等待上游 (starved) 與等待下游 (blocked) 的時間，
+使用率最高的步驟即為瓶頸。
+
+用法：
+    python -m backtest_sim.pipeline statistic_cta BTCUSDT ETHUSDT SOLUSDT --interval 1h --start 2024-01-01 --end 2024-11-30
+    python -m backtest_sim.pipeline statistic_cta BTCUSDT ETHUSDT --klines-dir data/      # 讀取 data/klines_<symbol>.csv
+    python -m backtest_sim.pipeline bincentive2 BTCUSDT ETHUSDT --synthetic 20000 --latency 0.5 --out results/
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# 上游結束時送給下游每個執行緒的結束標記
+_STOP = object()
+
+
+class Stage:
+    """管線中的一個步驟：fn(上一步的輸出) -> 下一步的輸入"""
+
+    def __init__(self, name, fn, workers=1, cpu=False):
+        """
+        :param workers: 處理此步驟的執行緒數 (下載等 I/O 步驟可多於 1)
+        :param cpu: CPU 密集的步驟；run_pipeline 指定 processes 時在 process pool 中執行 (fn 與資料需可 pickle)
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.cpu = cpu
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, workers={self.workers}, cpu={self.cpu})"
+
+
+def _new_stats(stage):
+    return {'stage': stage.name, 'workers': stage.workers, 'items': 0, 'errors': 0,
+            'busy_s': 0.0, 'starved_s': 0.0, 'blocked_s': 0.0}
+
+
+def run_pipeline(items, stages, maxsize=2, processes=0, verbose=True):
+    """
+    以 producer-consumer 方式讓每個項目依序經過各步驟，不同項目的不同步驟同時進行
+    某個項目在某一步失敗時記錄錯誤並略過後續步驟，不影響其他項目
+    :param items: 第一個步驟的輸入 (例如標的 list)，也作為結果的 key
+    :param stages: Stage list
+    :param maxsize: 相鄰步驟之間 queue 的容量
+    :param processes: >0 時 cpu=True 的步驟交給此數量的 process pool
+    :return: dict，'results' ({項目: 最後一步的輸出})、'errors' ({項目: 訊息})、'stages' (各步驟統計)、'wall_s'
+    """
+    items = list(items)
+    inboxes = [queue.Queue()] + [queue.Queue(maxsize=maxsize) for _ in stages[1:]]
+    for item in items:
+        inboxes[0].put((item, item))
+    for _ in range(stages[0].workers):
+        inboxes[0].put(_STOP)
+
+    stats = [_new_stats(stage) for stage in stages]
+    remaining = [stage.workers for stage in stages]
+    results, errors = {}, {}
+    lock = threading.Lock()
+    pool = None
+    if processes and any(s.cpu for s in stages):
+        # 在啟動執行緒之前建立 worker process (fork 時第一次 submit 會建立全部的 process)
+        pool = ProcessPoolExecutor(processes)
+        pool.submit(int).result()
+
+    def worker(index):
+        stage, inbox = stages[index], inboxes[index]
+        outbox = inboxes[index + 1] if index + 1 < len(stages) else None
+        busy = starved = blocked = 0.0
+        done = failed = 0
+        while True:
+            t0 = time.perf_counter()
+            message = inbox.get()
+            t1 = time.perf_counter()
+            starved += t1 - t0
+            if message is _STOP:
+                break
+            key, value = message
+            try:
+                if pool is not None and stage.cpu:
+                    value = pool.submit(stage.fn, value).result()
+                else:
+                    value = stage.fn(value)
+            except Exception as e:
+                failed += 1
+                with lock:
+                    errors[key] = f"{stage.name}: {type(e).__name__}: {e}"
+                if verbose:
+                    print(f"  {key}: {stage.name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                busy += time.perf_counter() - t1
+                continue
+            t2 = time.perf_counter()
+            busy += t2 - t1
+            done += 1
+            if outbox is None:
+                with lock:
+                    results[key] = value
+                if verbose:
+                    print(f"  {key}: done")
+            else:
+                outbox.put((key, value))
+                blocked += time.perf_counter() - t2
+
+        with lock:
+            s = stats[index]
+            s['items'] += done
+            s['errors'] += failed
+            s['busy_s'] += busy
+            s['starved_s'] += starved
+            s['blocked_s'] += blocked
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        # 此步驟的最後一個執行緒結束時通知下游
+        if last and outbox is not None:
+            for _ in range(stages[index + 1].workers):
+                outbox.put(_STOP)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,), name=f"pipeline-{stage.name}-{k}", daemon=True)
+               for index, stage in enumerate(stages) for k in range(stage.workers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    wall = time.perf_counter() - start
+
+    for s in stats:
+        s['utilization'] = s['busy_s'] / (wall * s['workers']) if wall > 0 else 0.0
+    return {'results': {item: results[item] for item in items if item in results}, 'errors': errors,
+            'stages': stats, 'wall_s': wall}
+
+
+def run_serial(items, stages, verbose=True):
+    """
+    與 preprocess -> add_factors -> backtest 相同的依序執行：每個步驟處理完所有項目後才進入下一步 (比較用)
+    :return: 與 run_pipeline 相同格式
+    """
+    items = list(items)
+    values = {item: item for item in items}
+    errors = {}
+    stats = []
+    start = time.perf_counter()
+    for stage in stages:
+        s = dict(_new_stats(stage), workers=1)
+        for key in list(values):
+            t0 = time.perf_counter()
+            try:
+                values[key] = stage.fn(values[key])
+                s['items'] += 1
+            except Exception as e:
+                del values[key]
+                errors[key] = f"{stage.name}: {type(e).__name__}: {e}"
+                s['errors'] += 1
+                if verbose:
+                    print(f"  {key}: {stage.name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            s['busy_s'] += time.perf_counter() - t0
+        stats.append(s)
+    wall = time.perf_counter() - start
+    for s in stats:
+        s['utilization'] = s['busy_s'] / wall if wall > 0 else 0.0
+    return {'results': values, 'errors': errors, 'stages': stats, 'wall_s': wall}
+
+
+def print_report(report, file=None):
+    """各步驟的處理數量、忙碌時間與使用率"""
+    file = file or sys.stdout
+    print(f"{'stage':10s} {'workers':>7s} {'items':>6s} {'errors':>6s} {'busy s':>8s} {'util':>6s} "
+          f"{'starved s':>9s} {'blocked s':>9s}", file=file)
+    for s in report['stages']:
+        print(f"{s['stage']:10s} {s['workers']:7d} {s['items']:6d} {s['errors']:6d} {s['busy_s']:8.2f} "
+              f"{s['utilization']:6.1%} {s['starved_s']:9.2f} {s['blocked_s']:9.2f}", file=file)
+    serial = sum(s['busy_s'] for s in report['stages'])
+    bottleneck = max(report['stages'], key=lambda s: s['busy_s'] / s['workers'])
+    print(f"wall {report['wall_s']:.2f}s; sum of stages {serial:.2f}s; "
+          f"slowest stage {bottleneck['stage']} {bottleneck['busy_s'] / bottleneck['workers']:.2f}s", file=file)
+
+
+# ---------------------------------------------------------------------------
+# 各專案的步驟
+# ---------------------------------------------------------------------------
+def fetch_klines(symbol, interval='1h', start='2024-01-01', end='2024-11-30', klines_dir=None, synthetic=None,
+                 latency=0.0, project='statistic_cta'):
+    """
+    下載一個標的的 K 線 (與 preprocess.py 相同的欄位)
+    :param klines_dir: 改為讀取 <klines_dir>/klines_<symbol>.csv
+    :param synthetic: 改為產生此數量的合成 K 線 (backtest_sim.synth，以標的名稱決定亂數種子)
+    :param latency: 模擬的網路延遲 (秒，只用於合成資料)
+    """
+    if klines_dir is not None:
+        from .loaders import load_klines
+        return load_klines(os.path.join(klines_dir, f'klines_{symbol}.csv'), time_as='datetime', report=False)
+    if synthetic:
+        from .synth import repo_klines
+        time.sleep(latency)
+        return repo_klines(int(synthetic), symbol=symbol, start=start, interval=interval,
+                           seed=zlib.crc32(symbol.encode()))
+    from .projects import load
+    df = load(project, 'preprocess').fetch_kline_price_data(symbol, interval, start, end)
+    df['Symbol'] = symbol
+    return df.reset_index(drop=True)
+
+
+def statistic_factors(df, window_size=24, threshold1=4.5, threshold2=2):
+    """Statistic_CTA：compute_factors -> get_direction"""
+    from .projects import load
+    df = load('statistic_cta', 'add_factors').compute_factors(df, window_size=window_size)
+    return load('statistic_cta', 'add_alphas').get_direction(df, threshold1=threshold1, threshold2=threshold2)
+
+
+def statistic_backtest(df, out_dir=None, initial_balance=10000):
+    """Statistic_CTA：backtesting -> 指標 (指定 out_dir 時另存 <symbol>_backtest.csv)"""
+    from .metrics import summary_metrics
+    from .projects import load
+    df = load('statistic_cta', 'backtest').backtesting(df)
+    if out_dir is not None:
+        df.to_csv(os.path.join(out_dir, f"{_symbol(df)}_backtest.csv"), index=False)
+    result = summary_metrics(df['PnL'], initial_balance=initial_balance)
+    result['bars'] = len(df)
+    return result
+
+
+def obv_factors(df, window=25):
+    """Bincentive/Problem2：OBV 與其均線"""
+    from .projects import load
+    df['OBV'] = load('bincentive2', 'add_factors').compute_OBV(df)
+    df['OBV_MA5'] = df['OBV'].rolling(window=window).mean()
+    return df
+
+
+def obv_backtest(df, out_dir=None, initial_capital=100000):
+    """Bincentive/Problem2：generate_trade_signals -> 交易統計 (指定 out_dir 時另存 <symbol>_trades.csv)"""
+    from .projects import load
+    signals = load('bincentive2', 'strategy_signals')
+    _, trades, capital = signals.generate_trade_signals(df, initial_capital=initial_capital)
+    if out_dir is not None:
+        trades.to_frame(signals.TRADE_COLUMNS).to_csv(os.path.join(out_dir, f"{_symbol(df)}_trades.csv"), index=False)
+    result = trades.stats()
+    result['final_capital'] = float(capital)
+    result['bars'] = len(df)
+    return result
+
+
+def _symbol(df):
+    return str(df['Symbol'].iloc[0]) if 'Symbol' in df.columns and len(df) else 'klines'
+
+
+# 專案 -> (因子步驟, 回測步驟, 需要預先載入的模組)
+PROJECTS = {
+    'statistic_cta': (statistic_factors, statistic_backtest, ('preprocess', 'add_factors', 'add_alphas', 'backtest')),
+    'bincentive2': (obv_factors, obv_backtest, ('preprocess', 'add_factors', 'strategy_signals')),
+}
+
+
+def symbol_stages(project, download_workers=2, fetch_kw=None, factors_kw=None, backtest_kw=None, cpu_workers=1):
+    """
+    專案的 download -> factors -> backtest 步驟
+    :param cpu_workers: factors / backtest 各自的執行緒數；在 process pool 中執行時，
+                        每個執行緒同時只送出一個工作，因此需與 processes 相同才能讓 pool 滿載
+    專案模組在這裡 (主執行緒) 先載入：projects.load 會暫時修改 sys.path / sys.modules，不能在多個執行緒中同時執行
+    """
+    from .projects import load
+
+    factors, backtest, modules = PROJECTS[project]
+    fetch_kw = dict(fetch_kw or {})
+    for module in modules:
+        if module != 'preprocess' or not (fetch_kw.get('klines_dir') or fetch_kw.get('synthetic')):
+            load(project, module)
+    return [Stage('download', partial(fetch_klines, project=project, **fetch_kw), workers=download_workers),
+            Stage('factors', partial(factors, **(factors_kw or {})), workers=cpu_workers, cpu=True),
+            Stage('backtest', partial(backtest, **(backtest_kw or {})), workers=cpu_workers, cpu=True)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipelined download -> factors -> backtest over many symbols")
+    parser.add_argument('project', choices=sorted(PROJECTS))
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--interval', default='1h')
+    parser.add_argument('--start', default='2024-01-01')
+    parser.add_argument('--end', default='2024-11-30')
+    parser.add_argument('--klines-dir', help="read <dir>/klines_<symbol>.csv instead of downloading")
+    parser.add_argument('--synthetic', type=int, help="generate this many synthetic bars per symbol instead of downloading")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated download latency in seconds (--synthetic)")
+    parser.add_argument('--out', help="directory for per-symbol backtest / trade CSVs")
+    parser.add_argument('--queue', type=int, default=2, help="capacity of the queues between stages")
+    parser.add_argument('--download-workers', type=int, default=2)
+    parser.add_argument('--processes', type=int, default=0, help="run the factor / backtest stages in a process pool")
+    parser.add_argument('--cpu-workers', type=int,
+                        help="threads feeding each factor / backtest stage (default: --processes, or 1 without a pool)")
+    parser.add_argument('--serial', action='store_true', help="run each stage over all symbols before the next (baseline)")
+    args = parser.parse_args(argv)
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    fetch_kw = {'interval': args.interval, 'start': args.start, 'end': args.end, 'klines_dir': args.klines_dir,
+                'synthetic': args.synthetic, 'latency': args.latency}
+    cpu_workers = args.cpu_workers or max(args.processes, 1)
+    stages = symbol_stages(args.project, args.download_workers, fetch_kw, backtest_kw={'out_dir': args.out},
+                           cpu_workers=cpu_workers)
+    if args.serial:
+        report = run_serial(args.symbols, stages)
+    else:
+        report = run_pipeline(args.symbols, stages, maxsize=args.queue, processes=args.processes)
+
+    for symbol, result in report['results'].items():
+        summary = ', '.join(f"{k} {v:.4g}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items())
+        print(f"{symbol}: {summary}")
+    print_report(report)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
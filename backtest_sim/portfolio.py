@@ -0,0 +1,232 @@
+"""
+多策略 × 多標的的投資組合回測。
+
+各專案的策略 (Statistic_CTA 均值回歸、ML_CTA XGBoost、CCI、OBV、配對交易) 原本各自以
+獨立的資金回測。這裡把每個策略在每個標的上的部位訊號視為一個 sleeve，
+共用同一筆資金，在同一個 K 線迴圈中一起前進：每根 K 線以向量運算同時處理所有 sleeve，
+套用資金配置與風險限制，輸出組合淨值與各 sleeve 的損益歸因。
+
+sleeve 的 signal 為目標部位方向 (-1 ~ 1，0 為空手)，可由下列函式從各專案的輸出轉換：
+    cta_positions(df)                     backtesting() 輸出的 'buy position' / 'sell position'
+    event_positions(signal, long_only)    CCI / OBV 的 1 / -1 事件訊號
+    toggle_positions(signal)              配對交易 OrderExecutor 的進出場規則
+"""
+import numpy as np
+import pandas as pd
+
+from .metrics import summary_metrics
+
+
+# ---------------------------------------------------------------------------
+# 訊號轉部位
+# ---------------------------------------------------------------------------
+def cta_positions(df):
+    """
+    Statistic_CTA / ML_CTA backtesting() 的輸出轉為淨部位 (多單 +1、空單 -1，可同時持有時相抵)
+    """
+    long = (df['buy position'] == True).to_numpy(dtype=np.float64)  # noqa: E712
+    short = (df['sell position'] == True).to_numpy(dtype=np.float64)  # noqa: E712
+    return long - short
+
+
+def event_positions(signal, long_only=False):
+    """
+    事件訊號轉為持有部位：1 進多、-1 進空 (long_only 時為平倉)、0 維持前一根的部位
+    例如 generate_cci_signals 的 'Signal'、generate_trade_signals 的 'Signal' (long_only=True)
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    target = np.where(signal > 0, 1.0, np.where(signal < 0, 0.0 if long_only else -1.0, np.nan))
+    return pd.Series(target).ffill().fillna(0.0).to_numpy()
+
+
+def toggle_positions(signal):
+    """
+    配對交易 OrderExecutor 的規則：空手時依訊號進場，持倉時遇到反向訊號平倉 (同一根不反手)
+    只在非 0 訊號上迴圈，成本與訊號數量成正比
+    """
+    signal = np.asarray(signal)
+    events = np.flatnonzero(signal)
+    changes = []
+    position = 0
+    for i in events:
+        s = 1 if signal[i] > 0 else -1
+        if position == 0:
+            position = s
+            changes.append((i, s))
+        elif s == -position:
+            position = 0
+            changes.append((i, 0))
+    out = np.full(len(signal), np.nan)
+    out[0] = 0.0
+    for i, p in changes:
+        out[i] = p
+    return pd.Series(out).ffill().to_numpy()
+
+
+def align_prices(frames, column='Close', time_column='Open time'):
+    """
+    多個標的的 K 線對齊成一個價格矩陣 (時間聯集，缺值沿用前一筆價格)
+    :param frames: {symbol: DataFrame}
+    :return: DataFrame，index 為時間，欄位為 symbol
+    """
+    series = {symbol: df.set_index(time_column)[column] for symbol, df in frames.items()}
+    return pd.DataFrame(series).sort_index().ffill()
+
+
+# ---------------------------------------------------------------------------
+# 回測
+# ---------------------------------------------------------------------------
+def _allocation_matrix(allocation, names, sleeve_symbol, returns, vol_window):
+    """每根 K 線每個 sleeve 的資金權重 (T, K)，各列總和為 1"""
+    k = len(names)
+    t = len(returns)
+    if isinstance(allocation, dict):
+        w = np.array([float(allocation.get(name, 0.0)) for name in names])
+        if w.sum() <= 0:
+            raise ValueError("Allocation weights must sum to a positive number")
+        return np.broadcast_to(w / w.sum(), (t, k))
+    if allocation == 'equal':
+        return np.full((t, k), 1.0 / k)
+    if allocation == 'inverse_vol':
+        vol = returns.rolling(vol_window, min_periods=2).std().to_numpy()[:, sleeve_symbol]
+        inv = np.where(vol > 0, 1.0 / vol, np.nan)
+        # 波動度尚無法估計的期間以平均分配
+        inv = np.where(np.isnan(inv).all(axis=1, keepdims=True), 1.0, np.nan_to_num(inv))
+        return inv / inv.sum(axis=1, keepdims=True)
+    raise ValueError(f"Unknown allocation: {allocation} (expected 'equal', 'inverse_vol' or a dict)")
+
+
+def run_portfolio(prices, sleeves, initial_capital=100000, allocation='equal', fee_rate=0.0005,
+                  max_gross_leverage=1.0, max_symbol_weight=None, max_drawdown=None, vol_window=100):
+    """
+    以共用資金同時回測多個 sleeve
+    :param prices: DataFrame (T, S)，各標的的收盤價，欄位為 symbol
+    :param sleeves: list of dict，每個包含 'name'、'symbol' 與長度 T 的 'signal' (目標方向 -1 ~ 1)
+    :param initial_capital: 初始資金
+    :param allocation: 'equal'、'inverse_vol' (依標的近期波動度反比配置) 或 {sleeve 名稱: 權重}
+    :param fee_rate: 單邊手續費率 (以成交金額計)
+    :param max_gross_leverage: 總曝險 (各標的淨部位絕對值加總) 不超過淨值的倍數
+    :param max_symbol_weight: 單一標的淨曝險不超過淨值的比例，None 為不限制
+    :param max_drawdown: 組合回撤超過此比例 (例如 0.2) 時全部平倉並停止交易，None 為不限制
+    :param vol_window: inverse_vol 使用的滾動視窗
+    :return: dict
+        equity          Series，組合淨值
+        sleeve_pnl      DataFrame (T, K)，各 sleeve 每根 K 線的損益 (含手續費)
+        exposure        DataFrame (T, S)，各標的的淨曝險金額
+        gross_leverage  Series，總曝險 / 淨值
+        attribution     DataFrame，各 sleeve 的損益、手續費、交易次數與貢獻比例
+        limits          dict，各風險限制觸發的次數
+    """
+    symbols = list(prices.columns)
+    names = [s['name'] for s in sleeves]
+    if len(set(names)) != len(names):
+        raise ValueError("Sleeve names must be unique")
+    sleeve_symbol = np.array([symbols.index(s['symbol']) for s in sleeves])
+    px = prices.to_numpy(dtype=np.float64)
+    t_len, k = len(px), len(sleeves)
+    signals = np.column_stack([np.asarray(s['signal'], dtype=np.float64) for s in sleeves])
+    if signals.shape[0] != t_len:
+        raise ValueError(f"Every sleeve signal must have {t_len} rows (one per price row)")
+    signals = np.clip(np.nan_to_num(signals), -1.0, 1.0)
+
+    weights = _allocation_matrix(allocation, names, sleeve_symbol, prices.pct_change(), vol_window)
+    # sleeve -> 標的的對應矩陣，淨曝險 = sleeve 曝險 @ mapping
+    mapping = np.zeros((k, len(symbols)))
+    mapping[np.arange(k), sleeve_symbol] = 1.0
+
+    units = np.zeros(k)             # 各 sleeve 持有的數量
+    prev_signal = np.zeros(k)
+    equity = np.empty(t_len)
+    sleeve_pnl = np.zeros((t_len, k))
+    fees = np.zeros(k)
+    trades = np.zeros(k, dtype=np.int64)
+    exposure = np.zeros((t_len, len(symbols)))
+    gross = np.zeros(t_len)
+    limits = {'gross_leverage': 0, 'symbol_weight': 0, 'max_drawdown': 0}
+
+    cash_equity = float(initial_capital)
+    peak = cash_equity
+    halted = False
+    for t in range(t_len):
+        p = px[t, sleeve_symbol]
+        if t > 0:
+            # 上一根結束時的部位在本根的損益
+            pnl = units * (p - px[t - 1, sleeve_symbol])
+            pnl = np.nan_to_num(pnl)
+            sleeve_pnl[t] = pnl
+            cash_equity += pnl.sum()
+
+        target = units.copy()
+        if halted:
+            target[:] = 0.0
+        else:
+            peak = max(peak, cash_equity)
+            if max_drawdown is not None and cash_equity < peak * (1 - max_drawdown):
+                halted = True
+                limits['max_drawdown'] += 1
+                target[:] = 0.0
+            else:
+                # 只有訊號改變的 sleeve 依目前淨值重新決定部位大小，其餘維持持有數量
+                changed = signals[t] != prev_signal
+                valid = changed & (p > 0)
+                target[valid] = signals[t, valid] * weights[t, valid] * cash_equity / p[valid]
+                prev_signal = np.where(valid, signals[t], prev_signal)
+
+                notional = np.nan_to_num(target * p)
+                net = notional @ mapping
+                if max_symbol_weight is not None:
+                    cap = max_symbol_weight * max(cash_equity, 0.0)
+                    over = np.abs(net) > cap + 1e-9
+                    if over.any():
+                        limits['symbol_weight'] += 1
+                        scale = np.where(over, cap / np.where(over, np.abs(net), 1.0), 1.0)
+                        target *= scale[sleeve_symbol]
+                        notional = np.nan_to_num(target * p)
+                        net = notional @ mapping
+                total = np.abs(net).sum()
+                cap = max_gross_leverage * max(cash_equity, 0.0)
+                if total > cap + 1e-9:
+                    limits['gross_leverage'] += 1
+                    target *= cap / total
+
+        traded = np.abs(target - units)
+        fee = np.nan_to_num(traded * p) * fee_rate
+        trades += (traded > 1e-12) & (np.sign(target) != np.sign(units))
+        sleeve_pnl[t] -= fee
+        fees += fee
+        cash_equity -= fee.sum()
+        units = target
+
+        equity[t] = cash_equity
+        net = np.nan_to_num(units * p) @ mapping
+        exposure[t] = net
+        gross[t] = np.abs(net).sum() / cash_equity if cash_equity > 0 else np.inf
+
+    index = prices.index
+    sleeve_pnl = pd.DataFrame(sleeve_pnl, index=index, columns=names)
+    total_pnl = sleeve_pnl.sum()
+    total = total_pnl.sum()
+    attribution = pd.DataFrame({
+        'symbol': [s['symbol'] for s in sleeves],
+        'pnl': total_pnl.to_numpy(),
+        'fees': fees,
+        'trades': trades,
+        'contribution': total_pnl.to_numpy() / total if total != 0 else np.nan,
+        'sharpe_ratio': [summary_metrics(sleeve_pnl[n], initial_capital)['sharpe_ratio'] for n in names],
+    }, index=names)
+    return {
+        'equity': pd.Series(equity, index=index, name='equity'),
+        'sleeve_pnl': sleeve_pnl,
+        'exposure': pd.DataFrame(exposure, index=index, columns=symbols),
+        'gross_leverage': pd.Series(gross, index=index, name='gross_leverage'),
+        'attribution': attribution,
+        'limits': limits,
+    }
+
+
+def portfolio_metrics(result, initial_capital=100000, periods_per_year=252):
+    """組合層級的績效指標 (公式與 metrics.summary_metrics 相同)"""
+    pnl = np.diff(result['equity'].to_numpy(), prepend=initial_capital)
+    metrics = summary_metrics(pnl, initial_capital, periods_per_year)
+    metrics['max_gross_leverage'] = float(result['gross_leverage'].replace(np.inf, np.nan).max())
+    return metrics
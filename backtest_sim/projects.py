@@ -0,0 +1,62 @@
+"""
+載入各專案資料夾中的腳本模組。
+
+各專案以 `from backtest import backtesting` 的方式互相引用，且不同專案有同名模組
+(例如 Statistic_CTA/backtest.py 與 ML_CTA/backtest.py)，因此不能直接 import。
+這裡以唯一的模組名稱載入，並在執行期間暫時讓專案資料夾優先於 sys.path。
+"""
+import importlib.util
+import os
+import sys
+
+from . import ROOT
+
+PROJECTS = {
+    'statistic_cta': 'Statistic_CTA',
+    'ml_cta': 'ML_CTA',
+    'pair_trading': 'Pair_Trading',
+    'bincentive1': os.path.join('Bincentive', 'Problem1'),
+    'bincentive2': os.path.join('Bincentive', 'Problem2'),
+}
+
+
+def project_dir(project):
+    """回傳專案資料夾的絕對路徑"""
+    try:
+        return os.path.join(ROOT, PROJECTS[project])
+    except KeyError:
+        raise ValueError(f"Unknown project: {project} (choose from {', '.join(PROJECTS)})") from None
+
+
+def load(project, module):
+    """
+    載入專案中的模組，例如 load('ml_cta', 'backtest').backtesting
+    :param project: PROJECTS 中的名稱
+    :param module: 模組檔名 (不含 .py)
+    :return: module 物件 (重複載入會回傳同一個物件)
+    """
+    name = f"_backtest_sim_{project}_{module}"
+    if name in sys.modules:
+        return sys.modules[name]
+
+    directory = project_dir(project)
+    path = os.path.join(directory, module + '.py')
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+
+    # 暫時移除與專案內檔案同名的已載入模組，避免拿到其他專案的 backtest.py
+    siblings = {f[:-3] for f in os.listdir(directory) if f.endswith('.py')}
+    saved = {k: sys.modules.pop(k) for k in list(sys.modules) if k in siblings}
+    sys.path.insert(0, directory)
+    try:
+        sys.modules[name] = mod
+        spec.loader.exec_module(mod)
+    except BaseException:
+        sys.modules.pop(name, None)
+        raise
+    finally:
+        sys.path.remove(directory)
+        for k in siblings:
+            sys.modules.pop(k, None)
+        sys.modules.update(saved)
+    return mod
@@ -0,0 +1,248 @@
+"""
+本地多時間週期 K 線金字塔。
+
+只下載 / 保存最細的 K 線 (例如 1m)，較粗的週期 (5m / 15m / 1h / 4h / 1d) 由本地彙總並快取：
+    <root>/<symbol>/<interval>.cols      欄式資料夾，'Open time' 為毫秒數
+每一層由上一層 (可整除的較細週期) 以 reduceat 彙總 first / max / min / last / sum。
+新的基礎 K 線到達時 (包含補回歷史中間的資料)，只重算各層受影響時間區段內的 K 線，不重建整個金字塔。
+要求金字塔中沒有的週期時，從可整除的最粗一層即時彙總。
+
+用法：
+    python -m backtest_sim.pyramid append klines_1m.csv --root data/pyramid --symbol BTCUSDT
+    python -m backtest_sim.pyramid export --root data/pyramid --symbol BTCUSDT --interval 4h --out klines_BTC.csv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .columnar import ColumnarWriter, is_columnar, open_columnar, read_schema, truncate_columnar
+from .ohlcv import SUM_COLUMNS, resample
+from .timeutil import interval_ms, to_epoch_ms, to_epoch_ms_array
+
+DEFAULT_LEVELS = ('5m', '15m', '1h', '4h', '1d')
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+
+def _interval_name(ms):
+    for name in ('1d', '12h', '8h', '6h', '4h', '2h', '1h', '30m', '15m', '5m', '3m', '1m'):
+        if interval_ms(name) == ms:
+            return name
+    return f"{ms}ms"
+
+
+class BarPyramid:
+    """
+    以基礎週期 K 線為來源的多週期 K 線快取
+        pyramid = BarPyramid('data/pyramid', 'BTCUSDT')
+        pyramid.append(df_1m)
+        df_4h = pyramid.bars('4h', start='2024-01-01')
+    """
+
+    def __init__(self, root, symbol, base='1m', levels=DEFAULT_LEVELS):
+        """
+        :param root: 快取根目錄
+        :param symbol: 交易對，輸出 K 線的 'Symbol' 欄位
+        :param base: 基礎週期
+        :param levels: 要快取的較粗週期，每個都需為 base 的整數倍
+        """
+        self.root = root
+        self.symbol = symbol
+        self.base = base
+        self.base_ms = interval_ms(base)
+        levels = sorted(set(levels) - {base}, key=interval_ms)
+        for level in levels:
+            if interval_ms(level) % self.base_ms:
+                raise ValueError(f"Interval {level} is not a multiple of base interval {base}")
+        self.levels = levels
+
+    def path(self, interval):
+        return os.path.join(self.root, self.symbol, f"{interval}.cols")
+
+    def intervals(self):
+        return [self.base] + self.levels
+
+    def _source(self, ms):
+        """可整除 ms 的最粗一層 (不含 ms 本身)"""
+        candidates = [i for i in self.intervals() if interval_ms(i) < ms and ms % interval_ms(i) == 0]
+        return max(candidates, key=interval_ms) if candidates else None
+
+    def rows(self, interval=None):
+        path = self.path(interval or self.base)
+        return read_schema(path)['rows'] if is_columnar(path) else 0
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _normalize(bars):
+        """輸入 K 線 (DataFrame 或 dict) 轉為依時間排序、去除重複的 {欄位: array}"""
+        times = to_epoch_ms_array(bars['Open time'])
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        # 重複的時間保留最後一筆
+        keep = np.append(times[1:] != times[:-1], True)
+        names = bars.columns if hasattr(bars, 'columns') else bars.keys()
+        columns = {'Open time': times[keep]}
+        for name in PRICE_COLUMNS + [c for c in SUM_COLUMNS if c in names]:
+            columns[name] = np.asarray(bars[name], dtype=np.float64)[order][keep]
+        return columns
+
+    def _splice(self, interval, columns, start, end):
+        """
+        以 columns 取代 interval 層中 start <= 時間 < end 的資料，其餘資料保留
+        (欄式資料夾只能截斷後附加，end 之後的資料先讀出，接在 columns 之後重新寫入)
+        :param end: None 為不限 (取代 start 之後的所有資料)
+        """
+        path = self.path(interval)
+        after = None
+        if is_columnar(path):
+            arrays = open_columnar(path)
+            times = arrays['Open time']
+            lo = int(np.searchsorted(times, start, side='left'))
+            if end is not None:
+                hi = int(np.searchsorted(times, end, side='left'))
+                if hi < len(times):
+                    after = {name: np.array(values[hi:]) for name, values in arrays.items() if name in columns}
+            del arrays, times
+            truncate_columnar(path, lo)
+            append = True
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            append = False
+        with ColumnarWriter(path, append=append) as writer:
+            writer.write(columns)
+            if after is not None:
+                writer.write(after)
+            writer.set_constant('Symbol', self.symbol)
+
+    def append(self, bars):
+        """
+        加入基礎週期 K 線並增量更新各層
+        新資料涵蓋的時間區段 [最早, 最晚] 內的既有資料以新資料取代，區段之外的資料不變 (可補回歷史中間的資料)；
+        各層只重算與這個區段重疊的 K 線
+        :param bars: DataFrame 或 dict，需包含 'Open time' 與 OHLC，可包含 Volume 等累加欄位
+        :return: 新資料的筆數
+        """
+        columns = self._normalize(bars)
+        if len(columns['Open time']) == 0:
+            return 0
+        if np.any(columns['Open time'] % self.base_ms):
+            raise ValueError(f"'Open time' is not aligned to the base interval {self.base}")
+        first, last = int(columns['Open time'][0]), int(columns['Open time'][-1])
+        self._splice(self.base, columns, first, last + self.base_ms)
+
+        for level in self.levels:
+            ms = interval_ms(level)
+            bucket_start, bucket_end = first // ms * ms, (last // ms + 1) * ms
+            source = self._read(self._source(ms), start=bucket_start, end=bucket_end)
+            self._splice(level, resample(source, ms), bucket_start, bucket_end)
+        return len(columns['Open time'])
+
+    def rebuild(self):
+        """由基礎週期重建所有較粗的層"""
+        base = self._read(self.base)
+        if len(base['Open time']) == 0:
+            return
+        for level in self.levels:
+            path = self.path(level)
+            if is_columnar(path):
+                truncate_columnar(path, 0)
+        for level in self.levels:
+            self._splice(level, resample(self._read(self._source(interval_ms(level))), interval_ms(level)), 0, None)
+
+    # ------------------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------------------
+    def _read(self, interval, start=None, end=None):
+        """讀取一層中 start <= 'Open time' < end 的資料 (memmap 後只複製需要的區段)"""
+        path = self.path(interval)
+        if not is_columnar(path):
+            raise FileNotFoundError(f"No {interval} bars for {self.symbol} under {self.root}")
+        arrays = open_columnar(path)
+        times = arrays['Open time']
+        lo = 0 if start is None else int(np.searchsorted(times, to_epoch_ms(start), side='left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, to_epoch_ms(end), side='left'))
+        return {name: np.array(values[lo:hi]) for name, values in arrays.items() if values.ndim == 1}
+
+    def bars(self, interval, start=None, end=None, complete=False, time_as='datetime'):
+        """
+        取得任意週期的 K 線 (金字塔中已有的層直接讀取，否則由可整除的最粗一層即時彙總)
+        :param interval: '1m' / '5m' / '1h' / '4h' / '1d' ... 或毫秒數，需為基礎週期的整數倍
+        :param start: 起始時間 (含)，日期字串 / Timestamp / 毫秒數
+        :param end: 結束時間 (不含)
+        :param complete: 只回傳基礎 K 線已完整涵蓋的 K 線 (去掉最後一根未收完的)
+        :param time_as: 'datetime' 與各專案 klines_BTC.csv 相同的格式，'epoch' 為毫秒數
+        :return: DataFrame，欄位 'Open time', OHLC, 累加欄位, 'Symbol'
+        """
+        ms = interval_ms(interval)
+        if ms % self.base_ms:
+            raise ValueError(f"Interval {interval} is not a multiple of base interval {self.base}")
+        name = _interval_name(ms)
+        if name in self.intervals() and is_columnar(self.path(name)):
+            columns = self._read(name, start, end)
+        else:
+            source = self._source(ms) or self.base
+            aligned_start = None if start is None else to_epoch_ms(start) // ms * ms
+            columns = resample(self._read(source, aligned_start, end), ms)
+            if start is not None:
+                keep = columns['Open time'] >= to_epoch_ms(start)
+                columns = {k: v[keep] for k, v in columns.items()}
+
+        if complete and len(columns['Open time']):
+            base_times = open_columnar(self.path(self.base), ['Open time'])['Open time']
+            covered_until = int(base_times[-1]) + self.base_ms
+            if int(columns['Open time'][-1]) + ms > covered_until:
+                columns = {k: v[:-1] for k, v in columns.items()}
+
+        df = pd.DataFrame(columns)
+        if time_as == 'datetime':
+            df['Open time'] = pd.to_datetime(df['Open time'], unit='ms')
+        df['Symbol'] = self.symbol
+        return df
+
+
+def main(argv=None):
+    from .loaders import load_klines
+
+    parser = argparse.ArgumentParser(description="Local multi-timeframe kline pyramid")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('append', help="add base-interval klines (CSV / columnar) and update every level")
+    p.add_argument('files', nargs='+')
+    p = sub.add_parser('rebuild', help="rebuild every level from the base interval")
+    p = sub.add_parser('export', help="write one interval in the klines_BTC.csv format")
+    p.add_argument('--interval', required=True)
+    p.add_argument('--start')
+    p.add_argument('--end')
+    p.add_argument('--complete', action='store_true', help="drop the last, still-forming bar")
+    p.add_argument('--out', required=True)
+    sub.add_parser('info', help="show the stored levels")
+    for p in sub.choices.values():
+        p.add_argument('--root', default='pyramid')
+        p.add_argument('--symbol', default='BTCUSDT')
+        p.add_argument('--base', default='1m')
+        p.add_argument('--levels', default=','.join(DEFAULT_LEVELS))
+    args = parser.parse_args(argv)
+
+    pyramid = BarPyramid(args.root, args.symbol, base=args.base, levels=args.levels.split(','))
+    if args.command == 'append':
+        for path in args.files:
+            n = pyramid.append(load_klines(path, report=False))
+            print(f"{path}: {n:,} {args.base} bars")
+    elif args.command == 'rebuild':
+        pyramid.rebuild()
+    elif args.command == 'export':
+        df = pyramid.bars(args.interval, start=args.start, end=args.end, complete=args.complete)
+        df.to_csv(args.out, index=False)
+        print(f"{len(df):,} {args.interval} bars -> {args.out}")
+    for interval in pyramid.intervals():
+        if args.command == 'info' and pyramid.rows(interval):
+            print(f"{interval:>4s} {pyramid.rows(interval):>12,d} bars")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
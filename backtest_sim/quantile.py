@@ -0,0 +1,138 @@
+"""
+滾動分位數 (rolling order statistics)。
+
+pandas 的 rolling().quantile(q) 每個分位數各自走過整段資料並重新維護一次排序視窗，
+要在長歷史上算多個百分位帶 (例如 1% / 5% / 95% / 99%) 時成本隨分位數個數倍增。
+這裡只維護一個排序好的視窗：每根 K 線插入新值、移除離開視窗的舊值 (二分搜尋定位)，
+所有分位數在同一步以索引直接讀出，內插 (與 pandas 的 'linear' 相同) 在迴圈結束後以向量運算完成。
+
+排序視窗：
+    - 視窗不大時 (預設 ≤ 100k) 為 Python list + bisect：定位 O(log w)，插入 / 刪除是一次連續記憶體搬移，實測比樹狀結構快
+    - 更大的視窗使用 sortedcontainers.SortedList (若有安裝)，插入 / 刪除 / 索引皆為 O(log w)
+每一步的成本幾乎與分位數個數無關；視窗很大 (上萬根) 且只要一兩個分位數時，pandas 以 C 實作的 skiplist 仍較快。
+
+用法：
+    bands = rolling_quantiles(df['Close'], 24, [0.01, 0.05, 0.95, 0.99])   # shape (n, 4)
+"""
+from bisect import bisect_left, insort
+from operator import itemgetter
+
+import numpy as np
+
+# 超過這個視窗大小時改用 SortedList (list 的記憶體搬移成本隨視窗線性成長)
+SORTED_LIST_WINDOW = 100_000
+
+
+def _sorted_window(backend='auto', window=None):
+    """
+    空的排序視窗與其插入 / 刪除函式 (container, add, remove)
+    :param backend: 'bisect' (Python list)、'sortedlist' 或 'auto' (依 window 選擇，沒有 sortedcontainers 時為 'bisect')
+    """
+    if backend == 'auto':
+        backend = 'bisect'
+        if window is not None and window > SORTED_LIST_WINDOW:
+            try:
+                import sortedcontainers  # noqa: F401
+                backend = 'sortedlist'
+            except ImportError:
+                pass
+    if backend == 'sortedlist':
+        try:
+            from sortedcontainers import SortedList
+        except ImportError as e:
+            raise ImportError("The 'sortedlist' backend requires sortedcontainers (pip install sortedcontainers)") from e
+        container = SortedList()
+        return container, container.add, container.remove
+    if backend != 'bisect':
+        raise ValueError(f"Unknown backend: {backend!r} (expected 'auto', 'bisect' or 'sortedlist')")
+    # 必須是 list 本身 (不能是子類別)，bisect 對 list 才走最快的路徑
+    container = []
+
+    def remove(value):
+        del container[bisect_left(container, value)]
+    return container, lambda value: insort(container, value), remove
+
+
+def _interpolate(window, quantiles):
+    """排序好的 window 上的分位數 (與 pandas 的 'linear' 內插相同)"""
+    last = len(window) - 1
+    out = []
+    for q in quantiles:
+        pos = q * last
+        lo = int(pos)
+        hi = min(lo + 1, last)
+        out.append(window[lo] + (pos - lo) * (window[hi] - window[lo]))
+    return out
+
+
+def rolling_quantiles(values, window, quantiles, min_periods=None, backend='auto'):
+    """
+    滾動視窗的多個分位數，一次走過資料
+    與 pd.Series(values).rolling(window, min_periods).quantile(q) 逐一計算的結果相同 (NaN 不計入視窗的筆數)
+    :param values: 1 維 array / Series
+    :param window: 視窗大小 (筆)
+    :param quantiles: 分位數的 list (0 ~ 1)
+    :param min_periods: 視窗內至少幾筆有效值才輸出，None 為 window
+    :param backend: 排序視窗的實作：'bisect'、'sortedlist' 或 'auto'
+    :return: ndarray，shape (len(values), len(quantiles))，不足 min_periods 的列為 NaN
+    """
+    x = np.asarray(values, dtype=np.float64)
+    qs = np.asarray(quantiles, dtype=np.float64).ravel()
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    if ((qs < 0) | (qs > 1)).any():
+        raise ValueError("quantiles must be between 0 and 1")
+    min_periods = window if min_periods is None else max(int(min_periods), 1)
+    if min_periods > window:
+        raise ValueError(f"min_periods {min_periods} must be <= window {window}")
+    n, k = len(x), len(qs)
+    out = np.full((n, k), np.nan)
+    if n == 0 or k == 0:
+        return out
+
+    vals = x.tolist()
+    has_nan = bool(np.isnan(x).any())
+    s, add, remove = _sorted_window(backend, window)
+    # 有 NaN 或視窗尚未填滿時，視窗內的筆數會變動，逐步計算分位數的位置
+    warmup = n if has_nan else min(window - 1, n)
+    qlist = qs.tolist()
+    for i in range(warmup):
+        v = vals[i]
+        if v == v:
+            add(v)
+        if i >= window:
+            old = vals[i - window]
+            if old == old:
+                remove(old)
+        if len(s) >= min_periods:
+            out[i] = _interpolate(s, qlist)
+    if warmup == n:
+        return out
+
+    # 視窗填滿之後筆數固定為 window，分位數的位置不變：每一步以 itemgetter 一次讀出所有需要的順序統計量
+    pos = qs * (window - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, window - 1)
+    frac = pos - lo
+    get = itemgetter(*lo.tolist(), *hi.tolist())
+    flat = []
+    extend = flat.extend
+    # 第 window-1 筆讓視窗剛好填滿，之後每一步先加入新值再移除離開視窗的值
+    add(vals[window - 1])
+    extend(get(s))
+    pairs = zip(vals[:n - window], vals[window:])
+    if type(s) is list:
+        # 直接呼叫 insort / bisect_left，省下每一步兩次 Python 方法呼叫
+        for old, v in pairs:
+            insort(s, v)
+            del s[bisect_left(s, old)]
+            extend(get(s))
+    else:
+        for old, v in pairs:
+            add(v)
+            remove(old)
+            extend(get(s))
+    order_stats = np.fromiter(flat, dtype=np.float64, count=len(flat)).reshape(-1, 2 * k)
+    low, high = order_stats[:, :k], order_stats[:, k:]
+    out[window - 1:] = low + frac * (high - low)
+    return out
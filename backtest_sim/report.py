@@ -0,0 +1,323 @@
+"""
+報表產生階段：以非互動式 backend (Agg) 繪圖、對長序列降採樣、以 process pool 平行輸出圖表與 HTML 摘要。
+
+圖表以可 pickle 的 dict 描述 (figure / axes / line / scatter ...)，
+在主程序中計算內容雜湊並降採樣後，送到子程序繪製。
+若某張圖的內容雜湊與上次相同且檔案仍在，直接略過不重繪。
+"""
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .decimate import decimate_indices
+
+CACHE_FILE = '.report_cache.json'
+
+
+# ---------------------------------------------------------------------------
+# 圖表描述
+# ---------------------------------------------------------------------------
+def _values(a):
+    """把 Series / Index / list 轉成 numpy array (datetime 保留 datetime64)"""
+    if a is None:
+        return None
+    if hasattr(a, 'to_numpy'):
+        return a.to_numpy()
+    return np.asarray(a)
+
+
+def line(y, x=None, decimate='minmax', **style):
+    """折線，style 直接傳給 Axes.plot (label, color, ...)"""
+    return {'kind': 'line', 'x': _values(x), 'y': _values(y), 'decimate': decimate, 'style': style}
+
+
+def scatter(x, y, **style):
+    """散佈點 (買賣點等稀疏資料，不降採樣)"""
+    return {'kind': 'scatter', 'x': _values(x), 'y': _values(y), 'style': style}
+
+
+def fill_between(y1, y2, x=None, **style):
+    """兩條序列之間填色 (例如累積損益與歷史高點之間的回撤)"""
+    return {'kind': 'fill_between', 'x': _values(x), 'y1': _values(y1), 'y2': _values(y2),
+            'decimate': 'minmax', 'style': style}
+
+
+def bar(height, x=None, sign_colors=None, **style):
+    """
+    長條圖
+    :param sign_colors: (正值顏色, 非正值顏色)，於降採樣後再決定每根長條的顏色
+    """
+    return {'kind': 'bar', 'x': _values(x), 'y': _values(height), 'decimate': 'minmax',
+            'sign_colors': sign_colors, 'style': style}
+
+
+def axhline(y, **style):
+    return {'kind': 'axhline', 'value': y, 'style': style}
+
+
+def axvline(x, **style):
+    return {'kind': 'axvline', 'value': x, 'style': style}
+
+
+def axes(*artists, title=None, xlabel=None, ylabel=None, legend=True, grid=True,
+         xticks=None, xlim=None, fontsize=None):
+    """
+    一個子圖
+    :param grid: True 或傳給 Axes.grid 的 dict
+    :param xticks: (位置, 標籤) tuple
+    :param fontsize: 標題/軸標籤字型大小，None 為預設
+    """
+    return {'artists': list(artists), 'title': title, 'xlabel': xlabel, 'ylabel': ylabel,
+            'legend': legend, 'grid': grid, 'xticks': xticks, 'xlim': xlim, 'fontsize': fontsize}
+
+
+def figure(filename, *subplots, figsize=(12, 6), sharex=False, dpi=300,
+           style='dark_background', tight=True, bbox_inches='tight'):
+    """
+    一張圖 (可包含多個垂直排列的子圖)
+    :param filename: 輸出檔名 (相對於報表資料夾)
+    """
+    return {'filename': filename, 'axes': list(subplots), 'figsize': figsize, 'sharex': sharex,
+            'dpi': dpi, 'style': style, 'tight': tight, 'bbox_inches': bbox_inches}
+
+
+# ---------------------------------------------------------------------------
+# 雜湊與降採樣
+# ---------------------------------------------------------------------------
+def _update_hash(h, obj):
+    if isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        h.update(f'nd{arr.dtype.str}{arr.shape}'.encode())
+        if arr.dtype == object:
+            h.update(repr(arr.tolist()).encode())
+        else:
+            h.update(arr.view(np.uint8).tobytes() if arr.size else b'')
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            h.update(str(key).encode())
+            _update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for item in obj:
+            _update_hash(h, item)
+        h.update(b']')
+    else:
+        h.update(repr(obj).encode())
+
+
+def fingerprint(obj):
+    """計算圖表描述 (含所有資料陣列) 的內容雜湊"""
+    h = hashlib.blake2b(digest_size=16)
+    _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def _decimate_artist(artist, max_points):
+    method = artist.get('decimate')
+    if not method or artist['kind'] not in ('line', 'fill_between', 'bar'):
+        return artist
+
+    ys = [artist['y1'], artist['y2']] if artist['kind'] == 'fill_between' else [artist['y']]
+    n = len(ys[0])
+    if n <= max_points:
+        return artist
+
+    idx = decimate_indices(ys, max_points, method)
+    out = dict(artist)
+    out['x'] = idx if artist['x'] is None else artist['x'][idx]
+    for key in ('y', 'y1', 'y2'):
+        if out.get(key) is not None:
+            out[key] = out[key][idx]
+    return out
+
+
+def decimate_figure(spec, max_points):
+    """回傳一份序列已降採樣的圖表描述 (不修改原本的 spec)"""
+    out = dict(spec)
+    out['axes'] = []
+    for ax in spec['axes']:
+        ax = dict(ax)
+        ax['artists'] = [_decimate_artist(a, max_points) for a in ax['artists']]
+        out['axes'].append(ax)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 繪圖 (子程序)
+# ---------------------------------------------------------------------------
+def _draw_artist(ax, artist):
+    kind = artist['kind']
+    style = artist['style']
+    if kind == 'line':
+        y = artist['y']
+        x = np.arange(len(y)) if artist['x'] is None else artist['x']
+        ax.plot(x, y, **style)
+    elif kind == 'scatter':
+        ax.scatter(artist['x'], artist['y'], **style)
+    elif kind == 'fill_between':
+        y1 = artist['y1']
+        x = np.arange(len(y1)) if artist['x'] is None else artist['x']
+        ax.fill_between(x, y1, artist['y2'], **style)
+    elif kind == 'bar':
+        y = artist['y']
+        x = np.arange(len(y)) if artist['x'] is None else artist['x']
+        if artist.get('sign_colors'):
+            pos, neg = artist['sign_colors']
+            style = dict(style, color=[pos if v > 0 else neg for v in y])
+        ax.bar(x, y, **style)
+    elif kind == 'axhline':
+        ax.axhline(y=artist['value'], **style)
+    elif kind == 'axvline':
+        ax.axvline(x=artist['value'], **style)
+    else:
+        raise ValueError(f"Unknown artist kind: {kind}")
+
+
+def render_figure(spec, save_path):
+    """在目前程序中以 Agg backend 繪製一張圖並存檔，回傳檔案路徑"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with plt.style.context(spec['style'] or 'default'):
+        fig, axs = plt.subplots(len(spec['axes']), 1, figsize=spec['figsize'],
+                                sharex=spec['sharex'], squeeze=False)
+        for ax, ax_spec in zip(axs[:, 0], spec['axes']):
+            for artist in ax_spec['artists']:
+                _draw_artist(ax, artist)
+            font = {} if ax_spec['fontsize'] is None else {'fontsize': ax_spec['fontsize']}
+            if ax_spec['title']:
+                ax.set_title(ax_spec['title'], **font)
+            if ax_spec['xlabel']:
+                ax.set_xlabel(ax_spec['xlabel'], **font)
+            if ax_spec['ylabel']:
+                ax.set_ylabel(ax_spec['ylabel'], **font)
+            if ax_spec['xticks'] is not None:
+                ax.set_xticks(ax_spec['xticks'][0], labels=ax_spec['xticks'][1])
+            if ax_spec['xlim'] is not None:
+                ax.set_xlim(ax_spec['xlim'])
+            if ax_spec['legend']:
+                ax.legend(**({} if ax_spec['legend'] is True else ax_spec['legend']))
+            if ax_spec['grid']:
+                ax.grid(**({} if ax_spec['grid'] is True else ax_spec['grid']))
+        if spec['tight']:
+            fig.tight_layout()
+        path = os.path.join(save_path, spec['filename'])
+        fig.savefig(path, dpi=spec['dpi'], bbox_inches=spec['bbox_inches'])
+        plt.close(fig)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# HTML 摘要
+# ---------------------------------------------------------------------------
+def _format_metric(name, value):
+    if isinstance(value, float):
+        lowered = name.lower()
+        if 'drawdown' in lowered or 'return' in lowered or ('ratio' in lowered and 'sharpe' not in lowered):
+            return f"{value:.2%}"
+        return f"{value:,.4f}"
+    return html.escape(str(value))
+
+
+def write_html(save_path, title, metrics, filenames, html_name='report.html'):
+    """輸出包含績效指標表格與所有圖表的 HTML 摘要"""
+    rows = ''.join(
+        f"<tr><th>{html.escape(str(k))}</th><td>{_format_metric(str(k), v)}</td></tr>"
+        for k, v in (metrics or {}).items()
+    )
+    images = ''.join(
+        f'<figure><img src="{html.escape(name)}" alt="{html.escape(name)}">'
+        f'<figcaption>{html.escape(name)}</figcaption></figure>'
+        for name in filenames
+    )
+    page = (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        f"<title>{html.escape(title)}</title>"
+        "<style>body{background:#111;color:#eee;font-family:sans-serif}"
+        "table{border-collapse:collapse}th,td{padding:4px 12px;border-bottom:1px solid #444;text-align:left}"
+        "img{max-width:100%}</style></head><body>"
+        f"<h1>{html.escape(title)}</h1><table>{rows}</table>{images}</body></html>"
+    )
+    path = os.path.join(save_path, html_name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# 入口
+# ---------------------------------------------------------------------------
+def _load_cache(save_path):
+    try:
+        with open(os.path.join(save_path, CACHE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(save_path, cache):
+    path = os.path.join(save_path, CACHE_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def render_report(figures, save_path='.', metrics=None, title='Backtest Report',
+                  workers=None, max_points=5000, html_name='report.html', force=False):
+    """
+    產生報表：降採樣、平行繪圖與輸出 HTML 摘要 (同一個 process pool)，內容未變的圖表會略過
+    :param figures: figure() 建立的圖表描述 list
+    :param save_path: 輸出資料夾
+    :param metrics: 顯示於 HTML 的績效指標 dict
+    :param title: HTML 標題
+    :param workers: process pool 大小，None 為 min(工作數 (圖表 + HTML), CPU 數)，1 表示在目前程序繪製
+    :param max_points: 每條序列降採樣後的最大點數
+    :param html_name: HTML 檔名，None 則不輸出
+    :param force: True 則忽略快取強制重繪
+    :return: 本次實際重繪的檔案路徑 list
+    """
+    os.makedirs(save_path, exist_ok=True)
+    cache = {} if force else _load_cache(save_path)
+    new_cache = {}
+
+    pending = []
+    for spec in figures:
+        key = fingerprint([spec, max_points])
+        new_cache[spec['filename']] = key
+        path = os.path.join(save_path, spec['filename'])
+        if cache.get(spec['filename']) == key and os.path.exists(path):
+            continue
+        pending.append(decimate_figure(spec, max_points))
+
+    # HTML 只引用圖檔名稱，不需要等圖表畫完，與圖表一起交給 process pool
+    html_args = None
+    if html_name:
+        filenames = [spec['filename'] for spec in figures]
+        html_key = fingerprint([title, metrics, filenames])
+        new_cache[html_name] = html_key
+        if pending or cache.get(html_name) != html_key or not os.path.exists(os.path.join(save_path, html_name)):
+            html_args = (save_path, title, metrics, filenames, html_name)
+
+    rendered = []
+    tasks = len(pending) + (html_args is not None)
+    if workers is None:
+        workers = min(tasks, os.cpu_count() or 1)
+    if workers <= 1 or tasks <= 1:
+        rendered = [render_figure(spec, save_path) for spec in pending]
+        if html_args is not None:
+            write_html(*html_args)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            html_future = pool.submit(write_html, *html_args) if html_args is not None else None
+            rendered = list(pool.map(render_figure, pending, [save_path] * len(pending)))
+            if html_future is not None:
+                html_future.result()
+
+    _save_cache(save_path, new_cache)
+    return rendered
@@ -0,0 +1,408 @@
+"""
+回測結果資料庫 (SQLite)。
+
+各專案每次執行都覆寫 orders.csv、trade_details.csv、equity_curve.csv 與 backtest_results/*.png，
+要比較不同次的結果只能重跑。這裡把每次回測記錄成一筆 run：
+    runs     策略、標的、設定 (JSON 與雜湊)、程式版本 (git commit)、資料區間、績效指標
+    params   每個設定參數一列 (name, value)，可依參數範圍查詢
+    blobs    壓縮後的逐根淨值曲線與交易明細
+策略 / 標的 / 各指標欄位都有索引，例如「BTC 上 window 24..200 的 Sharpe 前 20 名」
+在數十萬筆 run 中也只需數毫秒。
+
+設定環境變數 BACKTEST_SIM_RESULTS=results.sqlite 時，各專案的主程式會自動記錄該次回測。
+
+用法：
+    python -m backtest_sim.results top --db results.sqlite --strategy statistic_cta --symbol BTC \\
+        --param window_size=24:200 -n 20
+    python -m backtest_sim.results ingest --db results.sqlite --jobs runs/stat
+    python -m backtest_sim.results show --db results.sqlite 42
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from . import ROOT
+from .metrics import equity_curve, summary_metrics
+
+METRIC_COLUMNS = ('final_balance', 'sharpe_ratio', 'max_drawdown', 'win_ratio', 'total_trades')
+# 參數條件符合的 run 少於此數時，由 params 索引取出候選後排序
+DRIVE_LIMIT = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_key TEXT NOT NULL UNIQUE,
+    strategy TEXT NOT NULL,
+    symbol TEXT,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    code_version TEXT,
+    data_start TEXT,
+    data_end TEXT,
+    bars INTEGER,
+    created REAL NOT NULL,
+    final_balance REAL,
+    sharpe_ratio REAL,
+    max_drawdown REAL,
+    win_ratio REAL,
+    total_trades INTEGER,
+    metrics TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    text TEXT,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value, text, run_id);
+CREATE TABLE IF NOT EXISTS blobs (
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+""" + ''.join(
+    f"CREATE INDEX IF NOT EXISTS runs_{m} ON runs (strategy, symbol, {m});\n"
+    f"CREATE INDEX IF NOT EXISTS runs_{m}_symbol ON runs (symbol, {m});\n"
+    f"CREATE INDEX IF NOT EXISTS runs_{m}_all ON runs ({m});\n" for m in METRIC_COLUMNS)
+
+
+@functools.lru_cache(maxsize=1)
+def code_version(root=ROOT):
+    """目前程式的 git commit (有未提交的修改時加上 '-dirty')，不是 git 資料夾時為 'unknown'"""
+    try:
+        head = subprocess.run(['git', '-C', root, 'rev-parse', '--short=12', 'HEAD'],
+                              capture_output=True, text=True, timeout=10, check=True).stdout.strip()
+        dirty = subprocess.run(['git', '-C', root, 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+        return head + ('-dirty' if dirty else '')
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+
+def config_hash(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def symbol_from_path(path):
+    """'klines_BTC.csv' -> 'BTC'，'raw_MINAUSDT_futures.csv' -> 'MINAUSDT'"""
+    name = os.path.splitext(os.path.basename(str(path)))[0]
+    match = re.search(r'klines_([A-Za-z0-9]+)', name) or re.search(r'raw_([A-Za-z0-9]+)', name)
+    return match.group(1) if match else name
+
+
+# ---------------------------------------------------------------------------
+# blob 編碼
+# ---------------------------------------------------------------------------
+def encode_array(values):
+    """numpy array -> ('npy+zlib', bytes)"""
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(values), allow_pickle=False)
+    return 'npy+zlib', zlib.compress(buf.getvalue(), 6)
+
+
+def encode_frame(df):
+    """DataFrame -> ('csv+zlib', bytes)"""
+    return 'csv+zlib', zlib.compress(df.to_csv(index=False).encode(), 6)
+
+
+def decode_blob(codec, data):
+    raw = zlib.decompress(data)
+    if codec == 'npy+zlib':
+        return np.load(io.BytesIO(raw), allow_pickle=False)
+    if codec == 'csv+zlib':
+        import pandas as pd
+        return pd.read_csv(io.BytesIO(raw))
+    raise ValueError(f"Unknown blob codec: {codec}")
+
+
+# ---------------------------------------------------------------------------
+# 資料庫
+# ---------------------------------------------------------------------------
+class ResultsStore:
+    """
+    回測結果資料庫
+        store = ResultsStore('results.sqlite')
+        store.record('statistic_cta', 'BTC', {'window_size': 24}, metrics, equity=equity)
+        store.top('sharpe_ratio', 20, strategy='statistic_cta', symbol='BTC', window_size=(24, 200))
+    """
+
+    def __init__(self, path='results.sqlite'):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def record(self, strategy, symbol, config, metrics, data_range=(None, None), bars=None,
+               equity=None, trades=None, version=None):
+        """
+        記錄一次回測 (相同策略、標的、設定、程式版本與資料區間的 run 會被取代)
+        :param config: 參數 dict (數值參數可用 top() 的範圍條件查詢)
+        :param metrics: 績效指標 dict (至少包含 summary_metrics 的欄位)
+        :param data_range: (開始, 結束) 時間
+        :param equity: 逐根淨值 (array-like)，壓縮後保存
+        :param trades: 交易明細 DataFrame，壓縮後保存
+        :return: run id
+        """
+        version = version or code_version()
+        c_hash = config_hash(config)
+        start, end = (None if v is None else str(v) for v in data_range)
+        key = config_hash([strategy, symbol, c_hash, version, start, end])
+        values = [float(metrics[m]) if metrics.get(m) is not None else None for m in METRIC_COLUMNS]
+        with self._db:
+            for (old,) in self._db.execute('SELECT id FROM runs WHERE run_key = ?', (key,)).fetchall():
+                for table, column in (('runs', 'id'), ('params', 'run_id'), ('blobs', 'run_id')):
+                    self._db.execute(f'DELETE FROM {table} WHERE {column} = ?', (old,))
+            run_id = self._db.execute(
+                f"INSERT INTO runs (run_key, strategy, symbol, config_hash, config, code_version, data_start, "
+                f"data_end, bars, created, {', '.join(METRIC_COLUMNS)}, metrics) "
+                f"VALUES ({', '.join('?' * (11 + len(METRIC_COLUMNS)))})",
+                [key, strategy, symbol, c_hash, json.dumps(config, sort_keys=True, default=str), version,
+                 start, end, bars, time.time(), *values, json.dumps(metrics, default=float)]).lastrowid
+            self._db.executemany('INSERT INTO params (run_id, name, value, text) VALUES (?, ?, ?, ?)',
+                                 [(run_id, name, *_param_value(value)) for name, value in config.items()])
+            blobs = []
+            if equity is not None:
+                blobs.append(('equity', *encode_array(np.asarray(equity, dtype=np.float64))))
+            if trades is not None:
+                blobs.append(('trades', *encode_frame(trades)))
+            self._db.executemany('INSERT INTO blobs (run_id, name, codec, data) VALUES (?, ?, ?, ?)',
+                                 [(run_id, *b) for b in blobs])
+        return run_id
+
+    def record_backtest(self, strategy, symbol, config, df, pnl_column='PnL', time_column='Open time',
+                        initial_balance=10000, trades=None):
+        """由 backtesting() 的輸出計算指標與淨值曲線後記錄"""
+        pnl = df[pnl_column].to_numpy(dtype=np.float64)
+        times = df[time_column] if time_column in df.columns else None
+        data_range = (times.iloc[0], times.iloc[-1]) if times is not None and len(df) else (None, None)
+        return self.record(strategy, symbol, config, summary_metrics(pnl, initial_balance), data_range,
+                           bars=len(df), equity=equity_curve(pnl, initial_balance), trades=trades)
+
+    def top(self, metric='sharpe_ratio', n=20, strategy=None, symbol=None, ascending=False, **params):
+        """
+        依指標排序的前 n 筆 run
+        參數條件符合的 run 不多時，由 params 索引取出候選再排序；否則沿指標索引依序掃描，找到 n 筆即停止
+        :param params: 參數條件，(low, high) 為包含兩端的範圍，其他值為相等，例如 window_size=(24, 200)
+        :return: list of dict
+        """
+        if metric not in METRIC_COLUMNS:
+            raise ValueError(f"Unknown metric: {metric} (choose from {', '.join(METRIC_COLUMNS)})")
+        where, args = [f"r.{metric} IS NOT NULL"], []
+        for column, value in (('strategy', strategy), ('symbol', symbol)):
+            if value is not None:
+                where.append(f"r.{column} = ?")
+                args.append(value)
+        conditions = [_param_condition(name, cond) for name, cond in params.items()]
+        driver = min(conditions, key=self._estimate, default=None)
+        if driver is not None and self._estimate(driver) >= DRIVE_LIMIT:
+            driver = None
+        for cond in conditions:
+            if cond is not driver:
+                where.append(f"EXISTS (SELECT 1 FROM params p WHERE p.run_id = r.id AND {cond[0]})")
+                args.extend(cond[1])
+        columns = (f"r.id, r.strategy, r.symbol, r.config, r.code_version, r.data_start, r.data_end, r.bars, "
+                   f"{', '.join('r.' + m for m in METRIC_COLUMNS)}")
+        if driver is None:
+            sql = f"SELECT {columns} FROM runs r WHERE {' AND '.join(where)}"
+        else:
+            sql = (f"SELECT {columns} FROM params p CROSS JOIN runs r ON r.id = p.run_id "
+                   f"WHERE {driver[0]} AND {' AND '.join(where)}")
+            args = list(driver[1]) + args
+        sql += f" ORDER BY r.{metric} {'ASC' if ascending else 'DESC'} LIMIT ?"
+        rows = self._db.execute(sql, args + [n]).fetchall()
+        return [dict(row, config=json.loads(row['config'])) for row in rows]
+
+    def _estimate(self, cond):
+        """參數條件符合的筆數 (最多數到 DRIVE_LIMIT)"""
+        sql = f"SELECT COUNT(*) FROM (SELECT 1 FROM params p WHERE {cond[0]} LIMIT {DRIVE_LIMIT})"
+        return self._db.execute(sql, cond[1]).fetchone()[0]
+
+    def get(self, run_id):
+        row = self._db.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No run {run_id}")
+        return dict(row, config=json.loads(row['config']), metrics=json.loads(row['metrics']))
+
+    def blob(self, run_id, name):
+        """取出並解壓縮 blob ('equity' -> numpy array，'trades' -> DataFrame)，沒有時回傳 None"""
+        row = self._db.execute('SELECT codec, data FROM blobs WHERE run_id = ? AND name = ?', (run_id, name)).fetchone()
+        return None if row is None else decode_blob(row['codec'], row['data'])
+
+    def count(self):
+        return self._db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def analyze(self):
+        """更新查詢最佳化的統計資料 (大量匯入後執行)"""
+        self._db.execute('ANALYZE')
+
+    def close(self):
+        self._db.close()
+
+
+def _param_condition(name, cond):
+    """參數條件 -> (SQL, 參數)，都可以使用 params (name, value, text) 索引"""
+    if isinstance(cond, (tuple, list)):
+        return "p.name = ? AND p.value BETWEEN ? AND ?", (name, float(cond[0]), float(cond[1]))
+    value, text = _param_value(cond)
+    if value is not None:
+        return "p.name = ? AND p.value = ?", (name, value)
+    return "p.name = ? AND p.value IS NULL AND p.text = ?", (name, text)
+
+
+def _param_value(value):
+    """參數值 -> (數值, 文字)，數值型參數存在 value 欄位以便範圍查詢"""
+    if isinstance(value, bool) or value is None:
+        return None, json.dumps(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value), None
+    return None, str(value)
+
+
+# ---------------------------------------------------------------------------
+# 匯入與自動記錄
+# ---------------------------------------------------------------------------
+# jobs 的 task 名稱 -> 專案名稱
+TASK_STRATEGIES = {'statistic': 'statistic_cta', 'ml_fold': 'ml_cta'}
+DATA_PARAMS = ('klines', 'start', 'end')
+
+
+def _ingest_record(store, task_name, params, result, version):
+    config = {k: v for k, v in params.items() if k not in DATA_PARAMS}
+    symbol = params.get('symbol') or (symbol_from_path(params['klines']) if params.get('klines') else None)
+    return store.record(TASK_STRATEGIES.get(task_name, task_name), symbol, config, result,
+                        (params.get('start'), params.get('end')), bars=result.get('bars'), version=version)
+
+
+def ingest_jobs(store, checkpoint_dir, version=None):
+    """匯入 jobs 的 checkpoint 資料夾中已完成的 unit，回傳匯入筆數"""
+    from .jobs import CheckpointStore
+
+    n = 0
+    for record in CheckpointStore(checkpoint_dir).records():
+        _ingest_record(store, record['task'], record['params'], record['result'], version)
+        n += 1
+    return n
+
+
+def ingest_queue(store, db, version=None):
+    """匯入 taskqueue 中已完成的工作，回傳匯入筆數"""
+    from .taskqueue import TaskQueue
+
+    queue = TaskQueue(db)
+    try:
+        results = queue.results()
+    finally:
+        queue.close()
+    for r in results:
+        _ingest_record(store, r['task'], r['params'], r['result'], version)
+    return len(results)
+
+
+def record_from_env(strategy, symbol, config, df=None, metrics=None, **kwargs):
+    """
+    環境變數 BACKTEST_SIM_RESULTS 有設定時記錄這次回測 (各專案主程式呼叫，未設定時不做任何事)
+    :param df: backtesting() 的輸出 (以 record_backtest 記錄)；或改傳 metrics 與 record() 的其他參數
+    :return: run id 或 None
+    """
+    path = os.environ.get('BACKTEST_SIM_RESULTS')
+    if not path:
+        return None
+    store = ResultsStore(path)
+    try:
+        if df is not None:
+            run_id = store.record_backtest(strategy, symbol, config, df, **kwargs)
+        else:
+            run_id = store.record(strategy, symbol, config, metrics, **kwargs)
+    finally:
+        store.close()
+    print(f"Recorded run {run_id} in {path}")
+    return run_id
+
+
+# ---------------------------------------------------------------------------
+# 命令列
+# ---------------------------------------------------------------------------
+def _parse_param(text):
+    """'window_size=24:200' -> ('window_size', (24.0, 200.0))，'symbol=BTC' -> ('symbol', 'BTC')"""
+    name, _, value = text.partition('=')
+    if ':' in value:
+        low, high = value.split(':')
+        return name, (float(low), float(high))
+    try:
+        return name, float(value)
+    except ValueError:
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indexed results store for backtest runs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('top', help="best runs by a metric")
+    p.add_argument('--metric', default='sharpe_ratio', choices=METRIC_COLUMNS)
+    p.add_argument('-n', type=int, default=20)
+    p.add_argument('--strategy')
+    p.add_argument('--symbol')
+    p.add_argument('--param', action='append', default=[], help="name=value or name=low:high (repeatable)")
+    p.add_argument('--ascending', action='store_true')
+    p = sub.add_parser('ingest', help="import finished job units")
+    p.add_argument('--jobs', help="jobs checkpoint directory")
+    p.add_argument('--queue', help="taskqueue SQLite file")
+    p = sub.add_parser('show', help="one run with its equity / trade blobs")
+    p.add_argument('run_id', type=int)
+    p.add_argument('--equity-out')
+    p.add_argument('--trades-out')
+    for p in sub.choices.values():
+        p.add_argument('--db', default='results.sqlite')
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.db)
+    if args.command == 'top':
+        start = time.perf_counter()
+        rows = store.top(args.metric, args.n, args.strategy, args.symbol, args.ascending,
+                         **dict(_parse_param(p) for p in args.param))
+        elapsed = (time.perf_counter() - start) * 1000
+        for row in rows:
+            config = ' '.join(f"{k}={v}" for k, v in row['config'].items())
+            print(f"{row['id']:>8d} {row['strategy']:14s} {str(row['symbol']):8s} "
+                  f"{args.metric}={row[args.metric]:.4f}  {config}")
+        print(f"{len(rows)} of {store.count():,} runs ({elapsed:.1f} ms)")
+    elif args.command == 'ingest':
+        n = (ingest_jobs(store, args.jobs) if args.jobs else 0) + (ingest_queue(store, args.queue) if args.queue else 0)
+        store.analyze()
+        print(f"{n:,} runs ingested into {args.db}")
+    else:
+        run = store.get(args.run_id)
+        for key in ('strategy', 'symbol', 'code_version', 'data_start', 'data_end', 'bars'):
+            print(f"{key:14s} {run[key]}")
+        print(f"{'config':14s} {json.dumps(run['config'])}")
+        for key, value in run['metrics'].items():
+            print(f"{key:14s} {value}")
+        equity, trades = store.blob(args.run_id, 'equity'), store.blob(args.run_id, 'trades')
+        if args.equity_out and equity is not None:
+            np.savetxt(args.equity_out, equity, delimiter=',', header='equity', comments='')
+        if args.trades_out and trades is not None:
+            trades.to_csv(args.trades_out, index=False)
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+訊號規則的運算式層。
+
+各專案的訊號原本都是手寫的 Python 迴圈 (get_direction、generate_signals、generate_cci_signals、OBV 交叉)，
+每多一種規則變化就要多寫一個迴圈。這裡以 Python 運算式語法描述規則，編譯成 NumPy 向量運算：
+    Rule('Close < MA(24) - k * STD(24)')
+    Rule('crosses_above(OBV, SMA(OBV, 25))')
+    RuleSet([('CCI < lower and prev(CCI) >= lower', 1), ('CCI > upper', -1)])
+
+名稱為資料欄位或參數 (evaluate 的關鍵字參數優先)。支援：
+    + - * / **、< <= > >= == !=、and or not (亦可用 & | ~)
+    MA / SMA / STD / VAR / SUM / MAX / MIN (x, n)   滾動視窗 (pandas rolling，與 add_factors 算出的欄位相同)；只給 n 時 x 為 Close
+    EMA(x, span)                                    指數移動平均 (adjust=False)
+    prev(x[, k])                                    前 k 根的值 (前 k 列為 NaN，比較結果為 False)
+    abs(x)
+    crosses_above(a, b)                             prev(a) < prev(b) and a >= b
+    crosses_below(a, b)                             prev(a) > prev(b) and a <= b
+
+運算式解析為正規化的 tuple，同一次 evaluate 內相同的子運算式 (例如多個條件共用的 MA(Close, 24)) 只計算一次。
+參數傳入 list / array 時一次計算整批參數值 (各批次參數按位置對應)，結果為 (批次數, 列數) 的 array；
+批次中相同的視窗長度也只計算一次。
+"""
+import ast
+
+import numpy as np
+
+# 滾動視窗函式 -> pandas rolling 的方法
+WINDOW_FUNCTIONS = {'MA': 'mean', 'SMA': 'mean', 'STD': 'std', 'VAR': 'var', 'SUM': 'sum', 'MAX': 'max', 'MIN': 'min'}
+DEFAULT_INPUT = 'Close'
+
+_BINARY = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**'}
+_LOGICAL = {ast.BitAnd: 'and', ast.BitOr: 'or'}
+_COMPARE = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!='}
+_UFUNCS = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide, '**': np.power,
+           '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+           '==': np.equal, '!=': np.not_equal, 'and': np.logical_and, 'or': np.logical_or}
+
+
+# ---------------------------------------------------------------------------
+# 解析
+# ---------------------------------------------------------------------------
+def parse(text):
+    """規則運算式 -> 正規化的 tuple 節點 (可作為 dict key，相同的子運算式得到相同的節點)"""
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid rule {text!r}: {e.msg}") from None
+    return _node(tree.body, text)
+
+
+def _node(n, text):
+    def unsupported():
+        return ValueError(f"Unsupported syntax in rule {text!r}: {ast.unparse(n)}")
+
+    if isinstance(n, ast.Constant) and isinstance(n.value, (int, float)) and not isinstance(n.value, bool):
+        return ('num', n.value)
+    if isinstance(n, ast.Name):
+        return ('name', n.id)
+    if isinstance(n, ast.BinOp) and type(n.op) in _BINARY:
+        return ('op', _BINARY[type(n.op)], _node(n.left, text), _node(n.right, text))
+    if isinstance(n, ast.BinOp) and type(n.op) in _LOGICAL:
+        return ('op', _LOGICAL[type(n.op)], _node(n.left, text), _node(n.right, text))
+    if isinstance(n, ast.UnaryOp):
+        if isinstance(n.op, ast.USub):
+            operand = _node(n.operand, text)
+            return ('num', -operand[1]) if operand[0] == 'num' else ('neg', operand)
+        if isinstance(n.op, ast.UAdd):
+            return _node(n.operand, text)
+        if isinstance(n.op, (ast.Not, ast.Invert)):
+            return ('not', _node(n.operand, text))
+    if isinstance(n, ast.BoolOp):
+        op = 'and' if isinstance(n.op, ast.And) else 'or'
+        out = _node(n.values[0], text)
+        for value in n.values[1:]:
+            out = ('op', op, out, _node(value, text))
+        return out
+    if isinstance(n, ast.Compare) and all(type(op) in _COMPARE for op in n.ops):
+        # a < b < c -> a < b and b < c
+        operands = [_node(x, text) for x in [n.left, *n.comparators]]
+        out = None
+        for op, left, right in zip(n.ops, operands, operands[1:]):
+            cmp = ('op', _COMPARE[type(op)], left, right)
+            out = cmp if out is None else ('op', 'and', out, cmp)
+        return out
+    if isinstance(n, ast.Call) and isinstance(n.func, ast.Name) and not n.keywords:
+        return _call(n.func.id, [_node(a, text) for a in n.args], unsupported)
+    raise unsupported()
+
+
+def _call(name, args, unsupported):
+    if name in WINDOW_FUNCTIONS and len(args) in (1, 2):
+        x, window = args if len(args) == 2 else (('name', DEFAULT_INPUT), args[0])
+        return ('window', WINDOW_FUNCTIONS[name], x, window)
+    if name == 'EMA' and len(args) == 2:
+        return ('ema', args[0], args[1])
+    if name == 'prev' and len(args) in (1, 2):
+        k = args[1] if len(args) == 2 else ('num', 1)
+        if k[0] != 'num' or not isinstance(k[1], int) or k[1] < 1:
+            raise unsupported()
+        return ('prev', args[0], k[1])
+    if name == 'abs' and len(args) == 1:
+        return ('abs', args[0])
+    if name in ('crosses_above', 'crosses_below') and len(args) == 2:
+        a, b = args
+        before, now = ('<', '>=') if name == 'crosses_above' else ('>', '<=')
+        return ('op', 'and', ('op', before, ('prev', a, 1), ('prev', b, 1)), ('op', now, a, b))
+    raise unsupported()
+
+
+# ---------------------------------------------------------------------------
+# 計算
+# ---------------------------------------------------------------------------
+def _rolling(x, window, method, ema=False):
+    import pandas as pd
+
+    frame = pd.Series(x) if x.ndim == 1 else pd.DataFrame(x.T)
+    result = frame.ewm(span=window, adjust=False).mean() if ema else getattr(frame.rolling(window), method)()
+    return result.to_numpy() if x.ndim == 1 else result.to_numpy().T
+
+
+def _shift(x, k):
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    out[..., k:] = x[..., :-k]
+    return out
+
+
+class _Evaluator:
+    """一次 evaluate 的資料、參數與子運算式快取"""
+
+    def __init__(self, data, params):
+        self.data = data
+        self.rows = len(data) if hasattr(data, 'columns') else len(next(iter(data.values()), ()))
+        self.batch = None
+        self.params = {}
+        for name, value in params.items():
+            if isinstance(value, (list, tuple, np.ndarray)):
+                value = np.asarray(value)
+                if self.batch is not None and len(value) != self.batch:
+                    raise ValueError(f"Batched parameters must have the same length ({name!r} has {len(value)}, "
+                                     f"expected {self.batch})")
+                self.batch = len(value)
+                value = value.reshape(-1, 1)
+            self.params[name] = value
+        self.cache = {}
+
+    @property
+    def shape(self):
+        return (self.rows,) if self.batch is None else (self.batch, self.rows)
+
+    def column(self, name):
+        try:
+            values = self.data[name]
+        except KeyError:
+            raise ValueError(f"Unknown name {name!r}: not a column or parameter") from None
+        return values.to_numpy() if hasattr(values, 'to_numpy') else np.asarray(values)
+
+    def window(self, x, window, method, ema=False):
+        x = np.asarray(self(x), dtype=np.float64)
+        window = self(window)
+        if np.ndim(window) == 0:
+            return _rolling(np.broadcast_to(x, self.shape[-x.ndim:]) if x.ndim else np.full(self.rows, x),
+                            int(window), method, ema)
+        # 批次的視窗長度：輸入不隨批次變化時，相同長度只計算一次
+        out = np.empty(self.shape)
+        done = {}
+        for b, n in enumerate(window.ravel()):
+            if x.ndim < 2:
+                if int(n) not in done:
+                    done[int(n)] = _rolling(np.broadcast_to(x, (self.rows,)), int(n), method, ema)
+                out[b] = done[int(n)]
+            else:
+                out[b] = _rolling(np.broadcast_to(x, self.shape)[b], int(n), method, ema)
+        return out
+
+    def __call__(self, node):
+        if node in self.cache:
+            return self.cache[node]
+        kind = node[0]
+        if kind == 'num':
+            value = node[1]
+        elif kind == 'name':
+            value = self.params[node[1]] if node[1] in self.params else self.column(node[1])
+        elif kind == 'op':
+            value = _UFUNCS[node[1]](self(node[2]), self(node[3]))
+        elif kind == 'neg':
+            value = np.negative(self(node[1]))
+        elif kind == 'not':
+            value = np.logical_not(self(node[1]))
+        elif kind == 'abs':
+            value = np.abs(self(node[1]))
+        elif kind == 'prev':
+            value = self(node[1])
+            if np.ndim(value) == 0 or np.shape(value)[-1] != self.rows:
+                value = np.broadcast_to(value, self.shape)
+            value = _shift(value, node[2])
+        elif kind == 'window':
+            value = self.window(node[2], node[3], node[1])
+        elif kind == 'ema':
+            value = self.window(node[1], node[2], None, ema=True)
+        else:
+            raise ValueError(f"Unknown node {node!r}")
+        self.cache[node] = value
+        return value
+
+    def full(self, node):
+        """結果展開成 (列數,) 或 (批次數, 列數)"""
+        return np.broadcast_to(self(node), self.shape)
+
+
+class Rule:
+    """單一運算式 (條件或數值)"""
+
+    def __init__(self, text):
+        self.text = text
+        self.node = parse(text)
+
+    def __repr__(self):
+        return f"Rule({self.text!r})"
+
+    def _evaluate(self, ev, **kw):
+        return ev.full(self.node)
+
+    def evaluate(self, data, **params):
+        """
+        :param data: DataFrame 或 {欄位: array}
+        :param params: 參數值；list / array 為一批參數值
+        :return: (列數,) 或 (批次數, 列數) 的 array
+        """
+        return self._evaluate(_Evaluator(data, params))
+
+
+class RuleSet:
+    """
+    依序的 (條件, 輸出值)：每一列取第一個成立的條件的值 (與手寫迴圈的 if / elif 相同；
+    依序以 df.loc 指定、後者覆寫前者的寫法，則把條件反序排列)
+    """
+
+    def __init__(self, cases, default=0, hold=False):
+        """
+        :param cases: [(條件運算式, 值), ...]，值為數字或參數名稱
+        :param default: 沒有條件成立時的值
+        :param hold: True 時沒有條件成立就沿用前一列的值 (例如 get_direction 的趨勢)，第一列之前為 initial
+        """
+        self.cases = [(Rule(condition), parse(str(value))) for condition, value in cases]
+        self.default = default
+        self.hold = hold
+
+    def __repr__(self):
+        return f"RuleSet({[(r.text, v) for r, v in self.cases]!r}, default={self.default!r}, hold={self.hold!r})"
+
+    def _evaluate(self, ev, initial=None):
+        conditions = [np.asarray(ev.full(rule.node), dtype=bool) for rule, _ in self.cases]
+        values = [ev.full(value) for _, value in self.cases]
+        chosen = np.select(conditions, values, self.default)
+        if not self.hold:
+            return chosen
+        hit = np.logical_or.reduce(conditions) if conditions else np.zeros(ev.shape, dtype=bool)
+        # 每一列最近一次有條件成立的位置，之前都沒有時用 initial
+        last = np.maximum.accumulate(np.where(hit, np.arange(ev.rows), -1), axis=-1)
+        held = np.take_along_axis(chosen, np.maximum(last, 0), axis=-1) if chosen.ndim > 1 else chosen[np.maximum(last, 0)]
+        return np.where(last >= 0, held, self.default if initial is None else initial)
+
+    def evaluate(self, data, initial=None, **params):
+        """
+        :param initial: hold 時第一列之前的值 (分塊處理時為上一個區塊最後的值)，None 為 default
+        :return: (列數,) 或 (批次數, 列數) 的 array
+        """
+        return self._evaluate(_Evaluator(data, params), initial=initial)
+
+
+def evaluate(rules, data, **params):
+    """
+    一次計算多個規則，所有規則共用子運算式快取
+    :param rules: {名稱: Rule / RuleSet / 運算式字串}
+    :return: {名稱: array}
+    """
+    ev = _Evaluator(data, params)
+    return {name: (Rule(rule) if isinstance(rule, str) else rule)._evaluate(ev) for name, rule in rules.items()}
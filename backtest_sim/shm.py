@@ -0,0 +1,248 @@
+"""
+多 process 共用的行情資料伺服器。
+
+參數掃描與策略 worker 原本各自讀取一份 K 線 / 因子 / 成交紀錄，64 個 worker 就佔用 64 倍的記憶體與讀檔時間。
+MarketDataServer 在主 process 把資料讀取一次，放進
+    'shm'     multiprocessing.shared_memory (每個資料集一塊，各欄位 64 bytes 對齊連續存放)
+    'memmap'  欄式資料夾 (backtest_sim.columnar)，worker 以唯讀 memmap 映射
+worker 以 handle (描述各資料集位置的 JSON 字串，或環境變數 BACKTEST_SIM_SHM) 呼叫 attach()，
+以名稱取得唯讀的 numpy view 或 DataFrame，不複製資料，attach 的成本與資料大小無關。
+
+    with MarketDataServer() as server:
+        server.add('BTC', load_klines('klines_BTC.csv', time_as='datetime'))
+        server.export()                       # 之後建立的子 process 繼承 BACKTEST_SIM_SHM
+        ... 啟動 worker ...
+
+    # worker
+    df = attach().frame('BTC')                # 唯讀欄位；backtesting() 新增欄位不影響共享的資料
+    closes = attach().array('BTC', 'Close')
+
+DataFrame 的欄位為唯讀 view，寫入既有欄位時 pandas 會先複製該欄位 (copy-on-write)，不會改到共享的資料。
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .columnar import ColumnarWriter, frame_from_arrays, open_columnar, read_schema
+
+ENV_VAR = 'BACKTEST_SIM_SHM'
+ALIGN = 64
+
+
+def _codes(codes, categories):
+    """
+    category 欄位的 (spec, 代碼)
+    代碼存成 pandas 依類別數選用的 dtype (int8 / int16 / int32)，frame() 組成 Categorical 時不必轉型複製
+    """
+    n = len(categories)
+    dtype = np.int8 if n < 127 else np.int16 if n < 32767 else np.int32
+    codes = np.asarray(codes).astype(dtype, copy=False)
+    return {'kind': 'category', 'dtype': codes.dtype.str, 'categories': list(categories)}, codes
+
+
+def _encode(data):
+    """
+    DataFrame 或 {欄位: array} -> [(欄位名稱, spec, array)]，spec 與 columnar 的 schema 相同
+    字串 / category 欄位存為整數代碼與類別表，其他欄位 (含 datetime64) 維持原本的 dtype
+    """
+    items = data.items() if isinstance(data, dict) else ((c, data[c]) for c in data.columns)
+    out = []
+    for name, values in items:
+        if hasattr(values, 'cat'):
+            out.append((name, *_codes(values.cat.codes.to_numpy(), [str(c) for c in values.cat.categories])))
+            continue
+        values = values.to_numpy() if hasattr(values, 'to_numpy') else np.asarray(values)
+        if values.dtype == object or values.dtype.kind == 'U':
+            uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+            out.append((name, *_codes(inverse, uniques.tolist())))
+        else:
+            out.append((name, {'kind': 'array', 'dtype': values.dtype.str}, np.ascontiguousarray(values)))
+    return out
+
+
+class MarketDataServer:
+    """
+    在主 process 持有共享的資料集，結束 (close / with 區塊結束) 時釋放
+    :param backend: 'shm' (共享記憶體) 或 'memmap' (欄式資料夾)
+    :param root: memmap 的資料夾，None 時使用暫存資料夾並在 close 時刪除
+    """
+
+    def __init__(self, backend='shm', root=None):
+        if backend not in ('shm', 'memmap'):
+            raise ValueError(f"Unknown backend: {backend} (choose 'shm' or 'memmap')")
+        self.backend = backend
+        self._own_root = backend == 'memmap' and root is None
+        self.root = tempfile.mkdtemp(prefix='backtest_sim_shm_') if self._own_root else root
+        self.datasets = {}
+        self._blocks = []
+
+    def add(self, name, data):
+        """
+        加入一個資料集 (複製一次到共享記憶體 / 欄式資料夾)
+        :param data: DataFrame 或 {欄位: array}
+        :return: 筆數
+        """
+        if self.backend == 'memmap':
+            path = os.path.join(self.root, f"{len(self.datasets)}.cols")
+            with ColumnarWriter(path) as writer:
+                writer.write(data)
+            self.datasets[name] = {'path': path, 'rows': writer.rows}
+            return writer.rows
+
+        from multiprocessing import shared_memory
+
+        columns = _encode(data)
+        rows = len(columns[0][2]) if columns else 0
+
+        offset, specs = 0, {}
+        for column, spec, values in columns:
+            specs[column] = dict(spec, offset=offset)
+            offset += -(-values.nbytes // ALIGN) * ALIGN
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for column, spec, values in columns:
+            view = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf, offset=specs[column]['offset'])
+            view[:] = values
+        self._blocks.append(block)
+        self.datasets[name] = {'block': block.name, 'rows': rows, 'columns': specs}
+        return rows
+
+    def add_file(self, name, path, **kwargs):
+        """讀取 K 線 / 成交紀錄檔 (CSV 或欄式資料夾) 後加入，kwargs 傳給 loaders.load_csv"""
+        from .loaders import load_csv
+
+        return self.add(name, load_csv(path, report=False, **kwargs))
+
+    @property
+    def handle(self):
+        """傳給 attach() 的字串 (JSON)，可經由參數、pickle 或環境變數傳給 worker"""
+        return json.dumps({'backend': self.backend, 'datasets': self.datasets})
+
+    def export(self):
+        """設定環境變數 BACKTEST_SIM_SHM，之後建立的子 process 不帶參數呼叫 attach() 即可"""
+        os.environ[ENV_VAR] = self.handle
+        return self.handle
+
+    def close(self):
+        if os.environ.get(ENV_VAR) == self.handle:
+            del os.environ[ENV_VAR]
+        _attached.pop(self.handle, None)
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        if self._own_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MarketData:
+    """worker 端：以名稱取得共享資料集的唯讀 view"""
+
+    def __init__(self, handle):
+        manifest = json.loads(handle) if isinstance(handle, str) else handle
+        self.backend = manifest['backend']
+        self.datasets = manifest['datasets']
+        self._blocks = {}
+        self._arrays = {}
+
+    def __contains__(self, name):
+        return name in self.datasets
+
+    def names(self):
+        return list(self.datasets)
+
+    def schema(self, name):
+        """資料集的 schema (columnar 格式：'rows' 與各欄位的 kind / dtype / categories)"""
+        info = self.datasets[name]
+        if self.backend == 'memmap':
+            return read_schema(info['path'])
+        return {'rows': info['rows'], 'columns': info['columns']}
+
+    def _block(self, name):
+        if name not in self._blocks:
+            self._blocks[name] = _open_block(self.datasets[name]['block'])
+        return self._blocks[name]
+
+    def arrays(self, name, columns=None):
+        """
+        {欄位: 唯讀 numpy array} (category 欄位為整數代碼)
+        :param columns: 只取指定欄位，None 為全部
+        """
+        if name not in self._arrays:
+            if self.backend == 'memmap':
+                self._arrays[name] = open_columnar(self.datasets[name]['path'])
+            else:
+                info, block = self.datasets[name], self._block(name)
+                buf = getattr(block, 'buf', block)
+                arrays = {}
+                for column, spec in info['columns'].items():
+                    view = np.frombuffer(buf, dtype=np.dtype(spec['dtype']), count=info['rows'], offset=spec['offset'])
+                    view.flags.writeable = False
+                    arrays[column] = view
+                self._arrays[name] = arrays
+        arrays = self._arrays[name]
+        return arrays if columns is None else {c: arrays[c] for c in columns}
+
+    def array(self, name, column):
+        return self.arrays(name)[column]
+
+    def frame(self, name, columns=None):
+        """以唯讀 view 組成的 DataFrame (category 欄位還原為 pandas Categorical)"""
+        return frame_from_arrays(self.schema(name), self.arrays(name, columns))
+
+    def close(self):
+        """釋放對映 (之前取得的 view / DataFrame 仍在使用時，對映在它們被回收後才會解除)"""
+        self._arrays = {}
+        self._blocks = {}
+
+
+def _open_block(name):
+    """
+    對映 MarketDataServer 建立的共享記憶體，回傳 SharedMemory 或唯讀的 mmap
+    共享記憶體由 MarketDataServer 釋放；attach 端不向 resource tracker 登記，
+    否則 Python 3.12 以前獨立啟動的 worker 結束時會把共享記憶體刪除，而同一個 tracker 的 worker 取消登記又會影響主 process
+    """
+    from multiprocessing import shared_memory
+
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.12 以前沒有 track 參數
+        if os.name == 'nt':
+            # Windows 的共享記憶體不經過 resource tracker
+            block = shared_memory.SharedMemory(name=name)
+        else:
+            import _posixshmem
+            import mmap
+
+            fd = _posixshmem.shm_open('/' + name, os.O_RDONLY, mode=0o600)
+            try:
+                return mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+    return block
+
+
+_attached = {}
+
+
+def attach(handle=None):
+    """
+    連接共享的資料集 (同一個 process 內重複呼叫回傳同一個物件)
+    :param handle: MarketDataServer.handle，None 時讀取環境變數 BACKTEST_SIM_SHM
+    :return: MarketData，沒有 handle 時回傳 None
+    """
+    handle = handle or os.environ.get(ENV_VAR)
+    if not handle:
+        return None
+    if handle not in _attached:
+        _attached[handle] = MarketData(handle)
+    return _attached[handle]
@@ -0,0 +1,376 @@
+"""
+合成市場資料產生器，供離線、大規模測試使用。
+
+- klines()：與 Binance /fapi/v1/klines 相同的 12 個欄位
+- repo_klines()：與各專案 preprocess.py 輸出的 klines_BTC.csv 相同的欄位
+- iter_agg_trades()：成交紀錄 (trade Id, price, qty, quoteQty, time, isBuyerMaker, isBestMatch)，
+  以區塊產生，可產生數十億筆而不佔用大量記憶體
+- funding_rates()：資金費率事件序列
+價格模型可選幾何布朗運動 (gbm)、Merton 跳躍擴散 (jump)，或以相關係數矩陣產生多資產報酬。
+所有函式皆以 seed 控制亂數，結果可重現。
+
+用法：
+    python -m backtest_sim.synth klines --rows 1000000 --interval 1m --out klines_BTC.parquet
+    python -m backtest_sim.synth trades --rows 2000000000 --chunk-size 5000000 --out trades.cols
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from .timeutil import YEAR_MS, interval_ms, to_epoch_ms
+
+BINANCE_KLINE_COLUMNS = [
+    'Open time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close time',
+    'Quote asset volume', 'Number of trades', 'Taker buy base asset volume',
+    'Taker buy quote asset volume', 'Ignore'
+]
+
+REPO_KLINE_COLUMNS = [
+    'Open time', 'Open', 'High', 'Low', 'Close', 'Volume',
+    'Taker buy base asset volume', 'Taker buy quote asset volume', 'Symbol'
+]
+
+AGG_TRADE_COLUMNS = ['trade Id', 'price', 'qty', 'quoteQty', 'time', 'isBuyerMaker', 'isBestMatch']
+
+
+# ---------------------------------------------------------------------------
+# 報酬模型
+# ---------------------------------------------------------------------------
+def gbm_returns(n, sigma=0.6, mu=0.0, dt=1 / 8760, rng=None):
+    """
+    幾何布朗運動的對數報酬
+    :param sigma: 年化波動度
+    :param mu: 年化漂移
+    :param dt: 每步佔一年的比例
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    return (mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(n)
+
+
+def jump_diffusion_returns(n, sigma=0.6, mu=0.0, dt=1 / 8760, jump_intensity=20.0,
+                           jump_mean=0.0, jump_std=0.03, rng=None):
+    """
+    Merton 跳躍擴散的對數報酬
+    :param jump_intensity: 每年平均跳躍次數
+    :param jump_mean: 跳躍幅度 (對數) 平均
+    :param jump_std: 跳躍幅度 (對數) 標準差
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    returns = gbm_returns(n, sigma, mu, dt, rng)
+    counts = rng.poisson(jump_intensity * dt, n)
+    jumps = np.flatnonzero(counts)
+    # k 次跳躍的總和 ~ N(k * mean, k * std^2)
+    returns[jumps] += rng.normal(counts[jumps] * jump_mean, np.sqrt(counts[jumps]) * jump_std)
+    return returns
+
+
+def correlated_returns(n, corr, sigmas, mu=0.0, dt=1 / 8760, rng=None):
+    """
+    多資產相關的 GBM 對數報酬
+    :param corr: k x k 相關係數矩陣
+    :param sigmas: 長度 k 的年化波動度
+    :return: (n, k) 矩陣
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    corr = np.asarray(corr, dtype=np.float64)
+    sigmas = np.broadcast_to(np.asarray(sigmas, dtype=np.float64), (corr.shape[0],))
+    chol = np.linalg.cholesky(corr)
+    z = rng.standard_normal((n, corr.shape[0])) @ chol.T
+    return (mu - 0.5 * sigmas**2) * dt + sigmas * np.sqrt(dt) * z
+
+
+# 各價格模型接受的參數
+MODEL_PARAMS = {'gbm': ('sigma', 'mu'), 'jump': ('sigma', 'mu', 'jump_intensity', 'jump_mean', 'jump_std')}
+
+
+def _returns(model, n, dt, rng, **params):
+    """dt 可為純量或每步的 array (例如成交之間不等長的時間間隔)"""
+    if model not in MODEL_PARAMS:
+        raise ValueError(f"Unknown price model: {model}")
+    unknown = set(params) - set(MODEL_PARAMS[model])
+    if unknown:
+        raise ValueError(f"Unknown parameters for the {model} model: {', '.join(sorted(unknown))}")
+    if model == 'gbm':
+        return gbm_returns(n, dt=dt, rng=rng, **params)
+    return jump_diffusion_returns(n, dt=dt, rng=rng, **params)
+
+
+# ---------------------------------------------------------------------------
+# K 線
+# ---------------------------------------------------------------------------
+def _ohlcv_from_returns(log_returns, s0, step_ms, rng, tick_size):
+    """由每根 K 線的對數報酬建立 OHLCV 與 Binance 其餘欄位 (皆為 numpy array)"""
+    n = len(log_returns)
+    close = s0 * np.exp(np.cumsum(log_returns))
+    open_ = np.empty(n)
+    open_[0] = s0
+    open_[1:] = close[:-1]
+
+    # 以當根報酬的尺度估計影線長度 (Brownian bridge 的極值約為 |N| * 波動)
+    bar_vol = np.std(log_returns) if n > 1 else 0.01
+    wick_up = np.abs(rng.standard_normal(n)) * bar_vol * 0.5
+    wick_down = np.abs(rng.standard_normal(n)) * bar_vol * 0.5
+    high = np.maximum(open_, close) * np.exp(wick_up)
+    low = np.minimum(open_, close) * np.exp(-wick_down)
+    if tick_size:
+        open_, high, low, close = (np.round(a / tick_size) * tick_size for a in (open_, high, low, close))
+
+    # 成交量與價格變動幅度正相關
+    activity = 1 + np.abs(log_returns) / (bar_vol + 1e-12)
+    volume = rng.lognormal(mean=np.log(step_ms / 60_000 * 50), sigma=0.6, size=n) * activity
+    typical = (high + low + close) / 3
+    quote_volume = volume * typical
+    n_trades = rng.poisson(np.maximum(volume * 20, 1)).astype(np.int64)
+    buy_ratio = np.clip(0.5 + np.sign(log_returns) * rng.beta(2, 8, n), 0, 1)
+    taker_base = volume * buy_ratio
+    taker_quote = taker_base * typical
+    return open_, high, low, close, volume, quote_volume, n_trades, taker_base, taker_quote
+
+
+def klines(n, start='2024-01-01', interval='1h', s0=30000.0, model='gbm', sigma=0.6, mu=0.0,
+           tick_size=0.01, seed=None, **model_params):
+    """
+    產生 n 根 K 線，欄位與 Binance klines API 相同 (已轉為數值，時間為毫秒整數)
+    :param start: 第一根 K 線的開盤時間
+    :param interval: '1m', '1h', '4h' ...
+    :param s0: 起始價格
+    :param model: 'gbm' 或 'jump'
+    :param sigma: 年化波動度
+    :param tick_size: 價格最小跳動單位，None 為不取整
+    :param seed: 亂數種子
+    :return: DataFrame (BINANCE_KLINE_COLUMNS)
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    step = interval_ms(interval)
+    log_returns = _returns(model, n, step / YEAR_MS, rng, sigma=sigma, mu=mu, **model_params)
+    cols = _ohlcv_from_returns(log_returns, s0, step, rng, tick_size)
+    open_time = to_epoch_ms(start) + step * np.arange(n, dtype=np.int64)
+    return pd.DataFrame(dict(zip(BINANCE_KLINE_COLUMNS, (
+        open_time, *cols[:5], open_time + step - 1, cols[5], cols[6], cols[7], cols[8],
+        np.zeros(n, dtype=np.int64),
+    ))))
+
+
+def to_repo_klines(df, symbol='BTCUSDT'):
+    """把 Binance 12 欄 K 線轉成各專案 preprocess.py 輸出的格式 (Open time 為 datetime)"""
+    import pandas as pd
+
+    out = df[REPO_KLINE_COLUMNS[:-1]].copy()
+    out['Open time'] = pd.to_datetime(out['Open time'], unit='ms')
+    out['Symbol'] = symbol
+    return out
+
+
+def repo_klines(n, symbol='BTCUSDT', **kwargs):
+    """產生與 klines_BTC.csv 相同欄位的 K 線 (參數同 klines())"""
+    return to_repo_klines(klines(n, **kwargs), symbol)
+
+
+def multi_asset_klines(symbols, n, corr, s0=None, sigmas=0.6, start='2024-01-01', interval='1h',
+                       tick_size=0.01, seed=None):
+    """
+    產生多個相關資產的 K 線
+    :param symbols: 交易對 list
+    :param corr: 相關係數矩陣 (len(symbols) x len(symbols))
+    :param s0: 各資產起始價格，None 為 100
+    :return: {symbol: DataFrame (BINANCE_KLINE_COLUMNS)}
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    step = interval_ms(interval)
+    returns = correlated_returns(n, corr, sigmas, dt=step / YEAR_MS, rng=rng)
+    s0 = np.broadcast_to(100.0 if s0 is None else np.asarray(s0, dtype=np.float64), (len(symbols),))
+    open_time = to_epoch_ms(start) + step * np.arange(n, dtype=np.int64)
+    out = {}
+    for k, symbol in enumerate(symbols):
+        cols = _ohlcv_from_returns(returns[:, k], s0[k], step, rng, tick_size)
+        out[symbol] = pd.DataFrame(dict(zip(BINANCE_KLINE_COLUMNS, (
+            open_time, *cols[:5], open_time + step - 1, cols[5], cols[6], cols[7], cols[8],
+            np.zeros(n, dtype=np.int64),
+        ))))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 成交紀錄
+# ---------------------------------------------------------------------------
+def iter_agg_trades(n_total, chunk_size=1_000_000, start='2024-01-01', s0=30000.0, sigma=0.6,
+                    trades_per_second=20.0, mean_qty=0.01, tick_size=0.01, lot_size=1e-5,
+                    best_match_ratio=0.999, symbol=None, seed=None, model='gbm', **model_params):
+    """
+    以區塊產生成交紀錄，價格為連續時間的 GBM，到達時間為 Poisson 過程。
+    區塊之間延續最後價格、時間與 trade Id，因此串接後與一次產生的序列性質相同
+    (相同 seed 與 chunk_size 可重現)。
+    :param n_total: 總筆數
+    :param chunk_size: 每個區塊的筆數，決定記憶體用量
+    :param trades_per_second: 平均每秒成交筆數
+    :param mean_qty: 平均成交量
+    :param best_match_ratio: isBestMatch 為 True 的比例
+    :param symbol: 若給定則加入 'symbol' 欄位 (Pair_Trading 的格式)
+    :param model: 價格模型 'gbm' 或 'jump'，model_params 為該模型的其他參數 (例如 jump_intensity)
+    :return: generator of DataFrame (AGG_TRADE_COLUMNS)
+    """
+    import pandas as pd
+
+    if model not in MODEL_PARAMS:
+        raise ValueError(f"Unknown price model: {model}")
+    rng = np.random.default_rng(seed)
+    last_time = to_epoch_ms(start)
+    last_log_price = np.log(s0)
+    next_id = 0
+    mean_gap_ms = 1000.0 / trades_per_second
+
+    remaining = n_total
+    while remaining > 0:
+        n = min(chunk_size, remaining)
+        gaps = rng.exponential(mean_gap_ms, n)
+        t = last_time + np.cumsum(gaps)
+        times = np.floor(t).astype(np.int64)
+
+        # 價格擴散的變異數與經過時間成正比
+        dt = gaps / YEAR_MS
+        log_price = last_log_price + np.cumsum(_returns(model, n, dt, rng, sigma=sigma, **model_params))
+        price = np.exp(log_price)
+        if tick_size:
+            price = np.round(price / tick_size) * tick_size
+        qty = rng.exponential(mean_qty, n)
+        if lot_size:
+            qty = np.maximum(np.round(qty / lot_size), 1) * lot_size
+
+        chunk = pd.DataFrame({
+            'trade Id': np.arange(next_id, next_id + n, dtype=np.int64),
+            'price': price,
+            'qty': qty,
+            'quoteQty': price * qty,
+            'time': times,
+            'isBuyerMaker': rng.random(n) < 0.5,
+            'isBestMatch': rng.random(n) < best_match_ratio,
+        })
+        if symbol is not None:
+            chunk['symbol'] = pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[symbol])
+        yield chunk
+
+        last_time = t[-1]
+        last_log_price = log_price[-1]
+        next_id += n
+        remaining -= n
+
+
+def agg_trades(n, **kwargs):
+    """一次產生 n 筆成交紀錄 (參數同 iter_agg_trades)"""
+    import pandas as pd
+    return pd.concat(list(iter_agg_trades(n, chunk_size=max(n, 1), **kwargs)), ignore_index=True)
+
+
+# ---------------------------------------------------------------------------
+# 資金費率
+# ---------------------------------------------------------------------------
+def _ar1(shocks, phi):
+    """
+    x_i = phi * x_{i-1} + shocks_i (x_{-1} = 0) 的向量化計算
+    x_i = phi^i * (phi * x_{start-1} + sum_j shocks_j * phi^-j)，以區塊計算讓 phi^-j 不溢位，區塊之間延續最後一個值
+    """
+    n = len(shocks)
+    out = np.empty(n)
+    if phi == 0:
+        out[:] = shocks
+        return out
+    scale = abs(np.log10(abs(phi)))
+    block = n if scale == 0 else max(1, int(200 / scale))
+    carry = 0.0
+    for start in range(0, n, block):
+        e = shocks[start:start + block]
+        powers = phi ** np.arange(len(e), dtype=np.float64)
+        out[start:start + len(e)] = powers * (phi * carry + np.cumsum(e / powers))
+        carry = out[start + len(e) - 1]
+    return out
+
+
+def funding_rates(n, start='2024-01-01', interval='8h', mean=1e-4, phi=0.9, sigma=5e-5,
+                  symbol='BTCUSDT', mark_price=None, seed=None):
+    """
+    以 AR(1) 產生資金費率序列，格式與 preprocess.py 的 fetch_binance_funding_rates 相同
+    :param n: 事件數
+    :param interval: 結算間隔 (Binance 多為 8h)
+    :param mean: 長期平均費率
+    :param phi: AR(1) 係數 (持續性)
+    :param sigma: 每期衝擊的標準差
+    :param mark_price: 每期標記價格 array，None 則省略該欄位
+    :return: DataFrame ('symbol', 'Open time' (UTC), 'fundingRate'[, 'markPrice'])
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    rates = mean + _ar1(rng.normal(0, sigma, n), phi)
+    times = to_epoch_ms(start) + interval_ms(interval) * np.arange(n, dtype=np.int64)
+
+    df = pd.DataFrame({
+        'symbol': symbol,
+        'Open time': pd.to_datetime(times, unit='ms', utc=True),
+        'fundingRate': rates,
+    })
+    if mark_price is not None:
+        df['markPrice'] = np.asarray(mark_price, dtype=np.float64)[:n]
+    return df
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+def _write(chunks, out):
+    from .columnar import write_chunks
+
+    if out.endswith('.parquet'):
+        return write_chunks(chunks, out, fmt='parquet')
+    if out.endswith('.csv'):
+        rows = 0
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(out, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            rows += len(chunk)
+        return rows
+    return write_chunks(chunks, out, fmt='columnar')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic market data")
+    parser.add_argument('kind', choices=['klines', 'trades', 'funding'])
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--out', required=True, help=".parquet, .csv, or a directory for the columnar format")
+    parser.add_argument('--symbol', default='BTCUSDT')
+    parser.add_argument('--start', default='2024-01-01')
+    parser.add_argument('--interval', help="bar / settlement interval (default 1h for klines, 8h for funding)")
+    parser.add_argument('--model', choices=['gbm', 'jump'], help="price model for klines / trades (default gbm)")
+    parser.add_argument('--sigma', type=float, default=0.6)
+    parser.add_argument('--s0', type=float, default=30000.0)
+    parser.add_argument('--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.kind == 'funding' and args.model:
+        parser.error("--model only applies to klines and trades")
+    if args.kind == 'trades' and args.interval:
+        parser.error("--interval only applies to klines and funding")
+    model = args.model or 'gbm'
+
+    if args.kind == 'klines':
+        df = klines(args.rows, start=args.start, interval=args.interval or '1h', s0=args.s0,
+                    model=model, sigma=args.sigma, seed=args.seed)
+        chunks = iter([df])
+    elif args.kind == 'trades':
+        chunks = iter_agg_trades(args.rows, chunk_size=args.chunk_size, start=args.start, s0=args.s0,
+                                 sigma=args.sigma, symbol=args.symbol, seed=args.seed, model=model)
+    else:
+        chunks = iter([funding_rates(args.rows, start=args.start, interval=args.interval or '8h',
+                                     symbol=args.symbol, seed=args.seed)])
+
+    rows = _write(chunks, args.out)
+    print(f"{rows:,} rows written to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
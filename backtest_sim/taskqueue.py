@@ -0,0 +1,398 @@
+"""
+本機工作佇列：把回測設定分派給一台或多台機器上的 worker。
+
+佇列存放在一個 SQLite 檔 (不需要任何外部服務)：
+- 每個 task 的 id 為 jobs.unit_id(task 名稱, 參數)，重複送出同一組參數不會產生重複的工作
+- worker 以 lease 方式取出工作，lease 逾時 (worker 當機或被中斷) 的工作會重新交給其他 worker
+- 結果 (各 pipeline 的績效指標) 由 worker 回傳並寫回佇列
+同一台機器上的 worker 直接開啟 SQLite 檔；其他機器的 worker 連到 `serve` 啟動的 TCP broker
+(每行一個 JSON 請求)，由 broker 代為存取 SQLite。task 的參數以路徑指定資料，
+各機器需能以相同路徑讀到共用的市場資料 (例如網路磁碟上的 K 線檔或 pyramid 資料夾)。
+
+用法：
+    python -m backtest_sim.taskqueue submit sweep --db sweep.sqlite --klines Statistic_CTA/klines_BTC.csv --window 24:200:8
+    python -m backtest_sim.taskqueue serve --db sweep.sqlite --port 7777
+    python -m backtest_sim.taskqueue worker --db sweep.sqlite --processes 4          (同一台機器)
+    python -m backtest_sim.taskqueue worker --connect head-node:7777 --processes 8   (其他機器)
+    python -m backtest_sim.taskqueue status --db sweep.sqlite
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+from . import jobs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_until);
+CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (finished);
+"""
+
+
+class TaskQueue:
+    """
+    以 SQLite 實作的工作佇列
+        queue = TaskQueue('sweep.sqlite')
+        queue.submit('statistic', jobs.grid(klines=path, window_size=[24, 48]))
+        for item in queue.lease('host-1:123', n=4): ...
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        """
+        :param lease_seconds: worker 取出工作後需在此時間內完成或 heartbeat，否則工作重新分派
+        :param max_attempts: 失敗或逾時超過此次數的工作標記為 'failed'
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def _write(self, fn):
+        """在一個 IMMEDIATE 交易中執行 fn(cursor) (多個 process 同時寫入時互斥)"""
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                out = fn(cur)
+                cur.execute('COMMIT')
+                return out
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+
+    def submit(self, task_name, param_list):
+        """
+        加入工作，已存在的 id (相同 task 與參數) 略過
+        :return: 新加入的數量
+        """
+        now = time.time()
+        rows = [(jobs.unit_id(task_name, p), task_name, json.dumps(p, default=jobs._json_default), now)
+                for p in param_list]
+
+        def insert(cur):
+            before = cur.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            cur.executemany('INSERT OR IGNORE INTO tasks (id, task, params, created) VALUES (?, ?, ?, ?)', rows)
+            return cur.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+        return self._write(insert)
+
+    def lease(self, worker, n=1):
+        """
+        取出最多 n 個待執行 (或 lease 已逾時) 的工作
+        :return: list of dict，'id', 'task', 'params'
+        """
+        now = time.time()
+
+        def take(cur):
+            # lease 逾時且已達重試上限的工作不再分派
+            cur.execute("UPDATE tasks SET status = 'failed', error = 'lease expired', worker = NULL "
+                        "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts))
+            rows = cur.execute(
+                "SELECT id, task, params FROM tasks "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) "
+                "ORDER BY created, id LIMIT ?", (now, n)).fetchall()
+            cur.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, started = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(worker, now + self.lease_seconds, now, r[0]) for r in rows])
+            return [{'id': r[0], 'task': r[1], 'params': json.loads(r[2])} for r in rows]
+        return self._write(take)
+
+    def heartbeat(self, task_id, worker):
+        """延長 lease (長時間的工作定期呼叫)"""
+        def extend(cur):
+            cur.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                        (time.time() + self.lease_seconds, task_id, worker))
+            return cur.rowcount > 0
+        return self._write(extend)
+
+    def complete(self, task_id, worker, result):
+        """
+        回報結果；工作已完成 (例如逾時後被另一個 worker 完成) 時保留先完成的結果
+        :return: 是否寫入
+        """
+        def done(cur):
+            cur.execute("UPDATE tasks SET status = 'done', worker = ?, finished = ?, result = ?, error = NULL "
+                        "WHERE id = ? AND status != 'done'",
+                        (worker, time.time(), json.dumps(result, default=jobs._json_default), task_id))
+            return cur.rowcount > 0
+        return self._write(done)
+
+    def fail(self, task_id, worker, error):
+        """回報失敗：未達重試上限時重新排入佇列"""
+        def failed(cur):
+            cur.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "worker = NULL, lease_until = NULL, error = ? "
+                        "WHERE id = ? AND worker = ? AND status = 'leased'",
+                        (self.max_attempts, error, task_id, worker))
+            return cur.rowcount > 0
+        return self._write(failed)
+
+    def retry_failed(self):
+        """把 'failed' 的工作重新排入佇列 (重試次數歸零)"""
+        def retry(cur):
+            cur.execute("UPDATE tasks SET status = 'pending', attempts = 0, error = NULL WHERE status = 'failed'")
+            return cur.rowcount
+        return self._write(retry)
+
+    def stats(self, window=60.0):
+        """
+        佇列狀態與吞吐量
+        :param window: 計算近期吞吐量的秒數
+        :return: dict，各狀態數量、整體與近期每秒完成數、各 worker 的完成數與近期速率
+        """
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+            first, last = self._db.execute(
+                "SELECT MIN(started), MAX(finished) FROM tasks WHERE status = 'done'").fetchone()
+            workers = self._db.execute(
+                "SELECT worker, COUNT(*), SUM(finished >= ?) FROM tasks WHERE status = 'done' GROUP BY worker",
+                (now - window,)).fetchall()
+        done = counts.get('done', 0)
+        recent = sum(r[2] or 0 for r in workers)
+        return {
+            'counts': {s: counts.get(s, 0) for s in ('pending', 'leased', 'done', 'failed')},
+            'throughput': done / (last - first) if done and last > first else 0.0,
+            'recent_throughput': recent / window,
+            'workers': {r[0]: {'done': r[1], 'recent_per_s': (r[2] or 0) / window} for r in workers},
+        }
+
+    def results(self, task_name=None):
+        """已完成的工作：dict，'id', 'task', 'params', 'result', 'worker', 'elapsed'"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, task, params, result, worker, finished - started FROM tasks WHERE status = 'done'"
+                + (" AND task = ?" if task_name else "") + " ORDER BY finished",
+                (task_name,) if task_name else ()).fetchall()
+        return [{'id': r[0], 'task': r[1], 'params': json.loads(r[2]), 'result': json.loads(r[3]),
+                 'worker': r[4], 'elapsed': r[5]} for r in rows]
+
+    def close(self):
+        self._db.close()
+
+
+# ---------------------------------------------------------------------------
+# TCP broker
+# ---------------------------------------------------------------------------
+METHODS = ('submit', 'lease', 'heartbeat', 'complete', 'fail', 'stats', 'results', 'retry_failed')
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request['method'] not in METHODS:
+                    raise ValueError(f"Unknown method: {request['method']}")
+                value = getattr(self.server.queue, request['method'])(*request.get('args', []))
+                response = {'ok': True, 'value': value}
+            except Exception as e:
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, default=jobs._json_default).encode() + b'\n')
+            self.wfile.flush()
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    """以 TCP 提供 TaskQueue 的方法給其他機器的 worker (每行一個 JSON 請求 / 回應)"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queue, host='0.0.0.0', port=7777):
+        self.queue = queue
+        super().__init__((host, port), _Handler)
+
+
+class RemoteQueue:
+    """連到 Broker 的 client，方法與 TaskQueue 相同"""
+
+    def __init__(self, address, timeout=60):
+        host, port = address.rsplit(':', 1)
+        self._sock = socket.create_connection((host, int(port)), timeout=timeout)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args):
+        with self._lock:
+            self._file.write(json.dumps({'method': method, 'args': args}).encode() + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("Broker closed the connection")
+        response = json.loads(line)
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['value']
+
+    def __getattr__(self, method):
+        if method not in METHODS:
+            raise AttributeError(method)
+        return lambda *args: self._call(method, *args)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def open_queue(db=None, connect=None, **kwargs):
+    """依參數開啟本機 SQLite 佇列或連到遠端 broker"""
+    if connect:
+        return RemoteQueue(connect)
+    if db:
+        return TaskQueue(db, **kwargs)
+    raise ValueError("Need --db (local SQLite queue) or --connect host:port (broker)")
+
+
+# ---------------------------------------------------------------------------
+# worker
+# ---------------------------------------------------------------------------
+def work(queue, worker=None, batch=1, max_tasks=None, idle_exit=True, poll=2.0, heartbeat=60.0):
+    """
+    worker 迴圈：取出工作 -> jobs.run_unit -> 回報結果
+    執行期間以背景 thread 定期 heartbeat，避免長時間的工作被判定逾時
+    :param worker: worker 名稱，預設 'hostname:pid'
+    :param batch: 每次取出的工作數
+    :param max_tasks: 最多執行的工作數，None 為不限
+    :param idle_exit: 佇列沒有工作時結束 (False 則持續等待新工作)
+    :return: 完成的工作數
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    completed = 0
+    while max_tasks is None or completed < max_tasks:
+        items = queue.lease(worker, batch if max_tasks is None else min(batch, max_tasks - completed))
+        if not items:
+            if idle_exit:
+                break
+            time.sleep(poll)
+            continue
+        for item in items:
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat, args=(queue, item['id'], worker, stop, heartbeat), daemon=True)
+            beat.start()
+            try:
+                record = jobs.run_unit(item['task'], item['params'])
+                queue.complete(item['id'], worker, dict(record['result'], elapsed=record['elapsed']))
+                completed += 1
+            except Exception:
+                queue.fail(item['id'], worker, traceback.format_exc(limit=3))
+            finally:
+                stop.set()
+                beat.join()
+    return completed
+
+
+def _heartbeat(queue, task_id, worker, stop, interval):
+    while not stop.wait(interval):
+        try:
+            queue.heartbeat(task_id, worker)
+        except Exception:
+            return
+
+
+def _worker_process(db, connect, lease, batch, idle_exit):
+    queue = open_queue(db, connect, lease_seconds=lease)
+    try:
+        return work(queue, batch=batch, idle_exit=idle_exit)
+    finally:
+        queue.close()
+
+
+def run_workers(processes, db=None, connect=None, lease=300, batch=1, idle_exit=True):
+    """在本機啟動多個 worker process，回傳完成的工作總數"""
+    if processes <= 1:
+        return _worker_process(db, connect, lease, batch, idle_exit)
+    with multiprocessing.Pool(processes) as pool:
+        return sum(pool.starmap(_worker_process, [(db, connect, lease, batch, idle_exit)] * processes))
+
+
+def print_stats(stats, file=None):
+    file = file or sys.stdout
+    counts = stats['counts']
+    print(' '.join(f"{k}={v:,}" for k, v in counts.items()), file=file)
+    print(f"throughput {stats['throughput']:.2f} tasks/s overall, {stats['recent_throughput']:.2f} tasks/s recent",
+          file=file)
+    for name, w in sorted(stats['workers'].items(), key=lambda kv: str(kv[0])):
+        print(f"  {str(name):30s} {w['done']:>8,d} done  {w['recent_per_s']:.2f}/s", file=file)
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', help="SQLite queue file")
+    common.add_argument('--connect', help="broker address host:port")
+    common.add_argument('--lease', type=float, default=300, help="lease timeout in seconds")
+
+    parser = argparse.ArgumentParser(description="SQLite / TCP work queue for backtest sweeps")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('submit', help="enqueue the units of a sweep / walk-forward job")
+    jobs.add_job_parsers(p.add_subparsers(dest='job', required=True), parents=[common])
+    p = sub.add_parser('serve', help="serve the queue to workers on other hosts", parents=[common])
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=7777)
+    p = sub.add_parser('worker', help="run tasks from the queue", parents=[common])
+    p.add_argument('--processes', type=int, default=1)
+    p.add_argument('--batch', type=int, default=1)
+    p.add_argument('--wait', action='store_true', help="keep polling when the queue is empty")
+    sub.add_parser('status', help="queue counts and throughput", parents=[common])
+    sub.add_parser('retry', help="re-queue failed tasks", parents=[common])
+    p = sub.add_parser('export', help="write finished results as one CSV", parents=[common])
+    p.add_argument('--out', required=True)
+    p.add_argument('--task')
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        n = run_workers(args.processes, args.db, args.connect, args.lease, args.batch, idle_exit=not args.wait)
+        print(f"{n:,} tasks completed")
+        return 0
+    if args.command == 'serve' and not args.db:
+        parser.error("serve needs --db")
+
+    queue = open_queue(args.db, args.connect, lease_seconds=args.lease)
+    if args.command == 'submit':
+        args.command = args.job
+        task_name, params = jobs.job_units(args)
+        added = queue.submit(task_name, params)
+        print(f"{task_name}: {len(params):,} units, {added:,} new")
+    elif args.command == 'serve':
+        with Broker(queue, args.host, args.port) as server:
+            print(f"Serving {args.db} on {args.host}:{server.server_address[1]}")
+            server.serve_forever()
+    elif args.command == 'status':
+        print_stats(queue.stats())
+    elif args.command == 'retry':
+        print(f"{queue.retry_failed():,} tasks re-queued")
+    else:
+        import pandas as pd
+        rows = [{'id': r['id'], 'task': r['task'], 'worker': r['worker'], **r['params'], **r['result']}
+                for r in queue.results(args.task)]
+        pd.DataFrame(rows).to_csv(args.out, index=False)
+        print(f"{len(rows):,} results -> {args.out}")
+    queue.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,481 @@
+"""
+壓縮的逐筆成交 (tick) 儲存，以時間區間隨機讀取。
+
+OrderExecutor 只能從頭到尾讀取整份成交紀錄，每次回測都要重新解析整個 CSV。
+這裡把成交紀錄依 symbol 與日期分區，每 block_rows 筆壓縮成一個區塊：
+    time / trade Id      差分 (delta) 後的整數
+    price                定點數 (10^decimals 倍的整數) 再差分
+    qty                  定點數
+    isBuyerMaker / ...   bit-packed
+整數以能容納的最小 dtype 存放，依位元組重排 (byte shuffle) 後以 zlib 壓縮。
+定點數位數記錄在每個區塊的欄位標頭：後來的資料需要更多位數時，之後的區塊改用較多的位數，已寫出的區塊不受影響。
+每個 symbol 有一個稀疏的區塊索引 (每個區塊的第一筆與最後一筆時間、位置)，
+trades(symbol, t0, t1) 以二分搜尋 (O(log n)) 找出涵蓋的區塊，只解壓縮這些區塊。
+
+資料夾結構：
+    <root>/_store.json                 symbol、欄位、目前的定點數位數、筆數
+    <root>/<symbol>/<YYYY-MM-DD>.blk   當天的壓縮區塊 (依序串接)
+    <root>/<symbol>/index.npy          區塊索引 (INDEX_DTYPE)
+
+quoteQty 不另外儲存，讀取時以 price × qty 重建；price / qty 讀回的是四捨五入到儲存位數的十進位數值。
+
+用法：
+    python -m backtest_sim.tickstore ingest Pair_Trading/Preprocess/BTC_trades.csv ticks/ --symbol SPOT_BTC_USDT
+    python -m backtest_sim.tickstore ingest trades.csv ticks/ --price-decimals 2 --qty-decimals 6   # 四捨五入到指定位數
+    python -m backtest_sim.tickstore info ticks/
+    python -m backtest_sim.tickstore query ticks/ SPOT_BTC_USDT --start 2024-01-01T10:00 --end 2024-01-01T11:00
+    store = TickStore('ticks/'); arrays = store.trades('SPOT_BTC_USDT', t0, t1)
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from .columnar import _safe_name
+from .timeutil import to_epoch_ms
+
+STORE_FILE = '_store.json'
+FORMAT = 2
+INDEX_FILE = 'index.npy'
+DAY_MS = 86_400_000
+BLOCK_ROWS = 65_536
+MAX_DECIMALS = 8
+
+# 欄位 -> 編碼方式；其餘欄位不儲存
+CODECS = {'time': 'delta', 'trade Id': 'delta', 'price': 'fixed-delta', 'qty': 'fixed',
+          'isBuyerMaker': 'bool', 'isBestMatch': 'bool'}
+INDEX_DTYPE = np.dtype([('day', 'i4'), ('offset', 'i8'), ('nbytes', 'i4'), ('rows', 'i4'),
+                        ('t_first', 'i8'), ('t_last', 'i8')])
+
+# 區塊內每個欄位的標頭：dtype 代碼、定點數位數、第一個值、壓縮後長度
+_COLUMN_HEADER = struct.Struct('<Bbqi')
+_INT_DTYPES = [np.dtype(t) for t in ('i1', 'i2', 'i4', 'i8')]
+_BOOL = 255
+
+
+def is_tickstore(path):
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, STORE_FILE))
+
+
+def decimals_of(values, max_decimals=MAX_DECIMALS):
+    """能精確表示所有值的最少小數位數 (超過 max_decimals 時丟出 ValueError)"""
+    values = np.asarray(values, dtype=np.float64)
+    for d in range(max_decimals + 1):
+        scaled = values * 10.0 ** d
+        if not len(values) or np.abs(scaled - np.round(scaled)).max() < 1e-4:
+            return d
+    raise ValueError(f"Values need more than {max_decimals} decimals; pass the decimals explicitly")
+
+
+def _to_fixed(values, decimals, name):
+    scaled = np.asarray(values, dtype=np.float64) * 10.0 ** decimals
+    ints = np.round(scaled).astype(np.int64)
+    if len(ints) and np.abs(scaled - ints).max() >= 1e-4:
+        raise ValueError(f"'{name}' has more than {decimals} decimals")
+    return ints
+
+
+def _pack_ints(ints, level):
+    """int64 -> (dtype 代碼, 壓縮後 bytes)：縮成最小的 dtype，位元組重排後壓縮"""
+    lo, hi = (int(ints.min()), int(ints.max())) if len(ints) else (0, 0)
+    code = next(k for k, dt in enumerate(_INT_DTYPES) if np.iinfo(dt).min <= lo and hi <= np.iinfo(dt).max)
+    narrow = ints.astype(_INT_DTYPES[code])
+    shuffled = narrow.view(np.uint8).reshape(len(narrow), narrow.itemsize).T
+    return code, zlib.compress(np.ascontiguousarray(shuffled).tobytes(), level)
+
+
+def _unpack_ints(code, payload, rows):
+    dtype = _INT_DTYPES[code]
+    raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(dtype.itemsize, rows)
+    return np.ascontiguousarray(raw.T).view(dtype).ravel().astype(np.int64)
+
+
+def encode_block(arrays, columns, decimals, level=6):
+    """
+    一個區塊的欄位 arrays -> bytes
+    :param columns: 儲存的欄位 (順序與讀取時相同)
+    :param decimals: {'price': d, 'qty': d}，記錄在欄位標頭，讀取時不需另外提供
+    """
+    rows = len(arrays['time'])
+    parts = [struct.pack('<i', rows)]
+    for name in columns:
+        codec = CODECS[name]
+        values = arrays[name]
+        first = 0
+        digits = decimals[name] if codec.startswith('fixed') else 0
+        if codec == 'bool':
+            code, payload = _BOOL, zlib.compress(np.packbits(np.asarray(values, dtype=bool)).tobytes(), level)
+        else:
+            ints = _to_fixed(values, digits, name) if codec.startswith('fixed') else \
+                np.asarray(values, dtype=np.int64)
+            if codec.endswith('delta') and rows:
+                first = int(ints[0])
+                ints = np.diff(ints, prepend=ints[0])
+            code, payload = _pack_ints(ints, level)
+        parts.append(_COLUMN_HEADER.pack(code, digits, first, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_block(data, columns, wanted=None):
+    """encode_block 的反向：回傳 {欄位: numpy array}，wanted 以外的欄位不解壓縮"""
+    (rows,) = struct.unpack_from('<i', data, 0)
+    pos = 4
+    out = {}
+    for name in columns:
+        code, digits, first, size = _COLUMN_HEADER.unpack_from(data, pos)
+        pos += _COLUMN_HEADER.size
+        payload = data[pos:pos + size]
+        pos += size
+        if wanted is not None and name not in wanted:
+            continue
+        codec = CODECS[name]
+        if code == _BOOL:
+            out[name] = np.unpackbits(np.frombuffer(zlib.decompress(payload), dtype=np.uint8), count=rows).astype(bool)
+            continue
+        ints = _unpack_ints(code, payload, rows)
+        if codec.endswith('delta'):
+            ints = first + np.cumsum(ints)
+        out[name] = ints / 10.0 ** digits if codec.startswith('fixed') else ints
+    return out
+
+
+class TickStore:
+    """
+    寫入：
+        with TickStore('ticks/', mode='a') as store:
+            for chunk in chunks:          # 依時間排序的成交紀錄 (含 'symbol' 欄位或指定 symbol)
+                store.write(chunk)
+    讀取：
+        TickStore('ticks/').trades('SPOT_BTC_USDT', '2024-01-01T10:00', '2024-01-01T11:00')
+    """
+
+    def __init__(self, root, mode='r', block_rows=BLOCK_ROWS, level=6):
+        """
+        :param mode: 'r' 唯讀、'a' 新增 (資料夾不存在時建立)、'w' 清空重寫
+        :param block_rows: 每個壓縮區塊的筆數 (區塊不跨日)
+        :param level: zlib 壓縮等級
+        """
+        self.root = root
+        self.mode = mode
+        self.level = level
+        self._indexes = {}
+        self._pending = {}
+        path = os.path.join(root, STORE_FILE)
+        if mode == 'w' and os.path.exists(path):
+            import shutil
+            shutil.rmtree(root)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.meta = json.load(f)
+            if self.meta.get('format', 1) != FORMAT:
+                raise ValueError(f"Tick store at {root!r} has format {self.meta.get('format', 1)}, "
+                                 f"expected {FORMAT}; re-ingest it with --overwrite")
+        elif mode == 'r':
+            raise FileNotFoundError(f"No tick store at {root!r}")
+        else:
+            os.makedirs(root, exist_ok=True)
+            self.meta = {'format': FORMAT, 'block_rows': int(block_rows), 'symbols': {}}
+        self.block_rows = self.meta['block_rows']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def symbols(self):
+        return sorted(self.meta['symbols'])
+
+    def info(self, symbol):
+        return self.meta['symbols'][symbol]
+
+    def index(self, symbol):
+        """symbol 的區塊索引 (INDEX_DTYPE structured array，依時間排序)"""
+        if symbol not in self._indexes:
+            if symbol not in self.meta['symbols']:
+                raise KeyError(f"Unknown symbol: {symbol} (store has {', '.join(self.symbols) or 'none'})")
+            path = os.path.join(self.root, self.meta['symbols'][symbol]['dir'], INDEX_FILE)
+            self._indexes[symbol] = np.load(path) if os.path.exists(path) else np.empty(0, dtype=INDEX_DTYPE)
+        return self._indexes[symbol]
+
+    # -----------------------------------------------------------------------
+    # 寫入
+    # -----------------------------------------------------------------------
+    def write(self, trades, symbol=None, price_decimals=None, qty_decimals=None):
+        """
+        加入成交紀錄 (每個 symbol 的時間需接在已寫入的資料之後)
+        :param trades: DataFrame 或 {欄位: array}，至少包含 'time' (毫秒) 與 'price'
+        :param symbol: 沒有 'symbol' 欄位時的 symbol
+        :param price_decimals / qty_decimals: 定點數位數 (值會四捨五入到此位數)，
+            None 時由資料推算 (需要的位數超過目前的位數時，之後的區塊改用較多的位數)
+        :return: 寫入筆數
+        """
+        if self.mode == 'r':
+            raise ValueError("Tick store was opened read-only")
+        if symbol is None:
+            import pandas as pd
+            groups = pd.Series(np.asarray(trades['symbol'])).groupby(np.asarray(trades['symbol']), sort=False).indices
+            return sum(self.write({c: np.asarray(trades[c])[rows] for c in trades if c in CODECS}, name,
+                                  price_decimals, qty_decimals) for name, rows in groups.items())
+
+        arrays = {c: np.asarray(trades[c]) for c in trades if c in CODECS}
+        if 'time' not in arrays or 'price' not in arrays:
+            raise ValueError("Trades need 'time' and 'price' columns")
+        arrays['time'] = arrays['time'].astype(np.int64)
+        if len(arrays['time']) and (np.diff(arrays['time']) < 0).any():
+            order = np.argsort(arrays['time'], kind='stable')
+            arrays = {c: v[order] for c, v in arrays.items()}
+
+        # 在暫存任何資料之前完成所有檢查，不合格的區塊不會留下寫了一半的資料
+        info = self.meta['symbols'].get(symbol)
+        columns = info['columns'] if info is not None else [c for c in CODECS if c in arrays]
+        missing = set(columns) - set(arrays)
+        if missing:
+            raise ValueError(f"Trades for {symbol} are missing columns: {', '.join(sorted(missing))}")
+        n = len(arrays['time'])
+        if info is not None and n and info['last'] is not None and arrays['time'][0] < info['last']:
+            raise ValueError(f"Trades for {symbol} must be appended in time order "
+                             f"({arrays['time'][0]} < last stored {info['last']})")
+        decimals = {}
+        for name, explicit in (('price', price_decimals), ('qty', qty_decimals)):
+            if name not in columns:
+                continue
+            if explicit is not None:
+                arrays[name] = np.round(np.asarray(arrays[name], dtype=np.float64), int(explicit))
+                decimals[name] = int(explicit)
+            else:
+                decimals[name] = decimals_of(arrays[name])
+
+        if info is None:
+            info = self.meta['symbols'][symbol] = {
+                'dir': _safe_name(symbol), 'columns': columns, 'decimals': decimals,
+                'rows': 0, 'first': None, 'last': None}
+            os.makedirs(os.path.join(self.root, info['dir']), exist_ok=True)
+        else:
+            info['decimals'] = {c: max(d, decimals[c]) for c, d in info['decimals'].items()}
+        if n == 0:
+            return 0
+
+        pending = self._pending.get(symbol)
+        if pending is not None:
+            arrays = {c: np.concatenate([pending[c], arrays[c]]) for c in info['columns']}
+        self._pending[symbol] = self._flush(symbol, arrays, final=False)
+        info['rows'] += n
+        info['first'] = int(arrays['time'][0]) if info['first'] is None else info['first']
+        info['last'] = int(arrays['time'][-1])
+        return n
+
+    def _flush(self, symbol, arrays, final):
+        """把 arrays 切成區塊寫出 (以日期與 block_rows 切分)，回傳還不滿一個區塊的剩餘部分"""
+        info = self.meta['symbols'][symbol]
+        times = arrays['time']
+        days = times // DAY_MS
+        # 日期變換處與每 block_rows 筆為區塊邊界
+        day_starts = np.flatnonzero(np.diff(days)) + 1
+        bounds = []
+        for start, stop in zip(np.r_[0, day_starts], np.r_[day_starts, len(times)]):
+            bounds.extend((s, min(s + self.block_rows, stop)) for s in range(start, stop, self.block_rows))
+        if not final and bounds and bounds[-1][1] - bounds[-1][0] < self.block_rows:
+            keep = bounds.pop()[0]
+        else:
+            keep = len(times)
+
+        entries = []
+        for start, stop in bounds:
+            block = {c: arrays[c][start:stop] for c in info['columns']}
+            data = encode_block(block, info['columns'], info['decimals'], self.level)
+            day = int(days[start])
+            path = os.path.join(self.root, info['dir'], _day_file(day))
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            entries.append((day, offset, len(data), stop - start, int(times[start]), int(times[stop - 1])))
+        if entries:
+            self._indexes[symbol] = np.concatenate([self.index(symbol), np.array(entries, dtype=INDEX_DTYPE)])
+        return {c: arrays[c][keep:] for c in info['columns']}
+
+    def flush(self):
+        """寫出所有未滿一個區塊的資料與索引"""
+        for symbol, pending in list(self._pending.items()):
+            if len(pending['time']):
+                self._flush(symbol, pending, final=True)
+        self._pending.clear()
+        for symbol, index in self._indexes.items():
+            _atomic_save(os.path.join(self.root, self.meta['symbols'][symbol]['dir'], INDEX_FILE), index)
+        tmp = os.path.join(self.root, STORE_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(tmp, os.path.join(self.root, STORE_FILE))
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush()
+
+    # -----------------------------------------------------------------------
+    # 讀取
+    # -----------------------------------------------------------------------
+    def blocks(self, symbol, t0=None, t1=None):
+        """時間區間 [t0, t1) 涵蓋的區塊範圍 (i0, i1)，以二分搜尋索引"""
+        index = self.index(symbol)
+        i0 = 0 if t0 is None else int(np.searchsorted(index['t_last'], to_epoch_ms(t0), side='left'))
+        i1 = len(index) if t1 is None else int(np.searchsorted(index['t_first'], to_epoch_ms(t1), side='left'))
+        return i0, max(i0, i1)
+
+    def trades(self, symbol, t0=None, t1=None, columns=None):
+        """
+        時間區間 [t0, t1) 的成交紀錄，只讀取並解壓縮涵蓋的區塊
+        :param t0 / t1: 毫秒數、日期字串或 Timestamp，None 為不限
+        :param columns: 需要的欄位 ('quoteQty' 以 price × qty 重建)，None 為全部
+        :return: {欄位: numpy array}
+        """
+        info = self.meta['symbols'].get(symbol)
+        if info is None:
+            raise KeyError(f"Unknown symbol: {symbol} (store has {', '.join(self.symbols) or 'none'})")
+        stored = info['columns']
+        wanted = set(stored if columns is None else columns) | {'time'}
+        if 'quoteQty' in wanted:
+            wanted |= {'price', 'qty'}
+        unknown = wanted - set(stored) - {'quoteQty'}
+        if unknown:
+            raise KeyError(f"Columns not stored for {symbol}: {', '.join(sorted(unknown))}")
+
+        index = self.index(symbol)
+        i0, i1 = self.blocks(symbol, t0, t1)
+        parts = []
+        handles = {}
+        try:
+            for entry in index[i0:i1]:
+                day = int(entry['day'])
+                if day not in handles:
+                    handles[day] = open(os.path.join(self.root, info['dir'], _day_file(day)), 'rb')
+                f = handles[day]
+                f.seek(int(entry['offset']))
+                parts.append(decode_block(f.read(int(entry['nbytes'])), stored, wanted))
+        finally:
+            for f in handles.values():
+                f.close()
+
+        names = [c for c in stored if c in wanted]
+        if parts:
+            out = {c: np.concatenate([p[c] for p in parts]) for c in names}
+        else:
+            out = {c: np.empty(0, dtype=np.float64 if CODECS[c].startswith('fixed') else
+                               bool if CODECS[c] == 'bool' else np.int64) for c in names}
+        # 頭尾區塊只保留區間內的部分
+        lo = 0 if t0 is None else int(np.searchsorted(out['time'], to_epoch_ms(t0), side='left'))
+        hi = len(out['time']) if t1 is None else int(np.searchsorted(out['time'], to_epoch_ms(t1), side='left'))
+        out = {c: v[lo:hi] for c, v in out.items()}
+        if 'quoteQty' in wanted:
+            out['quoteQty'] = out['price'] * out['qty']
+        if columns is not None:
+            out = {c: out[c] for c in ['time', *columns] if c in out}
+        return out
+
+    def frame(self, symbol, t0=None, t1=None, columns=None):
+        """trades() 的 DataFrame 版本 (含 'symbol' 欄位)"""
+        import pandas as pd
+        df = pd.DataFrame(self.trades(symbol, t0, t1, columns), copy=False)
+        df['symbol'] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[symbol])
+        return df
+
+    def nbytes(self, symbol=None):
+        """壓縮後的資料量 (bytes)"""
+        symbols = self.symbols if symbol is None else [symbol]
+        return int(sum(self.index(s)['nbytes'].sum() for s in symbols))
+
+
+def _day_file(day):
+    return np.datetime_as_string(np.datetime64(int(day), 'D')) + '.blk'
+
+
+def _atomic_save(path, array):
+    tmp = path + '.tmp.npy'
+    np.save(tmp, array, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def ingest(source, root, symbol=None, chunksize=1_000_000, mode='a', block_rows=BLOCK_ROWS,
+           price_decimals=None, qty_decimals=None):
+    """
+    把成交紀錄 CSV / 欄式資料夾分塊寫入 tick store
+    :param symbol: 沒有 'symbol' 欄位時的 symbol
+    :param price_decimals / qty_decimals: 定點數位數 (見 TickStore.write)，None 為由資料推算
+    :return: 寫入筆數
+    """
+    from .chunked import iter_chunks
+
+    rows = 0
+    with TickStore(root, mode=mode, block_rows=block_rows) as store:
+        for chunk in iter_chunks(source, chunksize):
+            rows += store.write(chunk, symbol=None if 'symbol' in chunk.columns else symbol or 'TRADES',
+                                price_decimals=price_decimals, qty_decimals=qty_decimals)
+    return rows
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compressed, time-indexed trade tick store")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('ingest', help="append a trades CSV / columnar directory to a store")
+    p.add_argument('source')
+    p.add_argument('root')
+    p.add_argument('--symbol', help="symbol for files without a 'symbol' column")
+    p.add_argument('--chunksize', type=int, default=1_000_000)
+    p.add_argument('--block-rows', type=int, default=BLOCK_ROWS)
+    p.add_argument('--price-decimals', type=int, help="round prices to this many decimals (default: inferred)")
+    p.add_argument('--qty-decimals', type=int, help="round quantities to this many decimals (default: inferred)")
+    p.add_argument('--overwrite', action='store_true')
+    p = sub.add_parser('info', help="list symbols, rows and compressed size")
+    p.add_argument('root')
+    p = sub.add_parser('query', help="read trades of one symbol in [start, end)")
+    p.add_argument('root')
+    p.add_argument('symbol')
+    p.add_argument('--start')
+    p.add_argument('--end')
+    p.add_argument('--out', help="write the trades to this CSV")
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        start = time.perf_counter()
+        rows = ingest(args.source, args.root, args.symbol, args.chunksize, mode='w' if args.overwrite else 'a',
+                      block_rows=args.block_rows, price_decimals=args.price_decimals,
+                      qty_decimals=args.qty_decimals)
+        ratio = _size(args.source) / max(_size(args.root), 1)
+        print(f"Ingested {rows:,} trades in {time.perf_counter() - start:.1f}s; "
+              f"{_size(args.root) / 1e6:.1f} MB on disk ({ratio:.1f}x smaller than the source)")
+    elif args.command == 'info':
+        store = TickStore(args.root)
+        for symbol in store.symbols:
+            info = store.info(symbol)
+            span = [np.datetime64(info[k], 'ms') if info[k] is not None else None for k in ('first', 'last')]
+            print(f"{symbol}: {info['rows']:,} trades, {len(store.index(symbol)):,} blocks, "
+                  f"{store.nbytes(symbol) / 1e6:.1f} MB, {span[0]} .. {span[1]}, decimals {info['decimals']}")
+    else:
+        import pandas as pd  # noqa: F401 (匯入時間不計入查詢時間)
+        store = TickStore(args.root)
+        start = time.perf_counter()
+        df = store.frame(args.symbol, args.start, args.end)
+        i0, i1 = store.blocks(args.symbol, args.start, args.end)
+        print(f"{len(df):,} trades from {i1 - i0:,} of {len(store.index(args.symbol)):,} blocks "
+              f"in {(time.perf_counter() - start) * 1e3:.1f} ms")
+        if args.out:
+            df.to_csv(args.out, index=False)
+        else:
+            print(df.head(10).to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""K 線時間間隔與毫秒時間戳相關工具"""
+
+INTERVAL_MS = {
+    '1m': 60_000,
+    '3m': 3 * 60_000,
+    '5m': 5 * 60_000,
+    '15m': 15 * 60_000,
+    '30m': 30 * 60_000,
+    '1h': 3_600_000,
+    '2h': 2 * 3_600_000,
+    '4h': 4 * 3_600_000,
+    '6h': 6 * 3_600_000,
+    '8h': 8 * 3_600_000,
+    '12h': 12 * 3_600_000,
+    '1d': 86_400_000,
+}
+
+YEAR_MS = 365 * 86_400_000
+
+
+def interval_ms(interval):
+    """
+    Binance 的時間間隔字串轉為毫秒，例如 '1h' -> 3600000
+    :param interval: '1m', '5m', '1h', '4h', '1d' ... 或毫秒整數
+    """
+    if isinstance(interval, int):
+        return interval
+    try:
+        return INTERVAL_MS[interval]
+    except KeyError:
+        raise ValueError(f"Unknown interval: {interval} (choose from {', '.join(INTERVAL_MS)})") from None
+
+
+def to_epoch_ms(value):
+    """日期字串 / datetime / pandas Timestamp / 毫秒整數 轉成 UTC 毫秒時間戳"""
+    if isinstance(value, (int,)) or hasattr(value, 'dtype') and value.dtype.kind in 'iu':
+        return int(value)
+    import pandas as pd
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(ts.value // 10**6)
+
+
+def to_epoch_ms_array(values):
+    """日期字串 / datetime64 (可帶時區) / 毫秒整數的 array 或 Series 轉成 int64 毫秒 numpy array"""
+    import numpy as np
+    import pandas as pd
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if values.dtype.kind in 'iuf':
+        return values.to_numpy().astype(np.int64)
+    if values.dtype.kind != 'M':
+        values = pd.to_datetime(values, format='ISO8601')
+    if getattr(values.dt, 'tz', None) is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy().astype('datetime64[ms]').astype(np.int64)
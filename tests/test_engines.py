@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from backtest_sim.loaders import load_klines
+from backtest_sim.projects import load, project_dir
+
+# 不整除資料筆數的區塊大小，讓每個區塊邊界都落在回測途中
+CHUNK = 7
+
+
+def _klines(project):
+    return load_klines(os.path.join(project_dir(project), 'klines_BTC.csv'), time_as='datetime')
+
+
+def _roundtrip(df, path, **read_kw):
+    """寫成 CSV 再讀回 (與各專案主程式讀取上一步輸出的方式相同)"""
+    df.to_csv(path, index=False)
+    return pd.read_csv(path, **read_kw)
+
+
+# ---------------------------------------------------------------------------
+# 原本的逐列實作 (user-046 / user-047 之前)，作為 RuleSet 與 Ledger 的對照
+# ---------------------------------------------------------------------------
+def _statistic_direction_loop(df, threshold1=4.5, threshold2=2):
+    trend = 0
+    directions = [0] * len(df)
+    for i in range(len(df)):
+        close, mean, std = df.at[i, 'Close'], df.at[i, 'Rolling_Mean_Close'], df.at[i, 'Rolling_Std_Close']
+        if close > mean + threshold1 * std:
+            trend = -2
+        elif close < mean - threshold1 * std:
+            trend = -2
+        elif close > mean + threshold2 * std and close < mean + threshold1 * std:
+            trend = -1
+        elif close < mean - threshold2 * std and close > mean - threshold1 * std:
+            trend = 1
+        directions[i] = trend
+    return np.array(directions)
+
+
+def _cci_signals_loop(df, upper=100, lower=-100):
+    signal = np.zeros(len(df), dtype=np.int64)
+    for i in range(1, len(df)):
+        prev_cci, curr_cci = df.loc[i - 1, 'CCI'], df.loc[i, 'CCI']
+        if prev_cci >= lower and curr_cci < lower:
+            signal[i] = 1
+        if prev_cci <= upper and curr_cci > upper:
+            signal[i] = -1
+    return signal
+
+
+def _obv_signals_loop(df, fee_rate=0.0005):
+    df = df.copy()
+    df['Signal'] = 0
+    trades = []
+    position = 0
+    entry_price = 0
+    for i in range(1, len(df)):
+        prev_obv, prev_ma = df.at[i - 1, 'OBV'], df.at[i - 1, 'OBV_MA5']
+        curr_obv, curr_ma = df.at[i, 'OBV'], df.at[i, 'OBV_MA5']
+        if position == 0 and (prev_obv < prev_ma) and (curr_obv >= curr_ma):
+            df.at[i, 'Signal'] = 1
+            position = 1
+            entry_price = df.at[i, 'Close']
+            trades.append({'Entry_Time': df.at[i, 'Open time'], 'Entry_Price': entry_price,
+                           'Entry_Fee': entry_price * fee_rate, 'Exit_Time': None, 'Exit_Price': None,
+                           'Exit_Fee': None, 'PnL': None})
+        elif position == 1 and (prev_obv > prev_ma) and (curr_obv <= curr_ma):
+            df.at[i, 'Signal'] = -1
+            exit_price = df.at[i, 'Close']
+            trades[-1].update({'Exit_Time': df.at[i, 'Open time'], 'Exit_Price': exit_price,
+                               'Exit_Fee': exit_price * fee_rate,
+                               'PnL': exit_price - entry_price - exit_price * fee_rate})
+            position = 0
+    if position == 1:
+        exit_price = df.at[len(df) - 1, 'Close']
+        trades[-1].update({'Exit_Time': df.at[len(df) - 1, 'Open time'], 'Exit_Price': exit_price,
+                           'Exit_Fee': exit_price * fee_rate,
+                           'PnL': exit_price - entry_price - exit_price * fee_rate})
+        df.at[len(df) - 1, 'Signal'] = -1
+    return df, pd.DataFrame(trades)
+
+
+def _orders_loop(timestamps, signals, prices, fee_rate=0.0002):
+    orders = []
+    position = entry_price = None
+    quantity = 0.0001
+    for timestamp, signal, price in zip(timestamps, signals, prices):
+        turnover = quantity * price
+        fee = turnover * fee_rate
+        taipei_time = pd.to_datetime(timestamp, unit='ms') + pd.Timedelta(hours=8)
+        if position is None:
+            if signal == 1:
+                position, entry_price = 'LONG', price
+                orders.append([taipei_time, 'BUY', quantity, price, 'LONG', 'ENTER', 0, 0.0, fee, turnover])
+            elif signal == -1:
+                position, entry_price = 'SHORT', price
+                orders.append([taipei_time, 'SELL', quantity, price, 'SHORT', 'ENTER', 0, 0.0, fee, turnover])
+        elif (position == 'LONG' and signal == -1) or (position == 'SHORT' and signal == 1):
+            gross_pnl = (price - entry_price if position == 'LONG' else entry_price - price) * quantity
+            orders.append([taipei_time, 'SELL' if position == 'LONG' else 'BUY', quantity, price, position,
+                           'Exit Long' if position == 'LONG' else 'Exit Short', gross_pnl - fee, gross_pnl, fee,
+                           turnover])
+            position = entry_price = None
+    return pd.DataFrame(orders, columns=['timestamp', 'side', 'quantity', 'price', 'position', 'reason',
+                                         'profit_or_loss', 'gross_pnl', 'fee', 'turnover'])
+
+
+# ---------------------------------------------------------------------------
+# 分塊引擎與一次處理整段資料的輸出相同
+# ---------------------------------------------------------------------------
+def test_statistic_cta_chunked_matches_one_shot(tmp_path):
+    factors = load('statistic_cta', 'add_factors')
+    alphas = load('statistic_cta', 'add_alphas')
+    backtest = load('statistic_cta', 'backtest')
+    df = _roundtrip(factors.compute_factors(_klines('statistic_cta')), str(tmp_path / 'factors.csv'))
+    df = alphas.get_direction(df)
+    np.testing.assert_array_equal(df['direction'], _statistic_direction_loop(df))
+
+    source = str(tmp_path / 'direction.csv')
+    expected = backtest.backtesting(_roundtrip(df, source)).to_csv(index=False)
+    backtest.backtesting_chunks(source, str(tmp_path / 'chunked.csv'), chunksize=CHUNK)
+    assert open(str(tmp_path / 'chunked.csv')).read() == expected
+
+
+def test_ml_cta_chunked_matches_one_shot(tmp_path):
+    factors = load('ml_cta', 'add_factors')
+    alphas = load('ml_cta', 'add_alphas')
+    backtest = load('ml_cta', 'backtest')
+    df = factors.compute_factors(_klines('ml_cta'))
+    # 以過去 24 根的報酬代替 XGBoost 的預測，方向規則與原本的 .loc 指定相同
+    df['Predicted_Return'] = df['Close'].pct_change(24)
+    expected_direction = np.zeros(len(df), dtype=np.int64)
+    expected_direction[df['Predicted_Return'] > 0.01] = 1
+    expected_direction[df['Predicted_Return'] < -0.01] = -1
+    df['direction'] = alphas.DIRECTION_RULES.evaluate(df, threshold=0.01)
+    np.testing.assert_array_equal(df['direction'], expected_direction)
+
+    source = str(tmp_path / 'direction.csv')
+    expected = backtest.backtesting(_roundtrip(df, source)).to_csv(index=False)
+    backtest.backtesting_chunks(source, str(tmp_path / 'chunked.csv'), chunksize=CHUNK)
+    assert open(str(tmp_path / 'chunked.csv')).read() == expected
+
+
+def test_bincentive2_chunked_matches_one_shot_and_original(tmp_path):
+    factors = load('bincentive2', 'add_factors')
+    strategy = load('bincentive2', 'strategy_signals')
+    df = _klines('bincentive2')
+    df['OBV'] = factors.compute_OBV(df)
+    df['OBV_MA5'] = df['OBV'].rolling(window=factors.OBV_WINDOW).mean()
+    source = str(tmp_path / 'factors.csv')
+    df = _roundtrip(df, source, parse_dates=['Open time'])
+
+    signals, trades, _ = strategy.generate_trade_signals(df)
+    trades = trades.to_frame(strategy.TRADE_COLUMNS)
+    expected_signals, expected_trades = _obv_signals_loop(df)
+    pd.testing.assert_frame_equal(signals, expected_signals)
+    assert trades.to_csv(index=False) == expected_trades.to_csv(index=False)
+
+    strategy.generate_trade_signals_chunks(source, str(tmp_path / 'signals.csv'), str(tmp_path / 'trades.csv'),
+                                           chunksize=CHUNK)
+    assert open(str(tmp_path / 'signals.csv')).read() == signals.to_csv(index=False)
+    assert open(str(tmp_path / 'trades.csv')).read() == trades.to_csv(index=False)
+
+
+# ---------------------------------------------------------------------------
+# RuleSet 與 Ledger 與原本的實作相同
+# ---------------------------------------------------------------------------
+def test_cci_rules_match_original_loop():
+    backtest_performance = load('bincentive1', 'backtest_performance')
+    df = pd.read_csv(os.path.join(project_dir('bincentive1'), 'mina_with_cci.csv'))
+    signals = backtest_performance.generate_cci_signals(df)
+    np.testing.assert_array_equal(signals['Signal'], _cci_signals_loop(df))
+
+
+def test_pair_trading_rules_and_order_ledger_match_original(tmp_path):
+    pt_strategy = load('pair_trading', 'backtest_PT_strategy')
+    order_executor = load('pair_trading', 'order_executor')
+    strategy = pt_strategy.BacktestPTStrategy()
+    btc, other = _klines('statistic_cta'), _klines('bincentive2')
+    n = min(len(btc), len(other))
+    rename = {'Open time': 'timestamp'}
+    df = strategy.calculate_price_difference(btc.iloc[:n].rename(columns=rename),
+                                             other.iloc[:n].rename(columns=rename))
+    df = strategy.generate_signals(strategy.calculate_statistics(df))
+    expected = np.zeros(n, dtype=np.int64)
+    expected[df['diff'] < df['mean_diff'] - strategy.threshold * df['std_diff']] = 1
+    expected[df['diff'] > df['mean_diff'] + strategy.threshold * df['std_diff']] = -1
+    np.testing.assert_array_equal(df['signal'], expected)
+
+    bars = pd.DataFrame({'timestamp': df['timestamp'].astype('datetime64[ms]').astype(np.int64),
+                         'signal': df['signal'], 'Close': df['Close']})
+    trades = pd.DataFrame({'time': bars['timestamp'], 'price': bars['Close'], 'isBestMatch': True,
+                           'symbol': 'SPOT_BTC_USDT'})
+    executor = order_executor.OrderExecutor(bars, str(tmp_path / 'orders.csv'), trades)
+    executor.run_backtest()
+    expected_orders = _orders_loop(bars['timestamp'], bars['signal'], bars['Close'])
+    assert len(expected_orders) > 2
+    assert open(str(tmp_path / 'orders.csv')).read() == expected_orders.to_csv(index=False)
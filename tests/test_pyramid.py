@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from backtest_sim.ohlcv import resample
+from backtest_sim.pyramid import BarPyramid
+from backtest_sim.timeutil import interval_ms
+
+MINUTE = 60_000
+
+
+def _bars(n, start=1_704_067_200_000, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.standard_normal(n))
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({'Open time': start + MINUTE * np.arange(n), 'Open': open_,
+                         'High': np.maximum(open_, close) + 1, 'Low': np.minimum(open_, close) - 1,
+                         'Close': close, 'Volume': rng.random(n)})
+
+
+def _assert_levels_match(pyramid, base):
+    stored = pyramid.bars('1m', time_as='epoch')
+    np.testing.assert_array_equal(stored['Open time'], base['Open time'])
+    np.testing.assert_allclose(stored['Close'], base['Close'])
+    for level in pyramid.levels:
+        expected = resample({c: base[c].to_numpy() for c in base}, interval_ms(level))
+        got = pyramid.bars(level, time_as='epoch')
+        np.testing.assert_array_equal(got['Open time'], expected['Open time'])
+        for column in ('Open', 'High', 'Low', 'Close', 'Volume'):
+            np.testing.assert_allclose(got[column], expected[column])
+
+
+def test_append_extends_every_level(tmp_path):
+    full = _bars(4337)
+    pyramid = BarPyramid(str(tmp_path), 'BTCUSDT')
+    pyramid.append(full.iloc[:3000])
+    pyramid.append(full.iloc[2990:])
+    _assert_levels_match(pyramid, full)
+
+
+def test_mid_history_reappend_keeps_later_bars(tmp_path):
+    full = _bars(4337)
+    pyramid = BarPyramid(str(tmp_path), 'BTCUSDT')
+    pyramid.append(full)
+
+    # 補回歷史中間的一段 (價格修正)，之後的資料不能被截掉
+    patch = full.iloc[1000:1100].copy()
+    patch['Close'] += 5
+    patch['High'] += 5
+    pyramid.append(patch)
+
+    expected = full.copy()
+    expected.loc[1000:1099, ['Close', 'High']] += 5
+    assert pyramid.rows('1m') == 4337
+    _assert_levels_match(pyramid, expected)
+
+
+def test_backfill_before_stored_history(tmp_path):
+    full = _bars(4337)
+    pyramid = BarPyramid(str(tmp_path), 'BTCUSDT')
+    pyramid.append(full.iloc[2000:])
+    pyramid.append(full.iloc[:2000])
+    assert pyramid.rows('1m') == 4337
+    _assert_levels_match(pyramid, full)